@@ -0,0 +1,223 @@
+"""
+Backpressure for the callback pipeline.
+
+Every callback invocation (callbacks.db, callbacks.logging) takes a slot
+from one shared in-flight budget before doing any work, and the slot stays
+taken until the event is out of memory: callbacks.db releases it once the
+row's batch is written or spooled, callbacks.logging once the log line is
+on stdout. A slow database or log pipe therefore fills the budget. When the
+budget is exhausted, the sink's overflow policy decides what happens to the
+event:
+
+  block   wait up to CALLBACK_BLOCK_TIMEOUT_MS for a slot, then spool
+  spool   skip the in-memory path and hand the event to the durable spool
+          (sinks without a spool drop it); the spool has its own bounded
+          queue (callbacks.db: USAGE_SPOOL_QUEUE_SIZE), past which events
+          are dropped too
+  sample  keep CALLBACK_SAMPLE_RATE of overflow events, drop the rest
+
+  CALLBACK_MAX_IN_FLIGHT (default 512)
+  CALLBACK_OVERFLOW_DB (default spool), CALLBACK_OVERFLOW_LOGGING (default sample)
+  CALLBACK_BLOCK_TIMEOUT_MS (default 50), CALLBACK_SAMPLE_RATE (default 0.1)
+  CALLBACK_STATS_INTERVAL_SECONDS (default 60; 0 disables the stats log)
+
+Counters (admissions, drops, spills, flush latency) and registered gauges
+such as writer queue depth are available from stats() and are logged as a
+"callback_pipeline_stats" record every stats interval.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import sys
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from callbacks import log_writer
+
+RUN = "run"
+SPOOL = "spool"
+DROP = "drop"
+
+POLICIES = ("block", "spool", "sample")
+
+_DEFAULT_POLICIES = {"db": "spool", "logging": "sample"}
+
+_budget: Optional["CallbackBudget"] = None
+_gauges: Dict[str, Callable[[], int]] = {}
+_stats_task: Optional[asyncio.Task] = None
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        print(f"backpressure: invalid {name}; using {default}", file=sys.stderr)
+        return default
+
+
+def overflow_policy(sink: str) -> str:
+    policy = os.environ.get(f"CALLBACK_OVERFLOW_{sink.upper()}", _DEFAULT_POLICIES.get(sink, "spool"))
+    policy = policy.lower()
+    if policy not in POLICIES:
+        print(f"backpressure: unknown policy {policy!r} for {sink}; using spool", file=sys.stderr)
+        return "spool"
+    return policy
+
+
+class CallbackBudget:
+    """
+    Counting semaphore with overflow policies. Only touched from the event
+    loop, so plain integers are enough.
+    """
+
+    def __init__(self, max_in_flight: int, block_timeout: float, sample_rate: float) -> None:
+        self.max_in_flight = max(1, max_in_flight)
+        self.block_timeout = max(0.0, block_timeout)
+        self.sample_rate = min(1.0, max(0.0, sample_rate))
+        self.in_flight = 0
+        self.counters: Dict[str, int] = defaultdict(int)
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._flushes: Dict[str, Dict[str, float]] = {}
+
+    async def admit(self, sink: str, policy: str) -> str:
+        """Return RUN (caller must release()), SPOOL or DROP."""
+        if self.in_flight < self.max_in_flight:
+            self.in_flight += 1
+            self.counters[f"{sink}.admitted"] += 1
+            return RUN
+
+        if policy == "block":
+            self.counters[f"{sink}.blocked"] += 1
+            if await self._wait_for_slot():
+                self.counters[f"{sink}.admitted"] += 1
+                return RUN
+            policy = "spool"
+
+        if policy == "sample" and random.random() < self.sample_rate:
+            # Sampled events run over budget; the rate bounds the overshoot.
+            self.in_flight += 1
+            self.counters[f"{sink}.sampled"] += 1
+            return RUN
+
+        if policy == "spool":
+            self.counters[f"{sink}.spooled"] += 1
+            return SPOOL
+        self.counters[f"{sink}.dropped"] += 1
+        return DROP
+
+    def release(self) -> None:
+        # Hand the slot straight to the oldest waiter, if any.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def record(self, name: str, amount: int = 1) -> None:
+        self.counters[name] += amount
+
+    def observe_flush(self, sink: str, seconds: float, rows: int) -> None:
+        flush = self._flushes.setdefault(sink, {"count": 0, "rows": 0, "seconds": 0.0, "max_seconds": 0.0})
+        flush["count"] += 1
+        flush["rows"] += rows
+        flush["seconds"] += seconds
+        flush["max_seconds"] = max(flush["max_seconds"], seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        flushes = {}
+        for sink, flush in self._flushes.items():
+            count = flush["count"] or 1
+            flushes[sink] = {
+                "count": int(flush["count"]),
+                "rows": int(flush["rows"]),
+                "avg_ms": round(flush["seconds"] * 1000 / count, 3),
+                "max_ms": round(flush["max_seconds"] * 1000, 3),
+            }
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "waiting": len(self._waiters),
+            "counters": dict(self.counters),
+            "flush": flushes,
+        }
+
+    async def _wait_for_slot(self) -> bool:
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, self.block_timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+
+def get_budget() -> CallbackBudget:
+    global _budget
+    if _budget is None:
+        _budget = CallbackBudget(
+            max_in_flight=int(_env_number("CALLBACK_MAX_IN_FLIGHT", 512)),
+            block_timeout=_env_number("CALLBACK_BLOCK_TIMEOUT_MS", 50) / 1000,
+            sample_rate=_env_number("CALLBACK_SAMPLE_RATE", 0.1),
+        )
+    return _budget
+
+
+async def admit(sink: str) -> str:
+    """Take a slot for one callback event using the sink's overflow policy."""
+    _ensure_stats_log()
+    return await get_budget().admit(sink, overflow_policy(sink))
+
+
+def release(count: int = 1) -> None:
+    budget = get_budget()
+    for _ in range(count):
+        budget.release()
+
+
+def record(name: str, amount: int = 1) -> None:
+    get_budget().record(name, amount)
+
+
+def observe_flush(sink: str, seconds: float, rows: int) -> None:
+    get_budget().observe_flush(sink, seconds, rows)
+
+
+def register_gauge(name: str, read: Callable[[], int]) -> None:
+    """Register a callable sampled by stats(), e.g. a queue's qsize."""
+    _gauges[name] = read
+
+
+def stats() -> Dict[str, Any]:
+    snapshot = get_budget().stats()
+    gauges = {"logging.queue_depth": log_writer.get_writer().qsize()}
+    for name, read in list(_gauges.items()):
+        try:
+            gauges[name] = read()
+        except Exception:  # pragma: no cover - defensive
+            continue
+    snapshot["gauges"] = gauges
+    return snapshot
+
+
+async def _stats_loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        line = {"message": "callback_pipeline_stats", "severity": "INFO"}
+        line.update(stats())
+        log_writer.emit(line)
+
+
+def _ensure_stats_log() -> None:
+    global _stats_task
+    if _stats_task is not None and not _stats_task.done():
+        return
+    interval = _env_number("CALLBACK_STATS_INTERVAL_SECONDS", 60)
+    if interval <= 0:
+        return
+    _stats_task = asyncio.get_running_loop().create_task(_stats_loop(interval))
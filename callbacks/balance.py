@@ -0,0 +1,637 @@
+"""
+Prepaid balance enforcement for the customers/transactions tables
+(db/migrations/0002_billing.sql), see docs/stripe-billing.md.
+
+Requests are authorized against an in-process cache of each tenant's
+balance, so the hot path is a dictionary lookup rather than a database
+round-trip. Costs are not written per request either: debits are summed per
+tenant and applied every BALANCE_FLUSH_MS in one transaction that updates
+each customers row once and appends one 'debit_usage' ledger row per tenant.
+A busy tenant therefore takes its row lock once per interval instead of once
+per request. Debits still waiting to be flushed are subtracted from the
+cached balance when authorizing.
+
+Enable it in the proxy config:
+
+  litellm_settings:
+    success_callback: [..., "callbacks.balance.log_event"]
+    failure_callback: [..., "callbacks.balance.log_event"]
+    callbacks: [..., "callbacks.balance.proxy_handler_instance"]
+
+Before a request is sent, its estimated cost is reserved against the
+balance (callbacks.budget), so concurrent requests cannot overspend it.
+
+Tuning (defaults in brackets):
+  BALANCE_CACHE_TTL_SECONDS [30] how long a cached balance is trusted; an
+    expired entry is still used while it is refreshed in the background
+  BALANCE_FLUSH_MS [1000] how often accumulated debits are written
+  BALANCE_ALLOW_UNKNOWN [0] let tenants without a customers row through
+
+Many replicas serve the same tenants (every proxy worker process is one),
+so each one spending from its own copy of the balance would overspend it N
+times. With BALANCE_LEASES [1] a replica may only spend a slice of the
+balance that it leased in customer_balance_leases. Slices are granted from
+what the other replicas have not leased, renewed in the same transaction as
+each debit flush and sized from recent spend; an idle replica lets its
+lease expire. Slices are held for BALANCE_LEASE_SECONDS [30], are at least
+BALANCE_LEASE_MIN_USD [0.50] (or the request's estimate, if larger) and a
+replica whose slice is used up asks for more at most every
+BALANCE_LEASE_RETRY_MS [1000].
+
+With BALANCE_LISTEN [1] a dedicated connection, opened next to the pool
+rather than taken from it, LISTENs on litellm_balance, where a trigger on
+customers announces top-ups and balances that ran out, so replicas pick
+those up without polling. The connection is reopened when it drops.
+
+The tenant comes from the authenticated API key only (record.key_tenant):
+its user_id, else a tenant_id in the key's or its team's metadata. A client-supplied
+metadata.tenant_id is overwritten (or removed), so a key cannot spend
+another tenant's balance. Requests without a tenant (e.g. the master key)
+are not checked. If the database cannot be reached for a tenant that is not
+cached yet, the request is allowed and the failure is logged. Call
+invalidate() after a top-up so the next request sees the new balance.
+
+Uses the connection pool from callbacks.db (PGHOST etc.).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+import sys
+import uuid
+from decimal import ROUND_DOWN, Decimal
+from typing import Any, Dict, List, Optional, Set
+
+import asyncpg
+
+from callbacks import budget, db, lifecycle, streaming
+from callbacks.record import extract, key_tenant
+
+try:  # The proxy image ships litellm and fastapi; tests and tools may not.
+    from litellm.integrations.custom_logger import CustomLogger
+except ImportError:  # pragma: no cover - depends on the environment
+    CustomLogger = object  # type: ignore[misc,assignment]
+
+try:
+    from fastapi import HTTPException
+except ImportError:  # pragma: no cover - depends on the environment
+
+    class HTTPException(Exception):  # type: ignore[no-redef]
+        def __init__(self, status_code: int, detail: Any = None) -> None:
+            super().__init__(detail)
+            self.status_code = status_code
+            self.detail = detail
+
+
+# customers.balance_usd and transactions.amount_usd are NUMERIC(10, 4).
+_QUANTUM = Decimal("0.0001")
+_ZERO = Decimal(0)
+
+_LOAD_SQL = "SELECT balance_usd FROM customers WHERE tenant_id = $1"
+
+# Taking the row locks in tenant order keeps concurrent flushes (other
+# instances) from deadlocking each other.
+_LOCK_SQL = "SELECT 1 FROM customers WHERE tenant_id = ANY($1::text[]) ORDER BY tenant_id FOR UPDATE"
+
+_DEBIT_SQL = """
+WITH debits AS (
+    SELECT * FROM unnest($1::text[], $2::numeric[], $3::integer[]) AS d(tenant_id, amount_usd, requests)
+), updated AS (
+    UPDATE customers c
+    SET balance_usd = c.balance_usd - d.amount_usd, updated_at = NOW()
+    FROM debits d
+    WHERE c.tenant_id = d.tenant_id
+    RETURNING c.tenant_id, c.balance_usd, d.amount_usd, d.requests
+)
+INSERT INTO transactions (tenant_id, amount_usd, balance_after, type, description)
+SELECT tenant_id, -amount_usd, balance_usd, 'debit_usage', requests || ' requests'
+FROM updated
+RETURNING tenant_id, balance_after
+"""
+
+# Runs right after _DEBIT_SQL in the same transaction, so each grant is
+# taken from the balance net of the debits just written.
+_LEASE_SQL = """
+SELECT l.tenant_id, customer_balance_lease(l.tenant_id, $2, l.want, make_interval(secs => $4)) AS granted
+FROM unnest($1::text[], $3::numeric[]) AS l(tenant_id, want)
+"""
+
+_RELEASE_SQL = "DELETE FROM customer_balance_leases WHERE replica_id = $1 AND tenant_id = ANY($2::text[])"
+
+# Raised when the migrations that add the lease table have not run yet.
+_LEASES_MISSING = (asyncpg.exceptions.UndefinedTableError, asyncpg.exceptions.UndefinedFunctionError)
+
+_CHANNEL = "litellm_balance"
+_LISTEN_RETRY_SECONDS = 5.0
+_LISTEN_PING_SECONDS = 30.0
+
+# Identifies this process's leases; Cloud Run hostnames are not unique. Each
+# worker of a multi-worker container is a process, so a replica, of its own.
+_REPLICA_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+_leases_disabled = False
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _leasing() -> bool:
+    return not _leases_disabled and _env_flag("BALANCE_LEASES", True)
+
+
+def _lease_seconds() -> float:
+    return max(1.0, _env_float("BALANCE_LEASE_SECONDS", 30))
+
+
+class _Entry:
+    __slots__ = ("balance", "expires_at", "synced_at")
+
+    def __init__(self, balance: Optional[Decimal], expires_at: float, synced_at: float) -> None:
+        # None: the tenant has no customers row. With leases on, balance is
+        # this replica's slice rather than the whole customers balance.
+        self.balance = balance
+        self.expires_at = expires_at
+        self.synced_at = synced_at
+
+
+class BalanceCache:
+    """Per-tenant balances with a TTL; misses are loaded once however many requests wait."""
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._entries: Dict[str, _Entry] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    def get(self, tenant_id: str) -> Optional[_Entry]:
+        return self._entries.get(tenant_id)
+
+    def set(self, tenant_id: str, balance: Optional[Decimal]) -> None:
+        now = asyncio.get_running_loop().time()
+        # A leased slice is renewed at half its lifetime, well before it lapses.
+        ttl = _lease_seconds() / 2 if _leasing() else self.ttl
+        self._entries[tenant_id] = _Entry(balance, now + ttl, now)
+
+    def expired(self, entry: _Entry) -> bool:
+        return asyncio.get_running_loop().time() >= entry.expires_at
+
+    def tenants(self) -> List[str]:
+        return list(self._entries)
+
+    def invalidate(self, tenant_id: Optional[str] = None) -> None:
+        if tenant_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(tenant_id, None)
+
+    async def load(self, tenant_id: str, need: Decimal = _ZERO) -> Optional[_Entry]:
+        """Fetch one tenant's balance; concurrent callers share the query."""
+        pending = self._loading.get(tenant_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[tenant_id] = future
+        try:
+            entry = await self._fetch(tenant_id, need)
+            future.set_result(entry)
+        except Exception as exc:
+            print(f"balance: cannot load balance for {tenant_id}: {exc}", file=sys.stderr)
+            future.set_result(None)
+        finally:
+            del self._loading[tenant_id]
+        return future.result()
+
+    async def _fetch(self, tenant_id: str, need: Decimal) -> Optional[_Entry]:
+        if _leasing():
+            entry = await _get_debits().sync(tenant_id, need)
+            if _leasing():
+                return entry
+        pool = await db.get_pool()
+        if pool is None:
+            return None
+        balance = await pool.fetchval(_LOAD_SQL, tenant_id)
+        self.set(tenant_id, None if balance is None else Decimal(balance))
+        return self._entries[tenant_id]
+
+
+class DebitAccumulator:
+    """
+    Sums debits per tenant and writes them in one transaction per interval.
+
+    Amounts are kept at full precision; each flush writes the part that fits
+    NUMERIC(10, 4) and carries the remainder, so small requests are not
+    rounded away. With leases on, the same transaction renews the slices of
+    the tenants it debits and of any tenant passed to sync().
+    """
+
+    def __init__(self, cache: BalanceCache, interval: float) -> None:
+        self.cache = cache
+        self.interval = interval
+        self._pending: Dict[str, List[Any]] = {}  # tenant -> [amount, requests]
+        self._in_flight: Dict[str, Decimal] = {}
+        self._renew: Dict[str, Decimal] = {}  # tenant -> least slice wanted
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, tenant_id: str, amount: Decimal) -> None:
+        acc = self._pending.get(tenant_id)
+        if acc is None:
+            acc = self._pending[tenant_id] = [_ZERO, 0]
+        acc[0] += amount
+        acc[1] += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def owed(self, tenant_id: str) -> Decimal:
+        """Debits not yet reflected in the cached balance."""
+        acc = self._pending.get(tenant_id)
+        return (acc[0] if acc else _ZERO) + self._in_flight.get(tenant_id, _ZERO)
+
+    async def _run(self) -> None:
+        # Sub-cent remainders wait for the next add() to restart the loop.
+        try:
+            while any(acc[0] >= _QUANTUM for acc in self._pending.values()):
+                await asyncio.sleep(self.interval)
+                await self.flush()
+        except asyncio.CancelledError:
+            # Stopped (close() or the loop shutting down): write what is owed
+            # instead of handing out the requests since the last flush free.
+            await self.flush()
+            raise
+
+    async def flush(self) -> int:
+        """Write accumulated debits; returns the number of tenants debited."""
+        async with self._lock:
+            return await self._flush()
+
+    async def sync(self, tenant_id: str, need: Decimal = _ZERO) -> Optional[_Entry]:
+        """Lease (or renew) a slice for tenant_id now, along with pending debits."""
+        self._renew[tenant_id] = max(need, self._renew.get(tenant_id, _ZERO))
+        async with self._lock:
+            # Callers queued behind one flush are all served by it.
+            if tenant_id in self._renew:
+                await self._flush()
+        return self.cache.get(tenant_id)
+
+    async def _flush(self) -> int:
+        global _leases_disabled
+        batch: Dict[str, List[Any]] = {}
+        for tenant_id, (amount, requests) in self._pending.items():
+            whole = amount.quantize(_QUANTUM, rounding=ROUND_DOWN)
+            if whole > _ZERO:
+                batch[tenant_id] = [whole, requests]
+        renew, self._renew = self._renew, {}
+        leasing = _leasing()
+        if not batch and not (leasing and renew):
+            return 0
+        for tenant_id, (whole, requests) in batch.items():
+            acc = self._pending[tenant_id]
+            acc[0] -= whole
+            acc[1] -= requests
+            if acc[0] == _ZERO and acc[1] == 0:
+                del self._pending[tenant_id]
+            self._in_flight[tenant_id] = whole
+
+        debited = sorted(batch)
+        leased = sorted(set(batch) | set(renew)) if leasing else []
+        rows: List[Any] = []
+        grants: List[Any] = []
+        try:
+            pool = await db.get_pool()
+            if pool is None:
+                raise RuntimeError("no database pool")
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(_LOCK_SQL, sorted(set(debited) | set(leased)))
+                    if debited:
+                        rows = await conn.fetch(
+                            _DEBIT_SQL, debited, [batch[t][0] for t in debited], [batch[t][1] for t in debited]
+                        )
+                    if leased:
+                        # Enough for this tenant's recent pace until the next flush, at least.
+                        minimum = Decimal(str(_env_float("BALANCE_LEASE_MIN_USD", 0.5)))
+                        wants = [
+                            max(minimum, renew.get(t, _ZERO), 2 * batch[t][0] if t in batch else _ZERO)
+                            for t in leased
+                        ]
+                        grants = await conn.fetch(_LEASE_SQL, leased, _REPLICA_ID, wants, _lease_seconds())
+        except Exception as exc:
+            for tenant_id, (whole, requests) in batch.items():
+                acc = self._pending.setdefault(tenant_id, [_ZERO, 0])
+                acc[0] += whole
+                acc[1] += requests
+            self._in_flight.clear()
+            if isinstance(exc, _LEASES_MISSING) and "lease" in str(exc):
+                _leases_disabled = True
+                print(f"balance: balance leases unavailable ({exc}); using whole balances", file=sys.stderr)
+                self.cache.invalidate()
+                return await self._flush()
+            print(f"balance: debit of {len(batch)} tenants failed: {exc}; retrying", file=sys.stderr)
+            return 0
+        self._in_flight.clear()
+
+        if leasing:
+            for row in grants:
+                granted = row["granted"]
+                self.cache.set(row["tenant_id"], None if granted is None else Decimal(granted))
+        else:
+            for row in rows:
+                self.cache.set(row["tenant_id"], Decimal(row["balance_after"]))
+        return len(rows)
+
+    async def release(self, tenants: List[str]) -> None:
+        """Give this replica's slices of tenants back to the others."""
+        if not tenants:
+            return
+        pool = await db.get_pool()
+        if pool is not None:
+            await pool.execute(_RELEASE_SQL, _REPLICA_ID, tenants)
+
+    async def close(self) -> None:
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+
+_cache: Optional[BalanceCache] = None
+_debits: Optional[DebitAccumulator] = None
+_listen_task: Optional[asyncio.Task] = None
+_lease_task: Optional[asyncio.Task] = None
+
+
+def _get_cache() -> BalanceCache:
+    global _cache
+    if _cache is None:
+        _cache = BalanceCache(ttl=_env_float("BALANCE_CACHE_TTL_SECONDS", 30))
+    return _cache
+
+
+def _get_debits() -> DebitAccumulator:
+    global _debits
+    if _debits is None:
+        _debits = DebitAccumulator(_get_cache(), interval=_env_float("BALANCE_FLUSH_MS", 1000) / 1000)
+    return _debits
+
+
+def _refresh(tenant_id: str) -> None:
+    cache = _get_cache()
+    if tenant_id not in cache._loading:
+        asyncio.get_running_loop().create_task(cache.load(tenant_id))
+
+
+def _on_notify(connection: Any, pid: int, channel: str, payload: str) -> None:
+    """Apply a litellm_balance notification: [[tenant_id, balance_usd, "credit"|"debit"], ...]."""
+    cache = _get_cache()
+    try:
+        changes = json.loads(payload)
+    except ValueError:
+        print(f"balance: bad notification payload: {payload[:200]}", file=sys.stderr)
+        return
+    for tenant_id, balance_usd, kind in changes:
+        entry = cache.get(tenant_id)
+        if entry is None:
+            continue  # not served by this replica
+        if _leasing():
+            # This replica's slice is still its own; a top-up means a bigger
+            # slice may be available, so renew on the next request.
+            if kind == "credit":
+                entry.expires_at = entry.synced_at = 0.0
+        else:
+            cache.set(tenant_id, Decimal(str(balance_usd)))
+
+
+async def _listen_loop() -> None:
+    # LISTEN holds its connection for the life of the process. Taking it from
+    # db's pool would shrink the pool for good and stall db._resize_pool,
+    # which waits for every pool connection to come back.
+    while True:
+        conn = None
+        lost = asyncio.Event()
+        try:
+            conn = await db.connect()
+            if conn is None:
+                await asyncio.sleep(_LISTEN_RETRY_SECONDS)
+                continue
+            conn.add_termination_listener(lambda _conn: lost.set())
+            await conn.add_listener(_CHANNEL, _on_notify)
+            # Changes made while nobody was listening were missed.
+            _get_cache().invalidate()
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), _LISTEN_PING_SECONDS)
+                except asyncio.TimeoutError:
+                    await conn.execute("SELECT 1")
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            print(f"balance: LISTEN {_CHANNEL} failed: {exc}", file=sys.stderr)
+        finally:
+            if conn is not None and not conn.is_closed():
+                try:
+                    await conn.close(timeout=5)
+                except Exception:
+                    conn.terminate()
+        print(f"balance: lost LISTEN connection; reconnecting in {_LISTEN_RETRY_SECONDS:.0f}s", file=sys.stderr)
+        await asyncio.sleep(_LISTEN_RETRY_SECONDS)
+
+
+async def _resync_leases() -> None:
+    """Renew expiring slices still in use and give idle ones back."""
+    cache, debits = _get_cache(), _get_debits()
+    renew, idle = [], []
+    for tenant_id in cache.tenants():
+        entry = cache.get(tenant_id)
+        if entry is None or entry.balance is None or not cache.expired(entry):
+            continue
+        if debits.owed(tenant_id) or budget.held(tenant_id):
+            renew.append(tenant_id)
+        else:
+            idle.append(tenant_id)
+    for tenant_id in idle:
+        cache.invalidate(tenant_id)
+    try:
+        await debits.release(idle)
+        for tenant_id in renew:
+            await debits.sync(tenant_id)
+    except Exception as exc:
+        print(f"balance: lease resync failed: {exc}", file=sys.stderr)
+
+
+async def _lease_loop() -> None:
+    while _leasing():
+        await asyncio.sleep(_lease_seconds() / 4)
+        await _resync_leases()
+
+
+def _ensure_coherence() -> None:
+    global _listen_task, _lease_task
+    loop = asyncio.get_running_loop()
+    if _env_flag("BALANCE_LISTEN", True) and (_listen_task is None or _listen_task.done()):
+        _listen_task = loop.create_task(_listen_loop())
+    if _leasing() and (_lease_task is None or _lease_task.done()):
+        _lease_task = loop.create_task(_lease_loop())
+
+
+def available(tenant_id: str) -> Optional[Decimal]:
+    """Cached balance minus unflushed debits, or None if unknown or not cached."""
+    entry = _get_cache().get(tenant_id)
+    if entry is None or entry.balance is None:
+        return None
+    return entry.balance - _get_debits().owed(tenant_id)
+
+
+async def _lookup(tenant_id: str) -> Optional[_Entry]:
+    _ensure_coherence()
+    cache = _get_cache()
+    entry = cache.get(tenant_id)
+    if entry is None:
+        return await cache.load(tenant_id)
+    if cache.expired(entry):
+        _refresh(tenant_id)
+    return entry
+
+
+async def authorize(tenant_id: str) -> bool:
+    """True when the tenant has balance left beyond pending debits and open reservations."""
+    entry = await _lookup(tenant_id)
+    if entry is None:
+        return True  # database unavailable: fail open
+    if entry.balance is None:
+        return _env_flag("BALANCE_ALLOW_UNKNOWN", False)
+    return entry.balance - _get_debits().owed(tenant_id) - budget.held(tenant_id) > _ZERO
+
+
+async def reserve(tenant_id: str, estimate: Decimal) -> Optional[int]:
+    """
+    Hold estimate against the tenant's balance (callbacks.budget); returns the
+    reservation id, budget.UNCHECKED when there is nothing to hold against,
+    or None when the tenant cannot afford the request.
+    """
+    entry = await _lookup(tenant_id)
+    if entry is None:
+        return budget.UNCHECKED  # database unavailable: fail open
+    if entry.balance is None:
+        return budget.UNCHECKED if _env_flag("BALANCE_ALLOW_UNKNOWN", False) else None
+    debits, reservations = _get_debits(), budget.get_reservations()
+    # No await between reading the balance and taking the reservation.
+    reservation_id = reservations.reserve(tenant_id, estimate, entry.balance - debits.owed(tenant_id))
+    if reservation_id is not None or not _leasing():
+        return reservation_id
+    # This replica's slice is used up: ask for a bigger one, but not on every request.
+    retry = _env_float("BALANCE_LEASE_RETRY_MS", 1000) / 1000
+    if asyncio.get_running_loop().time() - entry.synced_at < retry:
+        return None
+    need = estimate + debits.owed(tenant_id) + reservations.held(tenant_id)
+    entry = await _get_cache().load(tenant_id, need)
+    if entry is None or entry.balance is None:
+        return None
+    return reservations.reserve(tenant_id, estimate, entry.balance - debits.owed(tenant_id))
+
+
+def debit(tenant_id: str, amount: Any) -> None:
+    """Queue a usage debit for the next flush."""
+    try:
+        amount = Decimal(str(amount))
+    except Exception:
+        return
+    if amount > _ZERO:
+        _get_debits().add(tenant_id, amount)
+
+
+def invalidate(tenant_id: Optional[str] = None) -> None:
+    """Forget a cached balance (or all of them), e.g. after a top-up."""
+    _get_cache().invalidate(tenant_id)
+
+
+async def flush() -> int:
+    return await _get_debits().flush()
+
+
+async def shutdown() -> None:
+    """
+    Write outstanding debits and give back this replica's leases. Runs on
+    proxy shutdown (callbacks.lifecycle), before callbacks.db.shutdown.
+    """
+    global _debits, _listen_task, _lease_task
+    for task in (_listen_task, _lease_task):
+        if task is not None:
+            task.cancel()
+    _listen_task = _lease_task = None
+    if _debits is not None:
+        await _debits.close()
+        if _leasing() and _cache is not None:
+            try:
+                await _debits.release(_cache.tenants())
+            except Exception as exc:  # pragma: no cover - defensive
+                print(f"balance: cannot release leases: {exc}", file=sys.stderr)
+        _debits = None
+
+
+async def log_event(
+    request_data: Optional[Dict[str, Any]],
+    response_data: Optional[Dict[str, Any]],
+    start_time: float,
+    end_time: float,
+    **kwargs: Any,
+) -> None:
+    """
+    LiteLLM callback: settles the request's reservation and adds its cost to
+    the tenant's pending debit. Register it for failures too, so reservations
+    of failed requests are released.
+    """
+    if streaming.deferred(request_data, kwargs):
+        return
+    try:
+        # Release the estimate before the actual cost takes its place.
+        budget.settle(request_data)
+        row = extract(request_data, response_data, start_time, end_time)
+        if row.tenant_id and row.cost_usd:
+            debit(row.tenant_id, row.cost_usd)
+    except Exception as exc:  # pragma: no cover - defensive
+        print(f"balance: log_event failed: {exc}", file=sys.stderr)
+
+
+class BalanceHandler(CustomLogger):
+    """Reserves each request's estimated cost; rejects it when the balance cannot cover it."""
+
+    async def async_pre_call_hook(
+        self, user_api_key_dict: Any, cache: Any, data: Dict[str, Any], call_type: Any
+    ) -> Dict[str, Any]:
+        tenant_id = key_tenant(user_api_key_dict)
+        metadata = data.setdefault("metadata", {})
+        if not tenant_id:
+            metadata.pop("tenant_id", None)
+            return data
+        # Let the usage sinks bill the same tenant that was authorized.
+        metadata["tenant_id"] = tenant_id
+        reservation_id = await reserve(tenant_id, budget.estimate_cost(data))
+        if reservation_id is None:
+            raise HTTPException(status_code=403, detail="Insufficient funds: top up your balance to continue")
+        if reservation_id != budget.UNCHECKED:
+            data["metadata"][budget.METADATA_KEY] = reservation_id
+        return data
+
+
+proxy_handler_instance = BalanceHandler()
+
+# Streamed requests are billed when the stream ends (callbacks.streaming).
+streaming.add_sink(__name__)
+lifecycle.on_shutdown(shutdown, lifecycle.ORDER_BALANCE)
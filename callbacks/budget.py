@@ -0,0 +1,154 @@
+"""
+Per-request budget reservations for prepaid tenants (callbacks.balance).
+
+Checking the balance before a request and debiting after it lets a tenant
+with $0.01 left start hundreds of concurrent calls, since none of them has
+cost anything yet. Instead each request reserves its estimated cost before
+it is sent: the model's per-token prices (litellm.model_cost) times the
+prompt token estimate plus the request's max_tokens. The request is refused
+when the tenant's balance, minus pending debits and open reservations,
+cannot cover it. When the callback fires the reservation is released and
+the actual cost_usd is debited; callbacks.balance reconciles debits with
+the customers table in batches.
+
+Reservations live in process memory. Checking and taking one happens
+without an await in between, so concurrent requests on the event loop
+cannot both spend the same balance and no lock is needed.
+
+  BUDGET_COMPLETION_TOKENS [512] completion tokens to reserve for when a
+    request sets neither max_tokens nor max_completion_tokens
+  BUDGET_UNPRICED_RESERVE_USD [0] reservation for models without a price
+  BUDGET_RESERVATION_TTL_SECONDS [900] release reservations whose callback
+    never arrived after this long
+"""
+
+from __future__ import annotations
+
+import itertools
+import os
+import time
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from callbacks import streaming
+
+METADATA_KEY = "budget_reservation"
+# Returned for requests that were let through without a balance to hold
+# against (database unreachable, unknown tenant allowed); settling it is a no-op.
+UNCHECKED = 0
+
+_ZERO = Decimal(0)
+_SWEEP_SECONDS = 10.0
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+@lru_cache(maxsize=256)
+def _prices(model: str) -> Optional[Tuple[Decimal, Decimal]]:
+    try:
+        import litellm
+    except ImportError:
+        return None
+    # Proxy aliases ("gpt-4o") and provider-prefixed names ("openai/gpt-4o") both occur.
+    for name in (model, model.split("/", 1)[-1]):
+        info = litellm.model_cost.get(name)
+        if info and info.get("input_cost_per_token") is not None:
+            return (
+                Decimal(str(info["input_cost_per_token"])),
+                Decimal(str(info.get("output_cost_per_token") or 0)),
+            )
+    return None
+
+
+def estimate_cost(request_data: Dict[str, Any]) -> Decimal:
+    """Upper estimate of what a request will cost, from its prompt and max_tokens."""
+    prices = _prices(request_data.get("model") or "")
+    if prices is None:
+        return Decimal(str(_env_float("BUDGET_UNPRICED_RESERVE_USD", 0)))
+    prompt = streaming.estimate_prompt_tokens(request_data) or 0
+    completion = (
+        request_data.get("max_completion_tokens")
+        or request_data.get("max_tokens")
+        or int(_env_float("BUDGET_COMPLETION_TOKENS", 512))
+    )
+    return prices[0] * prompt + prices[1] * completion
+
+
+class Reservations:
+    """Open reservations per tenant; reserve() checks and holds in one step."""
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._held: Dict[str, Decimal] = {}
+        self._open: Dict[int, Tuple[str, Decimal, float]] = {}
+        self._ids = itertools.count(1)
+        self._next_sweep = 0.0
+
+    def held(self, tenant_id: str) -> Decimal:
+        return self._held.get(tenant_id, _ZERO)
+
+    def reserve(self, tenant_id: str, amount: Decimal, available: Decimal) -> Optional[int]:
+        """
+        Hold amount for tenant_id if available (the balance net of pending
+        debits) covers it on top of what is already held; None when refused.
+        """
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self.expire(now)
+        free = available - self.held(tenant_id)
+        if free <= _ZERO or free < amount:
+            return None
+        reservation_id = next(self._ids)
+        self._open[reservation_id] = (tenant_id, amount, now + self.ttl)
+        self._held[tenant_id] = self.held(tenant_id) + amount
+        return reservation_id
+
+    def settle(self, reservation_id: Any) -> Optional[Tuple[str, Decimal]]:
+        """Release a reservation; returns (tenant_id, amount) or None if it was already gone."""
+        entry = self._open.pop(reservation_id, None)
+        if entry is None:
+            return None
+        tenant_id, amount, _ = entry
+        left = self._held[tenant_id] - amount
+        if left > _ZERO:
+            self._held[tenant_id] = left
+        else:
+            del self._held[tenant_id]
+        return tenant_id, amount
+
+    def expire(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        self._next_sweep = now + _SWEEP_SECONDS
+        stale = [rid for rid, (_, _, expires_at) in self._open.items() if expires_at <= now]
+        for rid in stale:
+            self.settle(rid)
+        return len(stale)
+
+
+_reservations: Optional[Reservations] = None
+
+
+def get_reservations() -> Reservations:
+    global _reservations
+    if _reservations is None:
+        _reservations = Reservations(ttl=_env_float("BUDGET_RESERVATION_TTL_SECONDS", 900))
+    return _reservations
+
+
+def held(tenant_id: str) -> Decimal:
+    return get_reservations().held(tenant_id)
+
+
+def settle(request_data: Optional[Dict[str, Any]]) -> None:
+    """Release the reservation recorded in a request's metadata, if any."""
+    if not isinstance(request_data, dict):
+        return
+    reservation_id = (request_data.get("metadata") or {}).get(METADATA_KEY, UNCHECKED)
+    if reservation_id != UNCHECKED:
+        get_reservations().settle(reservation_id)
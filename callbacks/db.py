@@ -6,6 +6,77 @@ Set these environment variables:
   PGHOST, PGPORT (default 5432), PGUSER, PGPASSWORD, PGDATABASE
 Optional:
   PGSSL=disable (to skip TLS; default is require)
+
+Pool tuning (defaults in brackets):
+  PG_POOL_MIN_SIZE [1], PG_POOL_MAX_SIZE [5]
+  PG_STATEMENT_CACHE_SIZE [100] (set 0 behind a transaction-mode pooler)
+  PG_POOL_MAX_QUERIES [50000] queries before a connection is replaced
+  PG_POOL_MAX_IDLE_SECONDS [300] idle connections above min size are closed
+  PG_POOL_MAX_LIFETIME_SECONDS [0 = off] recycle every connection this often
+  PG_CONNECT_TIMEOUT [10], PG_COMMAND_TIMEOUT [none] seconds
+  PG_POOL_WARMUP [1] open the pool when the proxy loads this module
+  PG_POOL_ADAPTIVE [0] resize the pool from observed acquire wait, between
+    PG_POOL_MAX_SIZE and PG_POOL_ADAPTIVE_MAX_SIZE [20]; it grows when a
+    probe acquire waits longer than PG_POOL_TARGET_WAIT_MS [20] and shrinks
+    back when connections sit idle
+
+litellm_usage is partitioned by created_at (db/migrations). While the pool
+is open, future partitions are created every PG_PARTITION_MAINTENANCE_SECONDS
+[3600; 0 = off], PG_PARTITION_AHEAD_DAYS [7] ahead, one per
+PG_PARTITION_GRANULARITY [day|month].
+
+Rows are not written inline: log_event puts them on a bounded in-process
+queue and a background writer flushes them as one multi-row write when
+either threshold is reached. Each queued row keeps its backpressure slot
+until its batch is written or spooled. Tuning:
+  PG_BATCH_MAX_ROWS (default 500)   rows per write
+  PG_BATCH_FLUSH_MS (default 100)   max time a row waits in the buffer
+  PG_BATCH_QUEUE_SIZE (default 10000) rows buffered; past that, rows follow
+    CALLBACK_OVERFLOW_DB (spooled, or dropped under the sample policy)
+  PG_INGEST_MODE=copy|insert (default copy) how multi-row batches are written
+
+Ingestion is idempotent on request_id: each batch claims its request_ids in
+litellm_usage_request_ids (ON CONFLICT DO NOTHING) and only rows whose id
+was new are written, in one statement. In copy mode a multi-row batch is
+first COPYed into a temp staging table and claimed and written from there;
+single rows and insert mode pass the batch as arrays instead. Events whose
+request_id was queued recently are dropped before they reach the database
+(an LRU of PG_DEDUP_CACHE_SIZE [100000] ids), which catches the same
+request arriving as both a success and a failure event. An id whose row is
+dropped (e.g. the spool queue is full) is forgotten again, so a retry of
+the request still lands. PG_DEDUP=0 turns this off; batches are then
+written with COPY/INSERT as below.
+
+Each batch also updates the usage rollup tables (callbacks.rollups) in the
+same transaction; PG_ROLLUPS=0 turns that off, and it switches itself off
+if the rollup tables are missing. Likewise, if litellm_usage does not have
+the timing columns of migration 0004 yet, the process logs it once and
+writes rows without them until it restarts.
+
+In copy mode batches are streamed with the binary COPY protocol. If the
+server (or a pooler in front of it) rejects COPY, the batch is retried with
+INSERT and the process stays on INSERT from then on.
+
+Rows that cannot be written (no pool, a failed write, or a full queue) go
+to the durable spool in callbacks.spool instead of being dropped. A replay
+worker drains the spool back into litellm_usage every
+USAGE_SPOOL_REPLAY_SECONDS (default 5), skipping request_ids already stored.
+Events that log_event diverts to the spool are handed to one spool writer
+task through a queue of USAGE_SPOOL_QUEUE_SIZE (default 10000) rows, which
+appends them in chunks of up to PG_BATCH_MAX_ROWS; when that queue is full
+too, the row is dropped and counted as db.spool_dropped.
+
+All of this state is per process. With several proxy workers in a
+container (start.sh PROXY_WORKERS) each opens its own pool, so the container
+holds up to PROXY_WORKERS * PG_POOL_MAX_SIZE connections, plus one LISTEN
+connection per worker with callbacks.balance (see connect()). Workers share
+the spool directory; each replays only the segments it claimed
+(Spool.claim), so no segment is replayed by two workers at once. The pool
+lock is created on the event loop that first needs it.
+
+Each event takes a slot from the shared budget in callbacks.backpressure;
+when the budget is exhausted the row goes to the spool by default
+(CALLBACK_OVERFLOW_DB).
 """
 
 from __future__ import annotations
@@ -14,13 +85,162 @@ import asyncio
 import os
 import sys
 import ssl
-from datetime import datetime
-from typing import Any, Dict, Optional
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 import asyncpg
 
+from callbacks import backpressure, lifecycle, rollups
+from callbacks import spool as usage_spool
+from callbacks import streaming
+from callbacks.record import UsageRecord, extract
+
 _pool: Optional[asyncpg.Pool] = None
-_pool_lock = asyncio.Lock()
+_spooler: Optional["_SpoolWriter"] = None
+# Created on first use, for the loop that uses it (see _get_pool_lock).
+_pool_lock: Optional[asyncio.Lock] = None
+_pool_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+_pool_retry_at = 0.0
+_pool_max_size: Optional[int] = None
+_maintenance_task: Optional[asyncio.Task] = None
+_partition_task: Optional[asyncio.Task] = None
+_writer: Optional["_UsageWriter"] = None
+_replay_task: Optional[asyncio.Task] = None
+_copy_disabled = False
+_rollups_disabled = False
+_dedup_disabled = False
+_timings_disabled = False
+_recent_ids: "OrderedDict[str, None]" = OrderedDict()
+
+_POOL_RETRY_SECONDS = 5.0
+_POOL_PROBE_SECONDS = 1.0
+_POOL_GROW_AFTER = 3  # consecutive slow probes before growing
+_POOL_SHRINK_AFTER = 60  # consecutive idle probes before shrinking
+
+_COPY_COLUMNS = (
+    "created_at",
+    "tenant_id",
+    "model",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "latency_ms",
+    "status",
+    "cost_usd",
+    "request_id",
+    "queue_ms",
+    "pre_call_ms",
+    "ttft_ms",
+    "upstream_ms",
+    "overhead_ms",
+    "callback_ms",
+)
+
+# Errors meaning "this connection can't do COPY", as opposed to bad data.
+_COPY_UNSUPPORTED = (
+    asyncpg.exceptions.FeatureNotSupportedError,
+    asyncpg.exceptions.ProtocolViolationError,
+    asyncpg.exceptions.InsufficientPrivilegeError,
+)
+
+# Raised when the migrations have not been applied with the rollup (or
+# request id) tables, or the timing columns, yet.
+_ROLLUPS_MISSING = (asyncpg.exceptions.UndefinedTableError, asyncpg.exceptions.UndefinedColumnError)
+
+# litellm_usage before migration 0004, without the timing columns. The SQL
+# below is built for both column lists; _usage_sql() picks one.
+_UNTIMED_COLUMNS = _COPY_COLUMNS[:10]
+_TIMED_LIST = ", ".join(_COPY_COLUMNS)
+_UNTIMED_LIST = ", ".join(_UNTIMED_COLUMNS)
+_UNTIMED_SQL: Dict[str, str] = {}
+
+# Claims the batch's request_ids and writes only the rows whose id was new
+# (plus rows without one). Arrays are columns in _COPY_COLUMNS order; the
+# batch must not repeat a request_id (see _unique).
+_DEDUP_INSERT_TEMPLATE = """
+WITH batch AS (
+    SELECT * FROM unnest(
+        $1::timestamptz[], $2::text[], $3::text[], $4::integer[], $5::integer[],
+        $6::integer[], $7::integer[], $8::integer[], $9::numeric[], $10::text[],
+        $11::integer[], $12::integer[], $13::integer[], $14::integer[], $15::integer[], $16::integer[]
+    ) AS b(created_at, tenant_id, model, prompt_tokens, completion_tokens,
+           total_tokens, latency_ms, status, cost_usd, request_id,
+           queue_ms, pre_call_ms, ttft_ms, upstream_ms, overhead_ms, callback_ms)
+), claimed AS (
+    INSERT INTO litellm_usage_request_ids (request_id, created_at)
+    SELECT request_id, created_at FROM batch WHERE request_id IS NOT NULL
+    ON CONFLICT DO NOTHING
+    RETURNING request_id
+)
+INSERT INTO litellm_usage ({columns})
+SELECT {columns}
+FROM batch b
+WHERE b.request_id IS NULL OR b.request_id IN (SELECT request_id FROM claimed)
+"""
+_DEDUP_INSERT_SQL = _DEDUP_INSERT_TEMPLATE.format(columns=_TIMED_LIST)
+_UNTIMED_SQL[_DEDUP_INSERT_SQL] = _DEDUP_INSERT_TEMPLATE.format(columns=_UNTIMED_LIST)
+
+# The same for a batch COPYed into _usage_stage (_STAGE_SQL).
+_DEDUP_MERGE_TEMPLATE = """
+WITH claimed AS (
+    INSERT INTO litellm_usage_request_ids (request_id, created_at)
+    SELECT request_id, created_at FROM _usage_stage WHERE request_id IS NOT NULL
+    ON CONFLICT DO NOTHING
+    RETURNING request_id
+)
+INSERT INTO litellm_usage ({columns})
+SELECT {columns}
+FROM _usage_stage s
+WHERE s.request_id IS NULL OR s.request_id IN (SELECT request_id FROM claimed)
+"""
+_DEDUP_MERGE_SQL = _DEDUP_MERGE_TEMPLATE.format(columns=_TIMED_LIST)
+_UNTIMED_SQL[_DEDUP_MERGE_SQL] = _DEDUP_MERGE_TEMPLATE.format(columns=_UNTIMED_LIST)
+
+# Appended to the inserts whose written rows feed the rollups, which only
+# read the columns up to request_id.
+_RETURNING_ROWS = "RETURNING " + ", ".join(_COPY_COLUMNS[:10])
+
+# Parameters are _row_args(); the untimed statement takes the first ten.
+_INSERT_TEMPLATE = """
+INSERT INTO litellm_usage ({columns})
+VALUES (COALESCE($10::timestamptz, NOW()), $1, $2, $3, $4, $5, $6, $7, $8, $9{timings})
+"""
+_INSERT_SQL = _INSERT_TEMPLATE.format(columns=_TIMED_LIST, timings=", $11, $12, $13, $14, $15, $16")
+_UNTIMED_SQL[_INSERT_SQL] = _INSERT_TEMPLATE.format(columns=_UNTIMED_LIST, timings="")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        print(f"pg_callback: invalid {name}; using {default}", file=sys.stderr)
+        return default
+
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"pg_callback: invalid {name}; using {default}", file=sys.stderr)
+        return default
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def _pg_configured() -> bool:
+    return all(
+        os.environ.get(name) for name in ("PGHOST", "PGUSER", "PGPASSWORD", "PGDATABASE")
+    )
 
 
 def _ssl_context() -> Optional[ssl.SSLContext]:
@@ -29,115 +249,939 @@ def _ssl_context() -> Optional[ssl.SSLContext]:
     return ssl.create_default_context()
 
 
+def _pool_settings() -> Dict[str, Any]:
+    """asyncpg.create_pool keyword arguments taken from the environment."""
+    min_size = max(0, _env_int("PG_POOL_MIN_SIZE", 1))
+    return {
+        "host": os.environ.get("PGHOST"),
+        "port": int(os.environ.get("PGPORT", "5432")),
+        "user": os.environ.get("PGUSER"),
+        "password": os.environ.get("PGPASSWORD"),
+        "database": os.environ.get("PGDATABASE"),
+        "ssl": _ssl_context(),
+        "min_size": min_size,
+        "max_size": max(min_size, 1, _env_int("PG_POOL_MAX_SIZE", 5)),
+        "max_queries": _env_int("PG_POOL_MAX_QUERIES", 50000),
+        "max_inactive_connection_lifetime": _env_float("PG_POOL_MAX_IDLE_SECONDS", 300.0),
+        "statement_cache_size": _env_int("PG_STATEMENT_CACHE_SIZE", 100),
+        "timeout": _env_float("PG_CONNECT_TIMEOUT", 10.0),
+        "command_timeout": _env_float("PG_COMMAND_TIMEOUT", None),
+    }
+
+
+async def _create_pool(max_size: Optional[int] = None) -> asyncpg.Pool:
+    settings = _pool_settings()
+    if max_size is not None:
+        settings["max_size"] = max(max_size, settings["min_size"], 1)
+    return await asyncpg.create_pool(**settings)
+
+
+def _get_pool_lock() -> asyncio.Lock:
+    """The lock serializing pool creation; a new event loop gets a new one."""
+    global _pool_lock, _pool_lock_loop
+    loop = asyncio.get_running_loop()
+    if _pool_lock is None or _pool_lock_loop is not loop:
+        _pool_lock, _pool_lock_loop = asyncio.Lock(), loop
+    return _pool_lock
+
+
 async def _get_pool() -> Optional[asyncpg.Pool]:
-    global _pool
+    global _pool, _pool_retry_at
     if _pool:
         return _pool
-    async with _pool_lock:
+    # After a failed connect, don't make every event wait on another one.
+    if asyncio.get_running_loop().time() < _pool_retry_at:
+        return None
+    async with _get_pool_lock():
         if _pool:
             return _pool
 
-        host = os.environ.get("PGHOST")
-        user = os.environ.get("PGUSER")
-        password = os.environ.get("PGPASSWORD")
-        database = os.environ.get("PGDATABASE")
-        port = int(os.environ.get("PGPORT", "5432"))
-
-        if not all([host, user, password, database]):
+        if not _pg_configured():
             print("pg_callback: missing PG env vars; skipping persistence")
             return None
 
         try:
-            _pool = await asyncpg.create_pool(
-                host=host,
-                port=port,
-                user=user,
-                password=password,
-                database=database,
-                ssl=_ssl_context(),
-                min_size=1,
-                max_size=5,
-            )
+            _pool = await _create_pool(_pool_max_size)
         except Exception as exc:  # pragma: no cover - defensive
             print(f"pg_callback: failed to create pool: {exc}")
+            _pool_retry_at = asyncio.get_running_loop().time() + _POOL_RETRY_SECONDS
             return None
+        _start_maintenance()
     return _pool
 
 
-async def _insert(pool: asyncpg.Pool, row: Dict[str, Any]) -> None:
-    sql = """
-    INSERT INTO litellm_usage (
-        created_at,
-        tenant_id,
-        model,
-        prompt_tokens,
-        completion_tokens,
-        total_tokens,
-        latency_ms,
-        status,
-        cost_usd,
-        request_id
-    ) VALUES (NOW(), $1, $2, $3, $4, $5, $6, $7, $8, $9)
-    """
-    await pool.execute(
-        sql,
-        row.get("tenant_id"),
-        row.get("model"),
-        row.get("prompt_tokens"),
-        row.get("completion_tokens"),
-        row.get("total_tokens"),
-        row.get("latency_ms"),
-        row.get("status"),
-        row.get("cost_usd"),
-        row.get("request_id"),
+async def get_pool() -> Optional[asyncpg.Pool]:
+    """The shared pool, opened on first use; None while Postgres is unreachable."""
+    return await _get_pool()
+
+
+async def connect() -> Optional[asyncpg.Connection]:
+    """
+    A connection of its own with the pool's settings, for work that would
+    otherwise hold a pool connection indefinitely (LISTEN); None if PG is not
+    configured. The caller closes it.
+    """
+    if not _pg_configured():
+        return None
+    settings = _pool_settings()
+    for pool_only in ("min_size", "max_size", "max_queries", "max_inactive_connection_lifetime"):
+        del settings[pool_only]
+    return await asyncpg.connect(**settings)
+
+
+async def warmup() -> bool:
+    """
+    Open the pool and run a round-trip on its min_size connections so the
+    first request on a cold instance doesn't pay for connect and TLS setup.
+    """
+    pool = await _get_pool()
+    if not pool:
+        return False
+
+    async def _ping() -> None:
+        async with pool.acquire() as conn:
+            await conn.fetchval("SELECT 1")
+
+    try:
+        await asyncio.gather(*(_ping() for _ in range(max(1, pool.get_min_size()))))
+    except Exception as exc:
+        print(f"pg_callback: pool warm-up failed: {exc}", file=sys.stderr)
+        return False
+    return True
+
+
+class _PoolSizer:
+    """
+    Adaptive pool sizing. asyncpg pools can't be resized in place, so the
+    sizer swaps in a new pool of the target size and closes the old one
+    once its in-flight queries finish.
+    """
+
+    def __init__(self, floor: int, ceiling: int, target_wait: float) -> None:
+        self.floor = floor
+        self.ceiling = max(floor, ceiling)
+        self.target_wait = target_wait
+        self._slow = 0
+        self._idle = 0
+
+    def observe(self, wait: float, in_use: int, size: int) -> Optional[int]:
+        """Feed one probe; returns a new max size when a resize is due."""
+        if wait > self.target_wait:
+            self._slow += 1
+            self._idle = 0
+        else:
+            self._slow = 0
+            self._idle = self._idle + 1 if in_use * 2 <= size else 0
+        if self._slow >= _POOL_GROW_AFTER and size < self.ceiling:
+            self._slow = 0
+            return min(self.ceiling, size * 2)
+        if self._idle >= _POOL_SHRINK_AFTER and size > self.floor:
+            self._idle = 0
+            return max(self.floor, size // 2)
+        return None
+
+
+async def _probe_wait(pool: asyncpg.Pool, timeout: float) -> float:
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    try:
+        async with pool.acquire(timeout=timeout):
+            pass
+    except asyncio.TimeoutError:
+        pass
+    return loop.time() - start
+
+
+async def _resize_pool(new_max: int) -> None:
+    global _pool, _pool_max_size
+    old = _pool
+    try:
+        new = await _create_pool(new_max)
+    except Exception as exc:
+        print(f"pg_callback: pool resize to {new_max} failed: {exc}", file=sys.stderr)
+        return
+    _pool, _pool_max_size = new, new.get_max_size()
+    print(f"pg_callback: pool resized to max_size={_pool_max_size}")
+    if old is not None:
+        await old.close()
+
+
+async def _pool_maintenance() -> None:
+    lifetime = _env_float("PG_POOL_MAX_LIFETIME_SECONDS", 0.0) or 0.0
+    sizer = None
+    if _env_flag("PG_POOL_ADAPTIVE", False):
+        floor = max(1, _env_int("PG_POOL_MAX_SIZE", 5))
+        sizer = _PoolSizer(
+            floor=floor,
+            ceiling=_env_int("PG_POOL_ADAPTIVE_MAX_SIZE", 20),
+            target_wait=_env_int("PG_POOL_TARGET_WAIT_MS", 20) / 1000,
+        )
+    if sizer is None and lifetime <= 0:
+        return
+
+    loop = asyncio.get_running_loop()
+    expire_at = loop.time() + lifetime
+    while True:
+        await asyncio.sleep(_POOL_PROBE_SECONDS)
+        pool = _pool
+        if pool is None:
+            return
+        try:
+            if lifetime > 0 and loop.time() >= expire_at:
+                # Connections are replaced as they are released.
+                await pool.expire_connections()
+                expire_at = loop.time() + lifetime
+            if sizer is not None:
+                wait = await _probe_wait(pool, timeout=max(1.0, sizer.target_wait * 10))
+                size = pool.get_max_size()
+                in_use = pool.get_size() - pool.get_idle_size()
+                new_max = sizer.observe(wait, in_use, size)
+                if new_max is not None:
+                    await _resize_pool(new_max)
+        except Exception as exc:
+            print(f"pg_callback: pool maintenance failed: {exc}", file=sys.stderr)
+
+
+_PARTITION_SQL = "SELECT litellm_usage_ensure_partitions($1::interval, $2)"
+
+
+async def _partition_maintenance(interval: float) -> None:
+    ahead = timedelta(days=_env_int("PG_PARTITION_AHEAD_DAYS", 7))
+    granularity = os.environ.get("PG_PARTITION_GRANULARITY", "day").lower()
+    while True:
+        pool = _pool
+        if pool is None:
+            return
+        try:
+            created = await pool.fetchval(_PARTITION_SQL, ahead, granularity)
+            if created:
+                print(f"pg_callback: created {created} litellm_usage partitions")
+        except asyncpg.UndefinedFunctionError:
+            print(
+                "pg_callback: litellm_usage_ensure_partitions() missing; run scripts/migrate.py",
+                file=sys.stderr,
+            )
+            return
+        except Exception as exc:
+            print(f"pg_callback: partition maintenance failed: {exc}", file=sys.stderr)
+        await asyncio.sleep(interval)
+
+
+def _start_maintenance() -> None:
+    global _maintenance_task, _partition_task
+    loop = asyncio.get_running_loop()
+    if _maintenance_task is None or _maintenance_task.done():
+        _maintenance_task = loop.create_task(_pool_maintenance())
+    interval = _env_float("PG_PARTITION_MAINTENANCE_SECONDS", 3600.0) or 0.0
+    if interval > 0 and (_partition_task is None or _partition_task.done()):
+        _partition_task = loop.create_task(_partition_maintenance(interval))
+
+
+def _status_code(value: Any) -> Optional[int]:
+    # litellm_usage.status is an INTEGER; one non-numeric status must not
+    # fail the whole batch it travels in.
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+def _row_args(row: UsageRecord) -> Tuple[Any, ...]:
+    return (
+        row.tenant_id,
+        row.model,
+        row.prompt_tokens,
+        row.completion_tokens,
+        row.total_tokens,
+        row.latency_ms,
+        _status_code(row.status),
+        row.cost_usd,
+        row.request_id,
+        row.created_at,
+        row.queue_ms,
+        row.pre_call_ms,
+        row.ttft_ms,
+        row.upstream_ms,
+        row.overhead_ms,
+        row.callback_ms,
     )
 
 
+def _copy_record(row: UsageRecord) -> Tuple[Any, ...]:
+    # Binary COPY sends values as-is: NUMERIC wants a Decimal, not a float.
+    cost = row.cost_usd
+    return (
+        row.created_at,
+        row.tenant_id,
+        row.model,
+        row.prompt_tokens,
+        row.completion_tokens,
+        row.total_tokens,
+        row.latency_ms,
+        _status_code(row.status),
+        Decimal(str(cost)) if cost is not None else None,
+        row.request_id,
+        row.queue_ms,
+        row.pre_call_ms,
+        row.ttft_ms,
+        row.upstream_ms,
+        row.overhead_ms,
+        row.callback_ms,
+    )
+
+
+def _usage_columns() -> Tuple[str, ...]:
+    return _UNTIMED_COLUMNS if _timings_disabled else _COPY_COLUMNS
+
+
+def _usage_sql(sql: str) -> str:
+    """sql, or its pre-0004 form once the timing columns were found missing."""
+    return _UNTIMED_SQL[sql] if _timings_disabled else sql
+
+
+def _timings_missing(exc: Exception) -> bool:
+    """True (and writes leave out the timing columns) if exc says litellm_usage lacks them."""
+    global _timings_disabled
+    if _timings_disabled or not isinstance(exc, asyncpg.exceptions.UndefinedColumnError):
+        return False
+    if not any(name in str(exc) for name in _COPY_COLUMNS[len(_UNTIMED_COLUMNS):]):
+        return False
+    _timings_disabled = True
+    print(f"pg_callback: timing columns unavailable ({exc}); run scripts/migrate.py", file=sys.stderr)
+    return True
+
+
+async def _insert(pool: asyncpg.Pool, row: UsageRecord) -> None:
+    args = _row_args(row)
+    await pool.execute(_usage_sql(_INSERT_SQL), *args[: len(_usage_columns())])
+
+
+async def _insert_many(pool: asyncpg.Pool, rows: List[UsageRecord]) -> None:
+    width = len(_usage_columns())
+    await pool.executemany(_usage_sql(_INSERT_SQL), [_row_args(row)[:width] for row in rows])
+
+
+async def _copy_rows(conn: asyncpg.Connection, rows: List[UsageRecord]) -> None:
+    columns = _usage_columns()
+    await conn.copy_records_to_table(
+        "litellm_usage",
+        records=[_copy_record(row)[: len(columns)] for row in rows],
+        columns=columns,
+    )
+
+
+async def _copy_many(pool: asyncpg.Pool, rows: List[UsageRecord]) -> None:
+    async with pool.acquire() as conn:
+        await _copy_rows(conn, rows)
+
+
+async def _copy_in_savepoint(conn: asyncpg.Connection, rows: List[UsageRecord]) -> None:
+    # A rejected COPY must not abort the transaction the INSERT fallback runs in.
+    async with conn.transaction():
+        await _copy_rows(conn, rows)
+
+
+def _copy_enabled() -> bool:
+    if _copy_disabled:
+        return False
+    return os.environ.get("PG_INGEST_MODE", "copy").lower() == "copy"
+
+
+def _rollups_enabled() -> bool:
+    if _rollups_disabled:
+        return False
+    return _env_flag("PG_ROLLUPS", True)
+
+
+def _rollups_missing(exc: Exception) -> bool:
+    """True (and rollups are switched off) if exc says the rollup tables don't exist."""
+    global _rollups_disabled
+    if not isinstance(exc, _ROLLUPS_MISSING) or "usage_rollup" not in str(exc):
+        return False
+    _rollups_disabled = True
+    print(f"pg_callback: usage rollups unavailable ({exc}); run scripts/migrate.py", file=sys.stderr)
+    return True
+
+
+async def _write_raw(
+    executor: Any,
+    rows: List[UsageRecord],
+    copy: Callable[[Any, List[UsageRecord]], Awaitable[None]],
+) -> None:
+    """One row as INSERT, more via COPY with INSERT fallback."""
+    global _copy_disabled
+    if len(rows) == 1:
+        await _insert(executor, rows[0])
+        return
+    if _copy_enabled():
+        try:
+            await copy(executor, rows)
+            return
+        except _COPY_UNSUPPORTED as exc:
+            _copy_disabled = True
+            print(f"pg_callback: COPY unavailable ({exc}); using INSERT", file=sys.stderr)
+        except Exception as exc:
+            print(f"pg_callback: COPY of {len(rows)} rows failed ({exc}); retrying as INSERT", file=sys.stderr)
+    await _insert_many(executor, rows)
+
+
+def _dedup_enabled() -> bool:
+    if _dedup_disabled:
+        return False
+    return _env_flag("PG_DEDUP", True)
+
+
+def _dedup_missing(exc: Exception) -> bool:
+    """True (and deduplication is switched off) if exc says litellm_usage_request_ids doesn't exist."""
+    global _dedup_disabled
+    if not isinstance(exc, _ROLLUPS_MISSING) or "litellm_usage_request_ids" not in str(exc):
+        return False
+    _dedup_disabled = True
+    print(f"pg_callback: request id dedup unavailable ({exc}); run scripts/migrate.py", file=sys.stderr)
+    return True
+
+
+def _seen_recently(request_id: Optional[str]) -> bool:
+    """Remember request_id; True if it was already queued by this process."""
+    if request_id is None or not _dedup_enabled():
+        return False
+    if request_id in _recent_ids:
+        _recent_ids.move_to_end(request_id)
+        return True
+    _recent_ids[request_id] = None
+    if len(_recent_ids) > _env_int("PG_DEDUP_CACHE_SIZE", 100000):
+        _recent_ids.popitem(last=False)
+    return False
+
+
+def _forget(rows: List[UsageRecord]) -> None:
+    """Undo _seen_recently for rows that were dropped, so a retry is not mistaken for a duplicate."""
+    for row in rows:
+        if row.request_id is not None:
+            _recent_ids.pop(row.request_id, None)
+
+
+def _unique(rows: List[UsageRecord]) -> List[UsageRecord]:
+    """Drop repeated request_ids within a batch, keeping the first."""
+    seen = set()
+    unique = []
+    for row in rows:
+        request_id = row.request_id
+        if request_id is not None:
+            if request_id in seen:
+                continue
+            seen.add(request_id)
+        unique.append(row)
+    return unique
+
+
+async def _stage(conn: asyncpg.Connection, records: List[Tuple[Any, ...]]) -> bool:
+    """COPY records into a new _usage_stage; False (nothing staged) if COPY is off or fails."""
+    global _copy_disabled
+    if not _copy_enabled():
+        return False
+    try:
+        # A savepoint, so a rejected COPY leaves the caller's transaction usable.
+        async with conn.transaction():
+            await conn.execute(_STAGE_SQL)
+            await conn.copy_records_to_table("_usage_stage", records=records, columns=_COPY_COLUMNS)
+        return True
+    except _COPY_UNSUPPORTED as exc:
+        _copy_disabled = True
+        print(f"pg_callback: COPY unavailable ({exc}); using INSERT", file=sys.stderr)
+    except Exception as exc:
+        print(f"pg_callback: COPY of {len(records)} rows failed ({exc}); retrying as INSERT", file=sys.stderr)
+    return False
+
+
+async def _write_deduped(pool: asyncpg.Pool, rows: List[UsageRecord]) -> int:
+    """Write rows whose request_id is not stored yet; returns how many were written."""
+    unique = _unique(rows)
+    if not unique:
+        return 0
+    records = [_copy_record(row) for row in unique]
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if len(records) > 1 and await _stage(conn, records):
+                sql, args = _usage_sql(_DEDUP_MERGE_SQL), []
+            else:
+                sql, args = _usage_sql(_DEDUP_INSERT_SQL), list(zip(*records))
+            if not _rollups_enabled():
+                status = await conn.execute(sql, *args)
+                return int(status.split()[-1])
+            inserted = await conn.fetch(sql + _RETURNING_ROWS, *args)
+            await rollups.apply(conn, [tuple(row) for row in inserted])
+            return len(inserted)
+
+
+async def _write_rows(pool: asyncpg.Pool, rows: List[UsageRecord]) -> int:
+    """
+    Write a batch and, in the same transaction, add it to the usage rollups.
+    Returns the number of rows written (duplicates are skipped).
+    """
+    try:
+        if _dedup_enabled():
+            written = await _write_deduped(pool, rows)
+            if written < len(rows):
+                backpressure.record("db.duplicates", len(rows) - written)
+            return written
+        if _rollups_enabled():
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await _write_raw(conn, rows, _copy_in_savepoint)
+                    await rollups.apply(conn, [_copy_record(row) for row in rows])
+            return len(rows)
+        await _write_raw(pool, rows, _copy_many)
+        return len(rows)
+    except _ROLLUPS_MISSING as exc:
+        if not (_dedup_missing(exc) or _rollups_missing(exc) or _timings_missing(exc)):
+            raise
+        return await _write_rows(pool, rows)
+
+
+_STAGE_SQL = """
+CREATE TEMP TABLE _usage_stage (
+    created_at TIMESTAMPTZ,
+    tenant_id TEXT,
+    model TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    latency_ms INTEGER,
+    status INTEGER,
+    cost_usd NUMERIC(12,6),
+    request_id TEXT,
+    queue_ms INTEGER,
+    pre_call_ms INTEGER,
+    ttft_ms INTEGER,
+    upstream_ms INTEGER,
+    overhead_ms INTEGER,
+    callback_ms INTEGER
+) ON COMMIT DROP
+"""
+
+_STAGE_INSERT_SQL = """
+INSERT INTO _usage_stage (
+    created_at, tenant_id, model, prompt_tokens, completion_tokens,
+    total_tokens, latency_ms, status, cost_usd, request_id,
+    queue_ms, pre_call_ms, ttft_ms, upstream_ms, overhead_ms, callback_ms
+) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16)
+"""
+
+_REPLAY_MERGE_TEMPLATE = """
+INSERT INTO litellm_usage ({columns})
+SELECT {columns}
+FROM _usage_stage r
+WHERE r.request_id IS NULL
+   OR NOT EXISTS (SELECT 1 FROM litellm_usage u WHERE u.request_id = r.request_id)
+"""
+
+_REPLAY_MERGE_SQL = _REPLAY_MERGE_TEMPLATE.format(columns=_TIMED_LIST)
+_UNTIMED_SQL[_REPLAY_MERGE_SQL] = _REPLAY_MERGE_TEMPLATE.format(columns=_UNTIMED_LIST)
+
+
+async def _spool_rows(rows: List[UsageRecord]) -> bool:
+    """Persist rows locally for later replay; False if they could not be kept."""
+    spool = usage_spool.get_spool()
+    if spool is None:
+        print(f"pg_callback: spool disabled; lost {len(rows)} rows", file=sys.stderr)
+        _forget(rows)
+        return False
+    try:
+        await asyncio.to_thread(spool.append, rows)
+    except Exception as exc:
+        print(f"pg_callback: spool write of {len(rows)} rows failed: {exc}", file=sys.stderr)
+        _forget(rows)
+        return False
+    _ensure_replay()
+    return True
+
+
+async def _replay_rows(pool: asyncpg.Pool, rows: List[UsageRecord]) -> int:
+    """
+    Write spooled rows, skipping request_ids already in litellm_usage (a batch
+    may have been committed even though its write reported an error).
+    Returns the number of rows inserted. Without the request id table this
+    falls back to an anti-join against litellm_usage.
+    """
+    if _dedup_enabled():
+        try:
+            return await _write_deduped(pool, rows)
+        except _ROLLUPS_MISSING as exc:
+            if not (_dedup_missing(exc) or _rollups_missing(exc) or _timings_missing(exc)):
+                raise
+            return await _replay_rows(pool, rows)
+
+    unique = _unique(rows)
+    if not unique:
+        return 0
+    records = [_copy_record(row) for row in unique]
+    with_rollups = _rollups_enabled()
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if not await _stage(conn, records):
+                    await conn.execute(_STAGE_SQL)
+                    await conn.executemany(_STAGE_INSERT_SQL, records)
+                merge_sql = _usage_sql(_REPLAY_MERGE_SQL)
+                if not with_rollups:
+                    status = await conn.execute(merge_sql)
+                    return int(status.split()[-1])
+                # Only rows the merge actually inserted go into the rollups.
+                inserted = await conn.fetch(merge_sql + _RETURNING_ROWS)
+                await rollups.apply(conn, [tuple(row) for row in inserted])
+                return len(inserted)
+    except _ROLLUPS_MISSING as exc:
+        if not ((with_rollups and _rollups_missing(exc)) or _timings_missing(exc)):
+            raise
+    return await _replay_rows(pool, rows)
+
+
+async def _replay_once() -> None:
+    spool = usage_spool.get_spool()
+    if spool is None:
+        return
+    segments = spool.sealed_segments()
+    if not segments and spool.has_active_rows():
+        await asyncio.to_thread(spool.seal)
+        segments = spool.sealed_segments()
+    if not segments:
+        return
+    pool = await _get_pool()
+    if not pool:
+        return
+    for segment in segments:
+        claimed = spool.claim(segment)
+        if claimed is None:
+            continue  # a sibling worker sharing the spool is replaying it
+        try:
+            spooled = await asyncio.to_thread(spool.read_segment, claimed)
+            rows = [UsageRecord.from_dict(row) for row in spooled]
+            inserted = await _replay_rows(pool, rows)
+        except BaseException:
+            spool.release(claimed)
+            raise
+        spool.remove(claimed)
+        print(f"pg_callback: replayed {inserted}/{len(rows)} spooled rows from {segment.name}")
+
+
+async def _replay_loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await _replay_once()
+        except Exception as exc:
+            print(f"pg_callback: spool replay failed: {exc}", file=sys.stderr)
+        spool = usage_spool.get_spool()
+        if spool is None or not spool.pending():
+            return
+
+
+def _ensure_replay() -> None:
+    global _replay_task
+    if _replay_task is None or _replay_task.done():
+        interval = _env_int("USAGE_SPOOL_REPLAY_SECONDS", 5)
+        _replay_task = asyncio.get_running_loop().create_task(_replay_loop(interval))
+
+
+_STOP = object()
+
+
+class _UsageWriter:
+    """
+    Buffers usage rows and writes them to Postgres in batches.
+
+    A single background task owns the queue; it flushes when max_rows rows
+    are buffered or flush_interval seconds have passed since the first row
+    of the batch arrived, whichever comes first. Every submitted row holds
+    a callbacks.backpressure slot, which _flush() releases once the row is
+    written or spooled.
+    """
+
+    def __init__(self, max_rows: int, flush_interval: float, queue_size: int) -> None:
+        self.max_rows = max(1, max_rows)
+        self.flush_interval = max(0.0, flush_interval)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self._pending: List[UsageRecord] = []
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def submit(self, row: UsageRecord) -> bool:
+        if self._closed:
+            return False
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            print("pg_callback: usage queue full; dropping row", file=sys.stderr)
+            return False
+        return True
+
+    async def close(self) -> None:
+        """Flush everything still queued and stop the background task."""
+        self._closed = True
+        if self._task is None or self._task.done():
+            return
+        await self._queue.put(_STOP)
+        await self._task
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                stop = await self._fill_batch()
+                if self._pending:
+                    await self._flush(self._pending)
+                    self._pending = []
+                if stop:
+                    return
+        finally:
+            # Cancelled while the loop shuts down: write what we still hold.
+            rows = self._pending + self._drain()
+            self._pending = []
+            if rows:
+                await self._flush(rows)
+
+    async def _fill_batch(self) -> bool:
+        """Collect rows into self._pending; returns True once stopped."""
+        loop = asyncio.get_running_loop()
+        first = await self._queue.get()
+        if first is _STOP:
+            return True
+        self._pending.append(first)
+        deadline = loop.time() + self.flush_interval
+        while len(self._pending) < self.max_rows:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                row = self._queue.get_nowait()
+            if row is _STOP:
+                return True
+            self._pending.append(row)
+        return False
+
+    def _drain(self) -> List[UsageRecord]:
+        rows = []
+        while not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is not _STOP:
+                rows.append(row)
+        return rows
+
+    async def _flush(self, batch: List[UsageRecord]) -> None:
+        try:
+            await self._write(batch)
+        finally:
+            backpressure.release(len(batch))
+
+    async def _write(self, batch: List[UsageRecord]) -> None:
+        pool = await _get_pool()
+        if not pool:
+            print(f"pg_callback: pool is None; spooling {len(batch)} rows", file=sys.stderr)
+            await _spool_rows(batch)
+            return
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            await _write_rows(pool, batch)
+        except Exception as exc:
+            print(f"pg_callback: batch insert of {len(batch)} rows failed: {exc}; spooling", file=sys.stderr)
+            backpressure.record("db.write_failures")
+            await _spool_rows(batch)
+            return
+        backpressure.observe_flush("db", loop.time() - start, len(batch))
+
+
+class _SpoolWriter:
+    """
+    Appends overflow rows to the spool from a single background task.
+
+    Rows wait in a bounded queue, so an overload costs at most queue_size
+    rows of memory and one executor thread at a time, instead of a thread
+    per event; submit() refuses rows once the queue is full.
+    """
+
+    def __init__(self, max_rows: int, queue_size: int) -> None:
+        self.max_rows = max(1, max_rows)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, row: UsageRecord) -> bool:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def close(self) -> None:
+        """Spool everything still queued and stop the background task."""
+        if self._task is None or self._task.done():
+            return
+        await self._queue.put(_STOP)
+        await self._task
+
+    async def _run(self) -> None:
+        rows: List[UsageRecord] = []
+        try:
+            while True:
+                first = await self._queue.get()
+                stop = first is _STOP
+                if not stop:
+                    rows.append(first)
+                while not stop and len(rows) < self.max_rows and not self._queue.empty():
+                    row = self._queue.get_nowait()
+                    stop = row is _STOP
+                    if not stop:
+                        rows.append(row)
+                if rows:
+                    await _spool_rows(rows)
+                    rows = []
+                if stop:
+                    return
+        finally:
+            # Cancelled while the loop shuts down: keep what we still hold.
+            while not self._queue.empty():
+                row = self._queue.get_nowait()
+                if row is not _STOP:
+                    rows.append(row)
+            if rows:
+                await _spool_rows(rows)
+
+
+def _get_spooler() -> _SpoolWriter:
+    global _spooler
+    if _spooler is None:
+        _spooler = _SpoolWriter(
+            max_rows=_env_int("PG_BATCH_MAX_ROWS", 500),
+            queue_size=_env_int("USAGE_SPOOL_QUEUE_SIZE", 10000),
+        )
+        backpressure.register_gauge("db.spool_queue_depth", _spooler._queue.qsize)
+    return _spooler
+
+
+def _spool_later(row: UsageRecord) -> None:
+    """Queue row for the spool writer; drop (and count) it when that queue is full."""
+    if not _get_spooler().submit(row):
+        backpressure.record("db.spool_dropped")
+        _forget([row])
+
+
+def _get_writer() -> _UsageWriter:
+    global _writer
+    if _writer is None:
+        _writer = _UsageWriter(
+            max_rows=_env_int("PG_BATCH_MAX_ROWS", 500),
+            flush_interval=_env_int("PG_BATCH_FLUSH_MS", 100) / 1000,
+            queue_size=_env_int("PG_BATCH_QUEUE_SIZE", 10000),
+        )
+        backpressure.register_gauge("db.queue_depth", _writer._queue.qsize)
+        # Rows spooled by a previous process are replayed on first use.
+        spool = usage_spool.get_spool()
+        if spool is not None and spool.pending():
+            _ensure_replay()
+    return _writer
+
+
+async def shutdown() -> None:
+    """Drain buffered usage rows and close the pool; runs on proxy shutdown (callbacks.lifecycle)."""
+    global _writer, _spooler, _pool, _replay_task, _maintenance_task, _partition_task
+    for task in (_replay_task, _maintenance_task, _partition_task):
+        if task is not None:
+            task.cancel()
+    _replay_task = _maintenance_task = _partition_task = None
+    if _writer is not None:
+        await _writer.close()
+        _writer = None
+    if _spooler is not None:
+        await _spooler.close()
+        _spooler = None
+    spool = usage_spool.get_spool()
+    if spool is not None:
+        await asyncio.to_thread(spool.seal)
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
 async def log_event(
     request_data: Optional[Dict[str, Any]],
     response_data: Optional[Dict[str, Any]],
     start_time: float,
     end_time: float,
-    **_: Any,
+    **kwargs: Any,
 ) -> None:
     """
-    LiteLLM callback: persists request usage to Postgres.
+    LiteLLM callback: queues request usage for a batched Postgres write.
     """
+    if streaming.deferred(request_data, kwargs):
+        return
+    decision = await backpressure.admit("db")
+    if decision == backpressure.DROP:
+        return
+    queued = False
+    row = None
     try:
+        row = extract(request_data, response_data, start_time, end_time)
+        # Don't keep the request/response payloads alive while we wait below.
+        del request_data, response_data
+
+        if _seen_recently(row.request_id):
+            backpressure.record("db.duplicates")
+            return
+
+        if decision == backpressure.SPOOL:
+            _spool_later(row)
+            return
+
         pool = await _get_pool()
         if not pool:
             print("pg_callback: pool is None", file=sys.stderr)
+            if _pg_configured():
+                _spool_later(row)
+            else:
+                _forget([row])
             return
 
-        try:
-            diff = end_time - start_time
-            if hasattr(diff, "total_seconds"):
-                latency_ms = int(diff.total_seconds() * 1000)
-            else:
-                latency_ms = int(diff * 1000)
-        except Exception as e:
-            print(f"pg_callback: latency calc failed: {e}", file=sys.stderr)
-            latency_ms = 0
-
-        usage = (response_data or {}).get("usage") or {}
-        
-        row = {
-            "tenant_id": (request_data or {}).get("metadata", {}).get("tenant_id"),
-            "model": (request_data or {}).get("model"),
-            "prompt_tokens": usage.get("prompt_tokens"),
-            "completion_tokens": usage.get("completion_tokens"),
-            "total_tokens": usage.get("total_tokens"),
-            "latency_ms": latency_ms,
-            "status": (response_data or {}).get("status")
-            or (response_data or {}).get("status_code"),
-            "cost_usd": (response_data or {}).get("response_cost")
-            or (response_data or {}).get("metadata", {}).get("response_cost"),
-            "request_id": (response_data or {}).get("id")
-            or (response_data or {}).get("request_id"),
-        }
-        
-        await _insert(pool, row)
+        # The writer releases the slot once the row is written or spooled.
+        queued = _get_writer().submit(row)
+        if not queued:
+            backpressure.record("db.queue_full")
+            if backpressure.overflow_policy("db") == "sample":
+                backpressure.record("db.dropped")
+                _forget([row])
+                return
+            _spool_later(row)
     except Exception as exc:  # pragma: no cover - defensive
         print(f"pg_callback: log_event failed: {exc}")
+        if row is not None:
+            _forget([row])
+    finally:
+        if decision == backpressure.RUN and not queued:
+            backpressure.release()
+
+
+def _schedule_warmup() -> None:
+    # LiteLLM imports callbacks while loading its config inside the proxy's
+    # startup event, so a running loop here means "the proxy is starting".
+    if not _env_flag("PG_POOL_WARMUP", True) or not _pg_configured():
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    loop.create_task(warmup())
 
 
+_schedule_warmup()
+lifecycle.on_shutdown(shutdown, lifecycle.ORDER_DB)
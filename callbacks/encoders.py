@@ -0,0 +1,103 @@
+"""
+JSON encoders for structured logs.
+
+Serialization runs once per request, so the log writer uses the fastest
+backend available: orjson, then msgspec, then the stdlib json module.
+LOG_JSON_ENCODER=auto|orjson|msgspec|json pins one; asking for a backend
+that isn't installed falls back to auto with a warning.
+
+Every encoder returns UTF-8 bytes and accepts plain dicts or record
+objects exposing as_dict() (see callbacks.logging.RequestLog).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Optional
+
+BACKENDS = ("orjson", "msgspec", "json")
+
+_encoders: Dict[str, "Encoder"] = {}
+
+
+def _as_plain(obj: Any) -> Any:
+    as_dict = getattr(obj, "as_dict", None)
+    if as_dict is not None:
+        return as_dict()
+    return obj
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    as_dict = getattr(obj, "as_dict", None)
+    if as_dict is not None:
+        return as_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class Encoder:
+    """A named dumps() returning bytes."""
+
+    def __init__(self, name: str, dumps: Callable[[Any], bytes]) -> None:
+        self.name = name
+        self._dumps = dumps
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._dumps(_as_plain(obj))
+
+    def __repr__(self) -> str:
+        return f"Encoder({self.name!r})"
+
+
+def _build(name: str) -> Optional[Encoder]:
+    if name == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            return None
+        return Encoder("orjson", lambda obj: orjson.dumps(obj, default=_default))
+    if name == "msgspec":
+        try:
+            import msgspec
+        except ImportError:
+            return None
+        return Encoder("msgspec", msgspec.json.Encoder(enc_hook=_default).encode)
+    if name == "json":
+        dumps = json.JSONEncoder(default=_default).encode
+        return Encoder("json", lambda obj: dumps(obj).encode("utf-8"))
+    raise ValueError(f"unknown JSON backend {name!r}; expected one of {BACKENDS}")
+
+
+def available() -> Dict[str, Encoder]:
+    """All installed backends, fastest first."""
+    found = {}
+    for name in BACKENDS:
+        encoder = get_encoder(name)
+        if encoder.name == name:
+            found[name] = encoder
+    return found
+
+
+def get_encoder(name: Optional[str] = None) -> Encoder:
+    """Return the encoder for name (default: LOG_JSON_ENCODER, else auto)."""
+    name = (name or os.environ.get("LOG_JSON_ENCODER") or "auto").lower()
+    cached = _encoders.get(name)
+    if cached is not None:
+        return cached
+
+    if name == "auto":
+        encoder = next(e for e in map(_build, BACKENDS) if e is not None)
+    else:
+        encoder = _build(name)
+        if encoder is None:
+            print(f"encoders: {name} is not installed; using auto", file=sys.stderr)
+            encoder = get_encoder("auto")
+    _encoders[name] = encoder
+    return encoder
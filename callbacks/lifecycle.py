@@ -0,0 +1,91 @@
+"""
+Shutdown steps of the callbacks, run when the proxy stops.
+
+Several callbacks hold work in memory between flushes: pending balance
+debits (callbacks.balance), queued usage rows (callbacks.db), stream
+reports not yet delivered (callbacks.streaming) and the metrics of this
+worker (callbacks.metrics). Each registers its async shutdown() here with
+on_shutdown(); loading any of them hooks run_shutdown() into the running
+LiteLLM proxy, the same way callbacks.usage_api adds its routes.
+
+LiteLLM's app has a lifespan, so Starlette never calls handlers added with
+app.add_event_handler("shutdown"). Its lifespan calls
+proxy_server.proxy_shutdown_event() once requests have drained (after
+SIGTERM, which start.sh forwards), so register() wraps that function; the
+callbacks run first, then LiteLLM's own teardown. Plain FastAPI apps get an
+ordinary shutdown handler.
+
+Steps run in ascending order (ties in registration order), each at most
+once per process; a failing step is logged and the rest still run.
+"""
+
+from __future__ import annotations
+
+import functools
+import sys
+from typing import Any, Awaitable, Callable, List, Tuple
+
+# Orders used by the callbacks: stream reports feed the sinks, balance
+# debits go through the db pool, so the pool closes last.
+ORDER_STREAMS = 0
+ORDER_BALANCE = 10
+ORDER_METRICS = 50
+ORDER_DB = 100
+
+_hooks: List[Tuple[int, int, Callable[[], Awaitable[Any]]]] = []
+_done = False
+_registered = False
+
+
+def on_shutdown(hook: Callable[[], Awaitable[Any]], order: int = 50) -> None:
+    """Run hook() (an async function) when the proxy shuts down."""
+    if any(existing is hook for _, _, existing in _hooks):
+        return
+    _hooks.append((order, len(_hooks), hook))
+    register()
+
+
+async def run_shutdown() -> None:
+    """Run the registered steps; later calls do nothing."""
+    global _done
+    if _done:
+        return
+    _done = True
+    for _, _, hook in sorted(_hooks, key=lambda entry: entry[:2]):
+        try:
+            await hook()
+        except Exception as exc:
+            name = f"{getattr(hook, '__module__', '?')}.{getattr(hook, '__qualname__', hook)}"
+            print(f"lifecycle: {name} failed: {exc}", file=sys.stderr)
+
+
+def _wrap(shutdown_event: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(shutdown_event)
+    async def proxy_shutdown_event(*args: Any, **kwargs: Any) -> Any:
+        await run_shutdown()
+        return await shutdown_event(*args, **kwargs)
+
+    proxy_shutdown_event.__wrapped_by_callbacks__ = True  # type: ignore[attr-defined]
+    return proxy_shutdown_event
+
+
+def register(app: Any = None) -> bool:
+    """Hook run_shutdown() into app's shutdown (default: the running LiteLLM proxy's)."""
+    global _registered
+    if _registered:
+        return True
+    try:
+        if app is None:
+            from litellm.proxy import proxy_server
+
+            if not getattr(proxy_server.proxy_shutdown_event, "__wrapped_by_callbacks__", False):
+                proxy_server.proxy_shutdown_event = _wrap(proxy_server.proxy_shutdown_event)
+        else:
+            app.add_event_handler("shutdown", run_shutdown)
+    except ImportError:
+        return False
+    except Exception as exc:  # pragma: no cover - defensive
+        print(f"lifecycle: cannot register shutdown: {exc}", file=sys.stderr)
+        return False
+    _registered = True
+    return True
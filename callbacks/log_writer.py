@@ -0,0 +1,209 @@
+"""
+Non-blocking stdout writer for structured logs.
+
+callbacks.logging used to json.dumps and print(..., flush=True) on the event
+loop, paying a write and a flush syscall per request and stalling whenever
+the Cloud Run log agent was slow to drain the pipe. Records are now queued
+and a daemon thread serializes them, coalesces lines into large chunks and
+writes a chunk when it reaches LOG_BUFFER_BYTES or LOG_FLUSH_MS has passed.
+
+  LOG_FLUSH_MS (default 200)
+  LOG_BUFFER_BYTES (default 65536)
+  LOG_QUEUE_SIZE (default 10000) records buffered before new ones are dropped
+
+Records are flushed at interpreter exit; flush() forces a write and waits
+for it, which tests and shutdown hooks use. A record submitted with
+on_written has it called, on the writer thread, once its line is written
+(or could not be encoded). Serialization uses the backend
+picked by callbacks.encoders (LOG_JSON_ENCODER).
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from callbacks import encoders
+
+_STOP = object()
+
+
+class _Tracked:
+    __slots__ = ("record", "on_written")
+
+    def __init__(self, record: Any, on_written: Callable[[], None]) -> None:
+        self.record = record
+        self.on_written = on_written
+
+_writer: Optional["LogWriter"] = None
+_writer_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class LogWriter:
+    """
+    One background thread owns serialization and stdout; submit() only
+    enqueues. The stream is looked up per write so redirected stdout
+    (pytest's capsys, for one) is honoured.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = 0.2,
+        buffer_bytes: int = 65536,
+        queue_size: int = 10000,
+        encode: Optional[Callable[[Any], bytes]] = None,
+        stream: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        self.flush_interval = max(0.0, flush_interval)
+        self.buffer_bytes = max(1, buffer_bytes)
+        self.encode = encode or encoders.get_encoder().dumps
+        self._stream = stream or (lambda: sys.stdout)
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self.dropped = 0
+
+    def submit(self, record: Any, on_written: Optional[Callable[[], None]] = None) -> bool:
+        """Queue a record for writing; False if the queue is full or closed."""
+        if self._closed:
+            return False
+        self._ensure_thread()
+        if on_written is not None:
+            record = _Tracked(record, on_written)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """Write everything queued so far and wait until it is on the stream."""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        self._closed = True
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        lines: List[bytes] = []
+        written: List[Callable[[], None]] = []
+        size = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._write(lines, written)
+                return
+            if isinstance(item, threading.Event):
+                self._write(lines, written)
+                lines, written, size, deadline = [], [], 0, None
+                item.set()
+                continue
+            if item is not None:
+                if isinstance(item, _Tracked):
+                    written.append(item.on_written)
+                    item = item.record
+                try:
+                    line = self.encode(item) + b"\n"
+                except Exception as exc:  # pragma: no cover - defensive
+                    print(f"log_writer: cannot encode record: {exc}", file=sys.stderr)
+                    continue
+                lines.append(line)
+                size += len(line)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if lines and (size >= self.buffer_bytes or time.monotonic() >= deadline):
+                self._write(lines, written)
+                lines, written, size, deadline = [], [], 0, None
+
+    def _write(self, lines: List[bytes], written: List[Callable[[], None]]) -> None:
+        try:
+            self._write_lines(lines)
+        finally:
+            for on_written in written:
+                try:
+                    on_written()
+                except Exception:  # pragma: no cover - e.g. the event loop already closed
+                    pass
+
+    def _write_lines(self, lines: List[bytes]) -> None:
+        if not lines:
+            return
+        data = b"".join(lines)
+        try:
+            stream = self._stream()
+            binary = getattr(stream, "buffer", None)
+            if binary is not None:
+                # Push out anything print() left in the text layer first so
+                # lines from both paths stay in order.
+                stream.flush()
+                binary.write(data)
+                binary.flush()
+            else:
+                stream.write(data.decode("utf-8"))
+                stream.flush()
+        except Exception as exc:  # pragma: no cover - defensive
+            print(f"log_writer: write failed: {exc}", file=sys.stderr)
+
+
+def get_writer() -> LogWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LogWriter(
+                    flush_interval=_env_int("LOG_FLUSH_MS", 200) / 1000,
+                    buffer_bytes=_env_int("LOG_BUFFER_BYTES", 65536),
+                    queue_size=_env_int("LOG_QUEUE_SIZE", 10000),
+                )
+                atexit.register(_writer.close)
+    return _writer
+
+
+def emit(record: Any, on_written: Optional[Callable[[], None]] = None) -> bool:
+    """Queue one structured log record for stdout."""
+    return get_writer().submit(record, on_written)
+
+
+def flush(timeout: Optional[float] = 5.0) -> bool:
+    if _writer is None:
+        return True
+    return _writer.flush(timeout)
@@ -3,41 +3,32 @@ Structured logging callback for LiteLLM proxy.
 
 Emits a JSON log per request so Cloud Logging/Monitoring can
 build dashboards and alerts around tokens, cost, latency, and errors.
+Events are admitted through callbacks.backpressure and hold their slot
+until the writer has put the line on stdout; when the pipeline is
+saturated, logs are sampled by default (CALLBACK_OVERFLOW_LOGGING).
+Records are written by the background writer in callbacks.log_writer, so
+the event loop never blocks on stdout. Fields come from the UsageRecord
+shared with the other sinks (callbacks.record), including its timing
+breakdown (queue_ms, pre_call_ms, ttft_ms, upstream_ms, overhead_ms,
+callback_ms).
+
+LOG_SAMPLE_RATE (default 1.0) keeps that fraction of successful request
+logs; 0 turns them off. Failed requests are always logged. Use it once
+dashboards read the counters from callbacks.metrics instead of log-based
+metrics.
 """
 
 from __future__ import annotations
 
-import json
+import asyncio
+import functools
 import os
-import time
-from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+import random
+import sys
+from typing import Any, Callable, Dict, Optional
 
-
-def _now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
-
-
-def _usage_fields(response_data: Optional[Dict[str, Any]]) -> Dict[str, Optional[int]]:
-    usage = {}
-    if isinstance(response_data, dict):
-        usage = response_data.get("usage") or {}
-    return {
-        "prompt_tokens": usage.get("prompt_tokens"),
-        "completion_tokens": usage.get("completion_tokens"),
-        "total_tokens": usage.get("total_tokens"),
-    }
-
-
-def _cost_usd(response_data: Optional[Dict[str, Any]]) -> Optional[float]:
-    if not isinstance(response_data, dict):
-        return None
-    # LiteLLM often injects cost under "response_cost" or in metadata; grab either if present.
-    cost = response_data.get("response_cost")
-    if cost is not None:
-        return cost
-    metadata = response_data.get("metadata") or {}
-    return metadata.get("response_cost")
+from callbacks import backpressure, log_writer, streaming
+from callbacks.record import UsageRecord, extract
 
 
 async def log_event(
@@ -49,36 +40,86 @@ async def log_event(
 ) -> None:
     """
     Callback signature expected by LiteLLM.
-    Prints structured JSON to stdout for Cloud Logging ingestion.
+    Queues structured JSON for stdout (Cloud Logging ingestion).
+    """
+    if streaming.deferred(request_data, kwargs):
+        return
+    record = extract(request_data, response_data, start_time, end_time)
+    if not _sampled(record):
+        backpressure.record("logging.sampled_out")
+        return
+    # There is no spool for logs, so SPOOL is treated like DROP here.
+    if await backpressure.admit("logging") != backpressure.RUN:
+        return
+    # The writer thread hands the slot back to the loop once the line is out.
+    release = functools.partial(asyncio.get_running_loop().call_soon_threadsafe, backpressure.release)
+    queued = False
+    try:
+        queued = _emit(record, release)
+    finally:
+        if not queued:
+            backpressure.release()
+
+
+def _sample_rate() -> float:
+    try:
+        return min(1.0, max(0.0, float(os.environ.get("LOG_SAMPLE_RATE", 1.0))))
+    except ValueError:
+        print("logging: invalid LOG_SAMPLE_RATE; logging every request", file=sys.stderr)
+        return 1.0
+
+
+def _sampled(record: UsageRecord) -> bool:
+    rate = _sample_rate()
+    if rate >= 1.0 or record.error:
+        return True
+    status = record.status
+    if isinstance(status, int) and not isinstance(status, bool) and status >= 400:
+        return True
+    return random.random() < rate
+
+
+class RequestLog:
+    """
+    Log view of a shared UsageRecord. Built on the event loop as a one-slot
+    object; the timestamp string, the labels block and the dict handed to
+    the JSON encoder are only produced by as_dict() on the log writer thread.
     """
 
-    latency_ms = int((end_time - start_time) * 1000)
-    usage = _usage_fields(response_data)
-    log_record = {
-        "message": "litellm_request",
-        "severity": "INFO",
-        "timestamp": _now_iso(),
-        "latency_ms": latency_ms,
-        "model": (request_data or {}).get("model"),
-        "tenant_id": (request_data or {}).get("metadata", {}).get("tenant_id"),
-        "status": (response_data or {}).get("status") or (response_data or {}).get(
-            "status_code"
-        ),
-        "error": (response_data or {}).get("error"),
-        "request_id": (response_data or {}).get("id")
-        or (response_data or {}).get("request_id"),
-        "prompt_tokens": usage["prompt_tokens"],
-        "completion_tokens": usage["completion_tokens"],
-        "total_tokens": usage["total_tokens"],
-        "cost_usd": _cost_usd(response_data),
-    }
-
-    # Optional: attach labels for easier Cloud Logging queries.
-    log_record["labels"] = {
-        "tenant_id": log_record["tenant_id"],
-        "model": log_record["model"],
-    }
-
-    print(json.dumps(log_record), flush=True)
-
-
+    __slots__ = ("record",)
+
+    def __init__(self, record: UsageRecord) -> None:
+        self.record = record
+
+    def as_dict(self) -> Dict[str, Any]:
+        record = self.record
+        return {
+            "message": "litellm_request",
+            "severity": "INFO",
+            "timestamp": record.created_at.isoformat(),
+            "latency_ms": record.latency_ms,
+            "queue_ms": record.queue_ms,
+            "pre_call_ms": record.pre_call_ms,
+            "ttft_ms": record.ttft_ms,
+            "upstream_ms": record.upstream_ms,
+            "overhead_ms": record.overhead_ms,
+            "callback_ms": record.callback_ms,
+            "model": record.model,
+            "tenant_id": record.tenant_id,
+            "status": record.status,
+            "error": record.error,
+            "request_id": record.request_id,
+            "prompt_tokens": record.prompt_tokens,
+            "completion_tokens": record.completion_tokens,
+            "total_tokens": record.total_tokens,
+            "cost_usd": record.cost_usd,
+            # Optional: attach labels for easier Cloud Logging queries.
+            "labels": {"tenant_id": record.tenant_id, "model": record.model},
+        }
+
+
+def _emit(record: UsageRecord, on_written: Optional[Callable[[], None]] = None) -> bool:
+    if not log_writer.emit(RequestLog(record), on_written):
+        backpressure.record("logging.queue_full")
+        return False
+    return True
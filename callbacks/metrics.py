@@ -0,0 +1,605 @@
+"""
+In-process usage metrics for LiteLLM proxy.
+
+Request counts, token and cost totals and a latency histogram are kept in
+memory per (tenant_id, model, status) instead of being derived from one
+log line per request by Cloud Logging log-based metrics. Register
+callbacks.metrics.log_event next to the other callbacks; it reads the
+UsageRecord shared with them (callbacks.record), so it adds no parsing.
+
+Exports (defaults in brackets):
+  METRICS_PROMETHEUS_PORT [9464] serve Prometheus text at /metrics on
+    METRICS_PROMETHEUS_HOST [127.0.0.1]; 0 disables the endpoint
+  METRICS_CLOUD_MONITORING [0] write every series to Cloud Monitoring as
+    custom.googleapis.com/litellm/* in one batched request every
+    METRICS_EXPORT_INTERVAL_SECONDS [60]; the project comes from
+    METRICS_GCP_PROJECT or GOOGLE_CLOUD_PROJECT
+  METRICS_MAX_SERIES [10000] label sets tracked before new tenants are
+    folded into tenant_id="__other__"
+
+The timing breakdown of callbacks.record is kept as one histogram per
+(model, phase), phase being queue, pre_call, ttft, upstream, overhead or
+callback, with finer buckets at the low end so the proxy overhead p99 can
+be read against a few-millisecond budget. Phases an event does not carry
+are not observed.
+
+Counters are cumulative from process start; each instance writes its own
+series (task_id is host and pid), so aggregate across instances in the
+query.
+
+Several proxy workers in one container (start.sh PROXY_WORKERS) share their
+counters through files:
+  METRICS_MULTIPROC_DIR [unset] directory, ideally memory-backed, where
+    every worker writes its registry to <pid>.json every
+    METRICS_MULTIPROC_WRITE_SECONDS [1]
+  PROXY_WORKER_ID [0] only worker 0 serves /metrics and exports to Cloud
+    Monitoring, reporting its own live counters plus the other workers' files
+Files of workers that exited are still summed, so counters never go back;
+start.sh empties the directory when the container starts.
+
+With metrics exported here, per-request logs can be thinned with
+LOG_SAMPLE_RATE (see callbacks.logging).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from callbacks import lifecycle, streaming
+from callbacks.record import TIMINGS, UsageRecord, extract
+
+# Upper bounds in milliseconds; the last bucket is +Inf.
+LATENCY_BUCKETS_MS: Tuple[float, ...] = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+PHASE_BUCKETS_MS: Tuple[float, ...] = (
+    1, 2, 3, 5, 7.5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000
+)
+# (label, UsageRecord field) for each timing phase.
+PHASES: Tuple[Tuple[str, str], ...] = tuple((name[: -len("_ms")], name) for name in TIMINGS)
+
+_OTHER = "__other__"
+_METRIC_PREFIX = "custom.googleapis.com/litellm/"
+# Cloud Monitoring accepts at most 200 time series per create call.
+_CLOUD_BATCH = 200
+
+_registry: Optional["MetricsRegistry"] = None
+_server: Optional[asyncio.AbstractServer] = None
+_server_started = False
+_export_task: Optional[asyncio.Task] = None
+_export_configured = False
+_snapshot_task: Optional[asyncio.Task] = None
+
+Labels = Tuple[str, str, str]
+PhaseLabels = Tuple[str, str]
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        print(f"metrics: invalid {name}; using {default}", file=sys.stderr)
+        return default
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _status_label(record: UsageRecord) -> str:
+    status = record.status
+    if isinstance(status, int) and not isinstance(status, bool):
+        return str(status)
+    if isinstance(status, str) and status.isdigit():
+        return status
+    return "error" if record.error else "ok"
+
+
+class _Series:
+    __slots__ = ("requests", "prompt_tokens", "completion_tokens", "cost_usd", "latency_buckets", "latency_sum")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latency_sum = 0.0
+
+
+class _Phase:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(PHASE_BUCKETS_MS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms keyed by (tenant_id, model, status), plus the
+    phase histograms keyed by (model, phase). Only touched from the event
+    loop; exporters work on snapshot() and phase_snapshot() copies.
+    """
+
+    def __init__(self, max_series: int = 10000) -> None:
+        self.max_series = max(1, max_series)
+        self.start_time = time.time()
+        self._series: Dict[Labels, _Series] = {}
+        self._phases: Dict[PhaseLabels, _Phase] = {}
+        self.observed = 0
+
+    def observe(self, record: UsageRecord) -> None:
+        self.observed += 1
+        key = (record.tenant_id or "", record.model or "", _status_label(record))
+        series = self._series.get(key)
+        if series is None:
+            if len(self._series) >= self.max_series:
+                key = (_OTHER, key[1], key[2])
+                series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series()
+        series.requests += 1
+        series.prompt_tokens += record.prompt_tokens or 0
+        series.completion_tokens += record.completion_tokens or 0
+        series.cost_usd += record.cost_usd or 0.0
+        latency = record.latency_ms or 0
+        series.latency_buckets[bisect_left(LATENCY_BUCKETS_MS, latency)] += 1
+        series.latency_sum += latency
+        self._observe_phases(record)
+
+    def _observe_phases(self, record: UsageRecord) -> None:
+        model = record.model or ""
+        for phase, field in PHASES:
+            value = getattr(record, field)
+            if value is None:
+                continue
+            key = (model, phase)
+            histogram = self._phases.get(key)
+            if histogram is None:
+                if len(self._phases) >= self.max_series:
+                    continue
+                histogram = self._phases[key] = _Phase()
+            histogram.buckets[bisect_left(PHASE_BUCKETS_MS, value)] += 1
+            histogram.sum += value
+            histogram.count += 1
+
+    def snapshot(self) -> List[Tuple[Labels, Dict[str, Any]]]:
+        return [
+            (
+                labels,
+                {
+                    "requests": s.requests,
+                    "prompt_tokens": s.prompt_tokens,
+                    "completion_tokens": s.completion_tokens,
+                    "cost_usd": s.cost_usd,
+                    "latency_buckets": list(s.latency_buckets),
+                    "latency_sum": s.latency_sum,
+                },
+            )
+            for labels, s in self._series.items()
+        ]
+
+    def phase_snapshot(self) -> List[Tuple[PhaseLabels, Dict[str, Any]]]:
+        return [
+            (labels, {"buckets": list(h.buckets), "sum": h.sum, "count": h.count})
+            for labels, h in self._phases.items()
+        ]
+
+    def export(self) -> Dict[str, Any]:
+        """What write_snapshot stores for the other workers."""
+        return {"start_time": self.start_time, "series": self.snapshot(), "phases": self.phase_snapshot()}
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+
+def _primary() -> bool:
+    return os.environ.get("PROXY_WORKER_ID", "0").strip() in ("", "0")
+
+
+def _multiproc_dir() -> Optional[str]:
+    return os.environ.get("METRICS_MULTIPROC_DIR") or None
+
+
+def _add(into: Dict[str, Any], values: Dict[str, Any]) -> None:
+    for name, value in values.items():
+        if isinstance(value, list):
+            current = into.setdefault(name, [0] * len(value))
+            for i, count in enumerate(value):
+                current[i] += count
+        else:
+            into[name] = into.get(name, 0) + value
+
+
+def _merge(snapshots: List[List[Tuple[Any, Dict[str, Any]]]]) -> List[Tuple[Any, Dict[str, Any]]]:
+    """Sum snapshot lists from several workers, label set by label set."""
+    merged: Dict[Any, Dict[str, Any]] = {}
+    for snapshot in snapshots:
+        for labels, values in snapshot:
+            _add(merged.setdefault(tuple(labels), {}), values)
+    return list(merged.items())
+
+
+def write_snapshot(directory: str, data: Dict[str, Any]) -> None:
+    """Atomically replace this worker's file in directory with data."""
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    temporary = os.path.join(directory, f".{os.getpid()}.json.tmp")
+    with open(temporary, "w", encoding="utf-8") as out:
+        json.dump(data, out, separators=(",", ":"))
+    os.replace(temporary, path)
+
+
+def read_snapshots(directory: str) -> List[Dict[str, Any]]:
+    """Every other worker's last written registry."""
+    own = f"{os.getpid()}.json"
+    found = []
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return found
+    for name in names:
+        if not name.endswith(".json") or name.startswith(".") or name == own:
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as source:
+                found.append(json.load(source))
+        except (OSError, ValueError) as exc:
+            print(f"metrics: skipping {name}: {exc}", file=sys.stderr)
+    return found
+
+
+async def collect() -> Tuple[List[Tuple[Labels, Dict[str, Any]]], List[Tuple[PhaseLabels, Dict[str, Any]]], float]:
+    """
+    (snapshot, phase_snapshot, start_time) to export: this process's
+    registry, summed with the other workers' files under METRICS_MULTIPROC_DIR.
+    """
+    registry = get_registry()
+    snapshot, phases, start_time = registry.snapshot(), registry.phase_snapshot(), registry.start_time
+    directory = _multiproc_dir()
+    if directory is None:
+        return snapshot, phases, start_time
+    others = await asyncio.to_thread(read_snapshots, directory)
+    if not others:
+        return snapshot, phases, start_time
+    return (
+        _merge([snapshot] + [other["series"] for other in others]),
+        _merge([phases] + [other["phases"] for other in others]),
+        min([start_time] + [other["start_time"] for other in others]),
+    )
+
+
+async def _snapshot_loop(directory: str, interval: float) -> None:
+    registry = get_registry()
+    written = -1
+    while True:
+        await asyncio.sleep(interval)
+        # Only rewrite the file when something was observed since.
+        observed = registry.observed
+        if observed == written:
+            continue
+        try:
+            await asyncio.to_thread(write_snapshot, directory, registry.export())
+            written = observed
+        except OSError as exc:
+            print(f"metrics: cannot write snapshot to {directory}: {exc}", file=sys.stderr)
+
+
+def get_registry() -> MetricsRegistry:
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry(max_series=int(_env_number("METRICS_MAX_SERIES", 10000)))
+    return _registry
+
+
+async def log_event(
+    request_data: Optional[Dict[str, Any]],
+    response_data: Optional[Dict[str, Any]],
+    start_time: float,
+    end_time: float,
+    **kwargs: Any,
+) -> None:
+    """Callback signature expected by LiteLLM. Updates in-memory counters only."""
+    if streaming.deferred(request_data, kwargs):
+        return
+    try:
+        get_registry().observe(extract(request_data, response_data, start_time, end_time))
+    except Exception as exc:  # pragma: no cover - defensive
+        print(f"metrics: cannot record event: {exc}", file=sys.stderr)
+    await _ensure_exporters()
+
+
+# --- Prometheus text ---------------------------------------------------------
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels: Labels, extra: str = "") -> str:
+    tenant, model, status = labels
+    text = f'tenant_id="{_escape(tenant)}",model="{_escape(model)}",status="{_escape(status)}"'
+    return "{" + text + (("," + extra) if extra else "") + "}"
+
+
+def _format(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(
+    snapshot: Optional[List[Tuple[Labels, Dict[str, Any]]]] = None,
+    phases: Optional[List[Tuple[PhaseLabels, Dict[str, Any]]]] = None,
+) -> str:
+    """Render the registry in the Prometheus text exposition format (0.0.4)."""
+    if snapshot is None:
+        registry = get_registry()
+        snapshot, phases = registry.snapshot(), registry.phase_snapshot()
+    lines = [
+        "# HELP litellm_requests_total Requests seen by the proxy.",
+        "# TYPE litellm_requests_total counter",
+    ]
+    for labels, values in snapshot:
+        lines.append(f"litellm_requests_total{_label_text(labels)} {values['requests']}")
+
+    lines += [
+        "# HELP litellm_tokens_total Tokens billed, by token type.",
+        "# TYPE litellm_tokens_total counter",
+    ]
+    for labels, values in snapshot:
+        for kind in ("prompt", "completion"):
+            text = _label_text(labels, f'type="{kind}"')
+            lines.append(f"litellm_tokens_total{text} {values[kind + '_tokens']}")
+
+    lines += [
+        "# HELP litellm_cost_usd_total Cost in USD.",
+        "# TYPE litellm_cost_usd_total counter",
+    ]
+    for labels, values in snapshot:
+        lines.append(f"litellm_cost_usd_total{_label_text(labels)} {_format(values['cost_usd'])}")
+
+    lines += [
+        "# HELP litellm_request_latency_ms Request latency in milliseconds.",
+        "# TYPE litellm_request_latency_ms histogram",
+    ]
+    for labels, values in snapshot:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS + (float("inf"),), values["latency_buckets"]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _format(bound)
+            text = _label_text(labels, f'le="{le}"')
+            lines.append(f"litellm_request_latency_ms_bucket{text} {cumulative}")
+        text = _label_text(labels)
+        lines.append(f"litellm_request_latency_ms_sum{text} {_format(values['latency_sum'])}")
+        lines.append(f"litellm_request_latency_ms_count{text} {values['requests']}")
+
+    lines += [
+        "# HELP litellm_request_phase_ms Time per request phase in milliseconds (see callbacks.record).",
+        "# TYPE litellm_request_phase_ms histogram",
+    ]
+    for (model, phase), values in phases or ():
+        labels = f'model="{_escape(model)}",phase="{phase}"'
+        cumulative = 0
+        for bound, count in zip(PHASE_BUCKETS_MS + (float("inf"),), values["buckets"]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _format(bound)
+            lines.append(f'litellm_request_phase_ms_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"litellm_request_phase_ms_sum{{{labels}}} {_format(values['sum'])}")
+        lines.append(f"litellm_request_phase_ms_count{{{labels}}} {values['count']}")
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?", 1)[0] == "/metrics":
+            snapshot, phases, _ = await collect()
+            status, body = "200 OK", render_prometheus(snapshot, phases).encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            status, body, content_type = "404 Not Found", b"not found\n", "text/plain"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host: str, port: int) -> Optional[asyncio.AbstractServer]:
+    """Serve /metrics; returns None (and logs) if the port cannot be bound."""
+    try:
+        return await asyncio.start_server(_handle_scrape, host, port)
+    except OSError as exc:
+        print(f"metrics: cannot serve /metrics on {host}:{port}: {exc}", file=sys.stderr)
+        return None
+
+
+# --- Cloud Monitoring --------------------------------------------------------
+
+
+def _timestamp(seconds: float) -> Dict[str, int]:
+    whole = int(seconds)
+    return {"seconds": whole, "nanos": int((seconds - whole) * 1e9)}
+
+
+def _monitored_resource(project: str) -> Dict[str, Any]:
+    return {
+        "type": "generic_task",
+        "labels": {
+            "project_id": project,
+            "location": os.environ.get("METRICS_GCP_LOCATION", "global"),
+            "namespace": os.environ.get("K_SERVICE", "litellm-proxy"),
+            "job": os.environ.get("K_REVISION", "local"),
+            "task_id": f"{socket.gethostname()}-{os.getpid()}",
+        },
+    }
+
+
+def cloud_time_series(
+    snapshot: List[Tuple[Labels, Dict[str, Any]]],
+    project: str,
+    start_time: float,
+    end_time: float,
+    phases: Optional[List[Tuple[PhaseLabels, Dict[str, Any]]]] = None,
+) -> List[Dict[str, Any]]:
+    """Build CUMULATIVE Cloud Monitoring time series (as dicts) for a snapshot."""
+    resource = _monitored_resource(project)
+    interval = {"start_time": _timestamp(start_time), "end_time": _timestamp(end_time)}
+
+    def series(name: str, labels: Dict[str, str], value_type: str, value: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "metric": {"type": _METRIC_PREFIX + name, "labels": labels},
+            "resource": resource,
+            "metric_kind": "CUMULATIVE",
+            "value_type": value_type,
+            "points": [{"interval": interval, "value": value}],
+        }
+
+    out = []
+    for (tenant, model, status), values in snapshot:
+        labels = {"tenant_id": tenant, "model": model, "status": status}
+        out.append(series("requests", labels, "INT64", {"int64_value": values["requests"]}))
+        out.append(
+            series("tokens", dict(labels, type="prompt"), "INT64", {"int64_value": values["prompt_tokens"]})
+        )
+        out.append(
+            series("tokens", dict(labels, type="completion"), "INT64", {"int64_value": values["completion_tokens"]})
+        )
+        out.append(series("cost_usd", labels, "DOUBLE", {"double_value": values["cost_usd"]}))
+        count = values["requests"]
+        out.append(
+            series(
+                "request_latency_ms",
+                labels,
+                "DISTRIBUTION",
+                {
+                    "distribution_value": {
+                        "count": count,
+                        "mean": values["latency_sum"] / count if count else 0.0,
+                        "bucket_options": {"explicit_buckets": {"bounds": list(LATENCY_BUCKETS_MS)}},
+                        "bucket_counts": values["latency_buckets"],
+                    }
+                },
+            )
+        )
+    for (model, phase), values in phases or ():
+        count = values["count"]
+        out.append(
+            series(
+                "request_phase_ms",
+                {"model": model, "phase": phase},
+                "DISTRIBUTION",
+                {
+                    "distribution_value": {
+                        "count": count,
+                        "mean": values["sum"] / count if count else 0.0,
+                        "bucket_options": {"explicit_buckets": {"bounds": list(PHASE_BUCKETS_MS)}},
+                        "bucket_counts": values["buckets"],
+                    }
+                },
+            )
+        )
+    return out
+
+
+def _cloud_client() -> Any:
+    try:
+        from google.cloud import monitoring_v3
+    except ImportError:
+        print("metrics: google-cloud-monitoring is not installed; Cloud Monitoring export disabled", file=sys.stderr)
+        return None
+    return monitoring_v3.MetricServiceClient()
+
+
+def _write_cloud(client: Any, project: str, time_series: List[Dict[str, Any]]) -> None:
+    for start in range(0, len(time_series), _CLOUD_BATCH):
+        client.create_time_series(name=f"projects/{project}", time_series=time_series[start : start + _CLOUD_BATCH])
+
+
+async def export_cloud_once(client: Any, project: str) -> int:
+    """Write the current registry to Cloud Monitoring; returns the series count."""
+    snapshot, phases, start_time = await collect()
+    time_series = cloud_time_series(snapshot, project, start_time, time.time(), phases)
+    if time_series:
+        await asyncio.to_thread(_write_cloud, client, project, time_series)
+    return len(time_series)
+
+
+async def _cloud_export_loop(client: Any, project: str, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await export_cloud_once(client, project)
+        except Exception as exc:
+            print(f"metrics: Cloud Monitoring export failed: {exc}", file=sys.stderr)
+
+
+async def _ensure_exporters() -> None:
+    global _server, _server_started, _export_task, _export_configured, _snapshot_task
+    directory = _multiproc_dir()
+    if directory is not None and _snapshot_task is None:
+        interval = max(0.1, _env_number("METRICS_MULTIPROC_WRITE_SECONDS", 1))
+        _snapshot_task = asyncio.get_running_loop().create_task(_snapshot_loop(directory, interval))
+    if not _primary():
+        return
+    if not _server_started:
+        _server_started = True
+        port = int(_env_number("METRICS_PROMETHEUS_PORT", 9464))
+        if port > 0:
+            _server = await start_server(os.environ.get("METRICS_PROMETHEUS_HOST", "127.0.0.1"), port)
+
+    if _export_configured or not _env_flag("METRICS_CLOUD_MONITORING"):
+        return
+    _export_configured = True
+    project = os.environ.get("METRICS_GCP_PROJECT") or os.environ.get("GOOGLE_CLOUD_PROJECT")
+    if not project:
+        print("metrics: METRICS_GCP_PROJECT is not set; Cloud Monitoring export disabled", file=sys.stderr)
+        return
+    client = _cloud_client()
+    if client is None:
+        return
+    # Cloud Monitoring rejects points for one series written less than 5s apart.
+    interval = max(10.0, _env_number("METRICS_EXPORT_INTERVAL_SECONDS", 60))
+    _export_task = asyncio.get_running_loop().create_task(_cloud_export_loop(client, project, interval))
+
+
+async def shutdown() -> None:
+    """Stop the exporters (the registry is kept); runs on proxy shutdown (callbacks.lifecycle)."""
+    global _server, _server_started, _export_task, _export_configured, _snapshot_task
+    for task in (_export_task, _snapshot_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+    _server, _server_started, _export_task, _export_configured = None, False, None, False
+    _snapshot_task = None
+    directory = _multiproc_dir()
+    if directory is not None and _registry is not None and _registry.observed:
+        # Leave the final counts for worker 0 to report.
+        try:
+            await asyncio.to_thread(write_snapshot, directory, _registry.export())
+        except OSError as exc:
+            print(f"metrics: cannot write snapshot to {directory}: {exc}", file=sys.stderr)
+
+
+lifecycle.on_shutdown(shutdown, lifecycle.ORDER_METRICS)
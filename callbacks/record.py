@@ -0,0 +1,254 @@
+"""
+Shared per-request usage record.
+
+callbacks.db and callbacks.logging are both registered as success and
+failure callbacks, so every event reaches each of them with the same
+request/response objects. extract() parses those once into a slotted
+UsageRecord and caches it, so the second sink (and any sink added later)
+reuses the first one's work instead of re-deriving usage, status, cost,
+ids and latency.
+
+The cache is a small LRU keyed on request id. An entry only matches the
+same response object and end time, so a retry or a failure event that
+reuses a request id gets its own record.
+
+Besides latency_ms (start to end of the LiteLLM call) a record carries a
+timing breakdown, in milliseconds, each None when the event lacks it:
+  queue_ms     proxy arrival to call start: request parsing, auth, hooks
+  pre_call_ms  call start to the upstream request (routing, transforms)
+  ttft_ms      call start to the first streamed token (streams only)
+  upstream_ms  the provider call, connection setup included
+  overhead_ms  time spent in the proxy rather than upstream: queue_ms plus
+               latency_ms - upstream_ms
+  callback_ms  end of the call to the first sink running (LiteLLM's
+               logging queue and callbacks registered before ours)
+
+A record's tenant_id is metadata.tenant_id, which callbacks.balance sets
+from key_tenant(); the usage API scopes reads with the same function, so a
+key reads exactly the usage it is billed for.
+"""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+_CACHE_SIZE = 1024
+
+# The timing breakdown fields of UsageRecord, in column order.
+TIMINGS = ("queue_ms", "pre_call_ms", "ttft_ms", "upstream_ms", "overhead_ms", "callback_ms")
+
+_cache: "OrderedDict[str, Tuple[int, Any, UsageRecord]]" = OrderedDict()
+
+
+@dataclass(slots=True)
+class UsageRecord:
+    """One request's billing-relevant fields. Treat as read-only: sinks share it."""
+
+    ts: float
+    latency_ms: int
+    model: Optional[str]
+    tenant_id: Optional[str]
+    status: Any
+    error: Any
+    request_id: Optional[str]
+    prompt_tokens: Optional[int]
+    completion_tokens: Optional[int]
+    total_tokens: Optional[int]
+    cost_usd: Optional[float]
+    queue_ms: Optional[int] = None
+    pre_call_ms: Optional[int] = None
+    ttft_ms: Optional[int] = None
+    upstream_ms: Optional[int] = None
+    overhead_ms: Optional[int] = None
+    callback_ms: Optional[int] = None
+
+    @property
+    def created_at(self) -> datetime:
+        return datetime.fromtimestamp(self.ts, timezone.utc)
+
+    def as_dict(self) -> Dict[str, Any]:
+        fields = asdict(self)
+        fields["created_at"] = self.created_at
+        return fields
+
+    @classmethod
+    def from_dict(cls, row: Dict[str, Any]) -> "UsageRecord":
+        """Rebuild a record from as_dict() output (e.g. a spooled row)."""
+        ts = row.get("ts")
+        if ts is None:
+            created_at = row.get("created_at")
+            if isinstance(created_at, str):
+                created_at = datetime.fromisoformat(created_at)
+            ts = created_at.timestamp() if created_at else time.time()
+        return cls(
+            ts=ts,
+            latency_ms=row.get("latency_ms") or 0,
+            model=row.get("model"),
+            tenant_id=row.get("tenant_id"),
+            status=row.get("status"),
+            error=row.get("error"),
+            request_id=row.get("request_id"),
+            prompt_tokens=row.get("prompt_tokens"),
+            completion_tokens=row.get("completion_tokens"),
+            total_tokens=row.get("total_tokens"),
+            cost_usd=row.get("cost_usd"),
+            **{name: row.get(name) for name in TIMINGS},
+        )
+
+
+def _usage_fields(response_data: Optional[Dict[str, Any]]) -> Dict[str, Optional[int]]:
+    usage = {}
+    if isinstance(response_data, dict):
+        usage = response_data.get("usage") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "total_tokens": usage.get("total_tokens"),
+    }
+
+
+def _cost_usd(response_data: Optional[Dict[str, Any]]) -> Optional[float]:
+    if not isinstance(response_data, dict):
+        return None
+    # LiteLLM often injects cost under "response_cost" or in metadata; grab either if present.
+    cost = response_data.get("response_cost")
+    if cost is not None:
+        return cost
+    metadata = response_data.get("metadata") or {}
+    return metadata.get("response_cost")
+
+
+def _request_id(response_data: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not isinstance(response_data, dict):
+        return None
+    return response_data.get("id") or response_data.get("request_id")
+
+
+def _latency_ms(start_time: Any, end_time: Any) -> int:
+    try:
+        diff = end_time - start_time
+        if hasattr(diff, "total_seconds"):
+            return int(diff.total_seconds() * 1000)
+        return int(diff * 1000)
+    except Exception:
+        return 0
+
+
+def _span_ms(start: Any, end: Any) -> Optional[int]:
+    """end - start in milliseconds for two datetimes or two epoch floats; None if unknown or negative."""
+    if start is None or end is None:
+        return None
+    try:
+        diff = end - start
+    except TypeError:
+        return None
+    seconds = diff.total_seconds() if isinstance(diff, timedelta) else diff
+    return round(seconds * 1000) if seconds >= 0 else None
+
+
+def _timings(
+    request_data: Dict[str, Any], response: Dict[str, Any], start_time: Any, end_time: Any, latency_ms: int
+) -> Dict[str, Optional[int]]:
+    """
+    The timing breakdown from LiteLLM's logging kwargs (api_call_start_time,
+    completion_start_time, llm_api_duration_ms and the proxy's
+    queue_time_seconds) or, for tracked streams, the response's ttft_ms.
+    """
+    metadata = (request_data.get("litellm_params") or {}).get("metadata") or request_data.get("metadata") or {}
+    queue = metadata.get("queue_time_seconds")
+    queue_ms = round(queue * 1000) if isinstance(queue, (int, float)) and queue >= 0 else None
+
+    api_start = request_data.get("api_call_start_time")
+    upstream = request_data.get("llm_api_duration_ms")
+    if isinstance(upstream, (int, float)) and upstream >= 0:
+        upstream_ms: Optional[int] = round(upstream)
+    else:
+        upstream_ms = _span_ms(api_start, end_time)
+
+    ttft_ms = response.get("ttft_ms")
+    if ttft_ms is None and request_data.get("stream"):
+        # Without streaming LiteLLM sets completion_start_time to the end time.
+        first = request_data.get("completion_start_time")
+        if first is not None and _span_ms(first, end_time):
+            ttft_ms = _span_ms(start_time, first)
+
+    overhead_ms = None
+    if upstream_ms is not None:
+        overhead_ms = max(latency_ms - upstream_ms, 0) + (queue_ms or 0)
+    # LiteLLM's times are naive local datetimes, so "now" has to be one too.
+    now = datetime.now(end_time.tzinfo) if isinstance(end_time, datetime) else time.time()
+    return {
+        "queue_ms": queue_ms,
+        "pre_call_ms": _span_ms(start_time, api_start),
+        "ttft_ms": ttft_ms,
+        "upstream_ms": upstream_ms,
+        "overhead_ms": overhead_ms,
+        "callback_ms": _span_ms(end_time, now),
+    }
+
+
+def key_tenant(user_api_key_dict: Any) -> Optional[str]:
+    """
+    The tenant an authenticated key acts for: its user_id, else a tenant_id
+    in the key's metadata, else in its team's metadata. Never the request
+    body, which the caller writes.
+    """
+    tenant_id = getattr(user_api_key_dict, "user_id", None)
+    for field in ("metadata", "team_metadata"):
+        if tenant_id:
+            break
+        tenant_id = (getattr(user_api_key_dict, field, None) or {}).get("tenant_id")
+    return tenant_id or None
+
+
+def _build(
+    request_data: Optional[Dict[str, Any]],
+    response_data: Optional[Dict[str, Any]],
+    start_time: Any,
+    end_time: Any,
+) -> UsageRecord:
+    request_data = request_data if isinstance(request_data, dict) else {}
+    response = response_data if isinstance(response_data, dict) else {}
+    usage = _usage_fields(response_data)
+    latency_ms = _latency_ms(start_time, end_time)
+    return UsageRecord(
+        ts=time.time(),
+        latency_ms=latency_ms,
+        model=request_data.get("model"),
+        tenant_id=(request_data.get("metadata") or {}).get("tenant_id"),
+        status=response.get("status") or response.get("status_code"),
+        error=response.get("error"),
+        request_id=_request_id(response_data),
+        prompt_tokens=usage["prompt_tokens"],
+        completion_tokens=usage["completion_tokens"],
+        total_tokens=usage["total_tokens"],
+        cost_usd=_cost_usd(response_data),
+        **_timings(request_data, response, start_time, end_time, latency_ms),
+    )
+
+
+def extract(
+    request_data: Optional[Dict[str, Any]],
+    response_data: Optional[Dict[str, Any]],
+    start_time: Any,
+    end_time: Any,
+) -> UsageRecord:
+    """Return the UsageRecord for this callback event, parsing it at most once."""
+    request_id = _request_id(response_data)
+    if request_id is None:
+        return _build(request_data, response_data, start_time, end_time)
+
+    hit = _cache.get(request_id)
+    if hit is not None and hit[0] == id(response_data) and hit[1] == end_time:
+        return hit[2]
+
+    record = _build(request_data, response_data, start_time, end_time)
+    _cache[request_id] = (id(response_data), end_time, record)
+    _cache.move_to_end(request_id)
+    if len(_cache) > _CACHE_SIZE:
+        _cache.popitem(last=False)
+    return record
@@ -0,0 +1,214 @@
+"""
+Usage rollups: pre-aggregated litellm_usage totals per minute, hour and day.
+
+usage_rollup_minute/_hour/_day (db/migrations/0001_usage.sql) hold request, token, cost
+and latency sums per (bucket_start, tenant_id, model, status). callbacks.db
+updates them in the same transaction that writes each batch of raw rows,
+so they never disagree with litellm_usage. Missing tenant/model are stored
+as "" and a missing status as 0.
+
+usage_summary() answers range queries from the rollups, using day rows for
+whole days, hour rows for whole hours and minute rows for the rest; only
+sub-minute edges and history older than usage_rollup_state.covered_from
+(rows written before rollups existed; see litellm_usage_rollup_backfill)
+are read from raw litellm_usage.
+
+Set PG_ROLLUPS=0 to stop maintaining them.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+BUCKETS = ("minute", "hour", "day")
+
+_UNITS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+_SUMS = "requests, prompt_tokens, completion_tokens, total_tokens, cost_usd, latency_ms_sum"
+
+_UPSERT = """
+    ON CONFLICT (bucket_start, tenant_id, model, status) DO UPDATE SET
+        requests = r.requests + EXCLUDED.requests,
+        prompt_tokens = r.prompt_tokens + EXCLUDED.prompt_tokens,
+        completion_tokens = r.completion_tokens + EXCLUDED.completion_tokens,
+        total_tokens = r.total_tokens + EXCLUDED.total_tokens,
+        cost_usd = r.cost_usd + EXCLUDED.cost_usd,
+        latency_ms_sum = r.latency_ms_sum + EXCLUDED.latency_ms_sum
+"""
+
+# One statement updates all three levels. Rows are pre-aggregated per minute,
+# so each level sees every key once; ORDER BY keeps lock order stable across
+# concurrent writers.
+APPLY_SQL = f"""
+WITH batch AS (
+    SELECT * FROM unnest(
+        $1::timestamptz[], $2::text[], $3::text[], $4::integer[], $5::bigint[],
+        $6::bigint[], $7::bigint[], $8::bigint[], $9::numeric[], $10::bigint[]
+    ) AS b(bucket_start, tenant_id, model, status, {_SUMS})
+), minute_rows AS (
+    INSERT INTO usage_rollup_minute AS r (bucket_start, tenant_id, model, status, {_SUMS})
+    SELECT * FROM batch ORDER BY 1, 2, 3, 4
+    {_UPSERT}
+), hour_rows AS (
+    INSERT INTO usage_rollup_hour AS r (bucket_start, tenant_id, model, status, {_SUMS})
+    SELECT date_trunc('hour', bucket_start, 'UTC'), tenant_id, model, status,
+           sum(requests), sum(prompt_tokens), sum(completion_tokens), sum(total_tokens),
+           sum(cost_usd), sum(latency_ms_sum)
+    FROM batch GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+    {_UPSERT}
+)
+INSERT INTO usage_rollup_day AS r (bucket_start, tenant_id, model, status, {_SUMS})
+SELECT date_trunc('day', bucket_start, 'UTC'), tenant_id, model, status,
+       sum(requests), sum(prompt_tokens), sum(completion_tokens), sum(total_tokens),
+       sum(cost_usd), sum(latency_ms_sum)
+FROM batch GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+{_UPSERT}
+"""
+
+_COVERED_SQL = "SELECT covered_from FROM usage_rollup_state"
+
+
+def _floor(ts: datetime, unit: str) -> datetime:
+    ts = ts.astimezone(timezone.utc)
+    if unit == "minute":
+        return ts.replace(second=0, microsecond=0)
+    if unit == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil(ts: datetime, unit: str) -> datetime:
+    floored = _floor(ts, unit)
+    return floored if floored == ts else floored + _UNITS[unit]
+
+
+def aggregate(records: Iterable[Sequence[Any]]) -> List[Tuple[Any, ...]]:
+    """
+    Sum raw rows per (minute, tenant_id, model, status) into APPLY_SQL args.
+
+    Records are tuples in callbacks.db._COPY_COLUMNS order: created_at,
+    tenant_id, model, prompt_tokens, completion_tokens, total_tokens,
+    latency_ms, status, cost_usd, request_id, then the timing columns
+    (which may be left off).
+    """
+    sums: Dict[Tuple[datetime, str, str, int], List[Any]] = {}
+    for record in records:
+        created_at, tenant, model, prompt, completion, total, latency, status, cost = record[:9]
+        key = (_floor(created_at, "minute"), tenant or "", model or "", status or 0)
+        acc = sums.get(key)
+        if acc is None:
+            acc = sums[key] = [0, 0, 0, 0, Decimal(0), 0]
+        acc[0] += 1
+        acc[1] += prompt or 0
+        acc[2] += completion or 0
+        acc[3] += total or 0
+        acc[4] += cost or 0
+        acc[5] += latency or 0
+    columns: List[List[Any]] = [[] for _ in range(10)]
+    for key, acc in sums.items():
+        for column, value in zip(columns, key + tuple(acc)):
+            column.append(value)
+    return [tuple(column) for column in columns]
+
+
+async def apply(conn: Any, records: Sequence[Sequence[Any]]) -> None:
+    """Add raw rows to the rollups; call inside the transaction that wrote them."""
+    if records:
+        await conn.execute(APPLY_SQL, *aggregate(records))
+
+
+def plan(start: datetime, end: datetime, bucket: str = "day") -> List[Tuple[str, datetime, datetime]]:
+    """
+    Split [start, end) into (source, lo, hi) pieces, where source is a
+    rollup level no coarser than bucket, or "raw" for sub-minute edges.
+    """
+    levels = BUCKETS[: BUCKETS.index(bucket) + 1]
+
+    def split(lo: datetime, hi: datetime, level: int) -> List[Tuple[str, datetime, datetime]]:
+        if lo >= hi:
+            return []
+        if level < 0:
+            return [("raw", lo, hi)]
+        unit = levels[level]
+        inner_lo, inner_hi = _ceil(lo, unit), _floor(hi, unit)
+        if inner_lo >= inner_hi:
+            return split(lo, hi, level - 1)
+        return split(lo, inner_lo, level - 1) + [(unit, inner_lo, inner_hi)] + split(inner_hi, hi, level - 1)
+
+    return split(start.astimezone(timezone.utc), end.astimezone(timezone.utc), len(levels) - 1)
+
+
+def summary_sql(
+    pieces: List[Tuple[str, datetime, datetime]], bucket: str, tenant_id: Optional[str] = None
+) -> Tuple[str, List[Any]]:
+    """Build the UNION ALL query (and its args) that sums the planned pieces per bucket."""
+    args: List[Any] = [bucket]
+    tenant_filter = ""
+    if tenant_id is not None:
+        args.append(tenant_id)
+        tenant_filter = " AND tenant_id = $2"
+    selects = []
+    for source, lo, hi in pieces:
+        args += [lo, hi]
+        lo_arg, hi_arg = f"${len(args) - 1}", f"${len(args)}"
+        if source == "raw":
+            selects.append(
+                "SELECT date_trunc($1, created_at, 'UTC') AS bucket, COALESCE(tenant_id, '') AS tenant_id, "
+                "COALESCE(model, '') AS model, COALESCE(status, 0) AS status, count(*) AS requests, "
+                "COALESCE(sum(prompt_tokens), 0) AS prompt_tokens, "
+                "COALESCE(sum(completion_tokens), 0) AS completion_tokens, "
+                "COALESCE(sum(total_tokens), 0) AS total_tokens, COALESCE(sum(cost_usd), 0) AS cost_usd, "
+                "COALESCE(sum(latency_ms), 0) AS latency_ms_sum "
+                f"FROM litellm_usage WHERE created_at >= {lo_arg} AND created_at < {hi_arg}{tenant_filter} "
+                "GROUP BY 1, 2, 3, 4"
+            )
+        else:
+            selects.append(
+                f"SELECT date_trunc($1, bucket_start, 'UTC') AS bucket, tenant_id, model, status, {_SUMS} "
+                f"FROM usage_rollup_{source} WHERE bucket_start >= {lo_arg} AND bucket_start < {hi_arg}"
+                f"{tenant_filter}"
+            )
+    sql = (
+        "SELECT bucket, tenant_id, model, status, sum(requests)::bigint AS requests, "
+        "sum(prompt_tokens)::bigint AS prompt_tokens, sum(completion_tokens)::bigint AS completion_tokens, "
+        "sum(total_tokens)::bigint AS total_tokens, sum(cost_usd) AS cost_usd, "
+        "sum(latency_ms_sum)::bigint AS latency_ms_sum "
+        f"FROM ({' UNION ALL '.join(selects)}) pieces GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4"
+    )
+    return sql, args
+
+
+async def usage_summary(
+    pool: Any,
+    start: datetime,
+    end: datetime,
+    bucket: str = "day",
+    tenant_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Totals per (bucket, tenant_id, model, status) for created_at in
+    [start, end). bucket is minute, hour or day (UTC).
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of {BUCKETS}, got {bucket!r}")
+    if start.tzinfo is None or end.tzinfo is None:
+        raise ValueError("start and end must be timezone-aware")
+    if start >= end:
+        return []
+
+    covered_from = await pool.fetchval(_COVERED_SQL)
+    pieces: List[Tuple[str, datetime, datetime]] = []
+    rolled_from = start if covered_from is None else max(start, covered_from)
+    if covered_from is None or start < covered_from:
+        pieces.append(("raw", start, end if covered_from is None else min(end, covered_from)))
+    if covered_from is not None and rolled_from < end:
+        pieces += plan(rolled_from, end, bucket)
+
+    sql, args = summary_sql(pieces, bucket, tenant_id)
+    return [dict(row) for row in await pool.fetch(sql, *args)]
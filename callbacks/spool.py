@@ -0,0 +1,263 @@
+"""
+Durable local spool for usage rows.
+
+When Postgres is down or too slow to keep up, callbacks.db appends rows here
+instead of dropping them, and a replay worker drains the spool back into
+litellm_usage once the database answers again.
+
+The spool is a directory of append-only JSON-lines segments. The segment
+being written ends in ".part"; it is sealed (renamed to ".jsonl") when it
+reaches USAGE_SPOOL_SEGMENT_BYTES or when the replay worker wants to drain
+it. Only sealed segments are replayed, and a segment is deleted only after
+its rows are committed. A line torn by a crash is skipped on read.
+
+Proxy workers in one container share the directory. A worker claims a
+sealed segment before replaying it by renaming it to
+"<segment>.replaying.<pid>"; the rename is atomic, so exactly one worker
+gets each segment. A failed replay renames it back, and claims left by a
+worker that died are released when the spool is next opened.
+
+  USAGE_SPOOL_DIR (default /tmp/billing-spool; "off" disables the spool)
+  USAGE_SPOOL_SEGMENT_BYTES (default 16777216)
+  USAGE_SPOOL_FSYNC=always|interval|never (default interval)
+  USAGE_SPOOL_FSYNC_MS (default 1000) max time between fsyncs in interval mode
+
+On Cloud Run /tmp is memory-backed, so the default protects against
+database outages but not against losing the instance; point
+USAGE_SPOOL_DIR at a mounted volume for stronger guarantees.
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+_PART_SUFFIX = ".jsonl.part"
+_SEALED_SUFFIX = ".jsonl"
+_CLAIM_INFIX = ".replaying."
+_FSYNC_POLICIES = ("always", "interval", "never")
+
+_spool: Optional["Spool"] = None
+_spool_lock = threading.Lock()
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    as_dict = getattr(value, "as_dict", None)
+    if as_dict is not None:
+        return as_dict()
+    raise TypeError(f"cannot spool {type(value).__name__}")
+
+
+def _decode(row: Dict[str, Any]) -> Dict[str, Any]:
+    created_at = row.get("created_at")
+    if isinstance(created_at, str):
+        row["created_at"] = datetime.fromisoformat(created_at)
+    return row
+
+
+def _fsync_dir(directory: Path) -> None:
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:  # pragma: no cover - platforms without directory fds
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Spool:
+    """
+    Segmented append-only row store. Methods block on file I/O, so async
+    callers should run them in a thread (asyncio.to_thread).
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 16 * 1024 * 1024,
+        fsync: str = "interval",
+        fsync_interval: float = 1.0,
+    ) -> None:
+        if fsync not in _FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {_FSYNC_POLICIES}, got {fsync!r}")
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._path: Optional[Path] = None
+        self._size = 0
+        self._last_sync = 0.0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._recover()
+
+    def _recover(self) -> None:
+        # A ".part" left behind by a previous process will never be appended
+        # to again; seal it so replay picks it up. Only segments from dead
+        # processes are touched, so sibling workers sharing the directory
+        # keep their active segments.
+        for path in self.directory.glob(f"*{_PART_SUFFIX}"):
+            if not _owner_alive(path):
+                path.rename(path.with_name(path.name[: -len(_PART_SUFFIX)] + _SEALED_SUFFIX))
+        # Likewise a segment claimed by a worker that died mid-replay.
+        for path in self.directory.glob(f"*{_SEALED_SUFFIX}{_CLAIM_INFIX}*"):
+            if not _claimer_alive(path):
+                self.release(path)
+
+    def append(self, rows: Iterable[Any]) -> int:
+        """Append rows (dicts or objects with as_dict()); returns how many were written."""
+        lines = [json.dumps(row, default=_encode, separators=(",", ":")) + "\n" for row in rows]
+        if not lines:
+            return 0
+        data = "".join(lines).encode("utf-8")
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            now = time.monotonic()
+            if self.fsync == "always" or (
+                self.fsync == "interval" and now - self._last_sync >= self.fsync_interval
+            ):
+                os.fsync(self._file.fileno())
+                self._last_sync = now
+            if self._size >= self.segment_bytes:
+                self._seal_locked()
+        return len(lines)
+
+    def seal(self) -> None:
+        """Close the active segment so it becomes eligible for replay."""
+        with self._lock:
+            self._seal_locked()
+
+    def has_active_rows(self) -> bool:
+        with self._lock:
+            return self._size > 0
+
+    def sealed_segments(self) -> List[Path]:
+        return sorted(self.directory.glob(f"*{_SEALED_SUFFIX}"))
+
+    def pending(self) -> bool:
+        return self.has_active_rows() or bool(self.sealed_segments())
+
+    @staticmethod
+    def read_segment(path: Path) -> List[Dict[str, Any]]:
+        rows = []
+        with open(path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    rows.append(_decode(json.loads(line)))
+                except ValueError:
+                    print(f"usage_spool: skipping torn line in {path.name}", file=sys.stderr)
+        return rows
+
+    @staticmethod
+    def claim(path: Path) -> Optional[Path]:
+        """Take a sealed segment for replay; None if another worker claimed it first."""
+        claimed = path.with_name(f"{path.name}{_CLAIM_INFIX}{os.getpid()}")
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None
+        return claimed
+
+    @staticmethod
+    def release(claimed: Path) -> None:
+        """Give a claimed segment back so it is replayed again."""
+        os.replace(claimed, claimed.with_name(claimed.name.split(_CLAIM_INFIX, 1)[0]))
+
+    @staticmethod
+    def remove(path: Path) -> None:
+        path.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        self.seal()
+
+    def _open_segment(self) -> None:
+        name = f"{time.time_ns():020d}-{os.getpid()}{_PART_SUFFIX}"
+        self._path = self.directory / name
+        self._file = open(self._path, "ab")
+        self._size = 0
+        _fsync_dir(self.directory)
+
+    def _seal_locked(self) -> None:
+        if self._file is None:
+            return
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+        self._file.close()
+        sealed = self._path.with_name(self._path.name[: -len(_PART_SUFFIX)] + _SEALED_SUFFIX)
+        os.replace(self._path, sealed)
+        if self.fsync != "never":
+            _fsync_dir(self.directory)
+        self._file = None
+        self._path = None
+        self._size = 0
+
+
+def _owner_alive(path: Path) -> bool:
+    try:
+        pid = int(path.name.split("-", 1)[1].split(".", 1)[0])
+    except (IndexError, ValueError):
+        return False
+    return _pid_alive(pid)
+
+
+def _claimer_alive(path: Path) -> bool:
+    try:
+        pid = int(path.name.rsplit(_CLAIM_INFIX, 1)[1])
+    except (IndexError, ValueError):
+        return False
+    return _pid_alive(pid)
+
+
+def _pid_alive(pid: int) -> bool:
+    # Our own pid means a previous incarnation of this process.
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def get_spool() -> Optional[Spool]:
+    """Return the process-wide spool, or None when USAGE_SPOOL_DIR=off."""
+    global _spool
+    if _spool is not None:
+        return _spool
+    directory = os.environ.get("USAGE_SPOOL_DIR", "/tmp/billing-spool")
+    if directory.lower() in ("", "off", "none"):
+        return None
+    with _spool_lock:
+        if _spool is None:
+            try:
+                _spool = Spool(
+                    directory,
+                    segment_bytes=int(os.environ.get("USAGE_SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024)),
+                    fsync=os.environ.get("USAGE_SPOOL_FSYNC", "interval").lower(),
+                    fsync_interval=int(os.environ.get("USAGE_SPOOL_FSYNC_MS", "1000")) / 1000,
+                )
+            except (OSError, ValueError) as exc:
+                print(f"usage_spool: disabled: {exc}", file=sys.stderr)
+                return None
+            atexit.register(_spool.close)
+    return _spool
@@ -0,0 +1,308 @@
+"""
+Streaming-aware usage accounting.
+
+For stream=True requests the usage block only shows up in the last chunk
+(and only if the provider sends one), so the per-request callbacks either
+see no usage or rely on LiteLLM buffering the whole stream. This module
+hooks the proxy's streaming iterator instead: each chunk is inspected as it
+passes through, only running counters are kept (never the text), and one
+usage event goes to the sinks when the stream finishes, fails or is closed
+by the client.
+
+Enable it in the proxy config:
+
+  litellm_settings:
+    callbacks: ["callbacks.streaming.proxy_handler_instance"]
+  environment_variables:
+    STREAM_USAGE_TRACKING: "1"
+
+With STREAM_USAGE_TRACKING on, callbacks.metrics/logging/db skip the
+regular callback for streams the tracker has started on, so each stream is
+billed once. A streamed request that fails before its first chunk (e.g. an
+upstream error) never reaches the tracker and is reported by the regular
+failure callback.
+
+  STREAM_USAGE_INCLUDE (default 1) ask the provider for a final usage chunk
+    (stream_options.include_usage); it is hidden from clients that did not
+    ask for it themselves
+
+Without a usage chunk, completion tokens are estimated from the streamed
+text length and prompt tokens with litellm.token_counter when available.
+Aborted streams are recorded with status 499, failed ones with 500. The
+time of the first content chunk gives the stream's ttft_ms (see
+callbacks.record), measured from the LiteLLM call start the proxy derives
+from proxy_server_request.arrival_time and metadata.queue_time_seconds.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib
+import os
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from callbacks import lifecycle
+
+try:  # The proxy image ships litellm; tests and tools may not.
+    from litellm.integrations.custom_logger import CustomLogger
+except ImportError:  # pragma: no cover - depends on the environment
+    CustomLogger = object  # type: ignore[misc,assignment]
+
+_SINKS = ["callbacks.metrics", "callbacks.logging", "callbacks.db"]
+_INJECTED_KEY = "stream_usage_injected"
+# Set by track(): from then on the tracker owns the request's usage event.
+_TRACKED_KEY = "stream_usage_tracked"
+# Rough OpenAI-family average, used only when the provider sends no usage.
+_CHARS_PER_TOKEN = 4
+
+STATUS_ABORTED = 499
+STATUS_FAILED = 500
+
+_pending: Set[asyncio.Task] = set()
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def enabled() -> bool:
+    return _env_flag("STREAM_USAGE_TRACKING", False)
+
+
+def deferred(request_data: Optional[Dict[str, Any]], kwargs: Dict[str, Any]) -> bool:
+    """True when a sink should ignore this callback because the stream tracker reports it."""
+    if kwargs.get("stream_usage") or not enabled() or not isinstance(request_data, dict):
+        return False
+    if not request_data.get("stream"):
+        return False
+    for metadata in ((request_data.get("litellm_params") or {}).get("metadata"), request_data.get("metadata")):
+        if metadata and metadata.get(_TRACKED_KEY):
+            return True
+    return False
+
+
+def add_sink(module_name: str) -> None:
+    """Also report finished streams to module_name.log_event (e.g. callbacks.balance)."""
+    if module_name not in _SINKS:
+        _SINKS.append(module_name)
+
+
+def _field(obj: Any, name: str) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+class StreamUsage:
+    """Running counters for one stream; holds no chunk text."""
+
+    __slots__ = (
+        "response_id",
+        "model",
+        "chunks",
+        "completion_chars",
+        "prompt_tokens",
+        "completion_tokens",
+        "total_tokens",
+        "cost_usd",
+        "first_token_at",
+    )
+
+    def __init__(self) -> None:
+        self.response_id: Optional[str] = None
+        self.model: Optional[str] = None
+        self.chunks = 0
+        self.completion_chars = 0
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.total_tokens: Optional[int] = None
+        self.cost_usd: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+
+    def add(self, chunk: Any) -> None:
+        self.chunks += 1
+        if self.response_id is None:
+            self.response_id = _field(chunk, "id")
+        if self.model is None:
+            self.model = _field(chunk, "model")
+
+        for choice in _field(chunk, "choices") or ():
+            delta = _field(choice, "delta")
+            content = _field(delta, "content") if delta is not None else None
+            if isinstance(content, str):
+                if content and self.first_token_at is None:
+                    self.first_token_at = time.time()
+                self.completion_chars += len(content)
+
+        usage = _field(chunk, "usage")
+        if usage:
+            # Providers repeat or refine usage; the last non-empty block wins.
+            for name in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                value = _field(usage, name)
+                if value is not None:
+                    setattr(self, name, value)
+
+        hidden = _field(chunk, "_hidden_params")
+        cost = _field(hidden, "response_cost") if hidden else None
+        if cost is not None:
+            self.cost_usd = cost
+
+    def usage(self, request_data: Dict[str, Any]) -> Dict[str, Optional[int]]:
+        completion = self.completion_tokens
+        if completion is None:
+            completion = -(-self.completion_chars // _CHARS_PER_TOKEN)
+        prompt = self.prompt_tokens
+        if prompt is None:
+            prompt = estimate_prompt_tokens(request_data)
+        total = self.total_tokens
+        if total is None or self.completion_tokens is None or self.prompt_tokens is None:
+            total = (prompt or 0) + completion
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": total}
+
+    def ttft_ms(self, request_data: Dict[str, Any]) -> Optional[int]:
+        """Milliseconds from the LiteLLM call start to the first content chunk, if both are known."""
+        arrival = (request_data.get("proxy_server_request") or {}).get("arrival_time")
+        queue = (request_data.get("metadata") or {}).get("queue_time_seconds")
+        if self.first_token_at is None or arrival is None or queue is None:
+            return None
+        return max(round((self.first_token_at - arrival - queue) * 1000), 0)
+
+
+def estimate_prompt_tokens(request_data: Dict[str, Any]) -> Optional[int]:
+    """Prompt tokens for a chat request: litellm.token_counter, else about 4 characters per token."""
+    messages = request_data.get("messages")
+    if not messages:
+        return None
+    try:
+        import litellm
+
+        return litellm.token_counter(model=request_data.get("model") or "", messages=messages)
+    except Exception:
+        chars = sum(
+            len(m["content"]) for m in messages if isinstance(m, dict) and isinstance(m.get("content"), str)
+        )
+        return -(-chars // _CHARS_PER_TOKEN)
+
+
+def _cost(model: Optional[str], usage: Dict[str, Optional[int]]) -> Optional[float]:
+    if not model:
+        return None
+    try:
+        import litellm
+
+        prompt_cost, completion_cost = litellm.cost_per_token(
+            model=model,
+            prompt_tokens=usage["prompt_tokens"] or 0,
+            completion_tokens=usage["completion_tokens"] or 0,
+        )
+    except Exception:
+        return None
+    return prompt_cost + completion_cost
+
+
+def _response_data(
+    state: StreamUsage, request_data: Dict[str, Any], error: Optional[str], status: int
+) -> Dict[str, Any]:
+    usage = state.usage(request_data)
+    cost = state.cost_usd
+    if cost is None:
+        cost = _cost(state.model or request_data.get("model"), usage)
+    return {
+        "id": state.response_id,
+        "model": state.model,
+        "status": status,
+        "error": error,
+        "usage": usage,
+        "response_cost": cost,
+        "ttft_ms": state.ttft_ms(request_data),
+    }
+
+
+async def _report(
+    request_data: Dict[str, Any], response_data: Dict[str, Any], start_time: float, end_time: float
+) -> None:
+    for name in _SINKS:
+        try:
+            sink = importlib.import_module(name)
+            await sink.log_event(request_data, response_data, start_time, end_time, stream_usage=True)
+        except Exception as exc:  # pragma: no cover - defensive
+            print(f"stream_usage: {name} failed: {exc}", file=sys.stderr)
+
+
+def _schedule_report(request_data: Dict[str, Any], response_data: Dict[str, Any], start_time: float) -> None:
+    # Reporting runs as its own task: a stream closed by a cancelled client
+    # must not wait on (or be cancelled together with) the sinks.
+    task = asyncio.get_running_loop().create_task(_report(request_data, response_data, start_time, time.time()))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+async def track(
+    stream: AsyncIterator[Any],
+    request_data: Dict[str, Any],
+    start_time: Optional[float] = None,
+) -> AsyncIterator[Any]:
+    """Yield stream chunks unchanged while counting usage; report once at the end."""
+    start_time = time.time() if start_time is None else start_time
+    metadata = request_data.setdefault("metadata", {})
+    metadata[_TRACKED_KEY] = True
+    hide_usage_chunks = bool(metadata.get(_INJECTED_KEY))
+    state = StreamUsage()
+    status, error = 200, None
+    try:
+        async for chunk in stream:
+            state.add(chunk)
+            if hide_usage_chunks and not _field(chunk, "choices") and _field(chunk, "usage"):
+                continue
+            yield chunk
+    except (GeneratorExit, asyncio.CancelledError):
+        status, error = STATUS_ABORTED, "stream closed before completion"
+        raise
+    except Exception as exc:
+        status, error = STATUS_FAILED, str(exc) or type(exc).__name__
+        raise
+    finally:
+        try:
+            _schedule_report(request_data, _response_data(state, request_data, error, status), start_time)
+        except Exception as exc:  # pragma: no cover - defensive
+            print(f"stream_usage: cannot report stream: {exc}", file=sys.stderr)
+
+
+async def flush() -> None:
+    """Wait for reports of streams that already ended (tests, and on proxy shutdown before the sinks stop)."""
+    while _pending:
+        await asyncio.gather(*list(_pending), return_exceptions=True)
+
+
+class StreamUsageHandler(CustomLogger):
+    """LiteLLM proxy hooks that route streamed requests through track()."""
+
+    async def async_pre_call_hook(
+        self, user_api_key_dict: Any, cache: Any, data: Dict[str, Any], call_type: Any
+    ) -> Dict[str, Any]:
+        if not (enabled() and data.get("stream") and _env_flag("STREAM_USAGE_INCLUDE", True)):
+            return data
+        options = data.get("stream_options") or {}
+        if not options.get("include_usage"):
+            data["stream_options"] = dict(options, include_usage=True)
+            data.setdefault("metadata", {})[_INJECTED_KEY] = True
+        return data
+
+    async def async_post_call_streaming_iterator_hook(
+        self, user_api_key_dict: Any, response: AsyncIterator[Any], request_data: Dict[str, Any]
+    ) -> AsyncIterator[Any]:
+        if not enabled():
+            async for chunk in response:
+                yield chunk
+            return
+        async for chunk in track(response, request_data):
+            yield chunk
+
+
+proxy_handler_instance = StreamUsageHandler()
+lifecycle.on_shutdown(flush, lifecycle.ORDER_STREAMS)
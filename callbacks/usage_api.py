@@ -0,0 +1,298 @@
+"""
+Usage read API: per-tenant request history, per-model totals and
+time-bucketed series, served by the proxy under /usage.
+
+Enable it in the proxy config (loading the module adds the routes to the
+proxy's FastAPI app):
+
+  litellm_settings:
+    callbacks: [..., "callbacks.usage_api.proxy_handler_instance"]
+
+  GET /usage/requests?start=&end=&limit=&cursor=  newest first; pass the
+    returned next_cursor back to get the following page
+  GET /usage/models?start=&end=                   totals per model
+  GET /usage/series?start=&end=&bucket=hour       totals per bucket and model
+    (bucket: minute, hour or day, UTC)
+
+start and end are ISO 8601 timestamps (UTC when no offset is given); end
+defaults to now and start to 30 days before end. Callers authenticate with
+their virtual key and see their own tenant (callbacks.record.key_tenant,
+the tenant callbacks.balance bills); proxy admins pick one with ?tenant_id=.
+
+History pages use keyset pagination on (created_at, id) instead of OFFSET,
+so page 1000 costs the same as page 1. They are read from
+idx_litellm_usage_tenant_history (db/migrations/0003), which includes every
+column a page returns: an index-only range scan per partition, with no
+heap fetches and no sort. Totals and series come from the usage rollups
+(callbacks.rollups). All queries go through the callbacks.db pool with
+fixed SQL text, so asyncpg prepares each statement once per connection and
+reuses it (PG_STATEMENT_CACHE_SIZE).
+
+Limits (defaults in brackets):
+  USAGE_API_MAX_LIMIT [1000] largest page size (default page: 100)
+  USAGE_API_MAX_DAYS [400] widest time range one call may cover
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from callbacks import db, rollups
+from callbacks.record import key_tenant
+
+try:  # The proxy image ships litellm and fastapi; tests and tools may not.
+    from litellm.integrations.custom_logger import CustomLogger
+except ImportError:  # pragma: no cover - depends on the environment
+    CustomLogger = object  # type: ignore[misc,assignment]
+
+try:
+    from fastapi import APIRouter, Depends, HTTPException
+except ImportError:  # pragma: no cover - depends on the environment
+    APIRouter = None
+
+    class HTTPException(Exception):  # type: ignore[no-redef]
+        def __init__(self, status_code: int, detail: Any = None) -> None:
+            super().__init__(detail)
+            self.status_code = status_code
+            self.detail = detail
+
+
+DEFAULT_LIMIT = 100
+DEFAULT_DAYS = 30
+
+_ADMIN_ROLE = "proxy_admin"
+
+_HISTORY_COLUMNS = (
+    "id, created_at, model, prompt_tokens, completion_tokens, total_tokens, latency_ms, status, cost_usd, request_id"
+)
+
+# Two statements rather than one with an optional keyset: an OR around the
+# row comparison would keep it from bounding the index scan.
+_HISTORY_SQL = f"""
+SELECT {_HISTORY_COLUMNS} FROM litellm_usage
+WHERE tenant_id = $1 AND created_at >= $2 AND created_at < $3
+ORDER BY created_at DESC, id DESC
+LIMIT $4
+"""
+
+_HISTORY_AFTER_SQL = f"""
+SELECT {_HISTORY_COLUMNS} FROM litellm_usage
+WHERE tenant_id = $1 AND created_at >= $2 AND created_at < $3 AND (created_at, id) < ($4, $5)
+ORDER BY created_at DESC, id DESC
+LIMIT $6
+"""
+
+_TOTALS = ("requests", "prompt_tokens", "completion_tokens", "total_tokens", "cost_usd", "latency_ms_sum")
+
+_registered = False
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        print(f"usage_api: invalid {name}; using {default}", file=sys.stderr)
+        return default
+
+
+def _parse_time(value: Optional[str], name: str) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO 8601 timestamp") from None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def window(start: Optional[str], end: Optional[str]) -> Tuple[datetime, datetime]:
+    """The [start, end) range of a request, defaulted and checked against USAGE_API_MAX_DAYS."""
+    end_at = _parse_time(end, "end") or datetime.now(timezone.utc)
+    start_at = _parse_time(start, "start") or end_at - timedelta(days=DEFAULT_DAYS)
+    if start_at >= end_at:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    max_days = _env_int("USAGE_API_MAX_DAYS", 400)
+    if end_at - start_at > timedelta(days=max_days):
+        raise HTTPException(status_code=400, detail=f"time range is limited to {max_days} days")
+    return start_at, end_at
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.astimezone(timezone.utc).isoformat()},{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit(",", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="invalid cursor") from None
+
+
+def tenant_for(user_api_key_dict: Any, requested: Optional[str] = None) -> str:
+    """The tenant a caller may read: their own, or any one for proxy admins."""
+    role = getattr(user_api_key_dict, "user_role", None)
+    is_admin = getattr(role, "value", role) == _ADMIN_ROLE
+    own = key_tenant(user_api_key_dict)
+    if requested and requested != own:
+        if not is_admin:
+            raise HTTPException(status_code=403, detail="keys can only read their own usage")
+        return requested
+    if requested:
+        return requested
+    if is_admin or not own:
+        raise HTTPException(status_code=400, detail="tenant_id is required")
+    return own
+
+
+async def request_history(
+    pool: Any,
+    tenant_id: str,
+    start: datetime,
+    end: datetime,
+    limit: int = DEFAULT_LIMIT,
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    """One page of a tenant's requests in [start, end), newest first."""
+    max_limit = _env_int("USAGE_API_MAX_LIMIT", 1000)
+    if not 1 <= limit <= max_limit:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {max_limit}")
+    # One extra row tells whether another page follows.
+    if cursor:
+        after_at, after_id = decode_cursor(cursor)
+        rows = await pool.fetch(_HISTORY_AFTER_SQL, tenant_id, start, end, after_at, after_id, limit + 1)
+    else:
+        rows = await pool.fetch(_HISTORY_SQL, tenant_id, start, end, limit + 1)
+    page = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor(last["created_at"], last["id"])
+    return {"tenant_id": tenant_id, "data": page, "next_cursor": next_cursor}
+
+
+def _fold(rows: List[Dict[str, Any]], keys: Tuple[str, ...]) -> List[Dict[str, Any]]:
+    """Sum rollup rows over everything but keys (e.g. across statuses)."""
+    totals: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    for row in rows:
+        key = tuple(row[name] for name in keys)
+        acc = totals.get(key)
+        if acc is None:
+            acc = totals[key] = dict(zip(keys, key), errors=0, **{name: 0 for name in _TOTALS})
+            acc["cost_usd"] = Decimal(0)
+        for name in _TOTALS:
+            acc[name] += row[name] or 0
+        if (row.get("status") or 0) >= 400:
+            acc["errors"] += row["requests"] or 0
+    result = []
+    for key in sorted(totals):
+        acc = totals[key]
+        latency_sum = acc.pop("latency_ms_sum")
+        acc["avg_latency_ms"] = round(latency_sum / acc["requests"], 1) if acc["requests"] else None
+        result.append(acc)
+    return result
+
+
+async def model_totals(pool: Any, tenant_id: str, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """Requests, errors, tokens, cost and mean latency per model in [start, end)."""
+    rows = await rollups.usage_summary(pool, start, end, "day", tenant_id)
+    return _fold(rows, ("model",))
+
+
+async def time_series(
+    pool: Any, tenant_id: str, start: datetime, end: datetime, bucket: str = "hour"
+) -> List[Dict[str, Any]]:
+    """The same totals per (bucket, model), buckets in UTC."""
+    if bucket not in rollups.BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(rollups.BUCKETS)}")
+    rows = await rollups.usage_summary(pool, start, end, bucket, tenant_id)
+    return _fold(rows, ("bucket", "model"))
+
+
+async def _pool() -> Any:
+    pool = await db.get_pool()
+    if pool is None:
+        raise HTTPException(status_code=503, detail="usage database unavailable")
+    return pool
+
+
+def _router() -> Any:
+    from litellm.proxy.auth.user_api_key_auth import user_api_key_auth
+
+    router = APIRouter(prefix="/usage", tags=["usage"])
+
+    @router.get("/requests")
+    async def get_requests(
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        limit: int = DEFAULT_LIMIT,
+        cursor: Optional[str] = None,
+        tenant_id: Optional[str] = None,
+        user_api_key_dict: Any = Depends(user_api_key_auth),
+    ) -> Dict[str, Any]:
+        tenant = tenant_for(user_api_key_dict, tenant_id)
+        start_at, end_at = window(start, end)
+        return await request_history(await _pool(), tenant, start_at, end_at, limit, cursor)
+
+    @router.get("/models")
+    async def get_models(
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        tenant_id: Optional[str] = None,
+        user_api_key_dict: Any = Depends(user_api_key_auth),
+    ) -> Dict[str, Any]:
+        tenant = tenant_for(user_api_key_dict, tenant_id)
+        start_at, end_at = window(start, end)
+        return {"tenant_id": tenant, "data": await model_totals(await _pool(), tenant, start_at, end_at)}
+
+    @router.get("/series")
+    async def get_series(
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        bucket: str = "hour",
+        tenant_id: Optional[str] = None,
+        user_api_key_dict: Any = Depends(user_api_key_auth),
+    ) -> Dict[str, Any]:
+        tenant = tenant_for(user_api_key_dict, tenant_id)
+        start_at, end_at = window(start, end)
+        data = await time_series(await _pool(), tenant, start_at, end_at, bucket)
+        return {"tenant_id": tenant, "bucket": bucket, "data": data}
+
+    return router
+
+
+def register(app: Any = None) -> bool:
+    """Add the /usage routes to app (default: the running LiteLLM proxy's)."""
+    global _registered
+    if _registered:
+        return True
+    if APIRouter is None:
+        return False
+    try:
+        if app is None:
+            from litellm.proxy.proxy_server import app
+        app.include_router(_router())
+    except ImportError:
+        return False
+    except Exception as exc:  # pragma: no cover - defensive
+        print(f"usage_api: cannot register routes: {exc}", file=sys.stderr)
+        return False
+    _registered = True
+    return True
+
+
+class UsageApiHandler(CustomLogger):
+    """Placeholder callback; referencing it in the config loads this module."""
+
+
+proxy_handler_instance = UsageApiHandler()
+
+register()
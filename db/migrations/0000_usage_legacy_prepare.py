@@ -0,0 +1,34 @@
+"""
+Prepare a pre-partitioning litellm_usage for migration 0001 without blocking writes.
+
+0001 attaches the old table as the partition for everything before a bound.
+Under its ACCESS EXCLUSIVE lock, ATTACH would scan the table to check that
+bound and build the parent's indexes that the old table lacks. Here, while
+writes continue, the bound is added NOT VALID and validated, and the
+primary key (id, created_at), the BRIN (created_at) and the
+(tenant_id, created_at) indexes are built concurrently. 0001 then turns the
+unique index into the primary key and attaches with catalog changes only.
+
+The bound is the start of the UTC day after tomorrow, which leaves at least
+a day for the builds; rows written after it are rejected until 0001 has run.
+If this is interrupted, run the migrations again promptly.
+
+Does nothing on a new database or one already partitioned.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+_PLAIN_TABLE_SQL = """
+SELECT 1 FROM pg_class
+WHERE relname = 'litellm_usage' AND relkind = 'r' AND relnamespace = 'public'::regnamespace
+"""
+
+
+def up(ops):
+    if ops.execute(_PLAIN_TABLE_SQL) <= 0:
+        return
+    boundary = datetime.now(timezone.utc).date() + timedelta(days=2)
+    ops.add_check("litellm_usage", "litellm_usage_legacy_bound", f"created_at < '{boundary.isoformat()} 00:00:00+00'")
+    ops.create_index("litellm_usage_legacy_key", "litellm_usage", "(id, created_at)", unique=True)
+    ops.create_index("litellm_usage_legacy_created_at_brin", "litellm_usage", "USING BRIN (created_at)")
+    ops.create_index("litellm_usage_legacy_tenant_created_at", "litellm_usage", "(tenant_id, created_at)")
@@ -0,0 +1,280 @@
+-- Table for LiteLLM proxy usage logs.
+--
+-- litellm_usage is range-partitioned on created_at (UTC days by default,
+-- months optionally). Each partition has its own small indexes, so insert
+-- cost stays flat as history grows, and queries bounded on created_at only
+-- read the partitions they need. Partitions are created ahead of time by
+-- litellm_usage_ensure_partitions() (the proxy calls it hourly) and old ones
+-- are detached or dropped with litellm_usage_detach_partitions()
+-- (scripts/manage_partitions.py). Rows with no matching partition land in
+-- litellm_usage_default and are moved out when their partition is created.
+--
+-- Baseline migration (scripts/migrate.py); later changes go in their own
+-- numbered files. It is idempotent, so databases set up before migrations
+-- were tracked run it once more to be recorded. A pre-partitioning
+-- litellm_usage is migrated in place: the old table is renamed to
+-- litellm_usage_legacy and attached, without copying, as the partition for
+-- everything before the bound that migration 0000 validated on it. 0000 also
+-- built the indexes the partition needs, so here ATTACH neither scans the
+-- table nor builds an index. Without 0000's bound (the file run on its own)
+-- the bound is tomorrow (UTC) and is checked, and the indexes built, under
+-- this transaction's lock.
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class
+        WHERE relname = 'litellm_usage' AND relkind = 'r' AND relnamespace = 'public'::regnamespace
+    ) THEN
+        ALTER TABLE litellm_usage RENAME TO litellm_usage_legacy;
+        ALTER TABLE litellm_usage_legacy RENAME CONSTRAINT litellm_usage_pkey TO litellm_usage_legacy_pkey;
+        ALTER INDEX IF EXISTS idx_litellm_usage_created_at RENAME TO idx_litellm_usage_legacy_created_at;
+        ALTER INDEX IF EXISTS idx_litellm_usage_tenant RENAME TO idx_litellm_usage_legacy_tenant;
+        ALTER INDEX IF EXISTS idx_litellm_usage_request_id RENAME TO idx_litellm_usage_legacy_request_id;
+        -- Keep the id sequence: the partitioned table continues it.
+        ALTER SEQUENCE IF EXISTS litellm_usage_id_seq OWNED BY NONE;
+    END IF;
+END $$;
+
+CREATE SEQUENCE IF NOT EXISTS litellm_usage_id_seq;
+
+CREATE TABLE IF NOT EXISTS litellm_usage (
+    id BIGINT NOT NULL DEFAULT nextval('litellm_usage_id_seq'),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    tenant_id TEXT,
+    model TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    latency_ms INTEGER,
+    status INTEGER,
+    cost_usd NUMERIC(12,6),
+    request_id TEXT,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE litellm_usage_id_seq OWNED BY litellm_usage.id;
+
+CREATE TABLE IF NOT EXISTS litellm_usage_default PARTITION OF litellm_usage DEFAULT;
+
+-- Rows arrive in time order, so a BRIN index is enough for created_at.
+CREATE INDEX IF NOT EXISTS idx_litellm_usage_created_at ON litellm_usage USING BRIN (created_at);
+CREATE INDEX IF NOT EXISTS idx_litellm_usage_tenant ON litellm_usage (tenant_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_litellm_usage_request_id ON litellm_usage (request_id);
+
+DO $$
+DECLARE
+    boundary TIMESTAMPTZ;
+BEGIN
+    IF to_regclass('litellm_usage_legacy') IS NOT NULL
+       AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass('litellm_usage_legacy')) THEN
+        -- A validated CHECK matching the bound lets ATTACH skip its own scan.
+        SELECT substring(pg_get_constraintdef(oid) FROM '''([^'']+)''')::TIMESTAMPTZ INTO boundary
+        FROM pg_constraint
+        WHERE conrelid = to_regclass('litellm_usage_legacy') AND conname = 'litellm_usage_legacy_bound' AND convalidated;
+        IF boundary IS NULL THEN
+            boundary := (date_trunc('day', NOW() AT TIME ZONE 'UTC') + INTERVAL '1 day') AT TIME ZONE 'UTC';
+            ALTER TABLE litellm_usage_legacy DROP CONSTRAINT IF EXISTS litellm_usage_legacy_bound;
+            EXECUTE format(
+                'ALTER TABLE litellm_usage_legacy ADD CONSTRAINT litellm_usage_legacy_bound CHECK (created_at < %L)',
+                boundary
+            );
+        END IF;
+        -- The parent's key is (id, created_at). 0000 built its index; without
+        -- it ATTACH builds the key.
+        ALTER TABLE litellm_usage_legacy DROP CONSTRAINT IF EXISTS litellm_usage_legacy_pkey;
+        IF to_regclass('litellm_usage_legacy_key') IS NOT NULL THEN
+            ALTER TABLE litellm_usage_legacy
+                ADD CONSTRAINT litellm_usage_legacy_pkey PRIMARY KEY USING INDEX litellm_usage_legacy_key;
+        END IF;
+        EXECUTE format(
+            'ALTER TABLE litellm_usage ATTACH PARTITION litellm_usage_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+            boundary
+        );
+        ALTER TABLE litellm_usage_legacy DROP CONSTRAINT litellm_usage_legacy_bound;
+    END IF;
+END $$;
+
+-- request_id identifies one request, but a partitioned table can only
+-- enforce uniqueness together with created_at. litellm_usage_request_ids
+-- holds every stored request_id once: writers claim ids here with ON
+-- CONFLICT DO NOTHING and only write the usage rows whose id was new, so
+-- retries, double callbacks and spool replays cannot bill a request twice.
+-- Keys older than the usage retention are pruned by
+-- scripts/manage_partitions.py. The ids of rows written before the table
+-- existed are claimed in batches by migration 0005, outside this
+-- transaction; until it finishes, a retry of such an old request is not
+-- recognized as a duplicate.
+CREATE TABLE IF NOT EXISTS litellm_usage_request_ids (
+    request_id TEXT PRIMARY KEY,
+    created_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_litellm_usage_request_ids_created_at
+    ON litellm_usage_request_ids USING BRIN (created_at);
+
+-- Create the partitions covering now() .. now() + ahead, one per day or month
+-- (partition names: litellm_usage_pYYYYMMDD / litellm_usage_pYYYYMM).
+-- Ranges already covered by another partition are skipped. Returns the
+-- number of partitions created.
+CREATE OR REPLACE FUNCTION litellm_usage_ensure_partitions(
+    ahead INTERVAL DEFAULT INTERVAL '7 days',
+    granularity TEXT DEFAULT 'day'
+) RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    step INTERVAL;
+    name_format TEXT;
+    lower_utc TIMESTAMP;
+    lower_bound TIMESTAMPTZ;
+    upper_bound TIMESTAMPTZ;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    IF granularity = 'day' THEN
+        step := INTERVAL '1 day';
+        name_format := 'YYYYMMDD';
+    ELSIF granularity = 'month' THEN
+        step := INTERVAL '1 month';
+        name_format := 'YYYYMM';
+    ELSE
+        RAISE EXCEPTION 'granularity must be day or month, got %', granularity;
+    END IF;
+
+    -- Every proxy instance runs this; let one of them do the work.
+    PERFORM pg_advisory_xact_lock(hashtext('litellm_usage_partitions'));
+
+    lower_utc := date_trunc(granularity, NOW() AT TIME ZONE 'UTC');
+    WHILE lower_utc <= (NOW() + ahead) AT TIME ZONE 'UTC' LOOP
+        partition_name := 'litellm_usage_p' || to_char(lower_utc, name_format);
+        lower_bound := lower_utc AT TIME ZONE 'UTC';
+        upper_bound := (lower_utc + step) AT TIME ZONE 'UTC';
+        IF to_regclass(partition_name) IS NULL THEN
+            BEGIN
+                EXECUTE format('CREATE TABLE %I (LIKE litellm_usage INCLUDING DEFAULTS)', partition_name);
+                -- Attaching fails while the default partition holds rows for
+                -- the new range, so move them over first.
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM litellm_usage_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                    'INSERT INTO %I SELECT * FROM moved',
+                    lower_bound, upper_bound, partition_name
+                );
+                EXECUTE format(
+                    'ALTER TABLE litellm_usage ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, lower_bound, upper_bound
+                );
+                created := created + 1;
+            EXCEPTION WHEN invalid_object_definition THEN
+                -- Overlaps an existing partition (the migrated legacy table, or
+                -- partitions made with the other granularity).
+                NULL;
+            END;
+        END IF;
+        lower_utc := lower_utc + step;
+    END LOOP;
+    RETURN created;
+END;
+$$;
+
+-- Detach every partition whose upper bound is older than now() - older_than
+-- and return their names. Detached tables are kept for archiving unless
+-- drop_detached is true.
+CREATE OR REPLACE FUNCTION litellm_usage_detach_partitions(
+    older_than INTERVAL,
+    drop_detached BOOLEAN DEFAULT FALSE
+) RETURNS SETOF TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+    part RECORD;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('litellm_usage_partitions'));
+    FOR part IN
+        SELECT c.relname AS name,
+               substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''([^'']+)''\)')::TIMESTAMPTZ AS upper_bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'litellm_usage'::regclass
+        ORDER BY 2
+    LOOP
+        CONTINUE WHEN part.upper_bound IS NULL OR part.upper_bound > NOW() - older_than;
+        EXECUTE format('ALTER TABLE litellm_usage DETACH PARTITION %I', part.name);
+        IF drop_detached THEN
+            EXECUTE format('DROP TABLE %I', part.name);
+        END IF;
+        RETURN NEXT part.name;
+    END LOOP;
+END;
+$$;
+
+SELECT litellm_usage_ensure_partitions();
+
+-- Rollups: litellm_usage totals per minute, hour and day (UTC) for each
+-- tenant, model and status. callbacks.db adds every batch it writes in the
+-- same transaction (callbacks/rollups.py). Missing tenant/model are stored
+-- as '' and a missing status as 0.
+CREATE TABLE IF NOT EXISTS usage_rollup_minute (
+    bucket_start TIMESTAMPTZ NOT NULL,
+    tenant_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    requests BIGINT NOT NULL DEFAULT 0,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    total_tokens BIGINT NOT NULL DEFAULT 0,
+    cost_usd NUMERIC(18,6) NOT NULL DEFAULT 0,
+    latency_ms_sum BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket_start, tenant_id, model, status)
+);
+CREATE INDEX IF NOT EXISTS idx_usage_rollup_minute_tenant ON usage_rollup_minute (tenant_id, bucket_start);
+
+CREATE TABLE IF NOT EXISTS usage_rollup_hour (LIKE usage_rollup_minute INCLUDING ALL);
+CREATE TABLE IF NOT EXISTS usage_rollup_day (LIKE usage_rollup_minute INCLUDING ALL);
+
+-- Rollups are complete for created_at >= covered_from. NULL until the first
+-- litellm_usage_rollup_backfill(); before that, queries read raw rows.
+CREATE TABLE IF NOT EXISTS usage_rollup_state (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    covered_from TIMESTAMPTZ
+);
+INSERT INTO usage_rollup_state DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+-- Rebuild the rollups from raw rows created since the start of since's UTC
+-- day and extend covered_from back to it. Run once after the proxy with
+-- rollup support is fully deployed (rows written by older instances are
+-- only picked up here). Returns the new covered_from.
+CREATE OR REPLACE FUNCTION litellm_usage_rollup_backfill(since TIMESTAMPTZ) RETURNS TIMESTAMPTZ
+LANGUAGE plpgsql AS $$
+DECLARE
+    start_at TIMESTAMPTZ := date_trunc('day', since, 'UTC');
+    covered TIMESTAMPTZ;
+BEGIN
+    -- Waits for in-flight batches and holds new ones until the rebuild commits.
+    LOCK TABLE usage_rollup_minute, usage_rollup_hour, usage_rollup_day IN SHARE ROW EXCLUSIVE MODE;
+    DELETE FROM usage_rollup_minute WHERE bucket_start >= start_at;
+    DELETE FROM usage_rollup_hour WHERE bucket_start >= start_at;
+    DELETE FROM usage_rollup_day WHERE bucket_start >= start_at;
+
+    INSERT INTO usage_rollup_minute
+    SELECT date_trunc('minute', created_at, 'UTC'), COALESCE(tenant_id, ''), COALESCE(model, ''), COALESCE(status, 0),
+           count(*), COALESCE(sum(prompt_tokens), 0), COALESCE(sum(completion_tokens), 0),
+           COALESCE(sum(total_tokens), 0), COALESCE(sum(cost_usd), 0), COALESCE(sum(latency_ms), 0)
+    FROM litellm_usage WHERE created_at >= start_at
+    GROUP BY 1, 2, 3, 4;
+
+    INSERT INTO usage_rollup_hour
+    SELECT date_trunc('hour', bucket_start, 'UTC'), tenant_id, model, status, sum(requests), sum(prompt_tokens),
+           sum(completion_tokens), sum(total_tokens), sum(cost_usd), sum(latency_ms_sum)
+    FROM usage_rollup_minute WHERE bucket_start >= start_at
+    GROUP BY 1, 2, 3, 4;
+
+    INSERT INTO usage_rollup_day
+    SELECT date_trunc('day', bucket_start, 'UTC'), tenant_id, model, status, sum(requests), sum(prompt_tokens),
+           sum(completion_tokens), sum(total_tokens), sum(cost_usd), sum(latency_ms_sum)
+    FROM usage_rollup_hour WHERE bucket_start >= start_at
+    GROUP BY 1, 2, 3, 4;
+
+    UPDATE usage_rollup_state SET covered_from = LEAST(COALESCE(covered_from, start_at), start_at)
+    RETURNING covered_from INTO covered;
+    RETURN covered;
+END;
+$$;
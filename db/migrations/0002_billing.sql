@@ -0,0 +1,98 @@
+-- Table for customer billing information
+CREATE TABLE IF NOT EXISTS customers (
+    tenant_id TEXT PRIMARY KEY, -- Corresponds to the LiteLLM token/user ID
+    stripe_customer_id TEXT UNIQUE,
+    balance_usd NUMERIC(10, 4) DEFAULT 0.0000,
+    email TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Table for billing transactions (credits and debits)
+CREATE TABLE IF NOT EXISTS transactions (
+    id BIGSERIAL PRIMARY KEY,
+    tenant_id TEXT REFERENCES customers(tenant_id),
+    stripe_charge_id TEXT, -- Null for usage debits
+    amount_usd NUMERIC(10, 4), -- Positive for credit, Negative for debit
+    balance_after NUMERIC(10, 4),
+    type TEXT NOT NULL, -- 'credit', 'debit_usage', 'adjustment'
+    description TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_transactions_tenant ON transactions (tenant_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_created_at ON transactions (created_at);
+
+-- Per-replica slices of a tenant's balance (callbacks/balance.py). Each proxy
+-- replica may only spend what it has leased here, so N replicas cannot each
+-- spend the whole balance; leases of replicas that went away expire.
+CREATE TABLE IF NOT EXISTS customer_balance_leases (
+    tenant_id TEXT NOT NULL REFERENCES customers(tenant_id) ON DELETE CASCADE,
+    replica_id TEXT NOT NULL,
+    amount_usd NUMERIC(10, 4) NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (tenant_id, replica_id)
+);
+
+-- Grant (or renew) a replica's slice: up to p_want, out of the balance the
+-- other replicas have not leased. Returns NULL for an unknown tenant.
+CREATE OR REPLACE FUNCTION customer_balance_lease(
+    p_tenant_id TEXT, p_replica_id TEXT, p_want NUMERIC, p_ttl INTERVAL
+) RETURNS NUMERIC LANGUAGE plpgsql AS $$
+DECLARE
+    current_balance NUMERIC;
+    leased NUMERIC;
+    granted NUMERIC;
+BEGIN
+    SELECT balance_usd INTO current_balance FROM customers WHERE tenant_id = p_tenant_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    DELETE FROM customer_balance_leases WHERE tenant_id = p_tenant_id AND expires_at <= now();
+    SELECT COALESCE(sum(amount_usd), 0) INTO leased
+    FROM customer_balance_leases
+    WHERE tenant_id = p_tenant_id AND replica_id <> p_replica_id;
+    granted := GREATEST(trunc(LEAST(p_want, COALESCE(current_balance, 0) - leased), 4), 0);
+    INSERT INTO customer_balance_leases AS l (tenant_id, replica_id, amount_usd, expires_at)
+    VALUES (p_tenant_id, p_replica_id, granted, now() + p_ttl)
+    ON CONFLICT (tenant_id, replica_id) DO UPDATE
+        SET amount_usd = EXCLUDED.amount_usd, expires_at = EXCLUDED.expires_at;
+    RETURN granted;
+END;
+$$;
+
+-- Tell proxy replicas (LISTEN litellm_balance) about top-ups and balances
+-- that ran out; routine debits are not announced. One notification per
+-- statement carries up to 50 [tenant_id, balance_usd, kind] entries.
+CREATE OR REPLACE FUNCTION customers_notify_balance() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('litellm_balance', json_agg(json_build_array(tenant_id, balance_usd, 'credit'))::text)
+        FROM (
+            SELECT tenant_id, balance_usd, (row_number() OVER () - 1) / 50 AS chunk FROM new_rows
+        ) changed
+        GROUP BY chunk;
+    ELSE
+        PERFORM pg_notify('litellm_balance', json_agg(json_build_array(tenant_id, balance_usd, kind))::text)
+        FROM (
+            SELECT n.tenant_id, n.balance_usd,
+                   CASE WHEN n.balance_usd > o.balance_usd THEN 'credit' ELSE 'debit' END AS kind,
+                   (row_number() OVER () - 1) / 50 AS chunk
+            FROM new_rows n JOIN old_rows o USING (tenant_id)
+            WHERE n.balance_usd > o.balance_usd OR (n.balance_usd <= 0 AND o.balance_usd > 0)
+        ) changed
+        GROUP BY chunk;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS customers_balance_insert ON customers;
+CREATE TRIGGER customers_balance_insert
+    AFTER INSERT ON customers REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION customers_notify_balance();
+
+DROP TRIGGER IF EXISTS customers_balance_update ON customers;
+CREATE TRIGGER customers_balance_update
+    AFTER UPDATE ON customers REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION customers_notify_balance();
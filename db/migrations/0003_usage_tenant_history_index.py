@@ -0,0 +1,18 @@
+"""
+Covering index for tenant usage history (callbacks.usage_api).
+
+History pages walk it backwards from a (created_at, id) keyset; INCLUDE
+holds every column a page returns, so they are index-only scans with no heap
+fetches or sorts. It replaces the plain (tenant_id, created_at) index, which
+is a prefix of it. Built per partition without blocking writes.
+"""
+
+
+def up(ops):
+    ops.create_index(
+        "idx_litellm_usage_tenant_history",
+        "litellm_usage",
+        "(tenant_id, created_at, id) INCLUDE "
+        "(model, prompt_tokens, completion_tokens, total_tokens, latency_ms, status, cost_usd, request_id)",
+    )
+    ops.drop_index("idx_litellm_usage_tenant")
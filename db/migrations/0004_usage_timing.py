@@ -0,0 +1,13 @@
+"""
+Per-request timing breakdown on litellm_usage (callbacks.record).
+
+queue_ms, pre_call_ms, ttft_ms, upstream_ms, overhead_ms and callback_ms are
+nullable, so adding them only touches the catalog; rows written before this
+migration keep NULLs. The tenant history index does not cover them.
+"""
+
+COLUMNS = ("queue_ms", "pre_call_ms", "ttft_ms", "upstream_ms", "overhead_ms", "callback_ms")
+
+
+def up(ops):
+    ops.add_columns("litellm_usage", [f"{name} INTEGER" for name in COLUMNS])
@@ -0,0 +1,47 @@
+"""
+Claim the request_ids of usage rows written before litellm_usage_request_ids
+existed (migration 0001 creates it empty).
+
+Rows are walked in id order, one short transaction per batch, with the
+position kept in litellm_usage_request_ids_backfill so an interrupted run
+resumes where it stopped. Rows written after the run starts claim their own
+ids. Until this finishes, retries, double callbacks and spool replays of
+requests stored before the upgrade can still be written twice: with
+PG_DEDUP on, all of them only check litellm_usage_request_ids.
+"""
+
+# One batch: claim the ids of the next rows after last_id and move last_id
+# past them. Affects the one progress row while rows are left, then none.
+_BATCH_SQL = """
+WITH progress AS (
+    SELECT last_id, stop_id FROM litellm_usage_request_ids_backfill
+), batch AS (
+    SELECT u.id, u.request_id, u.created_at FROM litellm_usage u, progress p
+    WHERE u.id > p.last_id AND u.id <= p.stop_id
+    ORDER BY u.id
+    LIMIT %(batch_size)s
+), claimed AS (
+    INSERT INTO litellm_usage_request_ids (request_id, created_at)
+    SELECT request_id, min(created_at) FROM batch
+    WHERE request_id IS NOT NULL
+    GROUP BY request_id
+    ON CONFLICT (request_id) DO UPDATE SET created_at = EXCLUDED.created_at
+    WHERE EXCLUDED.created_at < litellm_usage_request_ids.created_at
+)
+UPDATE litellm_usage_request_ids_backfill SET last_id = (SELECT max(id) FROM batch)
+WHERE EXISTS (SELECT 1 FROM batch)
+"""
+
+
+def up(ops):
+    ops.execute(
+        "CREATE TABLE IF NOT EXISTS litellm_usage_request_ids_backfill "
+        "(last_id BIGINT NOT NULL, stop_id BIGINT NOT NULL)"
+    )
+    ops.execute(
+        "INSERT INTO litellm_usage_request_ids_backfill (last_id, stop_id) "
+        "SELECT 0, COALESCE((SELECT max(id) FROM litellm_usage), 0) "
+        "WHERE NOT EXISTS (SELECT 1 FROM litellm_usage_request_ids_backfill)"
+    )
+    ops.backfill(_BATCH_SQL, batch_size=10000)
+    ops.execute("DROP TABLE litellm_usage_request_ids_backfill")
@@ -0,0 +1,316 @@
+"""
+Archive old litellm_usage rows to compressed Parquet files and remove them
+from Postgres, and summarize usage straight from the archive.
+
+archive: every whole UTC day older than --older-than-days is streamed with a
+server-side cursor (--batch-rows rows at a time, so memory stays flat) into
+<dest>/day=YYYY-MM-DD/usage.parquet. Files are zstd-compressed, with
+tenant_id and model dictionary-encoded. Each day runs in one REPEATABLE READ
+transaction: the file's row count must match the database's before the day
+is removed. A daily partition (litellm_usage_pYYYYMMDD) is detached and
+dropped; rows in other partitions (the pre-partitioning legacy table, monthly
+partitions) are deleted, so VACUUM those afterwards. A day whose file already
+exists with the right row count is not written again. --keep-source writes
+and verifies without touching Postgres. The usage rollup tables are left
+alone, so dashboards keep their history.
+
+summarize: totals per tenant_id and model (or --by) over the archive. Files
+outside --start/--end are skipped and the rest are aggregated one record
+batch at a time.
+
+<dest> is a local directory or a URI pyarrow.fs understands (gs://bucket/path,
+s3://bucket/path). Connection settings come from the usual libpq variables
+(PGHOST, PGPORT, PGUSER, PGPASSWORD, PGDATABASE, PGSSLMODE).
+
+Usage:
+  python scripts/archive_usage.py archive --dest DIR [--older-than-days 400]
+      [--batch-rows 50000] [--keep-source]
+  python scripts/archive_usage.py summarize --dest DIR [--start 2024-01-01]
+      [--end 2024-02-01] [--tenant ID] [--by tenant_id,model]
+
+Requires pyarrow (pip install pyarrow).
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import psycopg2
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - depends on the environment
+    pa = None
+
+COLUMNS = (
+    "id",
+    "created_at",
+    "tenant_id",
+    "model",
+    "prompt_tokens",
+    "completion_tokens",
+    "total_tokens",
+    "latency_ms",
+    "status",
+    "cost_usd",
+    "request_id",
+    "queue_ms",
+    "pre_call_ms",
+    "ttft_ms",
+    "upstream_ms",
+    "overhead_ms",
+    "callback_ms",
+)
+
+_SUMS = ("prompt_tokens", "completion_tokens", "total_tokens", "cost_usd")
+
+_COUNT_SQL = "SELECT count(*) FROM litellm_usage WHERE created_at >= %s AND created_at < %s"
+_SELECT_SQL = (
+    f"SELECT {', '.join(COLUMNS)} FROM litellm_usage "
+    "WHERE created_at >= %s AND created_at < %s ORDER BY created_at"
+)
+_DELETE_SQL = "DELETE FROM litellm_usage WHERE created_at >= %s AND created_at < %s"
+_PARTITION_SQL = """
+SELECT c.relname
+FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'litellm_usage'::regclass AND c.relname = %s
+"""
+
+
+def _schema() -> "pa.Schema":
+    return pa.schema([
+        ("id", pa.int64()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("tenant_id", pa.string()),
+        ("model", pa.string()),
+        ("prompt_tokens", pa.int32()),
+        ("completion_tokens", pa.int32()),
+        ("total_tokens", pa.int32()),
+        ("latency_ms", pa.int32()),
+        ("status", pa.int32()),
+        ("cost_usd", pa.decimal128(12, 6)),
+        ("request_id", pa.string()),
+        ("queue_ms", pa.int32()),
+        ("pre_call_ms", pa.int32()),
+        ("ttft_ms", pa.int32()),
+        ("upstream_ms", pa.int32()),
+        ("overhead_ms", pa.int32()),
+        ("callback_ms", pa.int32()),
+    ])
+
+
+def _filesystem(dest: str) -> Tuple["pafs.FileSystem", str]:
+    if "://" in dest:
+        return pafs.FileSystem.from_uri(dest)
+    return pafs.LocalFileSystem(), os.path.abspath(dest)
+
+
+def _day_path(root: str, day: date) -> str:
+    return f"{root}/day={day.isoformat()}/usage.parquet"
+
+
+def _bounds(day: date) -> Tuple[datetime, datetime]:
+    lo = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    return lo, lo + timedelta(days=1)
+
+
+def _archived_rows(fs: "pafs.FileSystem", path: str) -> Optional[int]:
+    if fs.get_file_info(path).type != pafs.FileType.File:
+        return None
+    with fs.open_input_file(path) as source:
+        return pq.ParquetFile(source).metadata.num_rows
+
+
+def write_day(cursor: Any, fs: "pafs.FileSystem", path: str, batch_rows: int) -> int:
+    """Stream the rows of an executed (server-side) cursor into one Parquet file."""
+    schema = _schema()
+    written = 0
+    fs.create_dir(path.rsplit("/", 1)[0], recursive=True)
+    with pq.ParquetWriter(
+        path, schema, filesystem=fs, compression="zstd", use_dictionary=["tenant_id", "model"]
+    ) as writer:
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            writer.write_batch(pa.record_batch(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+            ))
+            written += len(rows)
+    return written
+
+
+def archive_day(conn: Any, fs: "pafs.FileSystem", root: str, day: date, batch_rows: int, keep_source: bool) -> int:
+    """Archive and remove one UTC day; returns the number of rows archived."""
+    lo, hi = _bounds(day)
+    path = _day_path(root, day)
+    with conn.cursor() as cursor:
+        cursor.execute(_COUNT_SQL, (lo, hi))
+        expected = cursor.fetchone()[0]
+    if not expected:
+        return 0
+
+    if _archived_rows(fs, path) != expected:
+        # Named cursors are server-side: rows arrive batch_rows at a time.
+        with conn.cursor(name=f"archive_{day:%Y%m%d}") as cursor:
+            cursor.itersize = batch_rows
+            cursor.execute(_SELECT_SQL, (lo, hi))
+            write_day(cursor, fs, path, batch_rows)
+        archived = _archived_rows(fs, path)
+        if archived != expected:
+            fs.delete_file(path)
+            raise RuntimeError(f"{path} has {archived} rows, expected {expected}; source kept")
+    if keep_source:
+        return expected
+
+    partition = f"litellm_usage_p{day:%Y%m%d}"
+    with conn.cursor() as cursor:
+        cursor.execute(_PARTITION_SQL, (partition,))
+        if cursor.fetchone():
+            cursor.execute(f"ALTER TABLE litellm_usage DETACH PARTITION {partition}")
+            cursor.execute(f"DROP TABLE {partition}")
+        else:
+            cursor.execute(_DELETE_SQL, (lo, hi))
+            if cursor.rowcount != expected:
+                raise RuntimeError(f"deleting {day} matched {cursor.rowcount} rows, expected {expected}")
+    return expected
+
+
+def archive(conn: Any, dest: str, older_than_days: int, batch_rows: int, keep_source: bool) -> int:
+    fs, root = _filesystem(dest)
+    cutoff = datetime.now(timezone.utc).date() - timedelta(days=older_than_days)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT min(created_at) FROM litellm_usage WHERE created_at < %s", (_bounds(cutoff)[0],))
+        first = cursor.fetchone()[0]
+    conn.rollback()
+    if first is None:
+        print("nothing to archive")
+        return 0
+
+    total = 0
+    day = first.astimezone(timezone.utc).date()
+    while day < cutoff:
+        conn.set_session(isolation_level="REPEATABLE READ")
+        try:
+            rows = archive_day(conn, fs, root, day, batch_rows, keep_source)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if rows:
+            print(f"archived {rows} rows for {day} to {_day_path(root, day)}")
+        total += rows
+        day += timedelta(days=1)
+    return total
+
+
+def summarize(
+    dest: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    tenant_id: Optional[str] = None,
+    by: Sequence[str] = ("tenant_id", "model"),
+) -> List[Dict[str, Any]]:
+    """Request count and token/cost sums per `by` group for archived days in [start, end)."""
+    fs, root = _filesystem(dest)
+    partitioning = ds.partitioning(pa.schema([("day", pa.string())]), flavor="hive")
+    dataset = ds.dataset(root, filesystem=fs, format="parquet", partitioning=partitioning)
+
+    condition = None
+    clauses = []
+    if start is not None:
+        clauses.append(ds.field("day") >= start.isoformat())
+    if end is not None:
+        clauses.append(ds.field("day") < end.isoformat())
+    if tenant_id is not None:
+        clauses.append(ds.field("tenant_id") == tenant_id)
+    for clause in clauses:
+        condition = clause if condition is None else condition & clause
+
+    by = list(by)
+    totals: Dict[Tuple[Any, ...], List[Any]] = {}
+    aggregations = [(name, "sum") for name in _SUMS] + [([], "count_all")]
+    for batch in dataset.to_batches(columns=by + list(_SUMS), filter=condition):
+        if not batch.num_rows:
+            continue
+        grouped = pa.Table.from_batches([batch]).group_by(by).aggregate(aggregations)
+        for row in grouped.to_pylist():
+            key = tuple(row[name] for name in by)
+            acc = totals.get(key)
+            if acc is None:
+                acc = totals[key] = [0, 0, 0, 0, Decimal(0)]
+            acc[0] += row["count_all"]
+            for i, name in enumerate(_SUMS, start=1):
+                acc[i] += row[f"{name}_sum"] or 0
+
+    results = []
+    for key in sorted(totals, key=lambda k: tuple("" if v is None else str(v) for v in k)):
+        requests, prompt, completion, total, cost = totals[key]
+        results.append(dict(
+            zip(by, key),
+            requests=requests, prompt_tokens=prompt, completion_tokens=completion,
+            total_tokens=total, cost_usd=cost,
+        ))
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    archive_cmd = commands.add_parser("archive", help="export old days and remove them from Postgres")
+    archive_cmd.add_argument("--dest", required=True, help="directory or pyarrow URI for the archive")
+    archive_cmd.add_argument("--older-than-days", type=int, default=400)
+    archive_cmd.add_argument("--batch-rows", type=int, default=50000)
+    archive_cmd.add_argument("--keep-source", action="store_true", help="only write and verify the files")
+
+    summarize_cmd = commands.add_parser("summarize", help="aggregate usage from the archive")
+    summarize_cmd.add_argument("--dest", required=True)
+    summarize_cmd.add_argument("--start", type=date.fromisoformat, help="first day (UTC) to include")
+    summarize_cmd.add_argument("--end", type=date.fromisoformat, help="first day (UTC) to exclude")
+    summarize_cmd.add_argument("--tenant")
+    summarize_cmd.add_argument("--by", default="tenant_id,model", help="comma-separated columns to group by")
+    args = parser.parse_args(argv)
+
+    if pa is None:
+        print("archive_usage: pyarrow is required (pip install pyarrow)", file=sys.stderr)
+        return 1
+
+    if args.command == "summarize":
+        by = [name for name in args.by.split(",") if name]
+        unknown = set(by) - set(COLUMNS)
+        if unknown:
+            print(f"archive_usage: unknown --by columns: {', '.join(sorted(unknown))}", file=sys.stderr)
+            return 1
+        print("\t".join(by + ["requests", *_SUMS]))
+        for row in summarize(args.dest, args.start, args.end, args.tenant, by):
+            print("\t".join("" if row[name] is None else str(row[name]) for name in by + ["requests", *_SUMS]))
+        return 0
+
+    try:
+        conn = psycopg2.connect("")
+    except psycopg2.Error as exc:
+        print(f"archive_usage: cannot connect: {exc}", file=sys.stderr)
+        return 1
+    try:
+        total = archive(conn, args.dest, args.older_than_days, args.batch_rows, args.keep_source)
+    except (psycopg2.Error, RuntimeError, OSError) as exc:
+        print(f"archive_usage: {exc}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    print(f"archived {total} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,8 @@
 set -euo pipefail
 
 # Create log-based metrics for LiteLLM proxy.
+# These count one log line per request; callbacks/metrics.py exports the same
+# totals directly (see docs/deployment.md). Only keep them while LOG_SAMPLE_RATE=1.
 # Usage:
 #   PROJECT_ID=my-proj ./scripts/create_log_metrics.sh
 
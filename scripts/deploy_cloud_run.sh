@@ -7,6 +7,7 @@ set -euo pipefail
 #
 # Optional:
 #   PROXY_MASTER_KEY=... MAX_INSTANCES=50 MIN_INSTANCES=1 CONCURRENCY=15 IMAGE=gcr.io/$PROJECT_ID/litellm-proxy
+#   CPU=1 MEMORY=1Gi PROXY_WORKERS=1 (LiteLLM processes per instance; "auto" = one per CPU)
 
 : "${PROJECT_ID:?PROJECT_ID required}"
 : "${REGION:?REGION required}"
@@ -19,6 +20,9 @@ CONCURRENCY="${CONCURRENCY:-15}"
 MIN_INSTANCES="${MIN_INSTANCES:-1}"
 MAX_INSTANCES="${MAX_INSTANCES:-50}"
 PORT="${PORT:-8080}"
+CPU="${CPU:-1}"
+MEMORY="${MEMORY:-1Gi}"
+PROXY_WORKERS="${PROXY_WORKERS:-1}"
 
 echo "Building image $IMAGE"
 gcloud builds submit --tag "$IMAGE" .
@@ -32,9 +36,9 @@ gcloud run deploy "$SERVICE" \
   --concurrency="$CONCURRENCY" \
   --min-instances="$MIN_INSTANCES" \
   --max-instances="$MAX_INSTANCES" \
-  --cpu=1 \
-  --memory=1Gi \
-  --set-env-vars PORT="$PORT" \
+  --cpu="$CPU" \
+  --memory="$MEMORY" \
+  --set-env-vars PORT="$PORT",PROXY_WORKERS="$PROXY_WORKERS" \
   --set-env-vars OPENAI_API_KEY="$OPENAI_API_KEY",PROXY_GATEWAY_TOKEN="$PROXY_GATEWAY_TOKEN",PROXY_MASTER_KEY="${PROXY_MASTER_KEY:-}"
 
 echo "Done."
@@ -12,6 +12,11 @@ CONCURRENCY="${CONCURRENCY:-15}"
 MIN_INSTANCES="${MIN_INSTANCES:-1}"
 MAX_INSTANCES="${MAX_INSTANCES:-50}"
 PORT="${PORT:-8080}"
+# LiteLLM processes per instance (start.sh); "auto" = one per CPU. Each one
+# needs its own share of MEMORY and opens its own Postgres pool.
+CPU="${CPU:-1}"
+MEMORY="${MEMORY:-1Gi}"
+PROXY_WORKERS="${PROXY_WORKERS:-1}"
 
 # Database details (Cloud SQL optional; leave SQL_INSTANCE empty for external DB)
 SQL_INSTANCE="${SQL_INSTANCE:-}"
@@ -69,6 +74,7 @@ ENV_ARGS=(
   --set-env-vars PGUSER="$PGUSER"
   --set-env-vars PGDATABASE="$PGDATABASE"
   --set-env-vars PGSSL=require
+  --set-env-vars PROXY_WORKERS="$PROXY_WORKERS"
 )
 
 if [[ "$USE_DB_URL" -eq 1 ]]; then
@@ -85,8 +91,8 @@ gcloud run deploy "$SERVICE" \
   --concurrency="$CONCURRENCY" \
   --min-instances="$MIN_INSTANCES" \
   --max-instances="$MAX_INSTANCES" \
-  --cpu=1 \
-  --memory=1Gi \
+  --cpu="$CPU" \
+  --memory="$MEMORY" \
   --timeout=120 \
   "${ENV_ARGS[@]}" \
   --set-secrets OPENAI_API_KEY=openai-api-key:latest \
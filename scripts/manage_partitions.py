@@ -0,0 +1,71 @@
+"""
+Create upcoming litellm_usage partitions and detach (or drop) old ones.
+
+The proxy already creates partitions ahead of time while it runs; this is
+for retention and for environments where the proxy is scaled to zero. Run
+it daily, e.g. from a Cloud Run job or Cloud Scheduler.
+
+Connection settings come from the usual libpq variables (PGHOST, PGPORT,
+PGUSER, PGPASSWORD, PGDATABASE, PGSSLMODE).
+
+Usage:
+  python scripts/manage_partitions.py [--ahead-days 7] [--granularity day]
+      [--retain-days 400 [--drop]]
+
+Without --drop, old partitions are only detached: they stay as ordinary
+tables named litellm_usage_p<date> for archiving. --retain-days also prunes
+litellm_usage_request_ids keys older than the retention.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from datetime import timedelta
+
+import psycopg2
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--ahead-days", type=int, default=7, help="create partitions this far ahead")
+    parser.add_argument("--granularity", choices=("day", "month"), default="day")
+    parser.add_argument("--retain-days", type=int, help="detach partitions entirely older than this")
+    parser.add_argument("--drop", action="store_true", help="drop detached partitions instead of keeping them")
+    args = parser.parse_args(argv)
+
+    try:
+        conn = psycopg2.connect("")
+    except psycopg2.Error as exc:
+        print(f"manage_partitions: cannot connect: {exc}", file=sys.stderr)
+        return 1
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT litellm_usage_ensure_partitions(%s, %s)",
+                (timedelta(days=args.ahead_days), args.granularity),
+            )
+            print(f"created {cursor.fetchone()[0]} partitions")
+            if args.retain_days is not None:
+                cursor.execute(
+                    "SELECT * FROM litellm_usage_detach_partitions(%s, %s)",
+                    (timedelta(days=args.retain_days), args.drop),
+                )
+                action = "dropped" if args.drop else "detached"
+                for (name,) in cursor.fetchall():
+                    print(f"{action} {name}")
+                cursor.execute(
+                    "DELETE FROM litellm_usage_request_ids WHERE created_at < now() - %s",
+                    (timedelta(days=args.retain_days),),
+                )
+                print(f"pruned {cursor.rowcount} request id keys")
+    except psycopg2.Error as exc:
+        print(f"manage_partitions: {exc}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
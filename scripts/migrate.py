@@ -0,0 +1,387 @@
+"""
+Apply the numbered schema migrations in db/migrations.
+
+Migrations are files named NNNN_name.sql or NNNN_name.py. They are applied
+in version order and recorded in schema_migrations (version, name, checksum,
+applied_at, duration_ms), so each one runs once per database. A session
+advisory lock serializes runners: concurrent deploys (two Cloud Build runs,
+a job started twice) wait for each other and the later one finds nothing
+left to do.
+
+A .sql migration runs in one transaction together with its
+schema_migrations row, so it applies completely or not at all. Keep those
+to changes that are quick under lock: new tables and functions, changes to
+small tables.
+
+Changes to large tables (litellm_usage) go in a .py migration that defines
+up(ops). It runs outside a transaction and each ops step commits on its own:
+
+  ops.execute(sql, args=None)  one statement
+  ops.create_index(name, table, definition, unique=False)
+      CREATE INDEX CONCURRENTLY. On a partitioned table it creates an
+      invalid index ON ONLY the parent, builds each partition's index
+      concurrently and attaches it; the parent index becomes valid once
+      every partition has one.
+  ops.drop_index(name)  DROP INDEX (CONCURRENTLY where Postgres allows it),
+      retrying short lock waits instead of queueing writers behind it
+  ops.add_columns(table, ["name TYPE", ...])
+      ALTER TABLE ... ADD COLUMN IF NOT EXISTS in one statement, retrying
+      short lock waits like drop_index. Only add nullable columns without
+      a volatile default: those are catalog-only changes, no rewrite
+  ops.add_check(table, name, expression)
+      ADD CONSTRAINT ... CHECK (...) NOT VALID under a short lock wait like
+      add_columns, then VALIDATE CONSTRAINT, which scans the table without
+      blocking writes. Skipped if a constraint of that name exists
+  ops.backfill(sql, batch_size=10000, pause=0.0)
+      repeat an UPDATE/DELETE/INSERT that is limited with %(batch_size)s
+      until it touches no rows, one short transaction per batch
+
+A .py migration is recorded only after up() returns. If it is interrupted,
+the next run starts it again from the top, so its steps must be safe to
+repeat. The ops helpers are.
+
+Connection settings come from the usual libpq variables (PGHOST, PGPORT,
+PGUSER, PGPASSWORD, PGDATABASE, PGSSLMODE).
+
+Usage:
+  python scripts/migrate.py [--target N] [--dry-run] [--lock-timeout 600]
+  python scripts/migrate.py --status
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib.util
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, List, NamedTuple, Optional
+
+import psycopg2
+import psycopg2.errors
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "db" / "migrations"
+
+_FILENAME = re.compile(r"^(\d+)_(\w+)\.(sql|py)$")
+
+_LOCK_SQL = "SELECT pg_try_advisory_lock(hashtext('litellm_schema_migrations'))"
+_UNLOCK_SQL = "SELECT pg_advisory_unlock(hashtext('litellm_schema_migrations'))"
+
+_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    duration_ms INTEGER
+)
+"""
+
+_APPLIED_SQL = "SELECT version, checksum FROM schema_migrations ORDER BY version"
+
+_RECORD_SQL = "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s)"
+
+# Leaf partitions of a partitioned table, in name order.
+_PARTITIONS_SQL = """
+SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = to_regclass(%s) AND c.relkind = 'r'
+ORDER BY c.relname
+"""
+
+_RELKIND_SQL = "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)"
+_INDEX_VALID_SQL = "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)"
+_CONSTRAINT_SQL = "SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(%s) AND conname = %s"
+# Whether a partition already has an index attached to the parent index
+# (possibly one cloned by ATTACH PARTITION, under another name).
+_INDEX_ATTACHED_SQL = """
+SELECT 1 FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid
+WHERE i.inhparent = to_regclass(%s) AND x.indrelid = to_regclass(%s)
+"""
+
+# Postgres truncates identifiers to this many bytes.
+_MAX_IDENTIFIER = 63
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    path: Path
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.path.read_bytes()).hexdigest()
+
+    def __str__(self) -> str:
+        return f"{self.version:04d}_{self.name}"
+
+
+def discover(directory: Path = MIGRATIONS_DIR) -> List[Migration]:
+    """Migrations in directory, in version order."""
+    migrations = {}
+    for path in sorted(Path(directory).iterdir()):
+        match = _FILENAME.match(path.name)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise MigrationError(f"duplicate migration version {version}: {migrations[version].path.name}, {path.name}")
+        migrations[version] = Migration(version, match.group(2), path)
+    return [migrations[version] for version in sorted(migrations)]
+
+
+class Ops:
+    """Online-safe schema steps for .py migrations; the connection is in autocommit mode."""
+
+    def __init__(self, conn: Any, out: Callable[[str], None] = print, lock_retries: int = 20) -> None:
+        self.conn = conn
+        self.out = out
+        self.lock_retries = lock_retries
+
+    def execute(self, sql: str, args: Any = None) -> int:
+        with self.conn.cursor() as cursor:
+            cursor.execute(sql, args)
+            return cursor.rowcount
+
+    def _fetchone(self, sql: str, args: Any = None) -> Optional[tuple]:
+        with self.conn.cursor() as cursor:
+            cursor.execute(sql, args)
+            return cursor.fetchone()
+
+    def _relkind(self, name: str) -> Optional[str]:
+        row = self._fetchone(_RELKIND_SQL, (name,))
+        return row[0] if row else None
+
+    def _index_valid(self, name: str) -> Optional[bool]:
+        row = self._fetchone(_INDEX_VALID_SQL, (name,))
+        return row[0] if row else None
+
+    def _partitions(self, table: str) -> List[str]:
+        with self.conn.cursor() as cursor:
+            cursor.execute(_PARTITIONS_SQL, (table,))
+            return [name for (name,) in cursor.fetchall()]
+
+    def _locked(self, sql: str) -> None:
+        """Run sql with a short lock_timeout, retrying, so it never queues writers for long."""
+        for attempt in range(self.lock_retries):
+            try:
+                self.execute("SET lock_timeout = '2s'")
+                self.execute(sql)
+                return
+            except psycopg2.errors.LockNotAvailable:
+                self.out(f"  lock busy, retrying: {sql}")
+                time.sleep(min(2 ** attempt, 30))
+            finally:
+                self.execute("RESET lock_timeout")
+        raise MigrationError(f"could not get a lock for: {sql}")
+
+    def _build(self, name: str, table: str, definition: str, unique: bool) -> None:
+        # An interrupted CONCURRENTLY build leaves an invalid index behind.
+        if self._index_valid(name) is False:
+            self.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        self.execute(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}")
+
+    def create_index(self, name: str, table: str, definition: str, unique: bool = False) -> None:
+        """Create an index without blocking writes; definition is e.g. "(tenant_id, created_at)"."""
+        if self._relkind(table) != "p":
+            self.out(f"  building {name} on {table}")
+            self._build(name, table, definition, unique)
+            return
+
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        # ON ONLY is instant and leaves the parent index invalid until every
+        # partition's index is attached.
+        self.execute(f"CREATE {kind} IF NOT EXISTS {name} ON ONLY {table} {definition}")
+        # Partitions attached meanwhile get the index from ATTACH itself, so
+        # a second pass only sees the ones the first pass could not.
+        for _ in range(3):
+            if self._index_valid(name):
+                return
+            for partition in self._partitions(table):
+                if self._fetchone(_INDEX_ATTACHED_SQL, (name, partition)):
+                    continue
+                child = _child_index_name(partition, name)
+                self.out(f"  building {child} on {partition}")
+                self._build(child, partition, definition, unique)
+                self._locked(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+        if not self._index_valid(name):
+            raise MigrationError(f"{name} is still invalid: a partition of {table} has no matching index")
+
+    def drop_index(self, name: str) -> None:
+        kind = self._relkind(name)
+        if kind is None:
+            return
+        if kind == "I":
+            # Partitioned indexes cannot be dropped concurrently; the drop
+            # itself is quick, the lock wait is what has to stay short.
+            self._locked(f"DROP INDEX IF EXISTS {name}")
+        else:
+            self.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+    def add_columns(self, table: str, columns: List[str]) -> None:
+        """Add columns (e.g. "queue_ms INTEGER") that do not exist yet; partitions inherit them."""
+        clauses = ", ".join(f"ADD COLUMN IF NOT EXISTS {column}" for column in columns)
+        self._locked(f"ALTER TABLE {table} {clauses}")
+
+    def add_check(self, table: str, name: str, expression: str) -> None:
+        """Add and validate a CHECK constraint; only the catalog change waits for a table lock."""
+        if not self._fetchone(_CONSTRAINT_SQL, (table, name)):
+            self._locked(f"ALTER TABLE {table} ADD CONSTRAINT {name} CHECK ({expression}) NOT VALID")
+        # A no-op when it is already valid, e.g. on a rerun.
+        self.out(f"  validating {name} on {table}")
+        self.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+
+    def backfill(self, sql: str, batch_size: int = 10000, pause: float = 0.0) -> int:
+        """Run a batch-limited statement until it affects no rows; returns the total."""
+        total = 0
+        while True:
+            affected = self.execute(sql, {"batch_size": batch_size})
+            if affected <= 0:
+                return total
+            total += affected
+            self.out(f"  backfilled {total} rows")
+            if pause:
+                time.sleep(pause)
+
+
+def _child_index_name(partition: str, index: str) -> str:
+    name = f"{partition}_{index[4:] if index.startswith('idx_') else index}"
+    if len(name) <= _MAX_IDENTIFIER:
+        return name
+    digest = hashlib.sha1(name.encode()).hexdigest()[:8]
+    return f"{name[:_MAX_IDENTIFIER - 9]}_{digest}"
+
+
+def _acquire_lock(conn: Any, timeout: float, out: Callable[[str], None]) -> None:
+    deadline = time.monotonic() + timeout
+    waiting = False
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute(_LOCK_SQL)
+            if cursor.fetchone()[0]:
+                return
+        if time.monotonic() >= deadline:
+            raise MigrationError(f"another migration run still holds the lock after {timeout:.0f}s")
+        if not waiting:
+            out("waiting for another migration run to finish...")
+            waiting = True
+        time.sleep(1.0)
+
+
+def _applied(conn: Any) -> dict:
+    with conn.cursor() as cursor:
+        cursor.execute(_APPLIED_SQL)
+        return dict(cursor.fetchall())
+
+
+def _apply_sql(conn: Any, migration: Migration) -> None:
+    started = time.monotonic()
+    with conn.cursor() as cursor:
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute(migration.path.read_text(encoding="utf-8"))
+            duration_ms = int((time.monotonic() - started) * 1000)
+            cursor.execute(_RECORD_SQL, (migration.version, migration.name, migration.checksum, duration_ms))
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+
+
+def _apply_py(conn: Any, migration: Migration, out: Callable[[str], None]) -> None:
+    spec = importlib.util.spec_from_file_location(f"migration_{migration.version:04d}", migration.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    started = time.monotonic()
+    module.up(Ops(conn, out))
+    duration_ms = int((time.monotonic() - started) * 1000)
+    with conn.cursor() as cursor:
+        cursor.execute(_RECORD_SQL, (migration.version, migration.name, migration.checksum, duration_ms))
+
+
+def run(
+    conn: Any,
+    directory: Path = MIGRATIONS_DIR,
+    target: Optional[int] = None,
+    dry_run: bool = False,
+    lock_timeout: float = 600.0,
+    out: Callable[[str], None] = print,
+) -> List[Migration]:
+    """Apply pending migrations up to target (default: all); returns those applied (or due, with dry_run)."""
+    migrations = [m for m in discover(directory) if target is None or m.version <= target]
+    conn.autocommit = True
+    _acquire_lock(conn, lock_timeout, out)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(_TABLE_SQL)
+        applied = _applied(conn)
+        for migration in migrations:
+            if migration.version in applied and applied[migration.version] != migration.checksum:
+                print(f"migrate: {migration} changed after it was applied", file=sys.stderr)
+        pending = [m for m in migrations if m.version not in applied]
+        for migration in pending:
+            if dry_run:
+                out(f"pending {migration}")
+                continue
+            out(f"applying {migration}")
+            if migration.path.suffix == ".sql":
+                _apply_sql(conn, migration)
+            else:
+                _apply_py(conn, migration, out)
+        return pending
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute(_UNLOCK_SQL)
+
+
+def status(conn: Any, directory: Path = MIGRATIONS_DIR, out: Callable[[str], None] = print) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('schema_migrations')")
+        applied = _applied(conn) if cursor.fetchone()[0] else {}
+    for migration in discover(directory):
+        if migration.version not in applied:
+            state = "pending"
+        elif applied[migration.version] != migration.checksum:
+            state = "applied (file changed since)"
+        else:
+            state = "applied"
+        out(f"{migration}\t{state}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dir", type=Path, default=MIGRATIONS_DIR, help="migrations directory")
+    parser.add_argument("--target", type=int, help="stop after this version")
+    parser.add_argument("--dry-run", action="store_true", help="list pending migrations without applying them")
+    parser.add_argument("--status", action="store_true", help="show applied and pending migrations")
+    parser.add_argument("--lock-timeout", type=float, default=600.0, help="seconds to wait for another run")
+    args = parser.parse_args(argv)
+
+    try:
+        conn = psycopg2.connect("")
+    except psycopg2.Error as exc:
+        print(f"migrate: cannot connect: {exc}", file=sys.stderr)
+        return 1
+    try:
+        if args.status:
+            status(conn, args.dir)
+            return 0
+        applied = run(conn, args.dir, args.target, args.dry_run, args.lock_timeout)
+    except (psycopg2.Error, MigrationError) as exc:
+        print(f"migrate: {exc}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    if not args.dry_run:
+        print(f"applied {len(applied)} migrations" if applied else "schema is up to date")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,60 +1,100 @@
 #!/bin/bash
+# Container entrypoint: LiteLLM workers from port 4000, Nginx on $PORT in front.
+#
+# The Prisma client is generated when the image is built (Dockerfile), so a
+# cold start only launches the processes. Nginx is started once every worker
+# answers /health/readiness: Cloud Run sends traffic as soon as $PORT
+# accepts connections, so listening earlier would hand the first requests of
+# a new instance to a proxy that is still loading.
+#
+# One LiteLLM process parses, authenticates and runs callbacks on a single
+# event loop, so it uses one CPU at most. PROXY_WORKERS runs several, each on
+# its own port (4000, 4001, ...) with PROXY_WORKER_ID set to 0, 1, ...; Nginx
+# spreads requests over them (least_conn) on keepalive connections. Each
+# worker is a full proxy with its own Postgres pool; worker 0 serves
+# /metrics and exports the metrics of all of them (callbacks/metrics.py).
+#
+#   PROXY_WORKERS [1] number of workers; "auto" starts one per CPU (nproc)
+#   METRICS_MULTIPROC_DIR [/tmp/litellm-metrics with more than one worker]
+#     where workers share their metric counters; emptied at startup
+#   READY_TIMEOUT_SECONDS [120] give up (and fail the container) after this
+#   STARTUP_DIAGNOSTICS [0] print Python/package/Prisma details at startup
 
-# Start Billing Service on port 4001 (REMOVED)
-# python /app/proxy/billing_service.py &
+set -u
 
-# Start Nginx IMMEDIATELY to satisfy Cloud Run (Port 8080)
-echo "Starting Nginx on port 8080..."
-sed -i "s/8080/$PORT/g" /etc/nginx/nginx.conf
-nginx -g 'daemon off;' &
-NGINX_PID=$!
+PORT="${PORT:-8080}"
+FIRST_WORKER_PORT=4000
+WORKER_KEEPALIVE_SECONDS=75
+UPSTREAM_CONF=/etc/nginx/litellm_upstream.conf
 
-# Run Diagnostics
-echo "Current Directory: $(pwd)"
-echo "Python Version: $(python --version)"
-echo "Installed Packages:"
-pip list | grep prisma || echo "Prisma NOT installed"
-python -c "import prisma; print('Prisma import check: SUCCESS')" || echo "Prisma import check: FAILED"
-
-# Generate Prisma Client
-echo "Generating Prisma Client..."
-SCHEMA_PATH=$(find /usr/local/lib -name schema.prisma | grep "litellm/proxy/schema.prisma" | head -n 1)
-if [ -z "$SCHEMA_PATH" ]; then
-    echo "ERROR: Could not find schema.prisma"
-    # Kill Nginx to fail the container if we can't start
-    kill $NGINX_PID
-    exit 1
+WORKERS="${PROXY_WORKERS:-1}"
+if [ "$WORKERS" = "auto" ]; then
+    WORKERS="$(nproc)"
 fi
-echo "Found schema at: $SCHEMA_PATH"
-prisma generate --schema "$SCHEMA_PATH"
-
-# Start LiteLLM in the background on port 4000
-echo "Starting LiteLLM on port 4000..."
-litellm --config /app/config.yaml --port 4000 --host 0.0.0.0 --debug &
-LITELLM_PID=$!
-
-# Wait for LiteLLM to start (5 seconds initial check)
-sleep 5
-if ! kill -0 $LITELLM_PID; then
-    echo "ERROR: LiteLLM failed to start immediately!"
-    kill $NGINX_PID
-    exit 1
+case "$WORKERS" in
+    ''|*[!0-9]*|0)
+        echo "ERROR: PROXY_WORKERS must be a positive number or auto, not '$WORKERS'"
+        exit 1
+        ;;
+esac
+
+if [ "${STARTUP_DIAGNOSTICS:-0}" = "1" ]; then
+    echo "Current Directory: $(pwd)"
+    echo "Python Version: $(python --version)"
+    pip list 2>/dev/null | grep -i -E "^(litellm|prisma) " || echo "litellm/prisma NOT installed"
+    python -c "import prisma; print('Prisma import check: SUCCESS')" || echo "Prisma import check: FAILED"
+    echo "Prisma schema: $(cat /app/prisma_schema_path 2>/dev/null || echo unknown)"
+    echo "CPUs: $(nproc), workers: $WORKERS"
 fi
 
-# Deep Health Check (Wait up to 120s for migrations/startup)
-echo "Checking LiteLLM health via Python (Timeout 120s)..."
-if ! python /app/check_port.py; then
-    echo "ERROR: LiteLLM failed to bind port 4000 within timeout!"
-    kill $LITELLM_PID
-    kill $NGINX_PID
-    exit 1
+if [ "$WORKERS" -gt 1 ]; then
+    export METRICS_MULTIPROC_DIR="${METRICS_MULTIPROC_DIR:-/tmp/litellm-metrics}"
 fi
+if [ -n "${METRICS_MULTIPROC_DIR:-}" ]; then
+    mkdir -p "$METRICS_MULTIPROC_DIR"
+    find "$METRICS_MULTIPROC_DIR" -maxdepth 1 -name '*.json' -delete
+fi
+
+# Forward Cloud Run's SIGTERM so the workers can flush buffered usage rows.
+WORKER_PIDS=()
+NGINX_PID=""
+shutdown() {
+    [ -n "$NGINX_PID" ] && kill -TERM "$NGINX_PID" 2>/dev/null
+    [ "${#WORKER_PIDS[@]}" -gt 0 ] && kill -TERM "${WORKER_PIDS[@]}" 2>/dev/null
+    wait
+    exit 0
+}
+trap shutdown TERM INT
 
-# Monitor both processes
-echo "All services started. Monitoring..."
-while kill -0 $LITELLM_PID && kill -0 $NGINX_PID; do
-    sleep 5
+: > "$UPSTREAM_CONF"
+for ((i = 0; i < WORKERS; i++)); do
+    port=$((FIRST_WORKER_PORT + i))
+    echo "Starting LiteLLM worker $i on port $port..."
+    # Keep-alive above Nginx's keepalive_timeout (nginx.conf), so Nginx is
+    # the side that closes idle connections.
+    PROXY_WORKER_ID="$i" litellm --config /app/config.yaml --port "$port" --host 0.0.0.0 \
+        --keepalive_timeout "$WORKER_KEEPALIVE_SECONDS" --debug &
+    WORKER_PIDS+=($!)
+    echo "server 127.0.0.1:$port;" >> "$UPSTREAM_CONF"
 done
 
+# The workers load in parallel, so this waits about as long as the slowest.
+for ((i = 0; i < WORKERS; i++)); do
+    port=$((FIRST_WORKER_PORT + i))
+    if ! python /app/wait_ready.py --url "http://127.0.0.1:$port/health/readiness" --pid "${WORKER_PIDS[$i]}"; then
+        echo "ERROR: LiteLLM worker $i did not become ready"
+        kill "${WORKER_PIDS[@]}" 2>/dev/null
+        exit 1
+    fi
+done
+
+echo "Starting Nginx on port $PORT..."
+sed -i "s/listen 8080;/listen $PORT;/" /etc/nginx/nginx.conf
+nginx -g 'daemon off;' &
+NGINX_PID=$!
+
+# Exit (and let Cloud Run replace the instance) when any process dies.
+wait -n "${WORKER_PIDS[@]}" "$NGINX_PID"
 echo "One of the processes exited."
+kill -TERM "$NGINX_PID" "${WORKER_PIDS[@]}" 2>/dev/null
 exit 1
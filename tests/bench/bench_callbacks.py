@@ -0,0 +1,400 @@
+"""
+Benchmarks for the per-request callback hot path.
+
+Every request runs callbacks.logging.log_event and callbacks.db.log_event,
+and both run again when a success and a failure event fire for the same
+request. This measures, per event:
+
+  cpu_ns        CPU time on the event-loop thread (thread_time), so log
+                writer thread work is excluded; the median of --repeat runs
+  slice_p99_us  99th percentile / longest time one event-loop callback ran
+  slice_max_us    without yielding (how long other requests were blocked)
+  peak_kib      tracemalloc peak above the starting point during one run
+  retained_b    bytes still allocated per event after the run (caches, leaks)
+
+Benchmarks:
+  extract            callbacks.record.extract, first sink (cache miss)
+  extract_twice      first and second sink: a miss, then the cached record
+  serialize          RequestLog.as_dict + encoder, i.e. log writer thread cost
+  logging.log_event  the logging callback up to the writer queue
+  db.log_event       the db callback, including its share of the batched
+                     flush (dedup arrays, rollup aggregation) on the loop
+  db.write_batch     callbacks.db._write_rows for one --batch-rows batch,
+                     reported per row
+  both_sinks_twice   logging + db for a success and a failure event of the
+                     same request (the second db event is deduplicated)
+
+The DB runs against a fake asyncpg pool that sleeps --db-latency-ms per
+statement (default), or with --db postgres against the database in the
+libpq PG* env vars, with migrations applied (it inserts bench rows; use a
+throwaway database).
+
+Results can be saved as a baseline and later runs compared against it;
+a benchmark whose cpu_ns or slice_p99_us grew by more than
+--max-regression [0.25] fails the comparison (exit 1). Baselines are only
+comparable on the same machine and Python.
+
+Usage:
+    python tests/bench/bench_callbacks.py [--events 20000] [--repeat 5]
+        [--db fake|postgres] [--db-latency-ms 2] [--only db.log_event,...]
+        [--save-baseline tests/bench/baselines/callbacks.json]
+        [--compare tests/bench/baselines/callbacks.json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from callbacks import backpressure, db, encoders, log_writer, record  # noqa: E402
+from callbacks import logging as log_callback  # noqa: E402
+from callbacks.logging import RequestLog  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "callbacks.json")
+
+REQUEST = {"model": "gpt-4o", "metadata": {"tenant_id": "cust-1"}}
+
+# Awaiting events directly keeps task overhead out of cpu_ns; yielding this
+# often lets the db writer task flush, as it would between requests.
+_YIELD_EVERY = 50
+
+# Measured per call: a call is one event, except db.write_batch (one batch).
+Event = Callable[[int], Awaitable[None]]
+
+
+def _response(i: int) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-bench-{i}",
+        "status": 200,
+        "usage": {"prompt_tokens": 12, "completion_tokens": 48, "total_tokens": 60},
+        "response_cost": 0.00042,
+    }
+
+
+class FakeConnection:
+    """Answers the statements callbacks.db issues, each after latency seconds."""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+
+    async def _wait(self) -> None:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def execute(self, sql: str, *args: Any) -> str:
+        await self._wait()
+        return f"INSERT 0 {len(args[0]) if args and isinstance(args[0], (list, tuple)) else 1}"
+
+    async def executemany(self, sql: str, args: List[Any]) -> None:
+        await self._wait()
+
+    async def fetch(self, sql: str, *args: Any) -> List[Any]:
+        await self._wait()
+        # The dedup insert returns the rows it wrote: all of them.
+        return list(zip(*args))
+
+    async def copy_records_to_table(self, table: str, records: List[Any], columns: Any) -> None:
+        await self._wait()
+
+
+class FakePool:
+    def __init__(self, latency: float) -> None:
+        self.conn = FakeConnection(latency)
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+    async def execute(self, sql: str, *args: Any) -> str:
+        return await self.conn.execute(sql, *args)
+
+    async def executemany(self, sql: str, args: List[Any]) -> None:
+        await self.conn.executemany(sql, args)
+
+
+@contextmanager
+def _loop_slices(durations: List[int]):
+    """Record how long each event-loop callback (task step, timer, ...) runs."""
+    original = asyncio.events.Handle._run
+    clock = time.perf_counter_ns
+
+    def timed(handle):
+        start = clock()
+        try:
+            return original(handle)
+        finally:
+            durations.append(clock() - start)
+
+    asyncio.events.Handle._run = timed
+    try:
+        yield
+    finally:
+        asyncio.events.Handle._run = original
+
+
+def _reset(pool: Any = None) -> None:
+    """Fresh module state so runs do not see each other's caches and queues."""
+    record._cache.clear()
+    db._recent_ids.clear()
+    db._writer = None
+    db._pool = pool
+    db._copy_disabled = db._rollups_disabled = db._dedup_disabled = False
+    backpressure._budget = None
+    log_writer._writer = log_writer.LogWriter(stream=lambda: io.StringIO())
+
+
+async def _drain() -> None:
+    """Wait for the db writer to flush what the run queued."""
+    if db._writer is not None:
+        await db._writer.close()
+        db._writer = None
+    if log_writer._writer is not None:
+        log_writer._writer.flush()
+
+
+async def _run_events(event: Event, n: int, offset: int) -> None:
+    """Run events as LiteLLM schedules callbacks: one task each."""
+    loop = asyncio.get_running_loop()
+    for i in range(offset, offset + n):
+        await loop.create_task(event(i))
+    await _drain()
+
+
+async def _measure(event: Event, n: int, offset: int) -> int:
+    """Loop-thread CPU ns for n events, including the db writer's flushes."""
+    start = time.thread_time_ns()
+    for i in range(offset, offset + n):
+        await event(i)
+        if not i % _YIELD_EVERY:
+            await asyncio.sleep(0)
+    await _drain()
+    return time.thread_time_ns() - start
+
+
+async def _measure_slices(event: Event, n: int, offset: int) -> List[int]:
+    """Durations of every event-loop callback while n events run."""
+    slices: List[int] = []
+    with _loop_slices(slices):
+        await _run_events(event, n, offset)
+    return slices
+
+
+def _events(batch_rows: int) -> Dict[str, Callable[[], Event]]:
+    """name -> factory of a per-index event coroutine (factories run after _reset)."""
+
+    def extract() -> Event:
+        async def run(i: int) -> None:
+            record.extract(REQUEST, _response(i), 0.0, 0.25)
+        return run
+
+    def extract_twice() -> Event:
+        async def run(i: int) -> None:
+            response = _response(i)
+            record.extract(REQUEST, response, 0.0, 0.25)
+            record.extract(REQUEST, response, 0.0, 0.25)
+        return run
+
+    def serialize() -> Event:
+        encode = encoders.get_encoder().dumps
+        usage = record.extract(REQUEST, _response(0), 0.0, 0.25)
+
+        async def run(i: int) -> None:
+            encode(RequestLog(usage))
+        return run
+
+    def logging_event() -> Event:
+        async def run(i: int) -> None:
+            await log_callback.log_event(REQUEST, _response(i), 0.0, 0.25)
+        return run
+
+    def db_event() -> Event:
+        async def run(i: int) -> None:
+            await db.log_event(REQUEST, _response(i), 0.0, 0.25)
+        return run
+
+    def write_batch() -> Event:
+        pool = db._pool
+        rows = [record.extract(REQUEST, _response(i), 0.0, 0.25) for i in range(batch_rows)]
+
+        async def run(i: int) -> None:
+            # Distinct request ids per batch so a real database writes every row.
+            for row in rows:
+                row.request_id = f"chatcmpl-bench-{i}-{id(row)}-{time.monotonic_ns()}"
+            await db._write_rows(pool, rows)
+        return run
+
+    def both_twice() -> Event:
+        async def run(i: int) -> None:
+            response = _response(i)
+            for _ in range(2):
+                await log_callback.log_event(REQUEST, response, 0.0, 0.25)
+                await db.log_event(REQUEST, response, 0.0, 0.25)
+        return run
+
+    return {
+        "extract": extract,
+        "extract_twice": extract_twice,
+        "serialize": serialize,
+        "logging.log_event": logging_event,
+        "db.log_event": db_event,
+        "db.write_batch": write_batch,
+        "both_sinks_twice": both_twice,
+    }
+
+
+async def _bench(name: str, factory: Callable[[], Event], pool_factory: Callable[[], Awaitable[Any]], events: int,
+                 repeat: int, batch_rows: int) -> Dict[str, Any]:
+    per_call = batch_rows if name == "db.write_batch" else 1
+    calls = max(1, events // per_call)
+    offset = 0
+    cpu: List[float] = []
+    for run in range(repeat + 1):
+        _reset(await pool_factory())
+        elapsed = await _measure(factory(), calls, offset)
+        offset += calls
+        if run:  # run 0 warms up imports, the pool and first-use allocations
+            cpu.append(elapsed / (calls * per_call))
+
+    _reset(await pool_factory())
+    slices = sorted(await _measure_slices(factory(), calls, offset))
+    offset += calls
+
+    _reset(await pool_factory())
+    event = factory()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        await _run_events(event, calls, offset)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "cpu_ns": round(statistics.median(cpu)),
+        "cpu_ns_stdev": round(statistics.stdev(cpu)) if len(cpu) > 1 else 0,
+        "slice_p99_us": round(slices[int(len(slices) * 0.99)] / 1000, 1) if slices else 0.0,
+        "slice_max_us": round(slices[-1] / 1000, 1) if slices else 0.0,
+        "peak_kib": round((peak - before) / 1024, 1),
+        "retained_b": round((after - before) / (calls * per_call), 1),
+    }
+
+
+def compare(baseline: Dict[str, Any], results: Dict[str, Any], max_regression: float = 0.25) -> List[str]:
+    """Benchmarks whose cpu_ns or slice_p99_us grew past max_regression against the baseline."""
+    regressions = []
+    for name, current in results.get("results", {}).items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for metric in ("cpu_ns", "slice_p99_us"):
+            before, after = base.get(metric), current.get(metric)
+            if before and after is not None and after > before * (1 + max_regression):
+                regressions.append(f"{name} {metric} {before:g} -> {after:g} (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def _machine() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "encoder": encoders.get_encoder().name,
+    }
+
+
+def run(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=20_000, help="events per run")
+    parser.add_argument("--repeat", type=int, default=5, help="measured runs per benchmark")
+    parser.add_argument("--batch-rows", type=int, default=500, help="rows per db.write_batch call")
+    parser.add_argument("--db", choices=("fake", "postgres"), default="fake")
+    parser.add_argument("--db-latency-ms", type=float, default=2.0, help="fake pool delay per statement")
+    parser.add_argument("--only", help="comma-separated benchmark names")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE, metavar="PATH")
+    parser.add_argument("--compare", nargs="?", const=BASELINE, metavar="PATH")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    parser.add_argument("--output", help="also write the results JSON here")
+    args = parser.parse_args(argv)
+
+    # Rows the writer cannot take should show up as a regression, not be replayed into the next run.
+    os.environ.setdefault("USAGE_SPOOL_DIR", "off")
+
+    async def main() -> Dict[str, Any]:
+        real_pool = None
+
+        async def pool_factory() -> Any:
+            nonlocal real_pool
+            if args.db == "fake":
+                return FakePool(args.db_latency_ms / 1000)
+            if real_pool is None:
+                real_pool = await db._create_pool()
+            return real_pool
+
+        names = _events(args.batch_rows)
+        selected = [name.strip() for name in args.only.split(",")] if args.only else list(names)
+        results = {}
+        saved = (db._pool, db._writer, log_writer._writer, backpressure._budget)
+        try:
+            for name in selected:
+                results[name] = await _bench(name, names[name], pool_factory, args.events, args.repeat,
+                                             args.batch_rows)
+        finally:
+            _reset()
+            db._pool, db._writer, log_writer._writer, backpressure._budget = saved
+            if real_pool is not None:
+                await real_pool.close()
+        return results
+
+    results = {
+        "machine": _machine(),
+        "settings": {"events": args.events, "repeat": args.repeat, "db": args.db,
+                     "db_latency_ms": args.db_latency_ms, "batch_rows": args.batch_rows},
+        "results": asyncio.run(main()),
+    }
+    results["regressions"] = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as source:
+            results["regressions"] = compare(json.load(source), results, args.max_regression)
+    for path in (args.save_baseline, args.output):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as out:
+                json.dump({k: v for k, v in results.items() if k != "regressions"}, out, indent=2)
+                out.write("\n")
+    return results
+
+
+def main() -> int:
+    results = run()
+    print(f"{'benchmark':<20}{'cpu ns':>10}{'+-':>8}{'slice p99 us':>14}{'max us':>10}{'peak KiB':>10}{'ret B':>8}")
+    for name, r in results["results"].items():
+        print(
+            f"{name:<20}{r['cpu_ns']:>10}{r['cpu_ns_stdev']:>8}{r['slice_p99_us']:>14}"
+            f"{r['slice_max_us']:>10}{r['peak_kib']:>10}{r['retained_b']:>8}"
+        )
+    for line in results["regressions"]:
+        print(f"REGRESSION {line}")
+    return 1 if results["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Micro-benchmark for the structured log encoders.
+
+Compares the old path (build a dict with a nested labels dict, stdlib
+json.dumps) against RequestLog + each installed backend in callbacks.encoders.
+Reports the per-record cost on the event loop (building the record) and on
+the log writer thread (encoding it) separately.
+
+Usage:
+    python tests/bench/bench_encoders.py [--records 100000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from callbacks import encoders  # noqa: E402
+from callbacks.logging import RequestLog  # noqa: E402
+from callbacks.record import UsageRecord  # noqa: E402
+
+REQUEST = {"model": "gpt-4o", "metadata": {"tenant_id": "cust-1"}}
+RESPONSE = {
+    "id": "chatcmpl-123",
+    "status": 200,
+    "usage": {"prompt_tokens": 12, "completion_tokens": 48, "total_tokens": 60},
+    "response_cost": 0.00042,
+}
+
+
+def _legacy_record() -> dict:
+    usage = RESPONSE["usage"]
+    record = {
+        "message": "litellm_request",
+        "severity": "INFO",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "latency_ms": 250,
+        "model": REQUEST.get("model"),
+        "tenant_id": REQUEST.get("metadata", {}).get("tenant_id"),
+        "status": RESPONSE.get("status"),
+        "error": RESPONSE.get("error"),
+        "request_id": RESPONSE.get("id"),
+        "prompt_tokens": usage["prompt_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+        "total_tokens": usage["total_tokens"],
+        "cost_usd": RESPONSE.get("response_cost"),
+    }
+    record["labels"] = {"tenant_id": record["tenant_id"], "model": record["model"]}
+    return record
+
+
+def _slotted_record() -> RequestLog:
+    usage = RESPONSE["usage"]
+    return RequestLog(UsageRecord(
+        ts=time.time(),
+        latency_ms=250,
+        model=REQUEST.get("model"),
+        tenant_id=REQUEST["metadata"].get("tenant_id"),
+        status=RESPONSE.get("status"),
+        error=RESPONSE.get("error"),
+        request_id=RESPONSE.get("id"),
+        prompt_tokens=usage["prompt_tokens"],
+        completion_tokens=usage["completion_tokens"],
+        total_tokens=usage["total_tokens"],
+        cost_usd=RESPONSE.get("response_cost"),
+    ))
+
+
+def _ns_per_op(fn, n: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter_ns() - start) / n
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--records", type=int, default=100_000)
+    args = parser.parse_args()
+    n = args.records
+
+    legacy = _legacy_record()
+    slotted = _slotted_record()
+    rows = [
+        ("legacy dict + json.dumps", _ns_per_op(_legacy_record, n), _ns_per_op(lambda: json.dumps(legacy), n)),
+    ]
+    for name, encoder in encoders.available().items():
+        rows.append(
+            (f"RequestLog + {name}", _ns_per_op(_slotted_record, n), _ns_per_op(lambda: encoder.dumps(slotted), n))
+        )
+
+    print(f"{'path':<28}{'build ns':>12}{'encode ns':>12}{'total ns':>12}")
+    for name, build, encode in rows:
+        print(f"{name:<28}{build:>12.0f}{encode:>12.0f}{build + encode:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,423 @@
-from flask import Flask, request, jsonify
-
-app = Flask(__name__)
-
-@app.route("/v1/chat/completions", methods=["POST"])
-@app.route("/chat/completions", methods=["POST"])
-def chat_completions():
-    # Log request for debugging if needed
-    print("Received request:", request.json)
-    
-    # Return a fixed mock response matching OpenAI format
-    return jsonify({
-        "id": "chatcmpl-mock-123",
-        "object": "chat.completion",
-        "created": 1677652288,
-        "model": "gpt-4o",
-        "choices": [{
-            "index": 0,
-            "message": {
-                "role": "assistant",
-                "content": "This is a mock response from the integration test service."
-            },
-            "finish_reason": "stop"
-        }],
-        "usage": {
-            "prompt_tokens": 10,
-            "completion_tokens": 20,
-            "total_tokens": 30
-        }
-    })
+"""
+OpenAI-compatible mock LLM backend for integration and load tests.
+
+A single-process asyncio server (stdlib only; uses uvloop when installed)
+that answers POST /v1/chat/completions and /chat/completions without
+logging request bodies, so a benchmark measures the proxy rather than the
+mock. Responses are built from pre-encoded fragments; a non-streaming
+reply with no latency is written from the protocol callback without
+creating a task, and delays use loop.call_later. HTTP/1.1 keep-alive is
+supported (pipelined requests are answered in order).
+
+Behaviour (env var [default]; each also has a --flag):
+  MOCK_LATENCY [fixed:0] time to the response (or the first streamed token):
+    fixed:MS                  always MS milliseconds
+    lognormal:MEDIAN_MS,SIGMA lognormal with that median and shape
+    replay:PATH               cycle through PATH, one latency in ms per line
+                              (first CSV column; other lines are skipped), e.g.
+                              an export of litellm_usage.latency_ms
+  MOCK_PROMPT_TOKENS [10] prompt tokens reported in usage (N or MIN-MAX)
+  MOCK_COMPLETION_TOKENS [20] completion tokens (N or MIN-MAX), capped by the
+    request's max_tokens / max_completion_tokens
+  MOCK_ERROR_RATE [0] fraction of requests answered with MOCK_ERROR_STATUS
+  MOCK_ERROR_STATUS [500] e.g. 429 to exercise retries and fallbacks
+  MOCK_TOKEN_DELAY_MS [0] delay between streamed tokens
+
+stream=true requests get a real SSE stream (chunked transfer encoding): a
+role chunk, one chunk per completion token, a finish chunk, a usage chunk
+when stream_options.include_usage is set, then [DONE]. Clients that go
+away mid-stream stop the stream.
+
+GET /health answers 200. Run it with:
+  python tests/integration/mock_llm.py [--port 5000] [--latency lognormal:300,0.6]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_TEXT = "This is a mock response from the integration test service."
+
+_MAX_HEADER_BYTES = 64 * 1024
+_MAX_BODY_BYTES = 16 * 1024 * 1024
+_COMPLETION_PATHS = frozenset((b"/v1/chat/completions", b"/chat/completions"))
+_REASONS = {200: b"OK", 400: b"Bad Request", 404: b"Not Found", 411: b"Length Required", 413: b"Payload Too Large",
+            429: b"Too Many Requests", 500: b"Internal Server Error", 502: b"Bad Gateway", 503: b"Service Unavailable"}
+
+
+def _env(name: str, default: str) -> str:
+    return os.environ.get(name, default)
+
+
+def parse_latency(spec: str, rng: Optional[random.Random] = None) -> Callable[[], float]:
+    """A function returning the next latency in seconds for a MOCK_LATENCY spec."""
+    rng = rng or random.Random()
+    kind, _, arg = spec.partition(":")
+    kind = kind.strip().lower()
+    try:
+        if kind == "fixed":
+            seconds = float(arg or 0) / 1000
+            return lambda: seconds
+        if kind == "lognormal":
+            median, _, sigma = arg.partition(",")
+            mu, shape = math.log(float(median) / 1000), float(sigma or 0.5)
+            return lambda: rng.lognormvariate(mu, shape)
+        if kind == "replay":
+            samples = _read_trace(arg)
+            cycle = itertools.cycle(samples)
+            return lambda: next(cycle)
+    except (ValueError, OSError) as exc:
+        raise ValueError(f"invalid latency spec {spec!r}: {exc}") from None
+    raise ValueError(f"invalid latency spec {spec!r}: expected fixed:, lognormal: or replay:")
+
+
+def _read_trace(path: str) -> List[float]:
+    samples = []
+    with open(path, encoding="utf-8") as trace:
+        for line in trace:
+            field = line.split(",", 1)[0].strip()
+            try:
+                samples.append(float(field) / 1000)
+            except ValueError:
+                continue
+    if not samples:
+        raise ValueError(f"no latencies in {path}")
+    return samples
+
+
+def parse_count(spec: str, rng: Optional[random.Random] = None) -> Callable[[], int]:
+    """A function returning a token count for N or MIN-MAX."""
+    rng = rng or random.Random()
+    low, sep, high = str(spec).partition("-")
+    if not sep:
+        value = int(low)
+        return lambda: value
+    low_n, high_n = int(low), int(high)
+    if low_n > high_n:
+        raise ValueError(f"invalid token range {spec!r}")
+    return lambda: rng.randint(low_n, high_n)
+
+
+class MockConfig:
+    """Response behaviour shared by every connection."""
+
+    __slots__ = ("latency", "prompt_tokens", "completion_tokens", "error_rate", "error_status", "token_delay",
+                 "words", "random", "_texts")
+
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        prompt_tokens: str = "10",
+        completion_tokens: str = "20",
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        token_delay_ms: float = 0.0,
+        text: str = DEFAULT_TEXT,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.random = random.Random(seed)
+        self.latency = parse_latency(latency, self.random)
+        self.prompt_tokens = parse_count(prompt_tokens, self.random)
+        self.completion_tokens = parse_count(completion_tokens, self.random)
+        self.error_rate = float(error_rate)
+        self.error_status = int(error_status)
+        self.token_delay = float(token_delay_ms) / 1000
+        self.words = text.split() or ["mock"]
+        self._texts: Dict[int, Tuple[Tuple[bytes, ...], bytes]] = {}
+
+    def text(self, count: int) -> Tuple[Tuple[bytes, ...], bytes]:
+        """count tokens of reply text: each token's piece and the whole, JSON-encoded (cached per count)."""
+        cached = self._texts.get(count)
+        if cached is None:
+            words = self.words
+            pieces = [words[i % len(words)] if i == 0 else " " + words[i % len(words)] for i in range(count)]
+            cached = (tuple(json.dumps(piece).encode() for piece in pieces), json.dumps("".join(pieces)).encode())
+            self._texts[count] = cached
+        return cached
+
+
+def _response(status: int, body: bytes, keep_alive: bool, content_type: bytes = b"application/json") -> bytes:
+    return b"".join((
+        b"HTTP/1.1 %d %s\r\n" % (status, _REASONS.get(status, b"Error")),
+        b"Content-Type: ", content_type, b"\r\n",
+        b"Content-Length: %d\r\n" % len(body),
+        b"" if keep_alive else b"Connection: close\r\n",
+        b"\r\n",
+        body,
+    ))
+
+
+def _error_body(status: int, message: str) -> bytes:
+    kind = "rate_limit_error" if status == 429 else "server_error" if status >= 500 else "invalid_request_error"
+    return json.dumps({"error": {"message": message, "type": kind, "code": status}}).encode()
+
+
+def _chunk(data: bytes) -> bytes:
+    """One HTTP chunk carrying one SSE event."""
+    event = b"data: " + data + b"\n\n"
+    return b"%x\r\n%s\r\n" % (len(event), event)
+
+
+_STREAM_HEAD = (
+    b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+    b"Transfer-Encoding: chunked\r\n"
+)
+_STREAM_END = _chunk(b"[DONE]") + b"0\r\n\r\n"
+
+
+_BODY = (
+    b'{"id":"%s","object":"chat.completion","created":%d,"model":%s,"choices":[{"index":0,'
+    b'"message":{"role":"assistant","content":%s},"finish_reason":"stop"}],%s}'
+)
+_CHUNK_HEAD = b'{"id":"%s","object":"chat.completion.chunk","created":%d,"model":%s,"choices":'
+_USAGE = b'"usage":{"prompt_tokens":%d,"completion_tokens":%d,"total_tokens":%d}'
+
+
+class Completion:
+    """One chat completion, encoded as a JSON body or as SSE chunks from byte templates."""
+
+    __slots__ = ("id", "created", "model", "prompt_tokens", "completion_tokens", "pieces", "content",
+                 "include_usage")
+
+    _ids = itertools.count(1)
+
+    def __init__(self, config: MockConfig, request: Dict) -> None:
+        self.id = b"chatcmpl-mock-%d" % next(self._ids)
+        self.created = int(time.time())
+        self.model = json.dumps(request.get("model") or "gpt-4o").encode()
+        self.prompt_tokens = config.prompt_tokens()
+        limit = request.get("max_completion_tokens") or request.get("max_tokens")
+        count = config.completion_tokens()
+        if isinstance(limit, int) and limit > 0:
+            count = min(count, limit)
+        self.completion_tokens = count
+        self.pieces, self.content = config.text(count)
+        options = request.get("stream_options")
+        self.include_usage = bool(isinstance(options, dict) and options.get("include_usage"))
+
+    def _usage(self) -> bytes:
+        prompt, completion = self.prompt_tokens, self.completion_tokens
+        return _USAGE % (prompt, completion, prompt + completion)
+
+    def body(self) -> bytes:
+        return _BODY % (self.id, self.created, self.model, self.content, self._usage())
+
+    def events(self) -> Tuple[bytes, List[bytes], bytes]:
+        """The role chunk, one chunk per token, and the closing chunks (finish, usage, [DONE])."""
+        head = _CHUNK_HEAD % (self.id, self.created, self.model)
+        first = _chunk(head + b'[{"index":0,"delta":{"role":"assistant","content":""},"finish_reason":null}]}')
+        tokens = [
+            _chunk(b'%s[{"index":0,"delta":{"content":%s},"finish_reason":null}]}' % (head, piece))
+            for piece in self.pieces
+        ]
+        last = [_chunk(head + b'[{"index":0,"delta":{},"finish_reason":"stop"}]}')]
+        if self.include_usage:
+            last.append(_chunk(head + b"[]," + self._usage() + b"}"))
+        last.append(_STREAM_END)
+        return first, tokens, b"".join(last)
+
+
+class MockLLMProtocol(asyncio.Protocol):
+    """Minimal HTTP/1.1 server for one connection; one request in flight at a time."""
+
+    def __init__(self, config: MockConfig) -> None:
+        self.config = config
+        self.loop = asyncio.get_running_loop()
+        self.transport: Optional[asyncio.Transport] = None
+        self.buffer = bytearray()
+        self.busy = False
+        self.closed = False
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore[assignment]
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.closed = True
+
+    def data_received(self, data: bytes) -> None:
+        self.buffer += data
+        if not self.busy:
+            self._next()
+
+    def _next(self) -> None:
+        """Parse and answer buffered requests until one needs to wait."""
+        while not self.busy and not self.closed:
+            parsed = self._parse()
+            if parsed is None:
+                return
+            self._handle(*parsed)
+
+    def _parse(self) -> Optional[Tuple[bytes, bytes, bytes, bool]]:
+        buffer = self.buffer
+        end = buffer.find(b"\r\n\r\n")
+        if end < 0:
+            if len(buffer) > _MAX_HEADER_BYTES:
+                self._finish(_response(413, _error_body(413, "headers too large"), False), False)
+            return None
+        lines = bytes(buffer[:end]).split(b"\r\n")
+        try:
+            method, path, version = lines[0].split(b" ", 2)
+        except ValueError:
+            self._finish(_response(400, _error_body(400, "bad request line"), False), False)
+            return None
+        length = 0
+        keep_alive = version == b"HTTP/1.1"
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name == b"content-length":
+                try:
+                    length = int(value.strip() or 0)
+                except ValueError:
+                    self._finish(_response(400, _error_body(400, "bad Content-Length"), False), False)
+                    return None
+            elif name == b"connection":
+                token = value.strip().lower()
+                keep_alive = token != b"close" and (keep_alive or token == b"keep-alive")
+            elif name == b"transfer-encoding":
+                self._finish(_response(411, _error_body(411, "chunked request bodies are not supported"), False),
+                             False)
+                return None
+        if length > _MAX_BODY_BYTES:
+            self._finish(_response(413, _error_body(413, "body too large"), False), False)
+            return None
+        total = end + 4 + length
+        if len(buffer) < total:
+            return None
+        body = bytes(buffer[end + 4:total])
+        del buffer[:total]
+        return method, path.split(b"?", 1)[0], body, keep_alive
+
+    def _handle(self, method: bytes, path: bytes, body: bytes, keep_alive: bool) -> None:
+        if path in _COMPLETION_PATHS and method == b"POST":
+            self._complete(body, keep_alive)
+        elif path == b"/health" and method == b"GET":
+            self._write(_response(200, b'{"status":"ok"}', keep_alive), keep_alive)
+        else:
+            self._write(_response(404, _error_body(404, "not found"), keep_alive), keep_alive)
+
+    def _complete(self, body: bytes, keep_alive: bool) -> None:
+        config = self.config
+        try:
+            request = json.loads(body)
+            if not isinstance(request, dict):
+                raise ValueError("body must be a JSON object")
+        except ValueError as exc:
+            self._write(_response(400, _error_body(400, f"invalid JSON body: {exc}"), keep_alive), keep_alive)
+            return
+        delay = config.latency()
+        if config.error_rate and config.random.random() < config.error_rate:
+            status = config.error_status
+            self._later(delay, _response(status, _error_body(status, "mock error"), keep_alive), keep_alive)
+            return
+        completion = Completion(config, request)
+        if request.get("stream"):
+            self.busy = True
+            self.loop.create_task(self._stream(completion, delay, keep_alive))
+            return
+        self._later(delay, _response(200, completion.body(), keep_alive), keep_alive)
+
+    def _later(self, delay: float, payload: bytes, keep_alive: bool) -> None:
+        if delay <= 0:
+            self._write(payload, keep_alive)
+            return
+        self.busy = True
+        self.loop.call_later(delay, self._finish, payload, keep_alive)
+
+    def _write(self, payload: bytes, keep_alive: bool) -> None:
+        self.transport.write(payload)
+        if not keep_alive:
+            self.transport.close()
+            self.closed = True
+
+    def _finish(self, payload: bytes, keep_alive: bool) -> None:
+        """Send a (delayed) response, then carry on with any pipelined request."""
+        self.busy = False
+        if self.closed:
+            return
+        self._write(payload, keep_alive)
+        self._next()
+
+    async def _stream(self, completion: Completion, delay: float, keep_alive: bool) -> None:
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.closed:
+            return
+        transport = self.transport
+        transport.write(_STREAM_HEAD + (b"\r\n" if keep_alive else b"Connection: close\r\n\r\n"))
+        first, tokens, last = completion.events()
+        token_delay = self.config.token_delay
+        if token_delay <= 0:
+            transport.write(b"".join((first, *tokens, last)))
+        else:
+            transport.write(first)
+            for event in tokens:
+                await asyncio.sleep(token_delay)
+                if self.closed:
+                    return
+                transport.write(event)
+            transport.write(last)
+        self.busy = False
+        if not keep_alive:
+            transport.close()
+            self.closed = True
+            return
+        self._next()
+
+
+async def serve(config: MockConfig, host: str = "0.0.0.0", port: int = 5000) -> asyncio.AbstractServer:
+    """Start listening; the caller owns the returned server."""
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(lambda: MockLLMProtocol(config), host, port, backlog=4096, reuse_address=True)
+
+
+async def _main(config: MockConfig, host: str, port: int) -> None:
+    server = await serve(config, host, port)
+    print(f"mock_llm: listening on {host}:{port}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default=_env("MOCK_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(_env("MOCK_PORT", "5000")))
+    parser.add_argument("--latency", default=_env("MOCK_LATENCY", "fixed:0"))
+    parser.add_argument("--prompt-tokens", default=_env("MOCK_PROMPT_TOKENS", "10"))
+    parser.add_argument("--completion-tokens", default=_env("MOCK_COMPLETION_TOKENS", "20"))
+    parser.add_argument("--error-rate", type=float, default=float(_env("MOCK_ERROR_RATE", "0")))
+    parser.add_argument("--error-status", type=int, default=int(_env("MOCK_ERROR_STATUS", "500")))
+    parser.add_argument("--token-delay-ms", type=float, default=float(_env("MOCK_TOKEN_DELAY_MS", "0")))
+    parser.add_argument("--seed", type=int, help="make latencies, token counts and errors reproducible")
+    args = parser.parse_args(argv)
+
+    try:
+        config = MockConfig(args.latency, args.prompt_tokens, args.completion_tokens, args.error_rate,
+                            args.error_status, args.token_delay_ms, seed=args.seed)
+    except ValueError as exc:
+        print(f"mock_llm: {exc}", file=sys.stderr)
+        return 2
+    try:
+        import uvloop
+    except ImportError:
+        runner = asyncio.run
+    else:
+        runner = uvloop.run
+    try:
+        runner(_main(config, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    sys.exit(main())
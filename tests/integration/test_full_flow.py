@@ -1,4 +1,5 @@
 import os
+import subprocess
 import sys
 import time
 import requests
@@ -97,15 +98,16 @@ def main():
         # We need to apply schema first!
         # In this setup, we can rely on a migration container or apply it here via python
         # Let's apply it here for simplicity
-        print("Applying schema...")
-        conn = psycopg2.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        with open("../../db/schema.sql", "r") as f:
-            sql = f.read()
-            cur.execute(sql)
-            conn.commit()
-        cur.close()
-        conn.close()
+        print("Applying migrations...")
+        env = dict(
+            os.environ,
+            PGHOST=DB_CONFIG["host"],
+            PGPORT=str(DB_CONFIG["port"]),
+            PGUSER=DB_CONFIG["user"],
+            PGPASSWORD=DB_CONFIG["password"],
+            PGDATABASE=DB_CONFIG["database"],
+        )
+        subprocess.run([sys.executable, "../../scripts/migrate.py"], env=env, check=True)
         print("Schema applied.")
         
         req_id = test_proxy_request()
@@ -0,0 +1,125 @@
+"""
+Compare two loadgen.py result files and fail on regressions.
+
+Steps are matched by offered rate. For every step the candidate has in
+common with the baseline, the run fails (exit 1) when:
+  - throughput drops by more than --max-throughput-drop [0.05] (relative)
+  - a latency percentile (--metrics [p50,p99]) of end-to-end latency or of
+    stream TTFT rises by more than --max-latency-increase [0.10] (relative)
+    and by more than --min-latency-delta-ms [1.0] (so sub-millisecond noise
+    on a fast step does not fail the build)
+  - the error rate rises by more than --max-error-rate-increase [0.005]
+It also fails when the measured capacity (highest sustained rate) is
+lower than the baseline's.
+
+Usage:
+  python tests/load/compare.py baseline.json results.json [--metrics p50,p99,p999]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional
+
+
+def _load(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as source:
+        return json.load(source)
+
+
+def _latency_regressions(
+    label: str,
+    base: Optional[Dict[str, float]],
+    cand: Optional[Dict[str, float]],
+    metrics: List[str],
+    max_increase: float,
+    min_delta_ms: float,
+) -> List[str]:
+    found = []
+    if not base or not cand:
+        return found
+    for metric in metrics:
+        before, after = base.get(metric), cand.get(metric)
+        if before is None or after is None:
+            continue
+        if after - before > min_delta_ms and after > before * (1 + max_increase):
+            found.append(f"{label} {metric} {before:.1f} -> {after:.1f} ms (+{(after / before - 1) * 100:.0f}%)"
+                         if before else f"{label} {metric} {before:.1f} -> {after:.1f} ms")
+    return found
+
+
+def compare(
+    baseline: Dict[str, Any],
+    candidate: Dict[str, Any],
+    metrics: List[str] = ("p50", "p99"),
+    max_throughput_drop: float = 0.05,
+    max_latency_increase: float = 0.10,
+    min_latency_delta_ms: float = 1.0,
+    max_error_rate_increase: float = 0.005,
+) -> List[str]:
+    """Regressions of candidate against baseline, one line each (empty when it passes)."""
+    regressions: List[str] = []
+    base_steps = {step["offered_rps"]: step for step in baseline.get("steps", [])}
+    for step in candidate.get("steps", []):
+        rate = step["offered_rps"]
+        base = base_steps.get(rate)
+        if base is None:
+            continue
+        where = f"@{rate:g} req/s:"
+        if step["throughput_rps"] < base["throughput_rps"] * (1 - max_throughput_drop):
+            regressions.append(
+                f"{where} throughput {base['throughput_rps']:.1f} -> {step['throughput_rps']:.1f} req/s"
+            )
+        if step["error_rate"] > base["error_rate"] + max_error_rate_increase:
+            regressions.append(f"{where} error rate {base['error_rate']:.2%} -> {step['error_rate']:.2%}")
+        regressions += _latency_regressions(
+            f"{where} latency", base.get("latency_ms"), step.get("latency_ms"),
+            list(metrics), max_latency_increase, min_latency_delta_ms,
+        )
+        regressions += _latency_regressions(
+            f"{where} ttft", base.get("ttft_ms"), step.get("ttft_ms"),
+            list(metrics), max_latency_increase, min_latency_delta_ms,
+        )
+    before, after = baseline.get("capacity_rps"), candidate.get("capacity_rps")
+    if before is not None and (after is None or after < before):
+        regressions.append(f"capacity {before:g} -> {after if after is not None else 'none'} req/s")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--metrics", default="p50,p99")
+    parser.add_argument("--max-throughput-drop", type=float, default=0.05)
+    parser.add_argument("--max-latency-increase", type=float, default=0.10)
+    parser.add_argument("--min-latency-delta-ms", type=float, default=1.0)
+    parser.add_argument("--max-error-rate-increase", type=float, default=0.005)
+    args = parser.parse_args(argv)
+
+    try:
+        baseline, candidate = _load(args.baseline), _load(args.candidate)
+    except (OSError, ValueError) as exc:
+        print(f"compare: {exc}", file=sys.stderr)
+        return 2
+    regressions = compare(
+        baseline,
+        candidate,
+        [metric.strip() for metric in args.metrics.split(",") if metric.strip()],
+        args.max_throughput_drop,
+        args.max_latency_increase,
+        args.min_latency_delta_ms,
+        args.max_error_rate_increase,
+    )
+    if not regressions:
+        print(f"compare: no regressions against {args.baseline}")
+        return 0
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,521 @@
+"""
+Open-loop load generator for the proxy.
+
+Requests are started on a fixed schedule (constant spacing or Poisson
+arrivals at the offered rate) whether or not earlier ones have finished,
+so a slow proxy cannot slow the generator down and hide its own latency
+(coordinated omission): latency is measured from each request's intended
+start time. The time actually spent on the wire is reported separately as
+service time, and TTFT (time to the first content token) for streams.
+
+Rates are either one constant rate (--rate, --duration) or a staircase
+(--steps 50,100,200 --step-duration 30) to find the saturation point; each
+step is summarised on its own. Requests are drawn from a weighted profile
+of models, tenants and stream/non-stream mixes (--profile, see
+profiles/mixed.json); each profile entry's body is encoded once.
+
+Latencies go into HDR-style log-linear histograms (1 us resolution below
+128 us, within 1/64 of the value above), kept per step and written to the
+results JSON with p50/p90/p99/p999 so runs can be compared offline with
+compare.py.
+
+Usage:
+  python tests/load/loadgen.py --url http://localhost:8080 \\
+      --steps 50,100,200,400 --step-duration 30 --output results.json
+
+The client is a small keep-alive HTTP/1.1 implementation on asyncio (stdlib
+only), so the generator's own overhead stays well below the proxy's.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import ssl
+import sys
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+RESULTS_VERSION = 1
+
+_DEFAULT_PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles", "mixed.json")
+
+_SUB_BUCKETS = 128
+_HALF = _SUB_BUCKETS // 2
+_SUB_BITS = _SUB_BUCKETS.bit_length() - 1
+
+_PERCENTILES = (("p50", 50.0), ("p90", 90.0), ("p99", 99.0), ("p999", 99.9))
+
+
+class Histogram:
+    """Log-linear histogram of non-negative integer microseconds (HDR layout, sparse counts)."""
+
+    __slots__ = ("counts", "total", "sum", "min", "max")
+
+    def __init__(self) -> None:
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+        self.sum = 0
+        self.min: Optional[int] = None
+        self.max = 0
+
+    @staticmethod
+    def index(value: int) -> int:
+        if value < _SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - _SUB_BITS
+        return _SUB_BUCKETS + (shift - 1) * _HALF + (value >> shift) - _HALF
+
+    @staticmethod
+    def highest(index: int) -> int:
+        """Largest value that falls in bucket index."""
+        if index < _SUB_BUCKETS:
+            return index
+        shift, sub = divmod(index - _SUB_BUCKETS, _HALF)
+        shift += 1
+        return ((sub + _HALF + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        value = max(int(value), 0)
+        index = self.index(value)
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        self.total += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram") -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent: float) -> int:
+        """Value at percent (0-100); like HDR, the highest value equivalent to the matching bucket."""
+        if not self.total:
+            return 0
+        rank = max(1, -(-self.total * percent // 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.highest(index), self.max)
+        return self.max
+
+    def summary_ms(self) -> Optional[Dict[str, float]]:
+        if not self.total:
+            return None
+        summary = {name: round(self.percentile(p) / 1000, 3) for name, p in _PERCENTILES}
+        summary["max"] = round(self.max / 1000, 3)
+        summary["mean"] = round(self.sum / self.total / 1000, 3)
+        return summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "unit": "us",
+            "sub_buckets": _SUB_BUCKETS,
+            "total": self.total,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "counts": sorted(self.counts.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Histogram":
+        if data.get("sub_buckets", _SUB_BUCKETS) != _SUB_BUCKETS:
+            raise ValueError("histogram was recorded with a different bucket layout")
+        histogram = cls()
+        histogram.counts = {int(index): int(count) for index, count in data["counts"]}
+        histogram.total = data["total"]
+        histogram.sum = data["sum"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+
+def schedule(rates: List[float], step_duration: float, arrival: str = "constant",
+             rng: Optional[random.Random] = None) -> List[Tuple[float, int]]:
+    """(offset in seconds, step number) for every request of a run."""
+    rng = rng or random.Random()
+    arrivals: List[Tuple[float, int]] = []
+    step_start = 0.0
+    for step, rate in enumerate(rates):
+        if rate > 0 and arrival == "poisson":
+            end = step_start + step_duration
+            t = step_start + rng.expovariate(rate)
+            while t < end:
+                arrivals.append((t, step))
+                t += rng.expovariate(rate)
+        elif rate > 0:
+            # Offsets from an index rather than a running sum, so no float drift adds or drops a request.
+            arrivals.extend((step_start + i / rate, step) for i in range(round(rate * step_duration)))
+        step_start += step_duration
+    return arrivals
+
+
+class Profile:
+    """One weighted kind of request, with its body encoded up front."""
+
+    __slots__ = ("name", "weight", "stream", "body", "api_key")
+
+    def __init__(self, entry: Dict[str, Any], default_key: str) -> None:
+        self.name = entry.get("name") or entry["model"]
+        self.weight = float(entry.get("weight", 1))
+        self.stream = bool(entry.get("stream"))
+        self.api_key = entry.get("api_key") or default_key
+        body: Dict[str, Any] = {
+            "model": entry["model"],
+            "messages": entry.get("messages") or [{"role": "user", "content": "Reply with 'pong'."}],
+        }
+        if entry.get("max_tokens"):
+            body["max_tokens"] = entry["max_tokens"]
+        if self.stream:
+            body["stream"] = True
+            body["stream_options"] = {"include_usage": True}
+        if entry.get("tenant_id"):
+            body["metadata"] = {"tenant_id": entry["tenant_id"]}
+        self.body = json.dumps(body, separators=(",", ":")).encode()
+
+
+def load_profiles(path: str, default_key: str) -> List[Profile]:
+    with open(path, encoding="utf-8") as source:
+        entries = json.load(source)
+    if isinstance(entries, dict):
+        entries = entries.get("requests", [])
+    profiles = [Profile(entry, default_key) for entry in entries]
+    if not profiles or sum(p.weight for p in profiles) <= 0:
+        raise ValueError(f"{path}: no requests with a positive weight")
+    return profiles
+
+
+class Target:
+    """Where requests go: host, port, TLS, path and the static part of the request head."""
+
+    def __init__(self, url: str, path: str) -> None:
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"unsupported URL {url!r}")
+        self.host = parts.hostname or "localhost"
+        self.tls = parts.scheme == "https"
+        self.port = parts.port or (443 if self.tls else 80)
+        self.path = (parts.path.rstrip("/") + path) if parts.path not in ("", "/") else path
+        host_header = parts.netloc.rsplit("@", 1)[-1]
+        self.ssl = ssl.create_default_context() if self.tls else None
+        self.head = (
+            f"POST {self.path} HTTP/1.1\r\nHost: {host_header}\r\nContent-Type: application/json\r\n"
+        ).encode()
+
+    def request(self, profile: Profile) -> bytes:
+        return b"%sAuthorization: Bearer %s\r\nContent-Length: %d\r\n\r\n%s" % (
+            self.head, profile.api_key.encode(), len(profile.body), profile.body,
+        )
+
+
+class Pool:
+    """Idle keep-alive connections; new ones are opened on demand up to max_connections."""
+
+    def __init__(self, target: Target, max_connections: int) -> None:
+        self.target = target
+        self.idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self.slots = asyncio.Semaphore(max_connections)
+
+    async def acquire(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        await self.slots.acquire()
+        while self.idle:
+            reader, writer = self.idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+        try:
+            return await asyncio.open_connection(self.target.host, self.target.port, ssl=self.target.ssl)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, conn: Tuple[asyncio.StreamReader, asyncio.StreamWriter], reuse: bool) -> None:
+        if reuse:
+            self.idle.append(conn)
+        else:
+            conn[1].close()
+        self.slots.release()
+
+    def close(self) -> None:
+        for _, writer in self.idle:
+            writer.close()
+        self.idle.clear()
+
+
+class StepStats:
+    __slots__ = ("rate", "sent", "ok", "errors", "latency", "service", "ttft", "profiles", "max_lag")
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.sent = 0
+        self.ok = 0
+        self.errors: Counter = Counter()
+        self.latency = Histogram()
+        self.service = Histogram()
+        self.ttft = Histogram()
+        self.profiles: Dict[str, List[Any]] = {}
+        self.max_lag = 0.0
+
+    def result(self, duration: float) -> Dict[str, Any]:
+        failed = sum(self.errors.values())
+        return {
+            "offered_rps": self.rate,
+            "duration_s": duration,
+            "sent": self.sent,
+            "ok": self.ok,
+            "errors": dict(self.errors),
+            "error_rate": round(failed / self.sent, 6) if self.sent else 0.0,
+            "throughput_rps": round(self.ok / duration, 3) if duration else 0.0,
+            "max_schedule_lag_ms": round(self.max_lag * 1000, 3),
+            "latency_ms": self.latency.summary_ms(),
+            "service_ms": self.service.summary_ms(),
+            "ttft_ms": self.ttft.summary_ms(),
+            "profiles": {
+                name: {"sent": sent, "errors": errors, "latency_ms": histogram.summary_ms()}
+                for name, (sent, errors, histogram) in sorted(self.profiles.items())
+            },
+            "histograms": {
+                "latency": self.latency.to_dict(),
+                "service": self.service.to_dict(),
+                "ttft": self.ttft.to_dict(),
+            },
+        }
+
+
+async def _read_head(reader: asyncio.StreamReader) -> Tuple[int, Dict[bytes, bytes]]:
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.split(b"\r\n")
+    status = int(lines[0].split(b" ", 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(b":")
+        if value:
+            headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+def _has_content(events: bytes) -> bool:
+    """True when an SSE payload carries a non-empty content delta."""
+    for line in events.split(b"\n"):
+        if not line.startswith(b"data:") or b'"content"' not in line:
+            continue
+        try:
+            chunk = json.loads(line[5:])
+            choices = chunk.get("choices") or []
+            if any((choice.get("delta") or {}).get("content") for choice in choices):
+                return True
+        except (ValueError, AttributeError):
+            continue
+    return False
+
+
+async def _read_body(reader: asyncio.StreamReader, headers: Dict[bytes, bytes], on_data=None) -> bool:
+    """Consume the body; returns whether the connection can be reused."""
+    if headers.get(b"transfer-encoding", b"").lower() == b"chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0].strip(), 16)
+            data = await reader.readexactly(size + 2)
+            if size == 0:
+                break
+            if on_data is not None:
+                on_data(data)
+    elif b"content-length" in headers:
+        data = await reader.readexactly(int(headers[b"content-length"]))
+        if on_data is not None:
+            on_data(data)
+    else:
+        await reader.read()
+        return False
+    return headers.get(b"connection", b"").lower() != b"close"
+
+
+class LoadGenerator:
+    def __init__(self, target: Target, profiles: List[Profile], max_connections: int = 1000,
+                 timeout: float = 60.0, rng: Optional[random.Random] = None) -> None:
+        self.target = target
+        self.profiles = profiles
+        self.weights = [p.weight for p in profiles]
+        self.requests = {p.name: target.request(p) for p in profiles}
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.rng = rng or random.Random()
+
+    async def _one(self, pool: Pool, profile: Profile, intended: float, stats: Optional[StepStats]) -> None:
+        loop = asyncio.get_running_loop()
+        status: Any = None
+        first_token: List[float] = []
+
+        def on_data(data: bytes) -> None:
+            if not first_token and _has_content(data):
+                first_token.append(loop.time())
+
+        sent_at = intended
+        try:
+            async with asyncio.timeout(self.timeout):
+                conn = await pool.acquire()
+                reuse = False
+                try:
+                    sent_at = loop.time()
+                    conn[1].write(self.requests[profile.name])
+                    status, headers = await _read_head(conn[0])
+                    reuse = await _read_body(conn[0], headers, on_data if profile.stream else None)
+                finally:
+                    pool.release(conn, reuse)
+        except TimeoutError:
+            status = "timeout"
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            status = "connection"
+        if stats is None:
+            return
+        done = loop.time()
+        entry = stats.profiles.get(profile.name)
+        if entry is None:
+            entry = stats.profiles[profile.name] = [0, 0, Histogram()]
+        entry[0] += 1
+        if status == 200:
+            stats.ok += 1
+            latency = int((done - intended) * 1_000_000)
+            stats.latency.record(latency)
+            stats.service.record(int((done - sent_at) * 1_000_000))
+            entry[2].record(latency)
+            if first_token:
+                stats.ttft.record(int((first_token[0] - intended) * 1_000_000))
+        else:
+            stats.errors[str(status)] += 1
+            entry[1] += 1
+
+    async def run(self, rates: List[float], step_duration: float, arrival: str = "constant",
+                  warmup: float = 0.0) -> List[Dict[str, Any]]:
+        """Offer each rate for step_duration seconds (after an unrecorded warmup at the first rate)."""
+        loop = asyncio.get_running_loop()
+        pool = Pool(self.target, self.max_connections)
+        plan: List[Tuple[float, int]] = []
+        if warmup > 0:
+            plan = [(t, -1) for t, _ in schedule(rates[:1], warmup, arrival, self.rng)]
+        plan += [(t + warmup, step) for t, step in schedule(rates, step_duration, arrival, self.rng)]
+        steps = [StepStats(rate) for rate in rates]
+        profiles = self.rng.choices(self.profiles, weights=self.weights, k=len(plan))
+        pending = set()
+        start = loop.time() + 0.05
+        try:
+            for (offset, step), profile in zip(plan, profiles):
+                intended = start + offset
+                delay = intended - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                stats = steps[step] if step >= 0 else None
+                if stats is not None:
+                    stats.sent += 1
+                    lag = loop.time() - intended
+                    if lag > stats.max_lag:
+                        stats.max_lag = lag
+                task = loop.create_task(self._one(pool, profile, intended, stats))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            pool.close()
+        return [stats.result(step_duration) for stats in steps]
+
+
+def capacity(steps: List[Dict[str, Any]], max_error_rate: float = 0.01, min_ratio: float = 0.95,
+             slo_p99_ms: Optional[float] = None) -> Optional[float]:
+    """Highest offered rate that was sustained: throughput kept up, few errors, p99 within the SLO."""
+    best = None
+    for step in steps:
+        latency = step.get("latency_ms") or {}
+        sustained = (
+            step["offered_rps"] > 0
+            and step["throughput_rps"] >= min_ratio * step["offered_rps"]
+            and step["error_rate"] <= max_error_rate
+            and (slo_p99_ms is None or (latency.get("p99") or 0) <= slo_p99_ms)
+        )
+        if not sustained:
+            break
+        best = step["offered_rps"]
+    return best
+
+
+def _print_table(steps: List[Dict[str, Any]]) -> None:
+    print(f"{'offered':>8} {'rps':>9} {'err%':>6} {'p50':>9} {'p99':>9} {'p999':>9} {'ttft p99':>9}")
+    for step in steps:
+        latency = step["latency_ms"] or {}
+        ttft = step["ttft_ms"] or {}
+        print(
+            f"{step['offered_rps']:>8g} {step['throughput_rps']:>9.1f} {step['error_rate'] * 100:>6.2f}"
+            f" {latency.get('p50', 0):>9.1f} {latency.get('p99', 0):>9.1f} {latency.get('p999', 0):>9.1f}"
+            f" {ttft.get('p99', 0):>9.1f}"
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--path", default="/chat/completions")
+    parser.add_argument("--rate", type=float, default=50.0, help="constant arrival rate (requests/s)")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds at --rate")
+    parser.add_argument("--steps", help="comma-separated rates to step through instead of --rate")
+    parser.add_argument("--step-duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=5.0, help="unrecorded seconds at the first rate")
+    parser.add_argument("--arrival", choices=("constant", "poisson"), default="constant")
+    parser.add_argument("--profile", default=_DEFAULT_PROFILE)
+    parser.add_argument("--api-key", default=os.environ.get("LOADGEN_API_KEY", "sk-1234"))
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--slo-p99-ms", type=float, help="p99 a step must stay under to count toward capacity")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args(argv)
+
+    if args.steps:
+        rates = [float(rate) for rate in args.steps.split(",") if rate.strip()]
+        step_duration = args.step_duration
+    else:
+        rates, step_duration = [args.rate], args.duration
+    try:
+        profiles = load_profiles(args.profile, args.api_key)
+        target = Target(args.url, args.path)
+    except (OSError, ValueError, KeyError) as exc:
+        print(f"loadgen: {exc}", file=sys.stderr)
+        return 2
+
+    generator = LoadGenerator(target, profiles, args.max_connections, args.timeout, random.Random(args.seed))
+    started_at = datetime.now(timezone.utc)
+    steps = asyncio.run(generator.run(rates, step_duration, args.arrival, args.warmup))
+    results = {
+        "version": RESULTS_VERSION,
+        "label": args.label,
+        "started_at": started_at.isoformat(),
+        "target": args.url + target.path,
+        "arrival": args.arrival,
+        "profile": os.path.basename(args.profile),
+        "capacity_rps": capacity(steps, args.max_error_rate, slo_p99_ms=args.slo_p99_ms),
+        "steps": steps,
+    }
+    _print_table(steps)
+    print(f"capacity: {results['capacity_rps']} req/s")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            json.dump(results, out, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
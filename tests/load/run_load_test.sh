@@ -1,24 +1,38 @@
 #!/bin/bash
 set -e
 
+# Open-loop load test against a running stack (tests/integration: docker compose up -d --build).
+#
+#   LOAD_URL [http://localhost:8080]     proxy to load
+#   LOAD_STEPS [25,50,100,200,400]       offered rates (req/s), one step each
+#   LOAD_STEP_DURATION [30]              seconds per step
+#   LOAD_BASELINE [baseline.json]        results to compare against, if the file exists
+#                                        (CI uses the load-results artifact of the last green main run)
+#   LOAD_OUTPUT [results.json]
+
 # Default directory to script location
 DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 cd "$DIR"
 
-echo "=== Running Locust Load Test ==="
-# -f locustfile.py: file to use
-# --headless: no UI
-# -u 10: 10 users
-# -r 2: 2 users/sec spawn rate
-# -t 60s: run for 60 seconds
-# --host: target url (localhost:8080)
-# --html: report file
+LOAD_URL="${LOAD_URL:-http://localhost:8080}"
+LOAD_BASELINE="${LOAD_BASELINE:-baseline.json}"
+LOAD_OUTPUT="${LOAD_OUTPUT:-results.json}"
+
+echo "=== Waiting for $LOAD_URL ==="
+python ../../wait_ready.py --url "$LOAD_URL/health/readiness" --timeout 120
+
+echo "=== Running Open-Loop Load Test ==="
+python loadgen.py \
+       --url "$LOAD_URL" \
+       --steps "${LOAD_STEPS:-25,50,100,200,400}" \
+       --step-duration "${LOAD_STEP_DURATION:-30}" \
+       --output "$LOAD_OUTPUT"
 
-locust -f locustfile.py \
-       --headless \
-       -u 10 -r 2 -t 30s \
-       --host http://localhost:8080 \
-       --html load_test_report.html
+if [ -f "$LOAD_BASELINE" ]; then
+    echo "=== Comparing with $LOAD_BASELINE ==="
+    python compare.py "$LOAD_BASELINE" "$LOAD_OUTPUT"
+else
+    echo "No $LOAD_BASELINE; keep $LOAD_OUTPUT as the baseline for the next run."
+fi
 
 echo "=== Load Test Complete ==="
-echo "Check load_test_report.html for details."
@@ -1,102 +0,0 @@
-import sys
-import runpy
-import subprocess
-from unittest.mock import MagicMock, call, patch
-import pytest
-
-# Ensure path includes current directory
-sys.path.append(".")
-
-def test_apply_schema_success():
-    """Test successful schema application."""
-    with patch("subprocess.run") as mock_run, \
-         patch("subprocess.check_call") as mock_check_call, \
-         patch("builtins.open", new_callable=MagicMock) as mock_open, \
-         patch("psycopg2.connect") as mock_connect:
-        
-        # Setup mock returns
-        mock_secret_res = MagicMock()
-        mock_secret_res.stdout = "secret_password\n"
-        mock_ip_res = MagicMock()
-        mock_ip_res.stdout = "127.0.0.1\n"
-        mock_run.side_effect = [mock_secret_res, mock_ip_res]
-        
-        mock_file = MagicMock()
-        mock_file.__enter__.return_value.read.return_value = "CREATE TABLE..."
-        mock_open.return_value = mock_file
-        
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_conn.cursor.return_value = mock_cursor
-        mock_connect.return_value = mock_conn
-        
-        mock_cursor.fetchone.return_value = ("litellm_usage",)
-        
-        runpy.run_path("apply_schema.py", run_name="__main__")
-        
-        assert mock_run.call_count == 2
-        mock_conn.commit.assert_called_once()
-
-def test_apply_schema_table_not_found():
-    """Test verification failure (table not found)."""
-    with patch("subprocess.run") as mock_run, \
-         patch("builtins.open", new_callable=MagicMock) as mock_open, \
-         patch("psycopg2.connect") as mock_connect:
-        
-        mock_run.return_value.stdout = "dummy"
-        
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_conn.cursor.return_value = mock_cursor
-        mock_connect.return_value = mock_conn
-        
-        # Fetchone returns None
-        mock_cursor.fetchone.return_value = None
-        
-        with patch("sys.stdout") as mock_stdout:
-             runpy.run_path("apply_schema.py", run_name="__main__")
-             
-             # Should print warning (we could capture output to verify)
-             # "⚠️  Schema executed but table not found"
-             mock_conn.close.assert_called_once()
-
-def test_apply_schema_db_error():
-    """Test handling of database connection error."""
-    with patch("subprocess.run") as mock_run, \
-         patch("builtins.open"), \
-         patch("psycopg2.connect") as mock_connect:
-
-        mock_run.return_value.stdout = "dummy"
-        
-        import psycopg2
-        mock_connect.side_effect = psycopg2.Error("Connection Failed")
-        
-        with pytest.raises(SystemExit) as excinfo:
-            runpy.run_path("apply_schema.py", run_name="__main__")
-        
-        assert excinfo.value.code == 1
-
-def test_apply_schema_generic_error():
-    """Test handling of generic exception."""
-    with patch("subprocess.run") as mock_run, \
-         patch("builtins.open"), \
-         patch("psycopg2.connect") as mock_connect:
-
-        # Mock success for subprocess
-        mock_run.return_value.stdout = "dummy"
-        
-        # Raise generic exception from connect (inside try block)
-        mock_connect.side_effect = Exception("Generic Failure")
-        
-        with pytest.raises(SystemExit) as excinfo:
-            runpy.run_path("apply_schema.py", run_name="__main__")
-        
-        assert excinfo.value.code == 1
-
-def test_apply_schema_no_psycopg2(monkeypatch):
-    """Test installing psycopg2 if missing (partially mocked)."""
-    # This is tricky because we mocked subprocess.run globally above, 
-    # but runpy re-executes.
-    # To test lines 7-10, we'd need to mock import to raise ImportError.
-    # It's high effort for low reward given 90% goal, skipping unless needed.
-    pass
@@ -0,0 +1,139 @@
+import importlib.util
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq  # noqa: E402
+
+_spec = importlib.util.spec_from_file_location("archive_usage", "scripts/archive_usage.py")
+archive_usage = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(archive_usage)
+
+DAY = date(2024, 1, 2)
+
+
+def _row(i, tenant="t1", model="gpt-4o", cost="0.000100"):
+    return (
+        i, datetime(2024, 1, 2, 0, 0, i % 60, tzinfo=timezone.utc), tenant, model,
+        10, 5, 15, 120, 200, Decimal(cost), f"req-{i}", 1, 0, None, 115, 5, 2,
+    )
+
+
+class FakeCursor:
+    """Cursor that hands out rows fetchmany() at a time and records SQL."""
+
+    def __init__(self, rows=(), count=None, partition=None, rowcount=None):
+        self.rows = list(rows)
+        self.count = len(self.rows) if count is None else count
+        self.partition = partition
+        self.rowcount = len(self.rows) if rowcount is None else rowcount
+        self.executed = []
+        self._last = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, args=None):
+        self.executed.append(sql)
+        self._last = sql
+
+    def fetchone(self):
+        if "count(*)" in self._last:
+            return (self.count,)
+        return (self.partition,) if self.partition else None
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+def _conn(cursor):
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+    return conn
+
+
+def _local(tmp_path):
+    return archive_usage._filesystem(str(tmp_path))
+
+
+def test_write_day_streams_batches_with_dictionary_columns(tmp_path):
+    """Rows are written batch by batch and tenant_id/model are dictionary-encoded."""
+    fs, root = _local(tmp_path)
+    path = archive_usage._day_path(root, DAY)
+
+    written = archive_usage.write_day(FakeCursor([_row(i) for i in range(5)]), fs, path, batch_rows=2)
+
+    assert written == 5
+    metadata = pq.ParquetFile(path).metadata
+    assert metadata.num_rows == 5
+    assert metadata.num_row_groups == 3
+    names = [metadata.schema.column(i).name for i in range(metadata.num_columns)]
+    assert "RLE_DICTIONARY" in metadata.row_group(0).column(names.index("tenant_id")).encodings
+    assert pq.read_table(path).column("cost_usd").to_pylist()[0] == Decimal("0.000100")
+
+
+def test_summarize_aggregates_across_days_and_filters(tmp_path):
+    """summarize() merges per-batch group totals and honours day and tenant filters."""
+    fs, root = _local(tmp_path)
+    archive_usage.write_day(
+        FakeCursor([_row(1), _row(2), _row(3, tenant="t2"), _row(4, model="o1")]),
+        fs, archive_usage._day_path(root, DAY), batch_rows=1,
+    )
+    archive_usage.write_day(FakeCursor([_row(5)]), fs, archive_usage._day_path(root, date(2024, 1, 3)), 10)
+
+    rows = archive_usage.summarize(str(tmp_path))
+    assert [(r["tenant_id"], r["model"], r["requests"]) for r in rows] == [
+        ("t1", "gpt-4o", 3), ("t1", "o1", 1), ("t2", "gpt-4o", 1),
+    ]
+    assert rows[0]["total_tokens"] == 45
+    assert rows[0]["cost_usd"] == Decimal("0.000300")
+
+    rows = archive_usage.summarize(str(tmp_path), start=DAY, end=date(2024, 1, 3), tenant_id="t1", by=["model"])
+    assert [(r["model"], r["requests"]) for r in rows] == [("gpt-4o", 2), ("o1", 1)]
+
+
+def test_archive_day_drops_matching_daily_partition(tmp_path):
+    """A day with its own partition is detached and dropped once the file checks out."""
+    fs, root = _local(tmp_path)
+    cursor = FakeCursor([_row(i) for i in range(3)], partition="litellm_usage_p20240102")
+
+    assert archive_usage.archive_day(_conn(cursor), fs, root, DAY, 1000, keep_source=False) == 3
+
+    assert "ALTER TABLE litellm_usage DETACH PARTITION litellm_usage_p20240102" in cursor.executed
+    assert "DROP TABLE litellm_usage_p20240102" in cursor.executed
+    assert archive_usage._DELETE_SQL not in cursor.executed
+
+
+def test_archive_day_deletes_rows_outside_daily_partitions(tmp_path):
+    """Days in the legacy or monthly partitions are removed with DELETE; --keep-source skips it."""
+    fs, root = _local(tmp_path)
+    cursor = FakeCursor([_row(i) for i in range(3)])
+    archive_usage.archive_day(_conn(cursor), fs, root, DAY, 1000, keep_source=True)
+    assert archive_usage._DELETE_SQL not in cursor.executed
+
+    cursor = FakeCursor(count=3, rowcount=3)
+    conn = _conn(cursor)
+    assert archive_usage.archive_day(conn, fs, root, DAY, 1000, keep_source=False) == 3
+    assert archive_usage._DELETE_SQL in cursor.executed
+    # The verified file from the first run is reused, not rewritten.
+    assert all("name" not in c.kwargs for c in conn.cursor.call_args_list)
+
+
+def test_archive_day_keeps_source_when_counts_disagree(tmp_path):
+    """A file that does not hold every source row is removed and nothing is deleted."""
+    fs, root = _local(tmp_path)
+    cursor = FakeCursor([_row(i) for i in range(3)], count=4)
+
+    with pytest.raises(RuntimeError, match="expected 4"):
+        archive_usage.archive_day(_conn(cursor), fs, root, DAY, 1000, keep_source=False)
+
+    assert not (tmp_path / "day=2024-01-02" / "usage.parquet").exists()
+    assert archive_usage._DELETE_SQL not in cursor.executed
+    assert not any("DROP" in sql for sql in cursor.executed)
@@ -0,0 +1,41 @@
+import importlib.util
+import json
+
+_spec = importlib.util.spec_from_file_location("bench_callbacks", "tests/bench/bench_callbacks.py")
+bench = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench)
+
+
+def test_benchmarks_run_and_report_every_metric(tmp_path, monkeypatch):
+    """Test a tiny run of every benchmark completes against the fake pool and writes its results."""
+    monkeypatch.setenv("USAGE_SPOOL_DIR", "off")
+    output = tmp_path / "results.json"
+
+    results = bench.run(["--events", "120", "--repeat", "1", "--batch-rows", "40", "--db-latency-ms", "0.1",
+                         "--output", str(output)])
+
+    assert set(results["results"]) == {
+        "extract", "extract_twice", "serialize", "logging.log_event", "db.log_event", "db.write_batch",
+        "both_sinks_twice",
+    }
+    for metrics in results["results"].values():
+        assert metrics["cpu_ns"] > 0
+        assert metrics["slice_max_us"] >= metrics["slice_p99_us"] >= 0
+    saved = json.loads(output.read_text())
+    assert saved["settings"]["events"] == 120
+    assert "regressions" not in saved
+    assert bench.db._pool is None
+
+
+def test_compare_flags_cpu_and_blocking_regressions():
+    """Test growth past --max-regression in cpu_ns or slice_p99_us is reported, smaller drift is not."""
+    baseline = {"results": {"db.log_event": {"cpu_ns": 20000, "slice_p99_us": 30.0},
+                            "extract": {"cpu_ns": 5000, "slice_p99_us": 10.0}}}
+    current = {"results": {"db.log_event": {"cpu_ns": 26000, "slice_p99_us": 31.0},
+                           "extract": {"cpu_ns": 5500, "slice_p99_us": 14.0},
+                           "new_bench": {"cpu_ns": 1, "slice_p99_us": 1.0}}}
+
+    assert bench.compare(baseline, current, max_regression=0.25) == [
+        "db.log_event cpu_ns 20000 -> 26000 (+30%)",
+        "extract slice_p99_us 10 -> 14 (+40%)",
+    ]
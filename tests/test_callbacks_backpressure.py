@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from collections import OrderedDict
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from callbacks import backpressure
+from callbacks import db
+
+@pytest.fixture
+def reset_budget():
+    backpressure._budget = None
+    backpressure._gauges.clear()
+    with patch.dict(os.environ, {"CALLBACK_STATS_INTERVAL_SECONDS": "0"}):
+        yield
+    backpressure._budget = None
+    backpressure._gauges.clear()
+
+@pytest.mark.asyncio
+async def test_admit_within_budget():
+    """Test events run while slots are free and release frees them."""
+    budget = backpressure.CallbackBudget(max_in_flight=2, block_timeout=0, sample_rate=0)
+    assert await budget.admit("db", "spool") == backpressure.RUN
+    assert await budget.admit("db", "spool") == backpressure.RUN
+    assert budget.in_flight == 2
+    budget.release()
+    assert budget.in_flight == 1
+    assert budget.counters["db.admitted"] == 2
+
+@pytest.mark.asyncio
+async def test_overflow_spool_and_drop():
+    """Test the spool and sample policies once the budget is exhausted."""
+    budget = backpressure.CallbackBudget(max_in_flight=1, block_timeout=0, sample_rate=0)
+    await budget.admit("db", "spool")
+
+    assert await budget.admit("db", "spool") == backpressure.SPOOL
+    assert await budget.admit("logging", "sample") == backpressure.DROP
+    assert budget.counters["db.spooled"] == 1
+    assert budget.counters["logging.dropped"] == 1
+    assert budget.in_flight == 1
+
+@pytest.mark.asyncio
+async def test_overflow_sample_keeps_fraction():
+    """Test sample_rate=1 keeps every overflow event and counts it in flight."""
+    budget = backpressure.CallbackBudget(max_in_flight=1, block_timeout=0, sample_rate=1.0)
+    await budget.admit("logging", "sample")
+
+    assert await budget.admit("logging", "sample") == backpressure.RUN
+    assert budget.counters["logging.sampled"] == 1
+    assert budget.in_flight == 2
+
+@pytest.mark.asyncio
+async def test_overflow_block_gets_released_slot():
+    """Test a blocked event takes over the slot freed by release()."""
+    budget = backpressure.CallbackBudget(max_in_flight=1, block_timeout=1.0, sample_rate=0)
+    await budget.admit("db", "block")
+
+    waiter = asyncio.ensure_future(budget.admit("db", "block"))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    budget.release()
+
+    assert await waiter == backpressure.RUN
+    assert budget.in_flight == 1
+    assert budget.counters["db.blocked"] == 1
+
+@pytest.mark.asyncio
+async def test_overflow_block_timeout_spools():
+    """Test a blocked event falls back to the spool after the timeout."""
+    budget = backpressure.CallbackBudget(max_in_flight=1, block_timeout=0.01, sample_rate=0)
+    await budget.admit("db", "block")
+
+    assert await budget.admit("db", "block") == backpressure.SPOOL
+    assert not budget._waiters
+
+def test_overflow_policy_from_env():
+    """Test per-sink policies come from the environment with safe defaults."""
+    with patch.dict(os.environ, {"CALLBACK_OVERFLOW_DB": "block", "CALLBACK_OVERFLOW_LOGGING": "bogus"}):
+        assert backpressure.overflow_policy("db") == "block"
+        assert backpressure.overflow_policy("logging") == "spool"
+    with patch.dict(os.environ, {}, clear=True):
+        assert backpressure.overflow_policy("db") == "spool"
+        assert backpressure.overflow_policy("logging") == "sample"
+
+def test_stats_reports_gauges_and_flush_latency(reset_budget):
+    """Test stats() includes registered gauges and flush timings."""
+    backpressure.register_gauge("db.queue_depth", lambda: 7)
+    backpressure.observe_flush("db", 0.010, 100)
+    backpressure.observe_flush("db", 0.030, 50)
+
+    snapshot = backpressure.stats()
+    assert snapshot["gauges"]["db.queue_depth"] == 7
+    assert snapshot["flush"]["db"] == {"count": 2, "rows": 150, "avg_ms": 20.0, "max_ms": 30.0}
+
+@pytest.mark.asyncio
+async def test_db_log_event_spools_on_overflow(reset_budget):
+    """Test the db sink hands the row to the spool writer when over budget."""
+    with patch.dict(os.environ, {"CALLBACK_MAX_IN_FLIGHT": "1"}):
+        budget = backpressure.get_budget()
+    await budget.admit("db", "spool")
+
+    with patch("callbacks.db._spool_rows", new_callable=AsyncMock) as mock_spool, \
+         patch("callbacks.db._get_pool", new_callable=AsyncMock) as mock_get_pool, \
+         patch.object(db, "_spooler", None):
+        await db.log_event({"model": "gpt-4o"}, {"id": "req-1"}, 0, 0)
+        await db._spooler.close()
+
+    mock_get_pool.assert_not_called()
+    assert mock_spool.call_args[0][0][0].request_id == "req-1"
+    assert budget.in_flight == 1
+
+@pytest.mark.asyncio
+async def test_logging_log_event_drops_on_overflow(reset_budget, capsys):
+    """Test the logging sink emits nothing for dropped events."""
+    from callbacks import logging as cb_logging
+
+    with patch.dict(os.environ, {"CALLBACK_MAX_IN_FLIGHT": "1", "CALLBACK_SAMPLE_RATE": "0"}):
+        budget = backpressure.get_budget()
+    await budget.admit("db", "spool")
+
+    await cb_logging.log_event({"model": "gpt-4o"}, {"id": "req-1"}, 0, 0)
+
+    assert capsys.readouterr().out == ""
+    assert budget.counters["logging.dropped"] == 1
+
+@pytest.mark.asyncio
+async def test_db_slot_held_until_slow_write_lands(reset_budget):
+    """Test rows waiting on a slow database keep their slots, so the overflow policy kicks in."""
+    gate = asyncio.Event()
+    written = []
+
+    async def slow_write(pool, rows):
+        await gate.wait()
+        written.extend(row.request_id for row in rows)
+        return len(rows)
+
+    env = {"CALLBACK_MAX_IN_FLIGHT": "2", "PG_BATCH_FLUSH_MS": "0", "CALLBACK_STATS_INTERVAL_SECONDS": "0"}
+    with patch.dict(os.environ, env), \
+         patch("callbacks.db._write_rows", side_effect=slow_write), \
+         patch("callbacks.db._get_pool", new_callable=AsyncMock), \
+         patch("callbacks.db._spool_rows", new_callable=AsyncMock) as mock_spool, \
+         patch("callbacks.db.usage_spool.get_spool", return_value=None), \
+         patch.object(db, "_writer", None), patch.object(db, "_spooler", None), \
+         patch.object(db, "_recent_ids", OrderedDict()):
+        budget = backpressure.get_budget()
+        for request_id in ("req-1", "req-2", "req-3"):
+            await db.log_event({"model": "gpt-4o"}, {"id": request_id}, 0, 0)
+            await asyncio.sleep(0)
+
+        assert budget.in_flight == 2
+        assert budget.counters["db.spooled"] == 1
+
+        gate.set()
+        await db._writer.close()
+        await db._spooler.close()
+
+    assert written == ["req-1", "req-2"]
+    assert mock_spool.call_args[0][0][0].request_id == "req-3"
+    assert budget.in_flight == 0
+
+@pytest.mark.asyncio
+async def test_logging_slot_held_until_line_is_written(reset_budget):
+    """Test a log line stuck behind a slow stdout keeps its slot until the writer thread writes it."""
+    import threading
+
+    from callbacks import log_writer
+    from callbacks import logging as cb_logging
+
+    gate = threading.Event()
+    lines = []
+
+    class SlowStream:
+        def write(self, data):
+            gate.wait(5)
+            lines.append(data)
+
+        def flush(self):
+            pass
+
+    writer = log_writer.LogWriter(flush_interval=0, stream=lambda: SlowStream())
+    with patch.dict(os.environ, {"CALLBACK_MAX_IN_FLIGHT": "1", "CALLBACK_SAMPLE_RATE": "0"}), \
+         patch.object(log_writer, "_writer", writer):
+        budget = backpressure.get_budget()
+        await cb_logging.log_event({"model": "gpt-4o"}, {"id": "req-1"}, 0, 0)
+        await cb_logging.log_event({"model": "gpt-4o"}, {"id": "req-2"}, 0, 0)
+
+        assert budget.in_flight == 1
+        assert budget.counters["logging.dropped"] == 1
+
+        gate.set()
+        assert writer.flush()
+        for _ in range(100):
+            if budget.in_flight == 0:
+                break
+            await asyncio.sleep(0.01)
+        writer.close()
+
+    assert budget.in_flight == 0
+    assert len(lines) == 1 and "req-1" in lines[0]
+
+@pytest.mark.asyncio
+async def test_db_full_queue_follows_overflow_policy(reset_budget):
+    """Test a full writer queue drops the row under the sample policy instead of spooling it."""
+    full_writer = MagicMock()
+    full_writer.submit.return_value = False
+    with patch.dict(os.environ, {"CALLBACK_OVERFLOW_DB": "sample"}), \
+         patch("callbacks.db._get_pool", new_callable=AsyncMock), \
+         patch("callbacks.db._get_writer", return_value=full_writer), \
+         patch("callbacks.db._spool_later") as spool_later, \
+         patch.object(db, "_recent_ids", OrderedDict()):
+        await db.log_event({"model": "gpt-4o"}, {"id": "req-1"}, 0, 0)
+
+    spool_later.assert_not_called()
+    budget = backpressure.get_budget()
+    assert budget.counters["db.queue_full"] == 1
+    assert budget.counters["db.dropped"] == 1
+    assert budget.in_flight == 0
@@ -0,0 +1,392 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from callbacks import balance
+from callbacks import budget
+from callbacks import record
+
+@pytest.fixture(autouse=True)
+def reset_balance():
+    balance._cache = None
+    balance._debits = None
+    balance._leases_disabled = False
+    budget._reservations = None
+    record._cache.clear()
+    # Leases and LISTEN have their own tests below.
+    with patch.dict(os.environ, {"BALANCE_LEASES": "0", "BALANCE_LISTEN": "0"}):
+        yield
+    if balance._debits is not None and balance._debits._task is not None:
+        balance._debits._task.cancel()
+    for task in (balance._listen_task, balance._lease_task):
+        if task is not None:
+            task.cancel()
+    balance._listen_task = balance._lease_task = None
+    balance._cache = None
+    balance._debits = None
+
+def _pool(balances=None, debit_rows=None):
+    """A mock pool: fetchval answers balance lookups, the connection runs debits."""
+    balances = balances or {}
+    pool = MagicMock()
+    pool.fetchval = AsyncMock(side_effect=lambda sql, tenant: balances.get(tenant))
+    conn = MagicMock()
+    conn.execute = AsyncMock()
+    conn.fetch = AsyncMock(return_value=debit_rows or [])
+    tx = MagicMock()
+    tx.__aenter__ = AsyncMock(return_value=None)
+    tx.__aexit__ = AsyncMock(return_value=False)
+    conn.transaction = MagicMock(return_value=tx)
+    acquire = MagicMock()
+    acquire.__aenter__ = AsyncMock(return_value=conn)
+    acquire.__aexit__ = AsyncMock(return_value=False)
+    pool.acquire = MagicMock(return_value=acquire)
+    return pool, conn
+
+@pytest.mark.asyncio
+async def test_authorize_caches_balance():
+    """Test the first request loads the balance and later ones are memory lookups."""
+    pool, _ = _pool({"t-1": Decimal("1.5")})
+    with patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        assert await balance.authorize("t-1") is True
+        assert await balance.authorize("t-1") is True
+    assert pool.fetchval.await_count == 1
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_query():
+    """Test a burst of requests for an uncached tenant issues one lookup."""
+    pool, _ = _pool({"t-1": Decimal("1")})
+    with patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        results = await asyncio.gather(*(balance.authorize("t-1") for _ in range(20)))
+    assert all(results)
+    assert pool.fetchval.await_count == 1
+
+@pytest.mark.asyncio
+async def test_pending_debits_count_against_balance():
+    """Test unflushed debits are subtracted before the balance is checked."""
+    pool, _ = _pool({"t-1": Decimal("0.01")})
+    with patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        assert await balance.authorize("t-1") is True
+        balance.debit("t-1", 0.004)
+        assert balance.available("t-1") == Decimal("0.006")
+        balance.debit("t-1", 0.006)
+        assert await balance.authorize("t-1") is False
+
+@pytest.mark.asyncio
+async def test_unknown_tenants_and_unreachable_db():
+    """Test tenants without a customers row are refused unless allowed; no pool fails open."""
+    pool, _ = _pool({})
+    with patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        assert await balance.authorize("nobody") is False
+        with patch.dict(os.environ, {"BALANCE_ALLOW_UNKNOWN": "1"}):
+            assert await balance.authorize("nobody") is True
+    with patch.object(balance.db, "get_pool", AsyncMock(return_value=None)):
+        assert await balance.authorize("t-2") is True
+
+@pytest.mark.asyncio
+async def test_expired_entry_refreshes_in_background():
+    """Test a stale balance is still used while a refresh runs."""
+    pool, _ = _pool({"t-1": Decimal("5")})
+    with patch.dict(os.environ, {"BALANCE_CACHE_TTL_SECONDS": "0"}), \
+            patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        await balance.authorize("t-1")
+        pool.fetchval.side_effect = lambda sql, tenant: Decimal("0")
+        assert await balance.authorize("t-1") is True
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert await balance.authorize("t-1") is False
+
+@pytest.mark.asyncio
+async def test_invalidate_forces_reload():
+    """Test invalidate() makes the next request read the new balance."""
+    pool, _ = _pool({"t-1": Decimal("0")})
+    with patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        assert await balance.authorize("t-1") is False
+        pool.fetchval.side_effect = lambda sql, tenant: Decimal("10")
+        assert await balance.authorize("t-1") is False
+        balance.invalidate("t-1")
+        assert await balance.authorize("t-1") is True
+
+@pytest.mark.asyncio
+async def test_flush_coalesces_debits_per_tenant():
+    """Test one flush writes one debit per tenant, in tenant order, and carries sub-precision remainders."""
+    pool, conn = _pool(debit_rows=[
+        {"tenant_id": "a", "balance_after": Decimal("9.9997")},
+        {"tenant_id": "b", "balance_after": Decimal("4")},
+    ])
+    with patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        for _ in range(3):
+            balance.debit("b", "0.00011")
+        balance.debit("a", "0.0003")
+        assert await balance.flush() == 2
+
+    assert conn.execute.call_args[0][1] == ["a", "b"]  # row locks in tenant order
+    sql, tenants, amounts, requests = conn.fetch.call_args[0]
+    assert sql == balance._DEBIT_SQL
+    assert tenants == ["a", "b"]
+    assert amounts == [Decimal("0.0003"), Decimal("0.0003")]
+    assert requests == [1, 3]
+    assert balance.available("a") == Decimal("9.9997")
+    assert balance.available("b") == Decimal("3.99997")  # 0.00003 still pending
+
+@pytest.mark.asyncio
+async def test_cancelled_flush_loop_writes_pending_debits():
+    """Test debits waiting for the next interval are written when the loop is cancelled."""
+    pool, conn = _pool()
+    with patch.dict(os.environ, {"BALANCE_FLUSH_MS": "60000"}), \
+            patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        balance.debit("a", "0.5")
+        task = balance._get_debits()._task
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    assert conn.fetch.call_args[0][2] == [Decimal("0.5")]
+    assert balance._get_debits().owed("a") == 0
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_debits(capsys):
+    """Test debits survive a failed write and go out with the next flush."""
+    pool, conn = _pool()
+    conn.fetch.side_effect = [Exception("deadlock"), []]
+    with patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        balance.debit("a", "1")
+        assert await balance.flush() == 0
+        assert balance._get_debits().owed("a") == Decimal("1")
+        balance.debit("a", "1")
+        await balance.flush()
+
+    assert conn.fetch.call_args[0][2] == [Decimal("2")]
+    assert conn.fetch.call_args[0][3] == [2]
+    assert "retrying" in capsys.readouterr().err
+
+@pytest.mark.asyncio
+async def test_log_event_debits_cost():
+    """Test the callback queues the request cost for the tenant."""
+    request_data = {"model": "gpt-4o", "metadata": {"tenant_id": "t-1"}}
+    await balance.log_event(request_data, {"id": "r-1", "response_cost": 0.25}, 1.0, 2.0)
+    await balance.log_event({"model": "gpt-4o"}, {"id": "r-2", "response_cost": 0.25}, 1.0, 2.0)
+
+    assert balance._get_debits().owed("t-1") == Decimal("0.25")
+    assert list(balance._get_debits()._pending) == ["t-1"]
+
+@pytest.mark.asyncio
+async def test_pre_call_hook_rejects_empty_balance():
+    """Test the hook answers 403 when the balance cannot cover the request and tags the tenant."""
+    handler = balance.BalanceHandler()
+    key = SimpleNamespace(user_id="t-1")
+    with patch.object(balance, "reserve", AsyncMock(return_value=7)):
+        data = await handler.async_pre_call_hook(key, None, {"model": "gpt-4o"}, "completion")
+    assert data["metadata"] == {"tenant_id": "t-1", budget.METADATA_KEY: 7}
+
+    with patch.object(balance, "reserve", AsyncMock(return_value=None)):
+        with pytest.raises(balance.HTTPException) as excinfo:
+            await handler.async_pre_call_hook(key, None, {"model": "gpt-4o"}, "completion")
+    assert excinfo.value.status_code == 403
+
+    with patch.object(balance, "reserve", AsyncMock(return_value=budget.UNCHECKED)):
+        data = await handler.async_pre_call_hook(key, None, {"model": "gpt-4o"}, "completion")
+    assert budget.METADATA_KEY not in data["metadata"]
+
+    with patch.object(balance, "reserve", AsyncMock()) as reserve:
+        await handler.async_pre_call_hook(SimpleNamespace(user_id=None), None, {}, "completion")
+    reserve.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_pre_call_hook_ignores_client_tenant():
+    """Test the tenant comes from the key, never from the request's metadata."""
+    handler = balance.BalanceHandler()
+    with patch.object(balance, "reserve", AsyncMock(return_value=budget.UNCHECKED)) as reserve:
+        data = await handler.async_pre_call_hook(
+            SimpleNamespace(user_id="t-1"), None, {"metadata": {"tenant_id": "victim"}}, "completion"
+        )
+        assert reserve.call_args[0][0] == "t-1"
+        assert data["metadata"]["tenant_id"] == "t-1"
+
+        key = SimpleNamespace(user_id=None, metadata={}, team_metadata={"tenant_id": "team-t"})
+        data = await handler.async_pre_call_hook(key, None, {"metadata": {"tenant_id": "victim"}}, "completion")
+        assert reserve.call_args[0][0] == "team-t"
+        assert data["metadata"]["tenant_id"] == "team-t"
+
+        reserve.reset_mock()
+        data = await handler.async_pre_call_hook(
+            SimpleNamespace(user_id=None), None, {"metadata": {"tenant_id": "victim"}}, "completion"
+        )
+    reserve.assert_not_called()
+    assert "tenant_id" not in data["metadata"]
+
+@pytest.mark.asyncio
+async def test_concurrent_reservations_cannot_overspend():
+    """Test a tenant with $0.01 left gets only as many requests as it can pay for."""
+    pool, _ = _pool({"t-1": Decimal("0.01")})
+    with patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        results = await asyncio.gather(*(balance.reserve("t-1", Decimal("0.004")) for _ in range(500)))
+
+    granted = [rid for rid in results if rid is not None]
+    assert len(granted) == 2
+    assert budget.held("t-1") == Decimal("0.008")
+    assert await balance.authorize("t-1") is True
+
+@pytest.mark.asyncio
+async def test_log_event_settles_reservation():
+    """Test the callback swaps the reservation for the actual cost."""
+    pool, _ = _pool({"t-1": Decimal("1")})
+    with patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        rid = await balance.reserve("t-1", Decimal("0.5"))
+    request_data = {"model": "gpt-4o", "metadata": {"tenant_id": "t-1", budget.METADATA_KEY: rid}}
+
+    await balance.log_event(request_data, {"id": "r-1", "response_cost": 0.1}, 1.0, 2.0)
+    await balance.log_event(request_data, {"id": "r-1", "response_cost": 0.1}, 1.0, 2.0)
+
+    assert budget.held("t-1") == 0
+    assert balance.available("t-1") == Decimal("0.8")
+
+def _lease_pool(grants):
+    """A mock pool whose debit/lease statements answer from grants (tenant -> slice)."""
+    pool, conn = _pool()
+
+    async def fetch(sql, tenants, *args):
+        if sql == balance._LEASE_SQL:
+            return [{"tenant_id": t, "granted": grants.get(t)} for t in tenants]
+        return [{"tenant_id": t, "balance_after": Decimal("100")} for t in tenants]
+
+    conn.fetch = AsyncMock(side_effect=fetch)
+    pool.execute = AsyncMock()
+    return pool, conn
+
+@pytest.mark.asyncio
+async def test_leased_slice_limits_spending():
+    """Test with leases on a replica spends only its slice, not the whole balance."""
+    pool, conn = _lease_pool({"t-1": Decimal("0.5")})
+    with patch.dict(os.environ, {"BALANCE_LEASES": "1", "BALANCE_LEASE_MIN_USD": "0.5"}), \
+            patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        results = await asyncio.gather(*(balance.reserve("t-1", Decimal("0.2")) for _ in range(10)))
+
+    assert sum(rid is not None for rid in results) == 2
+    sql, tenants, replica, wants, seconds = conn.fetch.call_args[0]
+    assert sql == balance._LEASE_SQL
+    assert (tenants, replica, wants, seconds) == (["t-1"], balance._REPLICA_ID, [Decimal("0.5")], 30.0)
+    assert conn.fetch.await_count == 1  # one lease for the whole burst; the retry is throttled
+
+@pytest.mark.asyncio
+async def test_exhausted_slice_is_renewed_with_flush():
+    """Test a used-up slice is re-leased in the same transaction as the pending debits."""
+    pool, conn = _lease_pool({"t-1": Decimal("0.5")})
+    env = {"BALANCE_LEASES": "1", "BALANCE_LEASE_MIN_USD": "0.5", "BALANCE_LEASE_RETRY_MS": "0"}
+    with patch.dict(os.environ, env), patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        assert await balance.reserve("t-1", Decimal("0.5")) is not None
+        balance.debit("t-1", "0.5")
+        budget.get_reservations().settle(1)
+        assert await balance.reserve("t-1", Decimal("0.4")) is not None
+
+    debit_call, lease_call = conn.fetch.call_args_list[-2:]
+    assert debit_call[0][0] == balance._DEBIT_SQL
+    assert debit_call[0][2] == [Decimal("0.5")]
+    # Wants cover the request and twice the spend just flushed.
+    assert lease_call[0][3] == [Decimal("1.0")]
+    assert balance.available("t-1") == Decimal("0.5")
+
+@pytest.mark.asyncio
+async def test_missing_lease_table_falls_back(capsys):
+    """Test an unmigrated billing schema switches leases off and still writes debits."""
+    pool, conn = _pool({"t-1": Decimal("3")})
+    missing = balance.asyncpg.exceptions.UndefinedFunctionError("function customer_balance_lease does not exist")
+
+    async def fetch(sql, *args):
+        if sql == balance._LEASE_SQL:
+            raise missing
+        return []
+
+    conn.fetch = AsyncMock(side_effect=fetch)
+    with patch.dict(os.environ, {"BALANCE_LEASES": "1"}), \
+            patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        balance.debit("t-1", "1")
+        await balance.flush()
+        assert balance._leases_disabled is True
+        assert await balance.authorize("t-1") is True
+
+    assert [c[0][0] for c in conn.fetch.call_args_list].count(balance._DEBIT_SQL) == 2
+    assert pool.fetchval.await_count == 1
+    assert "balance leases unavailable" in capsys.readouterr().err
+
+@pytest.mark.asyncio
+async def test_notifications_update_cached_balances():
+    """Test LISTEN payloads refresh cached balances, or expire slices on top-up with leases on."""
+    cache = balance._get_cache()
+    cache.set("t-1", Decimal("0"))
+    payload = '[["t-1", 12.5, "credit"], ["t-9", 1, "credit"]]'
+    balance._on_notify(None, 1, balance._CHANNEL, payload)
+    assert cache.get("t-1").balance == Decimal("12.5")
+    assert cache.get("t-9") is None
+
+    with patch.dict(os.environ, {"BALANCE_LEASES": "1"}):
+        balance._on_notify(None, 1, balance._CHANNEL, '[["t-1", 0, "debit"]]')
+        assert not cache.expired(cache.get("t-1"))
+        balance._on_notify(None, 1, balance._CHANNEL, '[["t-1", 20, "credit"]]')
+        assert cache.expired(cache.get("t-1"))
+        assert cache.get("t-1").balance == Decimal("12.5")
+
+@pytest.mark.asyncio
+async def test_resync_releases_idle_and_renews_busy_slices():
+    """Test expired slices are renewed while in use and released once idle."""
+    pool, conn = _lease_pool({"busy": Decimal("1")})
+    with patch.dict(os.environ, {"BALANCE_LEASES": "1"}), \
+            patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)):
+        cache = balance._get_cache()
+        cache.set("busy", Decimal("1"))
+        cache.set("idle", Decimal("1"))
+        cache.get("busy").expires_at = cache.get("idle").expires_at = 0.0
+        budget.get_reservations().reserve("busy", Decimal("0.1"), Decimal("1"))
+
+        await balance._resync_leases()
+
+    pool.execute.assert_awaited_once_with(balance._RELEASE_SQL, balance._REPLICA_ID, ["idle"])
+    assert cache.get("idle") is None
+    assert conn.fetch.call_args[0][1] == ["busy"]
+    assert not cache.expired(cache.get("busy"))
+
+@pytest.mark.asyncio
+async def test_listener_uses_its_own_connection():
+    """Test the LISTEN loop subscribes on a dedicated connection, not a pooled one, and drops stale cache entries."""
+    pool, _ = _pool()
+    conn = AsyncMock()
+    conn.add_termination_listener = MagicMock()
+    conn.is_closed = MagicMock(return_value=False)
+    balance._get_cache().set("t-1", Decimal("1"))
+    with patch.object(balance.db, "get_pool", AsyncMock(return_value=pool)), \
+         patch.object(balance.db, "connect", AsyncMock(return_value=conn)):
+        task = asyncio.get_running_loop().create_task(balance._listen_loop())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    pool.acquire.assert_not_called()
+    conn.add_listener.assert_awaited_once_with(balance._CHANNEL, balance._on_notify)
+    conn.close.assert_awaited_once()
+    assert balance._get_cache().get("t-1") is None
+
+@pytest.mark.asyncio
+async def test_listener_reconnects_after_connection_loss():
+    """Test a dropped LISTEN connection is closed and replaced by a new one."""
+    first, second = AsyncMock(), AsyncMock()
+    for conn in (first, second):
+        conn.is_closed = MagicMock(return_value=False)
+    first.add_termination_listener = MagicMock(side_effect=lambda callback: callback(first))
+    second.add_termination_listener = MagicMock()
+    with patch.object(balance.db, "connect", AsyncMock(side_effect=[first, second])), \
+         patch.object(balance, "_LISTEN_RETRY_SECONDS", 0):
+        task = asyncio.get_running_loop().create_task(balance._listen_loop())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    first.close.assert_awaited_once()
+    second.add_listener.assert_awaited_once_with(balance._CHANNEL, balance._on_notify)
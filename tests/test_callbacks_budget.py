@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import os
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from callbacks import budget
+
+@pytest.fixture(autouse=True)
+def reset_budget():
+    budget._reservations = None
+    budget._prices.cache_clear()
+    yield
+    budget._reservations = None
+    budget._prices.cache_clear()
+
+def _litellm(model_cost):
+    return patch.dict("sys.modules", {"litellm": SimpleNamespace(model_cost=model_cost)})
+
+def test_estimate_cost_uses_prices_and_max_tokens():
+    """Test the estimate is prompt tokens at input price plus max_tokens at output price."""
+    prices = {"gpt-4o": {"input_cost_per_token": 2.5e-06, "output_cost_per_token": 1e-05}}
+    request = {"model": "openai/gpt-4o", "messages": [{"role": "user", "content": "x"}], "max_tokens": 100}
+    with _litellm(prices), patch.object(budget.streaming, "estimate_prompt_tokens", return_value=400):
+        assert budget.estimate_cost(request) == Decimal("0.002")
+        del request["max_tokens"]
+        with patch.dict(os.environ, {"BUDGET_COMPLETION_TOKENS": "200"}):
+            assert budget.estimate_cost(request) == Decimal("0.003")
+
+def test_estimate_cost_for_unpriced_models():
+    """Test models missing from the price table reserve BUDGET_UNPRICED_RESERVE_USD."""
+    with _litellm({}):
+        assert budget.estimate_cost({"model": "custom"}) == 0
+        with patch.dict(os.environ, {"BUDGET_UNPRICED_RESERVE_USD": "0.05"}):
+            assert budget.estimate_cost({"model": "custom"}) == Decimal("0.05")
+
+def test_reserve_holds_until_settled():
+    """Test reservations reduce what is free and settling is idempotent."""
+    reservations = budget.Reservations(ttl=60)
+    first = reservations.reserve("t-1", Decimal("0.6"), available=Decimal("1"))
+    assert first is not None
+    assert reservations.reserve("t-1", Decimal("0.6"), available=Decimal("1")) is None
+    assert reservations.reserve("t-2", Decimal("0.6"), available=Decimal("1")) is not None
+
+    assert reservations.settle(first) == ("t-1", Decimal("0.6"))
+    assert reservations.settle(first) is None
+    assert reservations.held("t-1") == 0
+
+def test_zero_estimate_needs_positive_balance():
+    """Test an unpriced request still requires something left."""
+    reservations = budget.Reservations(ttl=60)
+    assert reservations.reserve("t-1", Decimal(0), available=Decimal(0)) is None
+    assert reservations.reserve("t-1", Decimal(0), available=Decimal("0.0001")) is not None
+
+def test_expired_reservations_are_released():
+    """Test reservations whose callback never came stop holding the balance."""
+    reservations = budget.Reservations(ttl=30)
+    with patch.object(budget.time, "monotonic", return_value=1000.0):
+        reservations.reserve("t-1", Decimal("1"), available=Decimal("1"))
+    with patch.object(budget.time, "monotonic", return_value=1031.0):
+        assert reservations.reserve("t-1", Decimal("1"), available=Decimal("1")) is not None
+    assert reservations.held("t-1") == Decimal("1")
+
+def test_settle_reads_request_metadata():
+    """Test settle() releases the reservation named in the request metadata."""
+    rid = budget.get_reservations().reserve("t-1", Decimal("1"), available=Decimal("2"))
+    budget.settle({"metadata": {budget.METADATA_KEY: rid}})
+    budget.settle({"metadata": {}})
+    budget.settle(None)
+    assert budget.held("t-1") == 0
@@ -3,10 +3,17 @@ from __future__ import annotations
 import asyncio
 import os
 import ssl
+from datetime import timedelta
+from decimal import Decimal
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import asyncpg
 import pytest
+from callbacks import backpressure
 from callbacks import db
+from callbacks import rollups
+from callbacks import spool as usage_spool
+from callbacks.record import UsageRecord
 
 @pytest.fixture
 def mock_env():
@@ -20,11 +27,40 @@ def mock_env():
         yield
 
 @pytest.fixture
-def cleanup_pool():
-    # Reset the global pool before and after tests
+def cleanup_pool(tmp_path):
+    # Reset the global pool, writer and spool before and after tests
     db._pool = None
+    db._writer = None
+    db._spooler = None
+    db._replay_task = None
+    db._pool_retry_at = 0.0
+    db._pool_max_size = None
+    db._maintenance_task = None
+    db._partition_task = None
+    db._copy_disabled = False
+    # Rollup and dedup writes have their own tests; keep the raw write path simple here.
+    db._rollups_disabled = True
+    db._dedup_disabled = True
+    db._timings_disabled = False
+    db._recent_ids.clear()
+    usage_spool._spool = usage_spool.Spool(str(tmp_path / "spool"))
     yield
     db._pool = None
+    db._writer = None
+    db._spooler = None
+    if db._replay_task is not None and not db._replay_task.get_loop().is_closed():
+        db._replay_task.cancel()
+    db._replay_task = None
+    if db._partition_task is not None and not db._partition_task.get_loop().is_closed():
+        db._partition_task.cancel()
+    db._partition_task = None
+    db._pool_retry_at = 0.0
+    db._copy_disabled = False
+    db._rollups_disabled = False
+    db._dedup_disabled = False
+    db._timings_disabled = False
+    db._recent_ids.clear()
+    usage_spool._spool = None
 
 def test_ssl_context_default():
     """Test that SSL context is created by default (require)."""
@@ -62,6 +98,32 @@ async def test_get_pool_success(mock_env, cleanup_pool):
         assert call_kwargs["user"] == "test_user"
         assert call_kwargs["database"] == "test_db"
 
+@pytest.mark.asyncio
+async def test_get_pool_settings_from_env(mock_env, cleanup_pool):
+    """Test pool sizing and timeouts are read from the environment."""
+    with patch.dict(os.environ, {
+        "PG_POOL_MIN_SIZE": "2",
+        "PG_POOL_MAX_SIZE": "8",
+        "PG_STATEMENT_CACHE_SIZE": "0",
+        "PG_POOL_MAX_IDLE_SECONDS": "60",
+        "PG_COMMAND_TIMEOUT": "2.5",
+    }), patch("asyncpg.create_pool", new_callable=AsyncMock) as mock_create:
+        await db._get_pool()
+
+        call_kwargs = mock_create.call_args[1]
+        assert call_kwargs["min_size"] == 2
+        assert call_kwargs["max_size"] == 8
+        assert call_kwargs["statement_cache_size"] == 0
+        assert call_kwargs["max_inactive_connection_lifetime"] == 60.0
+        assert call_kwargs["command_timeout"] == 2.5
+        assert call_kwargs["timeout"] == 10.0
+
+def test_pool_settings_max_not_below_min(mock_env):
+    """Test a max size below the min size is raised to the min size."""
+    with patch.dict(os.environ, {"PG_POOL_MIN_SIZE": "4", "PG_POOL_MAX_SIZE": "2"}):
+        settings = db._pool_settings()
+        assert settings["max_size"] == 4
+
 @pytest.mark.asyncio
 async def test_get_pool_cached(mock_env, cleanup_pool):
     """Test that _get_pool returns the cached pool."""
@@ -75,6 +137,20 @@ async def test_get_pool_cached(mock_env, cleanup_pool):
         assert pool1 is pool2
         mock_create.assert_called_once()
 
+@pytest.mark.asyncio
+async def test_concurrent_first_use_creates_one_pool(mock_env, cleanup_pool):
+    """Test callbacks racing on a cold worker share one pool under the per-loop lock."""
+    async def slow_pool(**kwargs):
+        await asyncio.sleep(0.01)
+        return AsyncMock()
+
+    with patch("asyncpg.create_pool", side_effect=slow_pool) as mock_create:
+        pools = await asyncio.gather(*(db._get_pool() for _ in range(5)))
+
+    assert all(pool is pools[0] for pool in pools)
+    mock_create.assert_called_once()
+    assert db._pool_lock_loop is asyncio.get_running_loop()
+
 @pytest.mark.asyncio
 async def test_get_pool_failure(mock_env, cleanup_pool):
     """Test _get_pool handles exceptions during pool creation."""
@@ -86,17 +162,19 @@ async def test_get_pool_failure(mock_env, cleanup_pool):
 async def test_insert_success():
     """Test _insert executes the correct SQL."""
     mock_pool = AsyncMock()
-    row = {
-        "tenant_id": "tenant-123",
-        "model": "gpt-4",
-        "prompt_tokens": 10,
-        "completion_tokens": 20,
-        "total_tokens": 30,
-        "latency_ms": 500,
-        "status": "success",
-        "cost_usd": 0.002,
-        "request_id": "req-1",
-    }
+    row = UsageRecord(
+        ts=0.0,
+        tenant_id="tenant-123",
+        model="gpt-4",
+        prompt_tokens=10,
+        completion_tokens=20,
+        total_tokens=30,
+        latency_ms=500,
+        status="success",
+        error=None,
+        cost_usd=0.002,
+        request_id="req-1",
+    )
     
     await db._insert(mock_pool, row)
     
@@ -109,19 +187,86 @@ async def test_insert_success():
 
 @pytest.mark.asyncio
 async def test_log_event_no_pool(mock_env, cleanup_pool):
-    """Test log_event does nothing if pool cannot be created."""
-    with patch("callbacks.db._get_pool", return_value=None), \
-         patch("callbacks.db._insert") as mock_insert:
+    """Test log_event spools the row instead of inserting when the pool is down."""
+    with patch("callbacks.db._get_pool", new_callable=AsyncMock, return_value=None), \
+         patch("callbacks.db._insert") as mock_insert, \
+         patch("callbacks.db._spool_rows", new_callable=AsyncMock) as mock_spool:
         
-        await db.log_event(None, None, 0, 0)
+        await db.log_event(None, {"id": "req-1"}, 0, 0)
+        await db._spooler.close()
         mock_insert.assert_not_called()
+        mock_spool.assert_called_once()
+        assert mock_spool.call_args[0][0][0].request_id == "req-1"
+
+@pytest.mark.asyncio
+async def test_spooled_events_are_bounded(mock_env, cleanup_pool):
+    """Test overflow events share one bounded spool queue and are dropped, counted, once it is full."""
+    backpressure._budget = None
+    with patch.dict(os.environ, {"USAGE_SPOOL_QUEUE_SIZE": "3", "CALLBACK_STATS_INTERVAL_SECONDS": "0"}), \
+         patch("callbacks.db.backpressure.admit", new_callable=AsyncMock, return_value=backpressure.SPOOL), \
+         patch("callbacks.db._spool_rows", new_callable=AsyncMock) as mock_spool:
+        for i in range(5):
+            await db.log_event(None, {"id": f"req-{i}"}, 0, 0)
+        await db._spooler.close()
+
+    mock_spool.assert_called_once()
+    assert [row.request_id for row in mock_spool.call_args[0][0]] == ["req-0", "req-1", "req-2"]
+    assert backpressure.stats()["counters"]["db.spool_dropped"] == 2
+    backpressure._budget = None
+
+@pytest.mark.asyncio
+async def test_dropped_row_is_not_a_duplicate_of_its_retry(mock_env, cleanup_pool):
+    """Test a request whose row was dropped by a full spool queue is written when it is retried."""
+    db._dedup_disabled = False
+    backpressure._budget = None
+    with patch.dict(os.environ, {"USAGE_SPOOL_QUEUE_SIZE": "1", "CALLBACK_STATS_INTERVAL_SECONDS": "0"}), \
+         patch("callbacks.db.backpressure.admit", new_callable=AsyncMock, return_value=backpressure.SPOOL), \
+         patch("callbacks.db._spool_rows", new_callable=AsyncMock) as mock_spool:
+        await db.log_event(None, {"id": "req-0"}, 0, 0)
+        await db.log_event(None, {"id": "req-1"}, 0, 0)  # spool queue full: dropped
+        await db._spooler.close()
+        db._spooler = None
+        await db.log_event(None, {"id": "req-1"}, 0, 1)  # the retry
+        await db.log_event(None, {"id": "req-1"}, 0, 2)  # a real duplicate
+        await db._spooler.close()
+
+    spooled = [row.request_id for call in mock_spool.call_args_list for row in call[0][0]]
+    assert spooled == ["req-0", "req-1"]
+    assert backpressure.stats()["counters"]["db.duplicates"] == 1
+    backpressure._budget = None
+
+@pytest.mark.asyncio
+async def test_spool_failure_forgets_request_ids(cleanup_pool):
+    """Test rows the spool could not keep are forgotten by the recent-id filter."""
+    db._dedup_disabled = False
+    assert not db._seen_recently("req-1")
+    with patch.object(usage_spool, "get_spool", return_value=None):
+        assert await db._spool_rows([_row("req-1")]) is False
+    assert not db._seen_recently("req-1")
+
+@pytest.mark.asyncio
+async def test_log_event_unconfigured_skips_spool(cleanup_pool):
+    """Test nothing is spooled when Postgres is not configured at all."""
+    with patch.dict(os.environ, {}, clear=True), \
+         patch("callbacks.db._spool_rows", new_callable=AsyncMock) as mock_spool:
+        await db.log_event(None, None, 0, 0)
+        mock_spool.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_get_pool_backs_off_after_failure(mock_env, cleanup_pool):
+    """Test a failed connect is not retried by every following event."""
+    with patch("asyncpg.create_pool", side_effect=Exception("Connection failed")) as mock_create:
+        assert await db._get_pool() is None
+        assert await db._get_pool() is None
+        mock_create.assert_called_once()
 
 @pytest.mark.asyncio
 async def test_log_event_success(cleanup_pool):
-    """Test log_event correctly parses data and calls _insert."""
+    """Test log_event correctly parses data and queues the row."""
     mock_pool = AsyncMock()
+    mock_writer = MagicMock()
     with patch("callbacks.db._get_pool", return_value=mock_pool), \
-         patch("callbacks.db._insert", new_callable=AsyncMock) as mock_insert:
+         patch("callbacks.db._get_writer", return_value=mock_writer):
         
         request_data = {
             "model": "gpt-4",
@@ -142,16 +287,14 @@ async def test_log_event_success(cleanup_pool):
         
         await db.log_event(request_data, response_data, start_time, end_time)
         
-        mock_insert.assert_called_once()
-        call_args = mock_insert.call_args
-        pool_arg = call_args[0][0]
-        row_arg = call_args[0][1]
+        mock_writer.submit.assert_called_once()
+        row_arg = mock_writer.submit.call_args[0][0]
         
-        assert pool_arg is mock_pool
-        assert row_arg["tenant_id"] == "tenant-xyz"
-        assert row_arg["model"] == "gpt-4"
-        assert row_arg["latency_ms"] == 500
-        assert row_arg["cost_usd"] == 0.001
+        assert row_arg.tenant_id == "tenant-xyz"
+        assert row_arg.model == "gpt-4"
+        assert row_arg.latency_ms == 500
+        assert row_arg.cost_usd == 0.001
+        assert row_arg.created_at is not None
 
 @pytest.mark.asyncio
 async def test_log_event_exception_handling(cleanup_pool):
@@ -163,3 +306,554 @@ async def test_log_event_exception_handling(cleanup_pool):
         
         # Should not raise exception
         await db.log_event({}, {}, 0, 0)
+        await db.shutdown()
+
+def _row(request_id, **fields):
+    values = dict(
+        ts=1700000000.0, latency_ms=0, model="gpt-4", tenant_id="t", status=None, error=None,
+        request_id=request_id, prompt_tokens=None, completion_tokens=None, total_tokens=None, cost_usd=None,
+    )
+    values.update(fields)
+    return UsageRecord(**values)
+
+@pytest.fixture
+def insert_mode():
+    with patch.dict(os.environ, {"PG_INGEST_MODE": "insert"}):
+        yield
+
+def _copy_pool():
+    """A mock pool whose acquire() works as an async context manager."""
+    conn = AsyncMock()
+    pool = AsyncMock()
+    acquire = MagicMock()
+    acquire.__aenter__ = AsyncMock(return_value=conn)
+    acquire.__aexit__ = AsyncMock(return_value=False)
+    pool.acquire = MagicMock(return_value=acquire)
+    return pool, conn
+
+@pytest.mark.asyncio
+async def test_writer_flushes_full_batch(cleanup_pool, insert_mode):
+    """Test the writer issues one executemany once max_rows rows are queued."""
+    mock_pool = AsyncMock()
+    writer = db._UsageWriter(max_rows=3, flush_interval=10, queue_size=100)
+    with patch("callbacks.db._get_pool", return_value=mock_pool):
+        for i in range(3):
+            assert writer.submit(_row(f"req-{i}"))
+        await asyncio.sleep(0.01)
+
+        mock_pool.executemany.assert_called_once()
+        args = mock_pool.executemany.call_args[0]
+        assert "INSERT INTO litellm_usage" in args[0]
+        assert [r[8] for r in args[1]] == ["req-0", "req-1", "req-2"]
+        await writer.close()
+
+@pytest.mark.asyncio
+async def test_writer_flushes_on_interval(cleanup_pool, insert_mode):
+    """Test a partial batch is written once the flush interval elapses."""
+    mock_pool = AsyncMock()
+    writer = db._UsageWriter(max_rows=100, flush_interval=0.02, queue_size=100)
+    with patch("callbacks.db._get_pool", return_value=mock_pool):
+        writer.submit(_row("req-1"))
+        writer.submit(_row("req-2"))
+        await asyncio.sleep(0.005)
+        mock_pool.executemany.assert_not_called()
+
+        await asyncio.sleep(0.05)
+        mock_pool.executemany.assert_called_once()
+        await writer.close()
+
+@pytest.mark.asyncio
+async def test_writer_close_drains_queue(cleanup_pool, insert_mode):
+    """Test close() writes rows still buffered and rejects new ones."""
+    mock_pool = AsyncMock()
+    writer = db._UsageWriter(max_rows=100, flush_interval=10, queue_size=100)
+    with patch("callbacks.db._get_pool", return_value=mock_pool):
+        writer.submit(_row("req-1"))
+        writer.submit(_row("req-2"))
+        await writer.close()
+
+        mock_pool.executemany.assert_called_once()
+        assert len(mock_pool.executemany.call_args[0][1]) == 2
+        assert writer.submit(_row("req-3")) is False
+
+@pytest.mark.asyncio
+async def test_writer_queue_full_drops(cleanup_pool):
+    """Test submit returns False once the bounded queue is full."""
+    writer = db._UsageWriter(max_rows=10, flush_interval=10, queue_size=1)
+    with patch("callbacks.db._get_pool", return_value=AsyncMock()):
+        assert writer.submit(_row("req-1"))
+        assert writer.submit(_row("req-2")) is False
+        await writer.close()
+
+@pytest.mark.asyncio
+async def test_write_rows_uses_copy(cleanup_pool):
+    """Test multi-row batches are streamed with copy_records_to_table."""
+    pool, conn = _copy_pool()
+    rows = [_row("req-1", cost_usd=0.5, status=200), _row("req-2")]
+
+    await db._write_rows(pool, rows)
+
+    conn.copy_records_to_table.assert_called_once()
+    kwargs = conn.copy_records_to_table.call_args[1]
+    assert conn.copy_records_to_table.call_args[0][0] == "litellm_usage"
+    assert kwargs["columns"] == db._COPY_COLUMNS
+    first = kwargs["records"][0]
+    assert first[0] == rows[0].created_at
+    assert first[7] == 200
+    assert first[8] == Decimal("0.5")
+    pool.executemany.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_write_rows_copy_unsupported_falls_back(cleanup_pool):
+    """Test COPY rejected by the server switches the process to INSERT."""
+    pool, conn = _copy_pool()
+    conn.copy_records_to_table.side_effect = asyncpg.exceptions.FeatureNotSupportedError("no COPY")
+    rows = [_row("req-1"), _row("req-2")]
+
+    await db._write_rows(pool, rows)
+    await db._write_rows(pool, rows)
+
+    conn.copy_records_to_table.assert_called_once()
+    assert pool.executemany.call_count == 2
+    assert db._copy_disabled is True
+
+@pytest.mark.asyncio
+async def test_write_rows_copy_error_retries_insert(cleanup_pool):
+    """Test a transient COPY failure retries the batch but keeps COPY enabled."""
+    pool, conn = _copy_pool()
+    conn.copy_records_to_table.side_effect = Exception("connection reset")
+
+    await db._write_rows(pool, [_row("req-1"), _row("req-2")])
+
+    pool.executemany.assert_called_once()
+    assert db._copy_disabled is False
+
+@pytest.mark.asyncio
+async def test_write_rows_single_row_inserts(cleanup_pool):
+    """Test a batch of one skips COPY and uses a plain INSERT."""
+    pool, conn = _copy_pool()
+
+    await db._write_rows(pool, [_row("req-1", status="success")])
+
+    conn.copy_records_to_table.assert_not_called()
+    args = pool.execute.call_args[0]
+    assert args[7] is None  # non-numeric status is not sent to an INTEGER column
+
+@pytest.mark.asyncio
+async def test_writer_spools_failed_batch(cleanup_pool, insert_mode):
+    """Test a batch whose write fails ends up in the spool, not lost."""
+    mock_pool = AsyncMock()
+    mock_pool.executemany.side_effect = Exception("DB down")
+    writer = db._UsageWriter(max_rows=2, flush_interval=10, queue_size=100)
+    with patch("callbacks.db._get_pool", return_value=mock_pool):
+        writer.submit(_row("req-1"))
+        writer.submit(_row("req-2"))
+        await writer.close()
+
+    spool = usage_spool.get_spool()
+    spool.seal()
+    rows = spool.read_segment(spool.sealed_segments()[0])
+    assert [r["request_id"] for r in rows] == ["req-1", "req-2"]
+
+def _replay_pool(merge_status="INSERT 0 1"):
+    pool, conn = _copy_pool()
+    conn.execute.side_effect = [None, merge_status]
+    tx = MagicMock()
+    tx.__aenter__ = AsyncMock(return_value=None)
+    tx.__aexit__ = AsyncMock(return_value=False)
+    conn.transaction = MagicMock(return_value=tx)
+    return pool, conn
+
+@pytest.mark.asyncio
+async def test_replay_rows_dedupes_request_ids(cleanup_pool):
+    """Test replay stages unique rows and merges them skipping stored ids."""
+    pool, conn = _replay_pool("INSERT 0 2")
+    rows = [_row("req-1"), _row("req-1"), _row("req-2"), _row(None), _row(None)]
+
+    inserted = await db._replay_rows(pool, rows)
+
+    assert inserted == 2
+    records = conn.copy_records_to_table.call_args[1]["records"]
+    assert [r[9] for r in records] == ["req-1", "req-2", None, None]
+    merge_sql = conn.execute.call_args_list[1][0][0]
+    assert "NOT EXISTS" in merge_sql
+
+@pytest.mark.asyncio
+async def test_replay_once_drains_spool(cleanup_pool):
+    """Test replay seals the active segment, writes it and deletes it."""
+    spool = usage_spool.get_spool()
+    spool.append([_row("req-1")])
+    with patch("callbacks.db._get_pool", new_callable=AsyncMock, return_value=AsyncMock()), \
+         patch("callbacks.db._replay_rows", new_callable=AsyncMock, return_value=1) as mock_replay:
+        await db._replay_once()
+
+    mock_replay.assert_called_once()
+    assert not spool.pending()
+
+@pytest.mark.asyncio
+async def test_replay_once_skips_segments_claimed_by_another_worker(cleanup_pool):
+    """Test a worker never reads a segment a sibling worker has claimed."""
+    spool = usage_spool.get_spool()
+    spool.append([_row("req-1")])
+    spool.seal()
+    segment = spool.sealed_segments()[0]
+    real_claim = spool.claim
+
+    def sibling_claims_first(path):
+        claimed = real_claim(path)
+        claimed.rename(path.with_name(f"{path.name}.replaying.1"))
+        return real_claim(path)
+
+    with patch("callbacks.db._get_pool", new_callable=AsyncMock, return_value=AsyncMock()), \
+         patch("callbacks.db._replay_rows", new_callable=AsyncMock, return_value=1) as mock_replay, \
+         patch.object(spool, "claim", side_effect=sibling_claims_first):
+        await db._replay_once()
+
+    mock_replay.assert_not_called()
+    assert segment.with_name(f"{segment.name}.replaying.1").exists()
+
+@pytest.mark.asyncio
+async def test_replay_once_keeps_segment_on_failure(cleanup_pool):
+    """Test a segment stays on disk when its replay fails."""
+    spool = usage_spool.get_spool()
+    spool.append([_row("req-1")])
+    with patch("callbacks.db._get_pool", new_callable=AsyncMock, return_value=AsyncMock()), \
+         patch("callbacks.db._replay_rows", side_effect=Exception("DB down")):
+        with pytest.raises(Exception):
+            await db._replay_once()
+
+    assert len(spool.sealed_segments()) == 1
+
+@pytest.mark.asyncio
+async def test_warmup_pings_min_size_connections(cleanup_pool):
+    """Test warmup runs a round-trip on each of the pool's min connections."""
+    pool, conn = _copy_pool()
+    pool.get_min_size = MagicMock(return_value=3)
+    with patch("callbacks.db._get_pool", new_callable=AsyncMock, return_value=pool):
+        assert await db.warmup() is True
+    assert conn.fetchval.call_count == 3
+
+@pytest.mark.asyncio
+async def test_warmup_without_pool(cleanup_pool):
+    """Test warmup reports failure when the pool can't be opened."""
+    with patch("callbacks.db._get_pool", new_callable=AsyncMock, return_value=None):
+        assert await db.warmup() is False
+
+def test_schedule_warmup_without_loop(mock_env):
+    """Test importing outside the proxy's event loop does not start a warm-up."""
+    with patch("callbacks.db.warmup") as mock_warmup:
+        db._schedule_warmup()
+        mock_warmup.assert_not_called()
+
+def test_pool_sizer_grows_on_sustained_wait():
+    """Test the sizer doubles the pool after consecutive slow probes."""
+    sizer = db._PoolSizer(floor=5, ceiling=16, target_wait=0.02)
+    assert sizer.observe(0.1, 5, 5) is None
+    assert sizer.observe(0.1, 5, 5) is None
+    assert sizer.observe(0.1, 5, 5) == 10
+    for _ in range(db._POOL_GROW_AFTER):
+        new_max = sizer.observe(0.1, 10, 10)
+    assert new_max == 16
+
+def test_pool_sizer_shrinks_when_idle():
+    """Test the sizer halves an idle pool but never below its floor."""
+    sizer = db._PoolSizer(floor=5, ceiling=20, target_wait=0.02)
+    results = [sizer.observe(0.0, 1, 20) for _ in range(db._POOL_SHRINK_AFTER)]
+    assert results[-1] == 10
+    assert all(r is None for r in results[:-1])
+
+    sizer = db._PoolSizer(floor=5, ceiling=20, target_wait=0.02)
+    results = [sizer.observe(0.0, 0, 5) for _ in range(db._POOL_SHRINK_AFTER)]
+    assert all(r is None for r in results)
+
+@pytest.mark.asyncio
+async def test_resize_pool_swaps_and_closes_old(mock_env, cleanup_pool):
+    """Test a resize installs the new pool and closes the previous one."""
+    old_pool = AsyncMock()
+    new_pool = AsyncMock()
+    new_pool.get_max_size = MagicMock(return_value=10)
+    db._pool = old_pool
+    with patch("asyncpg.create_pool", new_callable=AsyncMock, return_value=new_pool) as mock_create:
+        await db._resize_pool(10)
+
+    assert mock_create.call_args[1]["max_size"] == 10
+    assert db._pool is new_pool
+    assert db._pool_max_size == 10
+    old_pool.close.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_partition_maintenance_creates_partitions(cleanup_pool, capsys):
+    """Test the maintenance loop asks Postgres for partitions ahead of time."""
+    pool = AsyncMock()
+    pool.fetchval.return_value = 3
+    db._pool = pool
+    with patch.dict(os.environ, {"PG_PARTITION_AHEAD_DAYS": "14", "PG_PARTITION_GRANULARITY": "Month"}):
+        task = asyncio.create_task(db._partition_maintenance(3600))
+        await asyncio.sleep(0)
+        task.cancel()
+
+    pool.fetchval.assert_awaited_once_with(db._PARTITION_SQL, timedelta(days=14), "month")
+    assert "created 3 litellm_usage partitions" in capsys.readouterr().out
+
+@pytest.mark.asyncio
+async def test_partition_maintenance_stops_without_function(cleanup_pool, capsys):
+    """Test maintenance gives up when the schema has not been partitioned yet."""
+    pool = AsyncMock()
+    pool.fetchval.side_effect = asyncpg.UndefinedFunctionError("missing")
+    db._pool = pool
+
+    await asyncio.wait_for(db._partition_maintenance(3600), 1)
+
+    assert "run scripts/migrate.py" in capsys.readouterr().err
+
+@pytest.mark.asyncio
+async def test_partition_maintenance_disabled(mock_env, cleanup_pool):
+    """Test PG_PARTITION_MAINTENANCE_SECONDS=0 starts no partition task."""
+    with patch.dict(os.environ, {"PG_PARTITION_MAINTENANCE_SECONDS": "0"}):
+        db._start_maintenance()
+    assert db._partition_task is None
+    await db.shutdown()
+
+def _tx_pool():
+    """A mock pool whose connections support (nested) transactions."""
+    pool, conn = _copy_pool()
+    tx = MagicMock()
+    tx.__aenter__ = AsyncMock(return_value=None)
+    tx.__aexit__ = AsyncMock(return_value=False)
+    conn.transaction = MagicMock(return_value=tx)
+    return pool, conn
+
+@pytest.mark.asyncio
+async def test_write_rows_updates_rollups_in_transaction(cleanup_pool):
+    """Test a batch and its rollup update share one connection and transaction."""
+    db._rollups_disabled = False
+    pool, conn = _tx_pool()
+    rows = [_row("req-1", cost_usd=0.5, status=200), _row("req-2", status=200)]
+
+    await db._write_rows(pool, rows)
+
+    conn.copy_records_to_table.assert_called_once()
+    rollup_sql, *args = conn.execute.call_args[0]
+    assert rollup_sql == rollups.APPLY_SQL
+    assert args[0] == (rows[0].created_at.replace(second=0, microsecond=0),)
+    assert args[4] == (2,)  # requests
+    # Outer transaction plus the savepoint around COPY.
+    assert conn.transaction.call_count == 2
+    pool.executemany.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_write_rows_copy_fallback_inside_transaction(cleanup_pool):
+    """Test a failed COPY falls back to INSERT on the same connection."""
+    db._rollups_disabled = False
+    pool, conn = _tx_pool()
+    conn.copy_records_to_table.side_effect = Exception("connection reset")
+
+    await db._write_rows(pool, [_row("req-1"), _row("req-2")])
+
+    conn.executemany.assert_called_once()
+    assert conn.execute.call_args[0][0] == rollups.APPLY_SQL
+
+@pytest.mark.asyncio
+async def test_write_rows_without_rollup_tables(cleanup_pool, capsys):
+    """Test missing rollup tables switch rollups off and the batch still lands."""
+    db._rollups_disabled = False
+    pool, conn = _tx_pool()
+    conn.execute.side_effect = asyncpg.exceptions.UndefinedTableError('relation "usage_rollup_minute" does not exist')
+
+    await db._write_rows(pool, [_row("req-1"), _row("req-2")])
+
+    assert db._rollups_disabled is True
+    assert conn.copy_records_to_table.call_count == 2  # once in the rolled-back transaction
+    assert "usage rollups unavailable" in capsys.readouterr().err
+
+@pytest.mark.asyncio
+async def test_write_rows_other_missing_table_raises(cleanup_pool):
+    """Test a missing litellm_usage is not mistaken for missing rollups."""
+    db._rollups_disabled = False
+    pool, conn = _tx_pool()
+    conn.copy_records_to_table.side_effect = asyncpg.exceptions.UndefinedTableError(
+        'relation "litellm_usage" does not exist'
+    )
+    conn.executemany.side_effect = conn.copy_records_to_table.side_effect
+
+    with pytest.raises(asyncpg.exceptions.UndefinedTableError):
+        await db._write_rows(pool, [_row("req-1"), _row("req-2")])
+    assert db._rollups_disabled is False
+
+@pytest.mark.asyncio
+async def test_replay_rows_rolls_up_inserted_rows(cleanup_pool):
+    """Test replay adds only the rows its merge inserted to the rollups."""
+    db._rollups_disabled = False
+    pool, conn = _replay_pool()
+    conn.execute.side_effect = None
+    inserted = db._copy_record(_row("req-2", status=200))
+    conn.fetch.return_value = [inserted]
+
+    assert await db._replay_rows(pool, [_row("req-1"), _row("req-2")]) == 1
+
+    merge_sql = conn.fetch.call_args[0][0]
+    assert merge_sql.rstrip().endswith("RETURNING " + ", ".join(db._COPY_COLUMNS[:10]))
+    rollup_sql, *args = conn.execute.call_args[0]
+    assert rollup_sql == rollups.APPLY_SQL
+    assert args[3] == (200,)
+
+@pytest.mark.asyncio
+async def test_write_rows_skips_stored_request_ids(cleanup_pool, insert_mode):
+    """Test dedup mode claims ids and inserts in one statement, counting skipped rows."""
+    db._dedup_disabled = False
+    pool, conn = _tx_pool()
+    conn.execute.return_value = "INSERT 0 1"
+    rows = [_row("req-1"), _row("req-1"), _row("req-2")]
+
+    with patch.object(db.backpressure, "record") as record:
+        assert await db._write_rows(pool, rows) == 1
+
+    sql, *columns = conn.execute.call_args[0]
+    assert sql == db._DEDUP_INSERT_SQL
+    assert len(columns) == len(db._COPY_COLUMNS)
+    assert columns[db._COPY_COLUMNS.index("request_id")] == ("req-1", "req-2")
+    conn.copy_records_to_table.assert_not_called()
+    record.assert_called_once_with("db.duplicates", 2)
+
+@pytest.mark.asyncio
+async def test_write_rows_dedup_feeds_rollups_only_new_rows(cleanup_pool):
+    """Test the rows the dedup insert returns are the ones added to the rollups."""
+    db._dedup_disabled = db._rollups_disabled = False
+    pool, conn = _tx_pool()
+    conn.fetch.return_value = [db._copy_record(_row("req-2", status=200))]
+
+    await db._write_rows(pool, [_row("req-1"), _row("req-2", status=200)])
+
+    assert conn.fetch.call_args[0][0] == db._DEDUP_MERGE_SQL + db._RETURNING_ROWS
+    rollup_sql, *args = conn.execute.call_args[0]
+    assert rollup_sql == rollups.APPLY_SQL
+    assert args[4] == (1,)
+
+@pytest.mark.asyncio
+async def test_dedup_write_copies_into_staging_table(cleanup_pool):
+    """Test copy mode stages a multi-row batch with COPY and claims and inserts it from there."""
+    db._dedup_disabled = False
+    pool, conn = _tx_pool()
+    conn.execute.side_effect = [None, "INSERT 0 2"]
+
+    assert await db._write_rows(pool, [_row("req-1"), _row("req-1"), _row("req-2")]) == 2
+
+    assert conn.execute.call_args_list[0][0][0] == db._STAGE_SQL
+    assert conn.execute.call_args_list[1][0] == (db._DEDUP_MERGE_SQL,)
+    table = conn.copy_records_to_table.call_args[0][0]
+    kwargs = conn.copy_records_to_table.call_args[1]
+    assert table == "_usage_stage"
+    assert [record[9] for record in kwargs["records"]] == ["req-1", "req-2"]
+
+@pytest.mark.asyncio
+async def test_dedup_write_without_copy_passes_arrays(cleanup_pool, capsys):
+    """Test a rejected COPY into the staging table falls back to the array insert and turns COPY off."""
+    db._dedup_disabled = False
+    pool, conn = _tx_pool()
+    conn.execute.side_effect = [None, "INSERT 0 2"]
+    conn.copy_records_to_table.side_effect = asyncpg.exceptions.FeatureNotSupportedError("COPY not supported")
+
+    assert await db._write_rows(pool, [_row("req-1"), _row("req-2")]) == 2
+
+    assert conn.execute.call_args[0][0] == db._DEDUP_INSERT_SQL
+    assert db._copy_disabled is True
+    assert "COPY unavailable" in capsys.readouterr().err
+
+@pytest.mark.asyncio
+async def test_write_rows_without_request_id_table(cleanup_pool, capsys):
+    """Test a schema without litellm_usage_request_ids falls back to plain writes."""
+    db._dedup_disabled = False
+    pool, conn = _tx_pool()
+    conn.execute.side_effect = asyncpg.exceptions.UndefinedTableError(
+        'relation "litellm_usage_request_ids" does not exist'
+    )
+
+    assert await db._write_rows(pool, [_row("req-1"), _row("req-2")]) == 2
+
+    assert db._dedup_disabled is True
+    conn.copy_records_to_table.assert_called_once()
+    assert "request id dedup unavailable" in capsys.readouterr().err
+
+@pytest.mark.asyncio
+async def test_replay_rows_with_request_id_table(cleanup_pool):
+    """Test replay relies on the id table instead of staging and anti-joining."""
+    db._dedup_disabled = False
+    pool, conn = _tx_pool()
+    conn.execute.return_value = "INSERT 0 0"
+
+    assert await db._replay_rows(pool, [_row("req-1"), _row("req-1")]) == 0
+
+    conn.execute.assert_called_once()
+    assert conn.execute.call_args[0][0] == db._DEDUP_INSERT_SQL
+
+_NO_QUEUE_MS = asyncpg.exceptions.UndefinedColumnError('column "queue_ms" of relation "litellm_usage" does not exist')
+
+@pytest.mark.asyncio
+async def test_write_rows_without_timing_columns(cleanup_pool, capsys):
+    """Test a litellm_usage without migration 0004 gets the pre-0004 columns instead of spooling."""
+    pool, conn = _copy_pool()
+    conn.copy_records_to_table.side_effect = [_NO_QUEUE_MS, None, None]
+    pool.executemany.side_effect = _NO_QUEUE_MS
+
+    assert await db._write_rows(pool, [_row("req-1"), _row("req-2")]) == 2
+
+    assert db._timings_disabled is True
+    kwargs = conn.copy_records_to_table.call_args[1]
+    assert kwargs["columns"] == db._COPY_COLUMNS[:10]
+    assert all(len(record) == 10 for record in kwargs["records"])
+    assert capsys.readouterr().err.count("timing columns unavailable") == 1
+
+    # Later batches go straight to the pre-0004 columns.
+    await db._write_rows(pool, [_row("req-3"), _row("req-4")])
+    assert conn.copy_records_to_table.call_count == 3
+    assert "queue_ms" not in db._usage_sql(db._INSERT_SQL)
+
+@pytest.mark.asyncio
+async def test_dedup_write_without_timing_columns(cleanup_pool):
+    """Test the dedup insert also falls back to the pre-0004 columns."""
+    db._dedup_disabled = False
+    pool, conn = _tx_pool()
+    conn.execute.side_effect = [_NO_QUEUE_MS, "INSERT 0 1"]
+
+    assert await db._write_rows(pool, [_row("req-1")]) == 1
+
+    sql = conn.execute.call_args[0][0]
+    assert sql == db._UNTIMED_SQL[db._DEDUP_INSERT_SQL]
+    assert "INSERT INTO litellm_usage (" + ", ".join(db._COPY_COLUMNS[:10]) + ")" in sql
+    assert len(conn.execute.call_args[0]) == 1 + len(db._COPY_COLUMNS)  # every array is still passed
+
+@pytest.mark.asyncio
+async def test_other_missing_column_raises(cleanup_pool):
+    """Test an unrelated missing column is not mistaken for missing timings."""
+    pool, conn = _copy_pool()
+    error = asyncpg.exceptions.UndefinedColumnError('column "cost_usd" does not exist')
+    conn.copy_records_to_table.side_effect = error
+    pool.executemany.side_effect = error
+
+    with pytest.raises(asyncpg.exceptions.UndefinedColumnError):
+        await db._write_rows(pool, [_row("req-1"), _row("req-2")])
+    assert db._timings_disabled is False
+
+@pytest.mark.asyncio
+async def test_log_event_drops_recent_duplicates(cleanup_pool):
+    """Test a request_id queued moments ago (e.g. success then failure) is not queued again."""
+    db._dedup_disabled = False
+    mock_writer = MagicMock()
+    with patch("callbacks.db._get_pool", return_value=AsyncMock()), \
+         patch("callbacks.db._get_writer", return_value=mock_writer):
+        await db.log_event({"model": "gpt-4"}, {"id": "req-1", "status": 200}, 0, 1)
+        await db.log_event({"model": "gpt-4"}, {"id": "req-1", "status": 500}, 0, 2)
+        await db.log_event({"model": "gpt-4"}, {"id": "req-2"}, 0, 3)
+
+    assert [c[0][0].request_id for c in mock_writer.submit.call_args_list] == ["req-1", "req-2"]
+
+def test_recent_ids_are_bounded(cleanup_pool):
+    """Test the recent-id filter forgets the oldest ids past PG_DEDUP_CACHE_SIZE."""
+    db._dedup_disabled = False
+    with patch.dict(os.environ, {"PG_DEDUP_CACHE_SIZE": "2"}):
+        assert not db._seen_recently("a")
+        assert not db._seen_recently("b")
+        assert db._seen_recently("a")
+        assert not db._seen_recently("c")  # evicts b, the least recently seen
+        assert not db._seen_recently("b")
+    assert not db._seen_recently(None)
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import json
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+from callbacks import encoders
+from callbacks.logging import RequestLog
+from callbacks.record import UsageRecord
+
+@pytest.fixture(autouse=True)
+def reset_cache():
+    encoders._encoders.clear()
+    yield
+    encoders._encoders.clear()
+
+def _record():
+    return RequestLog(UsageRecord(
+        ts=0.0,
+        latency_ms=120,
+        model="gpt-4o",
+        tenant_id="cust-1",
+        status=200,
+        error=None,
+        request_id="req-1",
+        prompt_tokens=5,
+        completion_tokens=7,
+        total_tokens=12,
+        cost_usd=0.0004,
+    ))
+
+@pytest.mark.parametrize("name", list(encoders.available()))
+def test_backends_agree_on_request_log(name):
+    """Test every installed backend produces the same JSON for a record."""
+    decoded = json.loads(encoders.get_encoder(name).dumps(_record()))
+    assert decoded == _record().as_dict()
+    assert decoded["labels"] == {"tenant_id": "cust-1", "model": "gpt-4o"}
+    assert decoded["timestamp"] == "1970-01-01T00:00:00+00:00"
+
+@pytest.mark.parametrize("name", list(encoders.available()))
+def test_backends_handle_datetime_and_decimal(name):
+    """Test values the stdlib can't encode natively go through the default hook."""
+    payload = {"at": datetime(2025, 1, 1, tzinfo=timezone.utc), "cost": Decimal("1.5")}
+    decoded = json.loads(encoders.get_encoder(name).dumps(payload))
+    assert decoded["at"].startswith("2025-01-01T00:00:00")
+    assert decoded["cost"] == 1.5
+
+def test_stdlib_always_available():
+    """Test the stdlib backend is always present as the last resort."""
+    assert "json" in encoders.available()
+    assert encoders.get_encoder("json").dumps({"a": 1}) == b'{"a": 1}'
+
+def test_env_selects_backend():
+    """Test LOG_JSON_ENCODER pins the backend."""
+    with patch.dict(os.environ, {"LOG_JSON_ENCODER": "json"}):
+        assert encoders.get_encoder().name == "json"
+
+def test_missing_backend_falls_back_to_auto():
+    """Test a backend that isn't installed falls back to the best available."""
+    with patch("callbacks.encoders._build", side_effect=lambda n: None if n == "msgspec" else encoders.Encoder(n, bytes)):
+        assert encoders.get_encoder("msgspec").name == "orjson"
+
+def test_unknown_backend_rejected():
+    """Test unknown backend names raise instead of silently picking one."""
+    with pytest.raises(ValueError):
+        encoders.get_encoder("yaml")
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import sys
+import types
+from unittest.mock import MagicMock, patch
+
+import pytest
+from callbacks import lifecycle
+
+@pytest.fixture(autouse=True)
+def reset_lifecycle():
+    with patch.object(lifecycle, "_hooks", []), patch.object(lifecycle, "_done", False), \
+            patch.object(lifecycle, "_registered", False):
+        yield
+
+@pytest.mark.asyncio
+async def test_run_shutdown_runs_steps_in_order_once(capsys):
+    """Test steps run by order then registration, a failing one doesn't stop the rest, and only once."""
+    ran = []
+
+    def step(name, fail=False):
+        async def hook():
+            ran.append(name)
+            if fail:
+                raise RuntimeError("boom")
+        return hook
+
+    with patch.object(lifecycle, "register"):
+        lifecycle.on_shutdown(step("db"), lifecycle.ORDER_DB)
+        lifecycle.on_shutdown(step("balance", fail=True), lifecycle.ORDER_BALANCE)
+        lifecycle.on_shutdown(step("metrics"), lifecycle.ORDER_METRICS)
+        lifecycle.on_shutdown(step("streams"), lifecycle.ORDER_STREAMS)
+    await lifecycle.run_shutdown()
+    await lifecycle.run_shutdown()
+
+    assert ran == ["streams", "balance", "metrics", "db"]
+    assert "boom" in capsys.readouterr().err
+
+@pytest.mark.asyncio
+async def test_register_wraps_the_proxy_shutdown_event():
+    """Test the LiteLLM proxy's shutdown runs the callbacks first, and is wrapped once."""
+    calls = []
+
+    async def proxy_shutdown_event(worker_heartbeat=None):
+        calls.append(("litellm", worker_heartbeat))
+
+    async def hook():
+        calls.append(("callbacks", None))
+
+    proxy_server = types.ModuleType("litellm.proxy.proxy_server")
+    proxy_server.proxy_shutdown_event = proxy_shutdown_event
+    modules = {
+        "litellm": types.ModuleType("litellm"),
+        "litellm.proxy": types.ModuleType("litellm.proxy"),
+        "litellm.proxy.proxy_server": proxy_server,
+    }
+    modules["litellm.proxy"].proxy_server = proxy_server
+    with patch.dict(sys.modules, modules):
+        lifecycle.on_shutdown(hook)
+        lifecycle._registered = False
+        assert lifecycle.register() is True
+        await proxy_server.proxy_shutdown_event(worker_heartbeat="hb")
+
+    assert proxy_server.proxy_shutdown_event.__wrapped__ is proxy_shutdown_event
+    assert calls == [("callbacks", None), ("litellm", "hb")]
+
+def test_register_adds_a_handler_to_other_apps():
+    """Test a plain FastAPI app gets an ordinary shutdown handler."""
+    app = MagicMock()
+    assert lifecycle.register(app) is True
+    app.add_event_handler.assert_called_once_with("shutdown", lifecycle.run_shutdown)
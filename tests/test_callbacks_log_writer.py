@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import io
+import json
+import time
+from unittest.mock import MagicMock
+
+from callbacks import encoders, log_writer
+
+def _writer(stream, **kwargs):
+    kwargs.setdefault("encode", encoders.get_encoder("json").dumps)
+    return log_writer.LogWriter(stream=lambda: stream, **kwargs)
+
+def test_records_are_coalesced_into_one_write():
+    """Test queued records are written as a single chunk on flush."""
+    stream = MagicMock()
+    writer = _writer(stream, flush_interval=10, buffer_bytes=1 << 20)
+    for i in range(50):
+        assert writer.submit({"n": i})
+    assert writer.flush()
+
+    stream.buffer.write.assert_called_once()
+    lines = stream.buffer.write.call_args[0][0].splitlines()
+    assert [json.loads(line)["n"] for line in lines] == list(range(50))
+    stream.buffer.flush.assert_called_once()
+    writer.close()
+
+def test_buffer_threshold_triggers_write():
+    """Test a full buffer is written without waiting for the interval."""
+    stream = io.StringIO()
+    writer = _writer(stream, flush_interval=10, buffer_bytes=32)
+    writer.submit({"message": "x" * 40})
+
+    deadline = time.monotonic() + 2
+    while not stream.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert json.loads(stream.getvalue())["message"] == "x" * 40
+    writer.close()
+
+def test_interval_triggers_write():
+    """Test a partial buffer is written once the flush interval elapses."""
+    stream = io.StringIO()
+    writer = _writer(stream, flush_interval=0.02, buffer_bytes=1 << 20)
+    writer.submit({"n": 1})
+
+    deadline = time.monotonic() + 2
+    while not stream.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert stream.getvalue() == '{"n": 1}\n'
+    writer.close()
+
+def test_queue_full_drops():
+    """Test submit reports drops once the bounded queue is full."""
+    writer = _writer(io.StringIO(), queue_size=1)
+    writer._ensure_thread = lambda: None  # keep the queue from draining
+    assert writer.submit({"n": 1})
+    assert writer.submit({"n": 2}) is False
+    assert writer.dropped == 1
+
+def test_close_writes_pending_and_rejects_new():
+    """Test close() drains queued records and refuses later ones."""
+    stream = io.StringIO()
+    writer = _writer(stream, flush_interval=10, buffer_bytes=1 << 20)
+    writer.submit({"n": 1})
+    writer.close()
+
+    assert stream.getvalue() == '{"n": 1}\n'
+    assert writer.submit({"n": 2}) is False
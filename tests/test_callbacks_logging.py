@@ -5,52 +5,9 @@ import logging
 from unittest.mock import MagicMock, patch
 
 import pytest
+from callbacks import log_writer
 from callbacks import logging as cb_logging
 
-def test_usage_fields_empty():
-    """Test _usage_fields with None or empty data."""
-    assert cb_logging._usage_fields(None) == {
-        "prompt_tokens": None,
-        "completion_tokens": None,
-        "total_tokens": None,
-    }
-    assert cb_logging._usage_fields({}) == {
-        "prompt_tokens": None,
-        "completion_tokens": None,
-        "total_tokens": None,
-    }
-
-def test_usage_fields_valid():
-    """Test _usage_fields extracts correct values."""
-    response = {
-        "usage": {
-            "prompt_tokens": 10,
-            "completion_tokens": 20,
-            "total_tokens": 30
-        }
-    }
-    expected = {
-        "prompt_tokens": 10,
-        "completion_tokens": 20,
-        "total_tokens": 30,
-    }
-    assert cb_logging._usage_fields(response) == expected
-
-def test_cost_usd_none():
-    """Test _cost_usd returns None when missing."""
-    assert cb_logging._cost_usd(None) is None
-    assert cb_logging._cost_usd({}) is None
-    assert cb_logging._cost_usd({"metadata": {}}) is None
-
-def test_cost_usd_direct():
-    """Test _cost_usd finds 'response_cost'."""
-    assert cb_logging._cost_usd({"response_cost": 1.23}) == 1.23
-
-def test_cost_usd_metadata():
-    """Test _cost_usd finds cost in metadata."""
-    data = {"metadata": {"response_cost": 4.56}}
-    assert cb_logging._cost_usd(data) == 4.56
-
 @pytest.mark.asyncio
 async def test_log_event_output(capsys):
     """Test log_event prints correct JSON to stdout."""
@@ -72,6 +29,7 @@ async def test_log_event_output(capsys):
     end_time = 1000.1 # 100ms
     
     await cb_logging.log_event(request_data, response_data, start_time, end_time)
+    assert log_writer.flush()
     
     captured = capsys.readouterr()
     output = captured.out.strip()
@@ -89,3 +47,26 @@ async def test_log_event_output(capsys):
     assert log_entry["cost_usd"] == 0.0002
     assert log_entry["total_tokens"] == 10
     assert log_entry["labels"]["tenant_id"] == "cust-1"
+    assert log_entry["upstream_ms"] is None
+    assert log_entry["callback_ms"] >= 0
+
+@pytest.mark.asyncio
+async def test_log_sampling_keeps_failures(capsys):
+    """Test LOG_SAMPLE_RATE=0 drops successful request logs but keeps failures."""
+    request_data = {"model": "gpt-4o", "metadata": {"tenant_id": "cust-1"}}
+    with patch.dict("os.environ", {"LOG_SAMPLE_RATE": "0"}), \
+            patch("callbacks.logging.backpressure.record") as record:
+        await cb_logging.log_event(request_data, {"id": "ok-1", "status": 200}, 0.0, 0.1)
+        await cb_logging.log_event(request_data, {"id": "bad-1", "status": 500}, 0.0, 0.1)
+        await cb_logging.log_event(request_data, {"id": "bad-2", "error": "timeout"}, 0.0, 0.1)
+    assert log_writer.flush()
+
+    logged = [json.loads(line)["request_id"] for line in capsys.readouterr().out.splitlines()]
+    assert logged == ["bad-1", "bad-2"]
+    record.assert_called_once_with("logging.sampled_out")
+
+def test_sample_rate_invalid(capsys):
+    """Test an unparsable LOG_SAMPLE_RATE logs everything."""
+    with patch.dict("os.environ", {"LOG_SAMPLE_RATE": "lots"}):
+        assert cb_logging._sample_rate() == 1.0
+    assert "invalid LOG_SAMPLE_RATE" in capsys.readouterr().err
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+from callbacks import metrics
+from callbacks import record
+from callbacks.record import UsageRecord
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics._registry = None
+    record._cache.clear()
+    with patch.dict(os.environ, {"METRICS_PROMETHEUS_PORT": "0"}):
+        yield
+    metrics._registry = None
+    metrics._server, metrics._server_started = None, False
+    metrics._export_task, metrics._export_configured = None, False
+
+def _record(tenant="t-1", model="gpt-4o", status=200, latency_ms=120, **fields):
+    values = dict(
+        ts=1700000000.0, latency_ms=latency_ms, model=model, tenant_id=tenant, status=status, error=None,
+        request_id=None, prompt_tokens=10, completion_tokens=5, total_tokens=15, cost_usd=0.25,
+    )
+    values.update(fields)
+    return UsageRecord(**values)
+
+def test_observe_aggregates_per_label_set():
+    """Test counters accumulate per (tenant, model, status)."""
+    registry = metrics.MetricsRegistry()
+    registry.observe(_record())
+    registry.observe(_record(latency_ms=3000))
+    registry.observe(_record(status=500))
+
+    series = dict(registry.snapshot())
+    ok = series[("t-1", "gpt-4o", "200")]
+    assert ok["requests"] == 2
+    assert ok["prompt_tokens"] == 20
+    assert ok["cost_usd"] == 0.5
+    assert ok["latency_sum"] == 3120
+    assert ok["latency_buckets"][metrics.LATENCY_BUCKETS_MS.index(250)] == 1
+    assert ok["latency_buckets"][metrics.LATENCY_BUCKETS_MS.index(5000)] == 1
+    assert series[("t-1", "gpt-4o", "500")]["requests"] == 1
+
+def test_status_label():
+    """Test non-numeric statuses collapse to ok/error."""
+    assert metrics._status_label(_record(status="429")) == "429"
+    assert metrics._status_label(_record(status="success")) == "ok"
+    assert metrics._status_label(_record(status=None, error="boom")) == "error"
+
+def test_series_cap_folds_new_tenants():
+    """Test tenants beyond METRICS_MAX_SERIES share one overflow series."""
+    registry = metrics.MetricsRegistry(max_series=1)
+    registry.observe(_record(tenant="a"))
+    registry.observe(_record(tenant="b"))
+    registry.observe(_record(tenant="c"))
+    registry.observe(_record(tenant="a"))
+
+    series = dict(registry.snapshot())
+    assert series[("a", "gpt-4o", "200")]["requests"] == 2
+    assert series[("__other__", "gpt-4o", "200")]["requests"] == 2
+
+def test_render_prometheus():
+    """Test the exposition text has counters, cumulative buckets and escaped labels."""
+    registry = metrics.MetricsRegistry()
+    registry.observe(_record(tenant='we"ird', latency_ms=30))
+    registry.observe(_record(tenant='we"ird', latency_ms=700))
+    text = metrics.render_prometheus(registry.snapshot())
+
+    labels = 'tenant_id="we\\"ird",model="gpt-4o",status="200"'
+    assert "# TYPE litellm_requests_total counter" in text
+    assert f"litellm_requests_total{{{labels}}} 2" in text
+    assert f'litellm_tokens_total{{{labels},type="completion"}} 10' in text
+    assert f"litellm_cost_usd_total{{{labels}}} 0.5" in text
+    assert f'litellm_request_latency_ms_bucket{{{labels},le="25"}} 0' in text
+    assert f'litellm_request_latency_ms_bucket{{{labels},le="50"}} 1' in text
+    assert f'litellm_request_latency_ms_bucket{{{labels},le="1000"}} 2' in text
+    assert f'litellm_request_latency_ms_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f"litellm_request_latency_ms_count{{{labels}}} 2" in text
+
+def test_phase_histograms():
+    """Test each timing phase is a per-model histogram and missing phases are skipped."""
+    registry = metrics.MetricsRegistry()
+    registry.observe(_record(queue_ms=1, overhead_ms=4, upstream_ms=300))
+    registry.observe(_record(queue_ms=2, overhead_ms=6, upstream_ms=900))
+    phases = dict(registry.phase_snapshot())
+    assert sorted(phase for _, phase in phases) == ["overhead", "queue", "upstream"]
+    overhead = phases[("gpt-4o", "overhead")]
+    assert overhead["count"] == 2
+    assert overhead["sum"] == 10
+    assert overhead["buckets"][metrics.PHASE_BUCKETS_MS.index(5)] == 1
+
+    text = metrics.render_prometheus(registry.snapshot(), registry.phase_snapshot())
+    assert "# TYPE litellm_request_phase_ms histogram" in text
+    assert 'litellm_request_phase_ms_bucket{model="gpt-4o",phase="overhead",le="5"} 1' in text
+    assert 'litellm_request_phase_ms_bucket{model="gpt-4o",phase="overhead",le="7.5"} 2' in text
+    assert 'litellm_request_phase_ms_count{model="gpt-4o",phase="queue"} 2' in text
+
+    series = metrics.cloud_time_series([], "proj", 0.0, 1.0, registry.phase_snapshot())
+    assert {ts["metric"]["type"].rsplit("/", 1)[1] for ts in series} == {"request_phase_ms"}
+    assert {ts["metric"]["labels"]["phase"] for ts in series} == {"queue", "overhead", "upstream"}
+
+@pytest.mark.asyncio
+async def test_collect_sums_other_workers_snapshots(tmp_path):
+    """Test worker 0 reports its live counters plus the files other workers wrote."""
+    other = metrics.MetricsRegistry()
+    other.start_time = 50.0
+    other.observe(_record(latency_ms=30, overhead_ms=2))
+    other.observe(_record(tenant="t-2"))
+    (tmp_path / "999999.json").write_text(json.dumps(other.export()))
+    (tmp_path / "broken.json").write_text("{")
+    metrics.get_registry().observe(_record(latency_ms=700, overhead_ms=4))
+
+    with patch.dict(os.environ, {"METRICS_MULTIPROC_DIR": str(tmp_path)}):
+        snapshot, phases, start_time = await metrics.collect()
+
+    series = dict(snapshot)
+    assert series[("t-1", "gpt-4o", "200")]["requests"] == 2
+    assert series[("t-1", "gpt-4o", "200")]["latency_buckets"][metrics.LATENCY_BUCKETS_MS.index(50)] == 1
+    assert series[("t-2", "gpt-4o", "200")]["requests"] == 1
+    assert dict(phases)[("gpt-4o", "overhead")]["sum"] == 6
+    assert start_time == 50.0
+
+@pytest.mark.asyncio
+async def test_workers_write_snapshots_and_only_worker_zero_exports(tmp_path):
+    """Test every worker writes its file while the exporters start on worker 0 only."""
+    env = {"METRICS_MULTIPROC_DIR": str(tmp_path), "METRICS_MULTIPROC_WRITE_SECONDS": "0.1",
+           "PROXY_WORKER_ID": "2", "METRICS_PROMETHEUS_PORT": "9464"}
+    with patch.dict(os.environ, env), patch.object(metrics, "start_server") as start_server:
+        await metrics.log_event({"model": "gpt-4o"}, {"status": 200}, 1.0, 1.1)
+        await asyncio.sleep(0.25)
+        start_server.assert_not_called()
+        await metrics.shutdown()
+
+    written = json.loads((tmp_path / f"{os.getpid()}.json").read_text())
+    assert [values["requests"] for _, values in written["series"]] == [1]
+
+@pytest.mark.asyncio
+async def test_log_event_feeds_registry():
+    """Test the callback records the shared UsageRecord."""
+    request_data = {"model": "gpt-4o", "metadata": {"tenant_id": "t-9"}}
+    response_data = {"id": "req-1", "status": 200, "usage": {"prompt_tokens": 3, "completion_tokens": 4}}
+    await metrics.log_event(request_data, response_data, 1.0, 1.5)
+
+    series = dict(metrics.get_registry().snapshot())
+    assert series[("t-9", "gpt-4o", "200")]["completion_tokens"] == 4
+
+@pytest.mark.asyncio
+async def test_prometheus_endpoint():
+    """Test /metrics serves the registry and other paths 404."""
+    metrics.get_registry().observe(_record())
+    server = await metrics.start_server("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    try:
+        body = await get("/metrics")
+        assert body.startswith("HTTP/1.1 200 OK")
+        assert "text/plain; version=0.0.4" in body
+        assert 'litellm_requests_total{tenant_id="t-1",model="gpt-4o",status="200"} 1' in body
+        assert (await get("/other")).startswith("HTTP/1.1 404")
+    finally:
+        server.close()
+        await server.wait_closed()
+
+def test_cloud_time_series():
+    """Test Cloud Monitoring series carry labels, kinds and the histogram."""
+    registry = metrics.MetricsRegistry()
+    registry.observe(_record(latency_ms=80))
+    series = metrics.cloud_time_series(registry.snapshot(), "proj", 100.0, 160.5)
+
+    by_type = {}
+    for ts in series:
+        by_type.setdefault(ts["metric"]["type"].rsplit("/", 1)[1], []).append(ts)
+    assert sorted(by_type) == ["cost_usd", "request_latency_ms", "requests", "tokens"]
+    assert len(by_type["tokens"]) == 2
+
+    requests = by_type["requests"][0]
+    assert requests["metric"]["labels"] == {"tenant_id": "t-1", "model": "gpt-4o", "status": "200"}
+    assert requests["metric_kind"] == "CUMULATIVE"
+    assert requests["resource"]["labels"]["project_id"] == "proj"
+    point = requests["points"][0]
+    assert point["interval"]["start_time"] == {"seconds": 100, "nanos": 0}
+    assert point["interval"]["end_time"] == {"seconds": 160, "nanos": 500000000}
+    assert point["value"] == {"int64_value": 1}
+
+    latency = by_type["request_latency_ms"][0]["points"][0]["value"]["distribution_value"]
+    assert latency["count"] == 1
+    assert latency["mean"] == 80
+    assert latency["bucket_counts"][metrics.LATENCY_BUCKETS_MS.index(100)] == 1
+
+@pytest.mark.asyncio
+async def test_export_cloud_once_batches_writes():
+    """Test the export writes at most 200 series per create_time_series call."""
+    registry = metrics.get_registry()
+    for i in range(50):
+        registry.observe(_record(tenant=f"t-{i}"))
+    client = MagicMock()
+
+    written = await metrics.export_cloud_once(client, "proj")
+
+    assert written == 250
+    calls = client.create_time_series.call_args_list
+    assert [len(call.kwargs["time_series"]) for call in calls] == [200, 50]
+    assert calls[0].kwargs["name"] == "projects/proj"
+
+@pytest.mark.asyncio
+async def test_cloud_export_needs_project(capsys):
+    """Test export is skipped with a warning when no project is configured."""
+    env = {"METRICS_CLOUD_MONITORING": "1", "METRICS_GCP_PROJECT": "", "GOOGLE_CLOUD_PROJECT": ""}
+    with patch.dict(os.environ, env), patch.object(metrics, "_cloud_client") as client:
+        await metrics._ensure_exporters()
+        await metrics._ensure_exporters()
+
+    client.assert_not_called()
+    assert metrics._export_task is None
+    assert capsys.readouterr().err.count("METRICS_GCP_PROJECT is not set") == 1
+
+@pytest.mark.asyncio
+async def test_cloud_export_loop_started():
+    """Test the export loop starts once and shutdown stops it."""
+    env = {"METRICS_CLOUD_MONITORING": "1", "METRICS_GCP_PROJECT": "proj"}
+    with patch.dict(os.environ, env), patch.object(metrics, "_cloud_client", return_value=MagicMock()):
+        await metrics._ensure_exporters()
+        task = metrics._export_task
+        await metrics._ensure_exporters()
+        assert metrics._export_task is task
+
+    await metrics.shutdown()
+    assert task.cancelled()
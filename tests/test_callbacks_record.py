@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from callbacks import record
+from callbacks.record import UsageRecord
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    record._cache.clear()
+    yield
+    record._cache.clear()
+
+def test_usage_fields_empty():
+    """Test _usage_fields with None or empty data."""
+    assert record._usage_fields(None) == {
+        "prompt_tokens": None,
+        "completion_tokens": None,
+        "total_tokens": None,
+    }
+    assert record._usage_fields({}) == {
+        "prompt_tokens": None,
+        "completion_tokens": None,
+        "total_tokens": None,
+    }
+
+def test_usage_fields_valid():
+    """Test _usage_fields extracts correct values."""
+    response = {
+        "usage": {
+            "prompt_tokens": 10,
+            "completion_tokens": 20,
+            "total_tokens": 30
+        }
+    }
+    expected = {
+        "prompt_tokens": 10,
+        "completion_tokens": 20,
+        "total_tokens": 30,
+    }
+    assert record._usage_fields(response) == expected
+
+def test_cost_usd_none():
+    """Test _cost_usd returns None when missing."""
+    assert record._cost_usd(None) is None
+    assert record._cost_usd({}) is None
+    assert record._cost_usd({"metadata": {}}) is None
+
+def test_cost_usd_direct():
+    """Test _cost_usd finds 'response_cost'."""
+    assert record._cost_usd({"response_cost": 1.23}) == 1.23
+
+def test_cost_usd_metadata():
+    """Test _cost_usd finds cost in metadata."""
+    data = {"metadata": {"response_cost": 4.56}}
+    assert record._cost_usd(data) == 4.56
+
+REQUEST = {"model": "gpt-4", "metadata": {"tenant_id": "t-1"}}
+
+def _response(request_id="req-1"):
+    return {
+        "id": request_id,
+        "status": 200,
+        "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3},
+        "response_cost": 0.01,
+    }
+
+def test_extract_builds_record():
+    """Test extract fills every field from the callback arguments."""
+    rec = record.extract(REQUEST, _response(), 1.0, 1.25)
+    assert rec.model == "gpt-4"
+    assert rec.tenant_id == "t-1"
+    assert rec.status == 200
+    assert rec.request_id == "req-1"
+    assert rec.total_tokens == 3
+    assert rec.cost_usd == 0.01
+    assert rec.latency_ms == 250
+
+def test_extract_latency_from_datetimes():
+    """Test latency is computed from datetime start/end times."""
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rec = record.extract(REQUEST, None, start, start + timedelta(milliseconds=40))
+    assert rec.latency_ms == 40
+    assert rec.request_id is None
+
+def test_extract_timing_breakdown():
+    """Test the phase timings come from LiteLLM's logging kwargs and the proxy queue time."""
+    start = datetime.now() - timedelta(milliseconds=400)
+    request = dict(
+        REQUEST,
+        stream=True,
+        litellm_params={"metadata": {"queue_time_seconds": 0.003}},
+        api_call_start_time=start + timedelta(milliseconds=2),
+        completion_start_time=start + timedelta(milliseconds=150),
+        llm_api_duration_ms=395.0,
+    )
+    rec = record.extract(request, _response(), start, start + timedelta(milliseconds=400))
+    assert (rec.queue_ms, rec.pre_call_ms, rec.ttft_ms, rec.upstream_ms) == (3, 2, 150, 395)
+    assert rec.overhead_ms == 3 + 5
+    assert 0 <= rec.callback_ms < 1000
+
+def test_extract_timing_fallbacks(monkeypatch):
+    """Test upstream time falls back to the API call span and non-streams get no TTFT."""
+    monkeypatch.setattr(record.time, "time", lambda: 1.257)
+    request = dict(REQUEST, api_call_start_time=1.01, completion_start_time=1.25)
+    rec = record.extract(request, _response(), 1.0, 1.25)
+    assert rec.upstream_ms == 240
+    assert rec.overhead_ms == 10
+    assert rec.callback_ms == 7
+    assert rec.ttft_ms is None
+    assert rec.queue_ms is None
+    bare = record.extract(REQUEST, _response("req-2"), 1.0, 1.25)
+    assert (bare.pre_call_ms, bare.upstream_ms, bare.overhead_ms) == (None, None, None)
+
+def test_extract_reuses_record_for_same_event():
+    """Test a second sink seeing the same event gets the cached record."""
+    response = _response()
+    first = record.extract(REQUEST, response, 1.0, 2.0)
+    assert record.extract(REQUEST, response, 1.0, 2.0) is first
+
+def test_extract_misses_for_different_event():
+    """Test a reused request id with a new response or end time is re-parsed."""
+    response = _response()
+    first = record.extract(REQUEST, response, 1.0, 2.0)
+    assert record.extract(REQUEST, _response(), 1.0, 2.0) is not first
+    assert record.extract(REQUEST, response, 1.0, 3.0) is not first
+
+def test_extract_without_id_is_not_cached():
+    """Test events without a request id never touch the cache."""
+    record.extract(REQUEST, {"usage": {}}, 1.0, 2.0)
+    assert not record._cache
+
+def test_extract_cache_is_bounded(monkeypatch):
+    """Test the oldest entry is evicted once the cache is full."""
+    monkeypatch.setattr(record, "_CACHE_SIZE", 2)
+    responses = [_response(f"req-{i}") for i in range(3)]
+    for response in responses:
+        record.extract(REQUEST, response, 1.0, 2.0)
+    assert list(record._cache) == ["req-1", "req-2"]
+
+def test_from_dict_round_trip():
+    """Test a record survives as_dict/from_dict, as spooled rows do."""
+    rec = record.extract(REQUEST, _response(), 1.0, 2.0)
+    assert UsageRecord.from_dict(rec.as_dict()) == rec
+
+def test_from_dict_uses_created_at_without_ts():
+    """Test rows spooled before records carried ts fall back to created_at."""
+    created_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rec = UsageRecord.from_dict({"request_id": "r", "created_at": created_at.isoformat()})
+    assert rec.created_at == created_at
+    assert rec.latency_ms == 0
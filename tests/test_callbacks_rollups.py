@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from callbacks import rollups
+
+UTC = timezone.utc
+
+def _ts(*args):
+    return datetime(*args, tzinfo=UTC)
+
+def _raw(created_at, tenant="t-1", model="gpt-4o", status=200, cost=Decimal("0.5"), latency=100):
+    return (created_at, tenant, model, 10, 5, 15, latency, status, cost, "req")
+
+def test_aggregate_sums_per_minute_key():
+    """Test raw rows collapse to one set of sums per (minute, tenant, model, status)."""
+    columns = rollups.aggregate([
+        _raw(_ts(2024, 5, 1, 12, 0, 5)),
+        _raw(_ts(2024, 5, 1, 12, 0, 55), latency=300),
+        _raw(_ts(2024, 5, 1, 12, 1, 0)),
+        _raw(_ts(2024, 5, 1, 12, 0, 10), tenant=None, model=None, status=None, cost=None, latency=None),
+    ])
+
+    rows = sorted(zip(*columns), key=lambda row: (row[0], row[1]))
+    assert len(columns) == 10
+    assert rows[0] == (_ts(2024, 5, 1, 12, 0), "", "", 0, 1, 10, 5, 15, Decimal(0), 0)
+    assert rows[1] == (_ts(2024, 5, 1, 12, 0), "t-1", "gpt-4o", 200, 2, 20, 10, 30, Decimal("1.0"), 400)
+    assert rows[2][0] == _ts(2024, 5, 1, 12, 1)
+    assert rows[2][4] == 1
+
+@pytest.mark.asyncio
+async def test_apply_skips_empty_batches():
+    """Test apply issues one statement per batch and none for an empty one."""
+    conn = MagicMock()
+    conn.execute = AsyncMock()
+    await rollups.apply(conn, [])
+    conn.execute.assert_not_called()
+
+    await rollups.apply(conn, [_raw(_ts(2024, 5, 1, 12, 0, 5))])
+    assert conn.execute.call_args[0][0] == rollups.APPLY_SQL
+    assert len(conn.execute.call_args[0]) == 11
+
+def test_plan_uses_coarsest_level_that_fits():
+    """Test a range splits into raw edges, minutes, hours and whole days."""
+    pieces = rollups.plan(_ts(2024, 5, 1, 22, 58, 30), _ts(2024, 5, 3, 1, 2, 0, 500))
+
+    assert pieces == [
+        ("raw", _ts(2024, 5, 1, 22, 58, 30), _ts(2024, 5, 1, 22, 59)),
+        ("minute", _ts(2024, 5, 1, 22, 59), _ts(2024, 5, 1, 23, 0)),
+        ("hour", _ts(2024, 5, 1, 23), _ts(2024, 5, 2)),
+        ("day", _ts(2024, 5, 2), _ts(2024, 5, 3)),
+        ("hour", _ts(2024, 5, 3), _ts(2024, 5, 3, 1)),
+        ("minute", _ts(2024, 5, 3, 1), _ts(2024, 5, 3, 1, 2)),
+        ("raw", _ts(2024, 5, 3, 1, 2), _ts(2024, 5, 3, 1, 2, 0, 500)),
+    ]
+
+def test_plan_never_uses_levels_coarser_than_bucket():
+    """Test hourly buckets are not answered from day rows."""
+    pieces = rollups.plan(_ts(2024, 5, 1), _ts(2024, 5, 3), bucket="hour")
+    assert pieces == [("hour", _ts(2024, 5, 1), _ts(2024, 5, 3))]
+
+def test_plan_normalises_timezones():
+    """Test non-UTC bounds are aligned to UTC boundaries."""
+    plus2 = timezone(timedelta(hours=2))
+    pieces = rollups.plan(datetime(2024, 5, 1, 2, tzinfo=plus2), datetime(2024, 5, 2, 2, tzinfo=plus2))
+    assert pieces == [("day", _ts(2024, 5, 1), _ts(2024, 5, 2))]
+
+def test_summary_sql_numbers_arguments():
+    """Test each piece gets its own bounds and the tenant filter uses $2."""
+    pieces = [("raw", _ts(2024, 5, 1, 0, 0, 30), _ts(2024, 5, 1, 0, 1)), ("minute", _ts(2024, 5, 1, 0, 1), _ts(2024, 5, 1, 1))]
+    sql, args = rollups.summary_sql(pieces, "hour", tenant_id="t-1")
+
+    assert args == ["hour", "t-1", *pieces[0][1:], *pieces[1][1:]]
+    assert "FROM litellm_usage WHERE created_at >= $3 AND created_at < $4 AND tenant_id = $2" in sql
+    assert "FROM usage_rollup_minute WHERE bucket_start >= $5 AND bucket_start < $6 AND tenant_id = $2" in sql
+    assert sql.count(" UNION ALL ") == 1
+
+    sql, args = rollups.summary_sql(pieces[1:], "hour")
+    assert args == ["hour", *pieces[1][1:]]
+    assert "tenant_id = $" not in sql
+
+def _pool(covered_from):
+    pool = MagicMock()
+    pool.fetchval = AsyncMock(return_value=covered_from)
+    pool.fetch = AsyncMock(return_value=[{"bucket": _ts(2024, 5, 1), "requests": 3}])
+    return pool
+
+@pytest.mark.asyncio
+async def test_usage_summary_reads_raw_before_backfill():
+    """Test history before covered_from (or all of it, when unset) comes from raw rows."""
+    pool = _pool(None)
+    rows = await rollups.usage_summary(pool, _ts(2024, 5, 1), _ts(2024, 5, 3))
+
+    assert rows == [{"bucket": _ts(2024, 5, 1), "requests": 3}]
+    sql = pool.fetch.call_args[0][0]
+    assert "FROM litellm_usage" in sql
+    assert "usage_rollup_" not in sql
+
+    pool = _pool(_ts(2024, 5, 2))
+    await rollups.usage_summary(pool, _ts(2024, 5, 1), _ts(2024, 5, 3))
+    sql, *args = pool.fetch.call_args[0]
+    assert "FROM litellm_usage" in sql
+    assert "FROM usage_rollup_day" in sql
+    assert args == ["day", _ts(2024, 5, 1), _ts(2024, 5, 2), _ts(2024, 5, 2), _ts(2024, 5, 3)]
+
+@pytest.mark.asyncio
+async def test_usage_summary_validates_arguments():
+    """Test bad buckets and naive datetimes are rejected; empty ranges skip the query."""
+    pool = _pool(None)
+    with pytest.raises(ValueError):
+        await rollups.usage_summary(pool, _ts(2024, 5, 1), _ts(2024, 5, 2), bucket="week")
+    with pytest.raises(ValueError):
+        await rollups.usage_summary(pool, datetime(2024, 5, 1), _ts(2024, 5, 2))
+    assert await rollups.usage_summary(pool, _ts(2024, 5, 2), _ts(2024, 5, 1)) == []
+    pool.fetch.assert_not_called()
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+from callbacks import spool as usage_spool
+
+@pytest.fixture
+def reset_spool():
+    usage_spool._spool = None
+    yield
+    usage_spool._spool = None
+
+def test_append_and_read_roundtrip(tmp_path):
+    """Test rows survive a write/seal/read cycle with types restored."""
+    spool = usage_spool.Spool(str(tmp_path))
+    created = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    spool.append([
+        {"request_id": "req-1", "created_at": created, "cost_usd": Decimal("0.25")},
+        {"request_id": "req-2", "created_at": created},
+    ])
+
+    assert spool.sealed_segments() == []
+    assert spool.has_active_rows()
+    spool.seal()
+
+    segments = spool.sealed_segments()
+    assert len(segments) == 1
+    rows = spool.read_segment(segments[0])
+    assert [r["request_id"] for r in rows] == ["req-1", "req-2"]
+    assert rows[0]["created_at"] == created
+    assert rows[0]["cost_usd"] == "0.25"
+
+def test_segment_rotates_at_size(tmp_path):
+    """Test a segment is sealed once it reaches segment_bytes."""
+    spool = usage_spool.Spool(str(tmp_path), segment_bytes=10, fsync="never")
+    spool.append([{"request_id": "req-1"}])
+    spool.append([{"request_id": "req-2"}])
+
+    assert len(spool.sealed_segments()) == 2
+    assert not spool.has_active_rows()
+
+def test_torn_line_is_skipped(tmp_path):
+    """Test a partially written last line does not block replay."""
+    spool = usage_spool.Spool(str(tmp_path), fsync="always")
+    spool.append([{"request_id": "req-1"}])
+    spool.seal()
+    segment = spool.sealed_segments()[0]
+    with open(segment, "a", encoding="utf-8") as handle:
+        handle.write('{"request_id": "req-')
+
+    rows = spool.read_segment(segment)
+    assert [r["request_id"] for r in rows] == ["req-1"]
+
+def test_recover_seals_orphaned_segment(tmp_path):
+    """Test an active segment left by a dead process is sealed on startup."""
+    orphan = tmp_path / f"{1:020d}-999999999.jsonl.part"
+    orphan.write_text('{"request_id": "req-1"}\n', encoding="utf-8")
+
+    spool = usage_spool.Spool(str(tmp_path))
+
+    assert not orphan.exists()
+    assert len(spool.sealed_segments()) == 1
+
+def test_claim_gives_each_segment_to_one_worker(tmp_path):
+    """Test only the first claim of a segment wins and a released claim is replayable again."""
+    spool = usage_spool.Spool(str(tmp_path))
+    spool.append([{"request_id": "req-1"}])
+    spool.seal()
+    segment = spool.sealed_segments()[0]
+
+    claimed = spool.claim(segment)
+    assert claimed.name == f"{segment.name}.replaying.{os.getpid()}"
+    assert spool.claim(segment) is None
+    assert spool.sealed_segments() == []
+
+    spool.release(claimed)
+    assert spool.sealed_segments() == [segment]
+
+def test_recover_releases_claims_of_dead_workers(tmp_path):
+    """Test a segment claimed by a worker that died is replayable again on startup."""
+    orphan = tmp_path / f"{1:020d}-123.jsonl.replaying.999999999"
+    orphan.write_text('{"request_id": "req-1"}\n', encoding="utf-8")
+
+    spool = usage_spool.Spool(str(tmp_path))
+
+    assert not orphan.exists()
+    assert [p.name for p in spool.sealed_segments()] == [f"{1:020d}-123.jsonl"]
+
+def test_invalid_fsync_policy(tmp_path):
+    """Test unknown fsync policies are rejected."""
+    with pytest.raises(ValueError):
+        usage_spool.Spool(str(tmp_path), fsync="sometimes")
+
+def test_get_spool_disabled(reset_spool):
+    """Test USAGE_SPOOL_DIR=off disables the spool."""
+    with patch.dict(os.environ, {"USAGE_SPOOL_DIR": "off"}):
+        assert usage_spool.get_spool() is None
+
+def test_get_spool_from_env(tmp_path, reset_spool):
+    """Test the process-wide spool is built from env and cached."""
+    with patch.dict(os.environ, {"USAGE_SPOOL_DIR": str(tmp_path / "spool"), "USAGE_SPOOL_FSYNC": "never"}):
+        spool = usage_spool.get_spool()
+        assert spool is usage_spool.get_spool()
+        assert spool.fsync == "never"
+        assert (tmp_path / "spool").is_dir()
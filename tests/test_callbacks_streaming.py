@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from callbacks import streaming
+
+REQUEST = {
+    "model": "gpt-4o",
+    "stream": True,
+    "messages": [{"role": "user", "content": "x" * 40}],
+    "metadata": {"tenant_id": "t-1"},
+}
+# REQUEST once track() has taken the stream over.
+TRACKED = dict(REQUEST, metadata={"tenant_id": "t-1", streaming._TRACKED_KEY: True})
+
+def _request():
+    """A fresh REQUEST: track() marks the request's metadata."""
+    return dict(REQUEST, metadata=dict(REQUEST["metadata"]))
+
+@pytest.fixture(autouse=True)
+def tracking_on():
+    with patch.dict(os.environ, {"STREAM_USAGE_TRACKING": "1"}), \
+            patch.object(streaming, "_cost", return_value=None):
+        yield
+
+def _chunk(content=None, usage=None, choices=True):
+    chunk = {"id": "chatcmpl-1", "model": "gpt-4o", "choices": [], "usage": usage}
+    if choices:
+        chunk["choices"] = [{"index": 0, "delta": {"content": content}}]
+    return chunk
+
+async def _stream(chunks, error=None):
+    for chunk in chunks:
+        yield chunk
+    if error is not None:
+        raise error
+
+async def _consume(iterator, limit=None):
+    seen = []
+    async for chunk in iterator:
+        seen.append(chunk)
+        if limit is not None and len(seen) == limit:
+            break
+    return seen
+
+@pytest.fixture
+def sinks():
+    reported = []
+
+    async def report(request_data, response_data, start_time, end_time):
+        reported.append(response_data)
+
+    with patch.object(streaming, "_report", side_effect=report):
+        yield reported
+
+@pytest.mark.asyncio
+async def test_stream_usage_from_final_chunk(sinks):
+    """Test the provider's usage chunk is used and chunks pass through unchanged."""
+    usage = {"prompt_tokens": 9, "completion_tokens": 2, "total_tokens": 11}
+    chunks = [_chunk("Hel"), _chunk("lo"), _chunk(usage=usage, choices=False)]
+    seen = await _consume(streaming.track(_stream(chunks), _request(), start_time=1.0))
+    await streaming.flush()
+
+    assert seen == chunks
+    assert sinks == [{
+        "id": "chatcmpl-1",
+        "model": "gpt-4o",
+        "status": 200,
+        "error": None,
+        "usage": {"prompt_tokens": 9, "completion_tokens": 2, "total_tokens": 11},
+        "response_cost": None,
+        "ttft_ms": None,
+    }]
+
+@pytest.mark.asyncio
+async def test_stream_ttft_from_first_content_chunk(sinks):
+    """Test TTFT runs from the LiteLLM call start (arrival plus queue time) to the first content."""
+    request = dict(
+        REQUEST,
+        proxy_server_request={"arrival_time": 100.0},
+        metadata={"tenant_id": "t-1", "queue_time_seconds": 0.004},
+    )
+    chunks = [_chunk(""), _chunk("Hi"), _chunk("!")]
+    with patch.object(streaming.time, "time", side_effect=[100.254, 101.0, 101.0]):
+        await _consume(streaming.track(_stream(chunks), request, start_time=100.0))
+        await streaming.flush()
+
+    assert sinks[0]["ttft_ms"] == 250
+
+@pytest.mark.asyncio
+async def test_stream_usage_estimated_without_usage_chunk(sinks):
+    """Test tokens are estimated from text length when no usage arrives."""
+    with patch.dict("sys.modules", {"litellm": None}):
+        await _consume(streaming.track(_stream([_chunk("a" * 10), _chunk("b" * 3)]), _request()))
+        await streaming.flush()
+
+    assert sinks[0]["usage"] == {"prompt_tokens": 10, "completion_tokens": 4, "total_tokens": 14}
+
+@pytest.mark.asyncio
+async def test_stream_aborted_by_client(sinks):
+    """Test a client disconnect still reports the tokens streamed so far."""
+    iterator = streaming.track(_stream([_chunk("abcd"), _chunk("efgh"), _chunk("ijkl")]), _request())
+    await _consume(iterator, limit=2)
+    await iterator.aclose()
+    await streaming.flush()
+
+    assert sinks[0]["status"] == streaming.STATUS_ABORTED
+    assert sinks[0]["usage"]["completion_tokens"] == 2
+
+@pytest.mark.asyncio
+async def test_stream_upstream_failure(sinks):
+    """Test a provider error mid-stream is reported once and re-raised."""
+    with pytest.raises(RuntimeError):
+        await _consume(streaming.track(_stream([_chunk("abcd")], error=RuntimeError("upstream reset")), _request()))
+    await streaming.flush()
+
+    assert len(sinks) == 1
+    assert sinks[0]["status"] == streaming.STATUS_FAILED
+    assert sinks[0]["error"] == "upstream reset"
+
+@pytest.mark.asyncio
+async def test_injected_usage_chunk_hidden(sinks):
+    """Test a usage chunk requested by the proxy is counted but not forwarded."""
+    request = dict(REQUEST, metadata={"tenant_id": "t-1", streaming._INJECTED_KEY: True})
+    usage_chunk = _chunk(usage={"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}, choices=False)
+    seen = await _consume(streaming.track(_stream([_chunk("hi"), usage_chunk]), request))
+    await streaming.flush()
+
+    assert seen == [_chunk("hi")]
+    assert sinks[0]["usage"]["total_tokens"] == 2
+
+def test_stream_usage_reads_objects():
+    """Test attribute-style chunks (LiteLLM ModelResponseStream) are understood."""
+    state = streaming.StreamUsage()
+    delta = SimpleNamespace(content="hello")
+    state.add(SimpleNamespace(
+        id="r-1", model="m", choices=[SimpleNamespace(delta=delta)], usage=None,
+        _hidden_params={"response_cost": 0.5},
+    ))
+    assert (state.response_id, state.completion_chars, state.cost_usd) == ("r-1", 5, 0.5)
+
+@pytest.mark.asyncio
+async def test_report_reaches_every_sink():
+    """Test the stream's single event goes to all sinks and they don't skip it."""
+    calls = []
+    sinks = {}
+    for name in streaming._SINKS:
+        sinks[name] = SimpleNamespace(log_event=AsyncMock(side_effect=lambda *a, **kw: calls.append(kw)))
+    with patch("importlib.import_module", side_effect=sinks.__getitem__):
+        await streaming._report(REQUEST, {"id": "r"}, 0.0, 1.0)
+
+    assert len(calls) == len(streaming._SINKS)
+    assert all(streaming.deferred(TRACKED, kw) is False for kw in calls)
+
+def test_deferred():
+    """Test regular callbacks skip tracked streams only while tracking is on."""
+    assert streaming.deferred(TRACKED, {}) is True
+    assert streaming.deferred({"stream": True, "litellm_params": {"metadata": TRACKED["metadata"]}}, {}) is True
+    assert streaming.deferred(dict(TRACKED, stream=False), {}) is False
+    assert streaming.deferred(None, {}) is False
+    with patch.dict(os.environ, {"STREAM_USAGE_TRACKING": "0"}):
+        assert streaming.deferred(TRACKED, {}) is False
+
+@pytest.mark.asyncio
+async def test_stream_failing_before_first_chunk_is_not_deferred(sinks):
+    """Test a streamed request the tracker never saw is left to the regular callbacks."""
+    request = _request()
+    assert streaming.deferred(request, {}) is False
+
+    await _consume(streaming.track(_stream([_chunk("hi")]), request))
+    await streaming.flush()
+    assert streaming.deferred(request, {}) is True
+
+@pytest.mark.asyncio
+async def test_pre_call_hook_requests_usage():
+    """Test include_usage is injected only when the client didn't ask for it."""
+    handler = streaming.StreamUsageHandler()
+    data = await handler.async_pre_call_hook(None, None, {"stream": True, "metadata": {}}, "completion")
+    assert data["stream_options"] == {"include_usage": True}
+    assert data["metadata"][streaming._INJECTED_KEY] is True
+
+    data = await handler.async_pre_call_hook(
+        None, None, {"stream": True, "stream_options": {"include_usage": True}}, "completion"
+    )
+    assert "metadata" not in data
+
+@pytest.mark.asyncio
+async def test_db_skips_streamed_callback():
+    """Test callbacks.db ignores LiteLLM's own callback for tracked streams."""
+    from callbacks import db
+
+    with patch("callbacks.db.backpressure.admit", new_callable=AsyncMock) as admit:
+        await db.log_event(TRACKED, {"id": "r"}, 0.0, 1.0)
+    admit.assert_not_called()
+
+def test_add_sink_registers_once():
+    """Test extra sinks are appended once and reported to like the built-in ones."""
+    with patch.object(streaming, "_SINKS", list(streaming._SINKS)):
+        streaming.add_sink("callbacks.extra")
+        streaming.add_sink("callbacks.extra")
+        assert streaming._SINKS.count("callbacks.extra") == 1
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from callbacks import usage_api
+
+UTC = timezone.utc
+
+def _ts(*args):
+    return datetime(*args, tzinfo=UTC)
+
+def _key(user_id="t-1", role="internal_user"):
+    return SimpleNamespace(user_id=user_id, user_role=role)
+
+def _usage_row(row_id, created_at):
+    return {"id": row_id, "created_at": created_at, "model": "gpt-4o", "total_tokens": 15, "cost_usd": Decimal("0.1")}
+
+def _pool(rows):
+    pool = MagicMock()
+    pool.fetch = AsyncMock(return_value=rows)
+    return pool
+
+def _rollup(bucket, model, status=200, requests=1, cost="0.5", latency=100):
+    return {
+        "bucket": bucket, "tenant_id": "t-1", "model": model, "status": status, "requests": requests,
+        "prompt_tokens": 10 * requests, "completion_tokens": 5 * requests, "total_tokens": 15 * requests,
+        "cost_usd": Decimal(cost), "latency_ms_sum": latency * requests,
+    }
+
+def test_window_defaults_and_limits(monkeypatch):
+    """Test the range defaults to the last 30 days, treats naive times as UTC and is capped."""
+    start, end = usage_api.window("2024-05-01T00:00:00", "2024-05-02T00:00:00Z")
+    assert (start, end) == (_ts(2024, 5, 1), _ts(2024, 5, 2))
+
+    start, end = usage_api.window(None, "2024-05-31T00:00:00+00:00")
+    assert start == _ts(2024, 5, 1)
+
+    monkeypatch.setenv("USAGE_API_MAX_DAYS", "7")
+    with pytest.raises(usage_api.HTTPException) as excinfo:
+        usage_api.window("2024-05-01", "2024-05-09")
+    assert excinfo.value.status_code == 400
+    with pytest.raises(usage_api.HTTPException):
+        usage_api.window("2024-05-02", "2024-05-01")
+    with pytest.raises(usage_api.HTTPException):
+        usage_api.window("yesterday", None)
+
+def test_cursor_round_trip_and_rejects_garbage():
+    """Test cursors encode (created_at, id) opaquely and bad ones are a 400."""
+    cursor = usage_api.encode_cursor(_ts(2024, 5, 1, 12, 0, 0, 123456), 42)
+    assert usage_api.decode_cursor(cursor) == (_ts(2024, 5, 1, 12, 0, 0, 123456), 42)
+
+    with pytest.raises(usage_api.HTTPException) as excinfo:
+        usage_api.decode_cursor("not-a-cursor")
+    assert excinfo.value.status_code == 400
+
+def test_tenant_for_scopes_keys_to_their_own_tenant():
+    """Test keys read their own usage and only proxy admins pick another tenant."""
+    assert usage_api.tenant_for(_key()) == "t-1"
+    assert usage_api.tenant_for(_key(), "t-1") == "t-1"
+    assert usage_api.tenant_for(_key("admin", SimpleNamespace(value="proxy_admin")), "t-2") == "t-2"
+
+    with pytest.raises(usage_api.HTTPException) as excinfo:
+        usage_api.tenant_for(_key(), "t-2")
+    assert excinfo.value.status_code == 403
+    with pytest.raises(usage_api.HTTPException) as excinfo:
+        usage_api.tenant_for(_key("admin", "proxy_admin"))
+    assert excinfo.value.status_code == 400
+
+def test_tenant_for_matches_the_billed_tenant():
+    """Test a key whose tenant comes from (team) metadata reads that tenant, as balance bills it."""
+    from callbacks import record
+
+    for key in (
+        SimpleNamespace(user_id=None, user_role="internal_user", metadata={"tenant_id": "t-meta"}),
+        SimpleNamespace(user_id=None, user_role="internal_user", metadata={}, team_metadata={"tenant_id": "t-meta"}),
+    ):
+        assert record.key_tenant(key) == "t-meta"
+        assert usage_api.tenant_for(key) == "t-meta"
+        assert usage_api.tenant_for(key, "t-meta") == "t-meta"
+        with pytest.raises(usage_api.HTTPException) as excinfo:
+            usage_api.tenant_for(key, "t-other")
+        assert excinfo.value.status_code == 403
+
+@pytest.mark.asyncio
+async def test_request_history_pages_with_keyset():
+    """Test a full page returns a cursor from its last row and the next page continues after it."""
+    rows = [_usage_row(3, _ts(2024, 5, 1, 12, 3)), _usage_row(2, _ts(2024, 5, 1, 12, 2)), _usage_row(1, _ts(2024, 5, 1, 12, 1))]
+    pool = _pool(rows)
+
+    page = await usage_api.request_history(pool, "t-1", _ts(2024, 5, 1), _ts(2024, 5, 2), limit=2)
+
+    assert [row["id"] for row in page["data"]] == [3, 2]
+    assert pool.fetch.call_args[0] == (usage_api._HISTORY_SQL, "t-1", _ts(2024, 5, 1), _ts(2024, 5, 2), 3)
+
+    pool = _pool(rows[2:])
+    page = await usage_api.request_history(pool, "t-1", _ts(2024, 5, 1), _ts(2024, 5, 2), 2, page["next_cursor"])
+
+    assert pool.fetch.call_args[0] == (
+        usage_api._HISTORY_AFTER_SQL, "t-1", _ts(2024, 5, 1), _ts(2024, 5, 2), _ts(2024, 5, 1, 12, 2), 2, 3,
+    )
+    assert [row["id"] for row in page["data"]] == [1]
+    assert page["next_cursor"] is None
+
+@pytest.mark.asyncio
+async def test_request_history_rejects_out_of_range_limit(monkeypatch):
+    """Test the page size is bounded by USAGE_API_MAX_LIMIT."""
+    monkeypatch.setenv("USAGE_API_MAX_LIMIT", "50")
+    pool = _pool([])
+    for limit in (0, 51):
+        with pytest.raises(usage_api.HTTPException):
+            await usage_api.request_history(pool, "t-1", _ts(2024, 5, 1), _ts(2024, 5, 2), limit=limit)
+    pool.fetch.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_model_totals_fold_statuses_from_rollups():
+    """Test per-model totals sum the rollup rows across buckets and statuses and count errors."""
+    summary = AsyncMock(return_value=[
+        _rollup(_ts(2024, 5, 1), "gpt-4o", requests=3),
+        _rollup(_ts(2024, 5, 2), "gpt-4o", status=500, requests=1, latency=500),
+        _rollup(_ts(2024, 5, 1), "o1", requests=2, cost="2"),
+    ])
+    with patch.object(usage_api.rollups, "usage_summary", summary):
+        totals = await usage_api.model_totals("pool", "t-1", _ts(2024, 5, 1), _ts(2024, 5, 3))
+
+    summary.assert_awaited_once_with("pool", _ts(2024, 5, 1), _ts(2024, 5, 3), "day", "t-1")
+    assert totals[0]["model"] == "gpt-4o"
+    assert totals[0]["requests"] == 4
+    assert totals[0]["errors"] == 1
+    assert totals[0]["cost_usd"] == Decimal("1.0")
+    assert totals[0]["avg_latency_ms"] == 200.0
+    assert "latency_ms_sum" not in totals[0]
+    assert (totals[1]["model"], totals[1]["total_tokens"]) == ("o1", 30)
+
+@pytest.mark.asyncio
+async def test_time_series_keeps_buckets_and_validates_bucket():
+    """Test the series has one row per (bucket, model) and unknown buckets are a 400."""
+    summary = AsyncMock(return_value=[
+        _rollup(_ts(2024, 5, 1, 13), "gpt-4o"),
+        _rollup(_ts(2024, 5, 1, 12), "gpt-4o"),
+        _rollup(_ts(2024, 5, 1, 12), "gpt-4o", status=429),
+    ])
+    with patch.object(usage_api.rollups, "usage_summary", summary):
+        series = await usage_api.time_series("pool", "t-1", _ts(2024, 5, 1), _ts(2024, 5, 2), "hour")
+        with pytest.raises(usage_api.HTTPException):
+            await usage_api.time_series("pool", "t-1", _ts(2024, 5, 1), _ts(2024, 5, 2), "week")
+
+    assert [(row["bucket"], row["requests"], row["errors"]) for row in series] == [
+        (_ts(2024, 5, 1, 12), 2, 1),
+        (_ts(2024, 5, 1, 13), 1, 0),
+    ]
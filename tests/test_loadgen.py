@@ -0,0 +1,120 @@
+import asyncio
+import importlib.util
+import random
+
+import pytest
+
+
+def _load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+loadgen = _load("loadgen", "tests/load/loadgen.py")
+compare = _load("compare", "tests/load/compare.py")
+mock_llm = _load("mock_llm", "tests/integration/mock_llm.py")
+
+
+def test_histogram_percentiles_stay_within_bucket_precision():
+    """Test percentiles match exact ones within 1/64 and survive a JSON round trip."""
+    rng = random.Random(7)
+    values = [int(rng.lognormvariate(10, 1.2)) for _ in range(20000)]
+    histogram = loadgen.Histogram()
+    for value in values:
+        histogram.record(value)
+
+    ordered = sorted(values)
+    for percent in (50, 90, 99, 99.9):
+        exact = ordered[int(len(ordered) * percent / 100 + 0.999999) - 1]
+        assert exact <= histogram.percentile(percent) <= exact * (1 + 1 / 64) + 1
+    assert histogram.percentile(100) == max(values)
+
+    restored = loadgen.Histogram.from_dict(histogram.to_dict())
+    restored.merge(loadgen.Histogram())
+    assert restored.percentile(99) == histogram.percentile(99)
+    assert restored.total == len(values)
+
+
+def test_schedule_is_open_loop_per_step():
+    """Test constant arrivals are evenly spaced per step and Poisson ones average the offered rate."""
+    plan = loadgen.schedule([10, 20], step_duration=1.0)
+
+    assert [step for _, step in plan].count(0) == 10
+    assert [step for _, step in plan].count(1) == 20
+    assert plan[1][0] == pytest.approx(0.1)
+    assert plan[10][0] == pytest.approx(1.0)
+    assert plan[11][0] == pytest.approx(1.05)
+
+    poisson = loadgen.schedule([1000], step_duration=10.0, arrival="poisson", rng=random.Random(3))
+    assert len(poisson) == pytest.approx(10000, rel=0.05)
+
+
+def test_run_against_mock_backend_measures_latency_and_ttft():
+    """Test a short run records every request, latency from the intended start and stream TTFT."""
+    async def run():
+        config = mock_llm.MockConfig(latency="fixed:20", completion_tokens="3", token_delay_ms=5)
+        server = await mock_llm.serve(config, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        profiles = [
+            loadgen.Profile({"name": "plain", "model": "m", "tenant_id": "t1"}, "sk-test"),
+            loadgen.Profile({"name": "stream", "model": "m", "stream": True}, "sk-test"),
+        ]
+        generator = loadgen.LoadGenerator(
+            loadgen.Target(f"http://127.0.0.1:{port}", "/chat/completions"), profiles, rng=random.Random(1),
+        )
+        try:
+            return await generator.run([50], step_duration=0.5)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    [step] = asyncio.run(run())
+
+    assert step["sent"] == step["ok"] == 25
+    assert step["errors"] == {}
+    assert step["latency_ms"]["p50"] >= 20
+    assert set(step["profiles"]) == {"plain", "stream"}
+    assert 20 <= step["ttft_ms"]["p50"] < step["profiles"]["stream"]["latency_ms"]["p50"]
+
+
+def test_capacity_is_the_last_sustained_step():
+    """Test capacity stops at the first step that falls behind, errors or breaks the p99 SLO."""
+    def step(rate, rps, errors=0.0, p99=50.0):
+        return {"offered_rps": rate, "throughput_rps": rps, "error_rate": errors, "latency_ms": {"p99": p99}}
+
+    steps = [step(100, 100), step(200, 199), step(400, 310), step(800, 800)]
+    assert loadgen.capacity(steps) == 200
+    assert loadgen.capacity([step(100, 100), step(200, 200, errors=0.05)]) == 100
+    assert loadgen.capacity([step(100, 100), step(200, 200, p99=900)], slo_p99_ms=500) == 100
+    assert loadgen.capacity([step(100, 50)]) is None
+
+
+def test_compare_flags_regressions_past_thresholds():
+    """Test throughput, latency, error-rate and capacity regressions fail, noise below the floors does not."""
+    def results(rps, p99, errors=0.0, ttft=None, capacity=400):
+        return {"capacity_rps": capacity, "steps": [{
+            "offered_rps": 400, "throughput_rps": rps, "error_rate": errors,
+            "latency_ms": {"p50": 10.0, "p99": p99}, "ttft_ms": ttft,
+        }]}
+
+    baseline = results(400, 100.0, ttft={"p50": 30.0, "p99": 60.0})
+    assert compare.compare(baseline, results(395, 105.0, ttft={"p50": 30.5, "p99": 61.0})) == []
+
+    found = compare.compare(
+        baseline, results(300, 150.0, errors=0.02, ttft={"p50": 30.0, "p99": 90.0}, capacity=200),
+    )
+    assert len(found) == 5
+    assert any("throughput" in line for line in found)
+    assert any("latency p99" in line for line in found)
+    assert any("ttft p99" in line for line in found)
+    assert any("error rate" in line for line in found)
+    assert found[-1] == "capacity 400 -> 200 req/s"
+
+    # +50% on a sub-millisecond p50 is under the absolute floor.
+    fast = {"capacity_rps": None, "steps": [{"offered_rps": 1, "throughput_rps": 1, "error_rate": 0,
+                                             "latency_ms": {"p50": 0.4, "p99": 0.8}}]}
+    slower = {"capacity_rps": None, "steps": [{"offered_rps": 1, "throughput_rps": 1, "error_rate": 0,
+                                               "latency_ms": {"p50": 0.6, "p99": 1.2}}]}
+    assert compare.compare(fast, slower) == []
@@ -0,0 +1,256 @@
+import importlib.util
+from unittest.mock import patch
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location("migrate", "scripts/migrate.py")
+migrate = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(migrate)
+
+
+class FakeConn:
+    """Records executed SQL; fetchone/fetchall answers come from respond(sql, args)."""
+
+    def __init__(self, respond=None, fail_on=None):
+        self.respond = respond or (lambda sql, args: None)
+        self.fail_on = fail_on
+        self.executed = []
+        self.autocommit = False
+        self.rowcounts = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = None
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, args=None):
+        self.conn.executed.append((sql, args))
+        if self.conn.fail_on and self.conn.fail_on in sql:
+            raise RuntimeError("boom")
+        self.result = self.conn.respond(sql, args)
+        if self.conn.rowcounts and "batch_size" in (args or {}):
+            self.rowcount = self.conn.rowcounts.pop(0)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result or []
+
+
+def _sql(conn):
+    return [sql for sql, _ in conn.executed]
+
+
+def _respond(applied=()):
+    def respond(sql, args):
+        if "pg_try_advisory_lock" in sql:
+            return [(True,)]
+        if sql == migrate._APPLIED_SQL:
+            return list(applied)
+        return None
+    return respond
+
+
+@pytest.fixture
+def migrations(tmp_path):
+    (tmp_path / "0001_first.sql").write_text("CREATE TABLE a (id INT);")
+    (tmp_path / "0002_second.py").write_text("def up(ops):\n    ops.execute('CREATE TABLE b (id INT)')\n")
+    (tmp_path / "0010_third.sql").write_text("CREATE TABLE c (id INT);")
+    (tmp_path / "README.md").write_text("not a migration")
+    return tmp_path
+
+
+def test_discover_orders_by_version_and_rejects_duplicates(migrations):
+    """Test migrations are sorted numerically and a reused version number is an error."""
+    assert [str(m) for m in migrate.discover(migrations)] == ["0001_first", "0002_second", "0010_third"]
+
+    (migrations / "0002_again.sql").write_text("SELECT 1;")
+    with pytest.raises(migrate.MigrationError, match="duplicate migration version 2"):
+        migrate.discover(migrations)
+
+
+def test_run_applies_only_pending_migrations_under_lock(migrations):
+    """Test applied versions are skipped, the rest recorded, and the advisory lock released."""
+    first = migrate.discover(migrations)[0]
+    conn = FakeConn(_respond([(1, first.checksum)]))
+
+    applied = migrate.run(conn, migrations, out=lambda line: None)
+
+    assert [m.version for m in applied] == [2, 10]
+    assert conn.autocommit is True
+    sql = _sql(conn)
+    assert sql[0] == migrate._LOCK_SQL
+    assert sql[-1] == migrate._UNLOCK_SQL
+    assert "CREATE TABLE a (id INT);" not in sql
+    assert "CREATE TABLE b (id INT)" in sql
+    # The .sql migration and its record share one transaction.
+    third = sql.index("CREATE TABLE c (id INT);")
+    assert sql[third - 1] == "BEGIN"
+    assert sql[third + 1] == migrate._RECORD_SQL
+    assert sql[third + 2] == "COMMIT"
+    recorded = [args[0] for sql, args in conn.executed if sql == migrate._RECORD_SQL]
+    assert recorded == [2, 10]
+
+
+def test_run_rolls_back_a_failed_sql_migration(migrations):
+    """Test a failing .sql migration is rolled back, not recorded, and later ones do not run."""
+    conn = FakeConn(_respond(), fail_on="CREATE TABLE a")
+
+    with pytest.raises(RuntimeError):
+        migrate.run(conn, migrations, out=lambda line: None)
+
+    sql = _sql(conn)
+    assert "ROLLBACK" in sql
+    assert migrate._RECORD_SQL not in sql
+    assert "CREATE TABLE b (id INT)" not in sql
+    assert sql[-1] == migrate._UNLOCK_SQL
+
+
+def test_run_dry_run_lists_without_applying(migrations):
+    """Test --dry-run reports pending migrations and executes none of them."""
+    conn = FakeConn(_respond())
+    lines = []
+
+    migrate.run(conn, migrations, target=2, dry_run=True, out=lines.append)
+
+    assert lines == ["pending 0001_first", "pending 0002_second"]
+    assert migrate._RECORD_SQL not in _sql(conn)
+
+
+def test_run_gives_up_when_lock_is_held(migrations):
+    """Test a second runner waits for the lock and fails after --lock-timeout."""
+    conn = FakeConn(lambda sql, args: [(False,)] if "pg_try_advisory_lock" in sql else None)
+
+    with patch.object(migrate.time, "sleep"), pytest.raises(migrate.MigrationError, match="holds the lock"):
+        migrate.run(conn, migrations, lock_timeout=0, out=lambda line: None)
+
+    assert "CREATE TABLE a (id INT);" not in _sql(conn)
+
+
+def test_create_index_on_partitioned_table_builds_each_partition_concurrently():
+    """Test partitions get concurrent builds attached to an ON ONLY parent index, skipping attached ones."""
+    state = {"valid": False}
+
+    def respond(sql, args):
+        if sql == migrate._RELKIND_SQL:
+            return [("p",)]
+        if sql == migrate._INDEX_VALID_SQL:
+            if args == ("idx_usage_x",):
+                return [(state["valid"],)] if any("ON ONLY" in s for s, _ in conn.executed) else None
+            return None
+        if sql == migrate._PARTITIONS_SQL:
+            return [("usage_p1",), ("usage_p2",)]
+        if sql == migrate._INDEX_ATTACHED_SQL:
+            return [(1,)] if args == ("idx_usage_x", "usage_p1") else None
+        if sql.startswith("ALTER INDEX"):
+            state["valid"] = True
+        return None
+
+    conn = FakeConn(respond)
+    migrate.Ops(conn, out=lambda line: None).create_index("idx_usage_x", "usage", "(tenant_id)")
+
+    sql = _sql(conn)
+    assert "CREATE INDEX IF NOT EXISTS idx_usage_x ON ONLY usage (tenant_id)" in sql
+    assert "CREATE INDEX CONCURRENTLY IF NOT EXISTS usage_p2_usage_x ON usage_p2 (tenant_id)" in sql
+    assert "ALTER INDEX idx_usage_x ATTACH PARTITION usage_p2_usage_x" in sql
+    assert not any("ON usage_p1" in s for s in sql)
+
+
+def test_drop_index_retries_lock_timeouts():
+    """Test dropping a partitioned index retries when its short lock_timeout expires."""
+    attempts = []
+
+    def respond(sql, args):
+        if sql == migrate._RELKIND_SQL:
+            return [("I",)]
+        if sql.startswith("DROP INDEX"):
+            attempts.append(sql)
+            if len(attempts) == 1:
+                raise migrate.psycopg2.errors.LockNotAvailable()
+        return None
+
+    conn = FakeConn(respond)
+    with patch.object(migrate.time, "sleep"):
+        migrate.Ops(conn, out=lambda line: None).drop_index("idx_usage_x")
+
+    assert attempts == ["DROP INDEX IF EXISTS idx_usage_x"] * 2
+    assert _sql(conn).count("RESET lock_timeout") == 2
+
+
+def test_add_columns_is_one_short_lock_statement():
+    """Test add_columns adds every missing column in one ALTER under a lock_timeout."""
+    conn = FakeConn()
+
+    migrate.Ops(conn, out=lambda line: None).add_columns("usage", ["a_ms INTEGER", "b_ms INTEGER"])
+
+    assert _sql(conn) == [
+        "SET lock_timeout = '2s'",
+        "ALTER TABLE usage ADD COLUMN IF NOT EXISTS a_ms INTEGER, ADD COLUMN IF NOT EXISTS b_ms INTEGER",
+        "RESET lock_timeout",
+    ]
+
+
+def test_add_check_validates_outside_the_short_lock():
+    """Test add_check adds the constraint NOT VALID under a lock_timeout and validates it separately."""
+    conn = FakeConn()
+
+    migrate.Ops(conn, out=lambda line: None).add_check("usage", "usage_bound", "created_at < '2024-01-02'")
+
+    assert _sql(conn)[1:] == [
+        "SET lock_timeout = '2s'",
+        "ALTER TABLE usage ADD CONSTRAINT usage_bound CHECK (created_at < '2024-01-02') NOT VALID",
+        "RESET lock_timeout",
+        "ALTER TABLE usage VALIDATE CONSTRAINT usage_bound",
+    ]
+
+
+def test_add_check_only_validates_an_existing_constraint():
+    """Test a rerun does not add the constraint again."""
+    conn = FakeConn(lambda sql, args: [(1,)] if sql == migrate._CONSTRAINT_SQL else None)
+
+    migrate.Ops(conn, out=lambda line: None).add_check("usage", "usage_bound", "created_at < '2024-01-02'")
+
+    assert _sql(conn)[1:] == ["ALTER TABLE usage VALIDATE CONSTRAINT usage_bound"]
+
+
+def test_backfill_runs_batches_until_nothing_is_left():
+    """Test backfill repeats the batch statement until it affects no rows."""
+    conn = FakeConn()
+    conn.rowcounts = [500, 500, 120, 0]
+
+    total = migrate.Ops(conn, out=lambda line: None).backfill("UPDATE t ... LIMIT %(batch_size)s", batch_size=500)
+
+    assert total == 1120
+    assert [args for _, args in conn.executed] == [{"batch_size": 500}] * 4
+
+
+def test_child_index_names_fit_postgres_identifiers():
+    """Test long partition index names are shortened with a stable hash suffix."""
+    assert migrate._child_index_name("litellm_usage_p20240102", "idx_tenant") == "litellm_usage_p20240102_tenant"
+    long_name = migrate._child_index_name("litellm_usage_p20240102", "idx_" + "x" * 60)
+    assert len(long_name) == 63
+    assert long_name == migrate._child_index_name("litellm_usage_p20240102", "idx_" + "x" * 60)
+
+
+def test_repository_migrations_are_well_formed():
+    """Test the shipped migrations have unique versions and .py ones define up()."""
+    found = migrate.discover()
+    assert [m.version for m in found][:4] == [0, 1, 2, 3]
+    for migration in found:
+        if migration.path.suffix == ".py":
+            spec = importlib.util.spec_from_file_location(f"m{migration.version}", migration.path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            assert callable(module.up)
@@ -0,0 +1,120 @@
+import asyncio
+import importlib.util
+import json
+import random
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location("mock_llm", "tests/integration/mock_llm.py")
+mock_llm = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(mock_llm)
+
+
+def _request(body, path="/v1/chat/completions"):
+    data = json.dumps(body).encode()
+    return b"POST %s HTTP/1.1\r\nHost: mock\r\nContent-Length: %d\r\n\r\n%s" % (path.encode(), len(data), data)
+
+
+async def _read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    headers = dict(
+        (name.strip().lower(), value.strip())
+        for name, _, value in (line.partition(b":") for line in head.split(b"\r\n")[1:] if line)
+    )
+    if headers.get(b"transfer-encoding") == b"chunked":
+        body = b""
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).strip(), 16)
+            chunk = await reader.readexactly(size + 2)
+            if size == 0:
+                break
+            body += chunk[:-2]
+        return status, body
+    return status, await reader.readexactly(int(headers[b"content-length"]))
+
+
+def _exchange(config, *payloads, responses=None):
+    """Start a server on a free port, send payloads on one connection and read the responses."""
+    async def run():
+        server = await mock_llm.serve(config, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"".join(payloads))
+        results = [await _read_response(reader) for _ in range(responses or len(payloads))]
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return results
+
+    return asyncio.run(run())
+
+
+def test_completion_defaults_match_the_integration_contract():
+    """Test the default reply keeps the content and 10/20/30 usage test_full_flow.py checks."""
+    [(status, body)] = _exchange(mock_llm.MockConfig(), _request({"model": "gpt-4o", "messages": []}))
+
+    reply = json.loads(body)
+    assert status == 200
+    assert reply["model"] == "gpt-4o"
+    assert "mock response" in reply["choices"][0]["message"]["content"]
+    assert reply["usage"] == {"prompt_tokens": 10, "completion_tokens": 20, "total_tokens": 30}
+
+
+def test_stream_sends_one_chunk_per_token_and_usage():
+    """Test stream=true yields SSE chunks whose text and usage match the non-streamed reply."""
+    config = mock_llm.MockConfig(completion_tokens="5", token_delay_ms=1)
+    request = {"model": "m", "stream": True, "stream_options": {"include_usage": True}}
+    [(status, body)] = _exchange(config, _request(request))
+
+    events = [line[len(b"data: "):] for line in body.split(b"\n\n") if line]
+    assert status == 200
+    assert events[-1] == b"[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    deltas = [c["choices"][0]["delta"].get("content") for c in chunks if c["choices"]]
+    assert "".join(d for d in deltas if d) == "This is a mock response"
+    assert len([d for d in deltas if d]) == 5
+    assert chunks[-1]["usage"] == {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+
+
+def test_keep_alive_answers_pipelined_requests_in_order():
+    """Test several requests on one connection are answered in order, including delayed and capped ones."""
+    config = mock_llm.MockConfig(latency="fixed:5")
+    responses = _exchange(
+        config,
+        _request({"model": "first", "max_tokens": 3}),
+        _request({"model": "second"}, path="/chat/completions"),
+        b"GET /health HTTP/1.1\r\nHost: mock\r\n\r\n",
+    )
+
+    first, second, health = responses
+    assert json.loads(first[1])["model"] == "first"
+    assert json.loads(first[1])["usage"]["completion_tokens"] == 3
+    assert json.loads(second[1])["model"] == "second"
+    assert health == (200, b'{"status":"ok"}')
+
+
+def test_error_rate_returns_the_configured_status():
+    """Test MOCK_ERROR_RATE=1 answers every request with an OpenAI-style error."""
+    config = mock_llm.MockConfig(error_rate=1.0, error_status=429)
+    [(status, body)] = _exchange(config, _request({"model": "m"}))
+
+    assert status == 429
+    assert json.loads(body)["error"]["type"] == "rate_limit_error"
+
+
+def test_latency_specs(tmp_path):
+    """Test fixed, lognormal and replayed latency distributions."""
+    assert mock_llm.parse_latency("fixed:250")() == 0.25
+
+    lognormal = mock_llm.parse_latency("lognormal:200,0.5", random.Random(1))
+    samples = sorted(lognormal() for _ in range(2001))
+    assert samples[1000] == pytest.approx(0.2, rel=0.1)
+
+    trace = tmp_path / "latency.csv"
+    trace.write_text("latency_ms\n120\n80,gpt-4o\n")
+    replay = mock_llm.parse_latency(f"replay:{trace}")
+    assert [replay() for _ in range(3)] == [0.12, 0.08, 0.12]
+
+    with pytest.raises(ValueError, match="invalid latency spec"):
+        mock_llm.parse_latency("uniform:1")
@@ -0,0 +1,86 @@
+import http.server
+import sys
+import threading
+
+import pytest
+
+sys.path.append(".")
+import wait_ready  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_wait_ready_backs_off_exponentially_until_ready():
+    """Test polls start fast and double up to the cap until the endpoint is ready."""
+    clock = FakeClock()
+    answers = iter([False] * 8 + [True])
+
+    ready = wait_ready.wait_ready(
+        "http://proxy/health/readiness", timeout=60, check=lambda url: next(answers),
+        sleep=clock.sleep, clock=clock, initial_delay=0.025, max_delay=1.0,
+    )
+
+    assert ready is True
+    assert clock.sleeps == [0.025, 0.05, 0.1, 0.2, 0.4, 0.8, 1.0, 1.0]
+
+
+def test_wait_ready_times_out():
+    """Test the wait stops at the deadline without oversleeping it."""
+    clock = FakeClock()
+
+    ready = wait_ready.wait_ready(
+        "http://proxy/health/readiness", timeout=2, check=lambda url: False, sleep=clock.sleep, clock=clock,
+    )
+
+    assert ready is False
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_wait_ready_stops_when_process_exits(monkeypatch):
+    """Test a dead proxy process ends the wait immediately."""
+    clock = FakeClock()
+    monkeypatch.setattr(wait_ready, "_alive", lambda pid: pid != 4242)
+
+    ready = wait_ready.wait_ready(
+        "http://proxy/health/readiness", timeout=60, pid=4242, check=lambda url: False,
+        sleep=clock.sleep, clock=clock,
+    )
+
+    assert ready is False
+    assert clock.sleeps == []
+
+
+def test_probe_requires_http_200():
+    """Test probe() is true only for a 200 answer and false when nothing listens."""
+    statuses = {"/health/readiness": 200, "/starting": 503}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(statuses.get(self.path, 404))
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        assert wait_ready.probe(f"{base}/health/readiness") is True
+        assert wait_ready.probe(f"{base}/starting") is False
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert wait_ready.probe(f"{base}/health/readiness", timeout=0.5) is False
@@ -0,0 +1,109 @@
+"""
+Wait until the LiteLLM proxy answers its readiness endpoint.
+
+start.sh runs this between starting the proxy and starting Nginx, so the
+container only listens on $PORT (which is what Cloud Run waits for) once
+requests can actually be served. Polls start at READY_INITIAL_DELAY_MS
+[25] apart and double up to READY_MAX_DELAY_MS [1000]: a proxy that is up
+in 1.3 s is noticed within a few tens of milliseconds of that, not at the
+next whole second.
+
+Usage:
+  python wait_ready.py [--url http://127.0.0.1:4000/health/readiness]
+      [--timeout 120] [--pid PID]
+
+With --pid, gives up as soon as that process (the proxy) has exited.
+Exits 0 when ready, 1 on timeout or if the proxy died.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Callable, Optional
+
+DEFAULT_URL = "http://127.0.0.1:4000/health/readiness"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        print(f"wait_ready: invalid {name}; using {default}", file=sys.stderr)
+        return default
+
+
+def _alive(pid: Optional[int]) -> bool:
+    if pid is None:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def probe(url: str, timeout: float = 2.0) -> bool:
+    """True when url answers 200."""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status == 200
+    except (urllib.error.URLError, OSError, ValueError):
+        return False
+
+
+def wait_ready(
+    url: str = DEFAULT_URL,
+    timeout: float = 120.0,
+    pid: Optional[int] = None,
+    initial_delay: float = 0.025,
+    max_delay: float = 1.0,
+    check: Callable[[str], bool] = probe,
+    sleep: Callable[[float], None] = time.sleep,
+    clock: Callable[[], float] = time.monotonic,
+) -> bool:
+    """Poll url with exponential backoff until it is ready, the deadline passes or pid exits."""
+    deadline = clock() + timeout
+    delay = initial_delay
+    while True:
+        if check(url):
+            return True
+        if not _alive(pid):
+            print(f"wait_ready: process {pid} exited before {url} was ready", file=sys.stderr)
+            return False
+        remaining = deadline - clock()
+        if remaining <= 0:
+            print(f"wait_ready: {url} not ready after {timeout:.0f}s", file=sys.stderr)
+            return False
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--timeout", type=float, default=_env_float("READY_TIMEOUT_SECONDS", 120.0))
+    parser.add_argument("--pid", type=int, help="stop waiting if this process exits")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    ready = wait_ready(
+        args.url,
+        args.timeout,
+        args.pid,
+        initial_delay=_env_float("READY_INITIAL_DELAY_MS", 25.0) / 1000,
+        max_delay=_env_float("READY_MAX_DELAY_MS", 1000.0) / 1000,
+    )
+    if ready:
+        print(f"wait_ready: {args.url} ready after {time.monotonic() - started:.2f}s")
+    return 0 if ready else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())